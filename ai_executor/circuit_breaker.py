@@ -0,0 +1,290 @@
+# ~/projects/deepseek_dispatcher-new/ai_executor/circuit_breaker.py
+
+import asyncio
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+from redis import Redis
+
+from ai_executor.concurrency_limiter import ConcurrencyLimitExceeded
+from ai_executor.executor import ModelClientError, ModelRateLimitError, ModelTimeoutError
+from common.logging_utils import get_logger
+from common.redis_utils import get_redis
+from services.exceptions import ServiceExecutionError
+
+logger = get_logger("circuit_breaker")
+
+# 每个执行器一个哈希，完整键为 breaker:<执行器名称>，所有 worker 进程共享
+BREAKER_KEY_PREFIX = "breaker"
+
+# Redis 访问失败后，这段时间 (秒) 内不再访问 Redis，直接放行，避免每个请求都等待连接超时
+_REDIS_RETRY_SECONDS = 5.0
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# 请求前检查：关闭状态直接放行；打开状态在冷却期内拒绝，冷却期满后转为半开；
+# 半开状态最多同时放行 ARGV[3] 个探测请求，探测请求超过 ARGV[4] 毫秒没有结果（例如 worker 进程退出）时名额被收回。
+# 返回 {是否放行, 是否为探测请求, 当前状态}
+_ALLOW_SCRIPT = """
+local key = KEYS[1]
+local state = redis.call('HGET', key, 'state')
+if not state or state == 'closed' then
+    return {1, 0, 'closed'}
+end
+local now = tonumber(ARGV[1])
+if state == 'open' then
+    if now - tonumber(redis.call('HGET', key, 'changed_at') or '0') < tonumber(ARGV[2]) then
+        redis.call('HINCRBY', key, 'rejected', 1)
+        return {0, 0, 'open'}
+    end
+    redis.call('HSET', key, 'state', 'half_open', 'changed_at', now, 'probes', 0, 'probe_ok', 0)
+    state = 'half_open'
+end
+local probes = tonumber(redis.call('HGET', key, 'probes') or '0')
+if probes >= tonumber(ARGV[3]) and now - tonumber(redis.call('HGET', key, 'probe_at') or '0') >= tonumber(ARGV[4]) then
+    probes = 0
+end
+if probes >= tonumber(ARGV[3]) then
+    redis.call('HINCRBY', key, 'rejected', 1)
+    return {0, 0, 'half_open'}
+end
+redis.call('HSET', key, 'probes', probes + 1, 'probe_at', now)
+return {1, 1, 'half_open'}
+"""
+
+# 请求结束后记录结果（ARGV[2] 为 ok / error / timeout，ARGV[3] 为是否探测请求）：
+# - 探测请求成功达到 ARGV[8] 次时关闭，任何一次失败重新打开；
+# - 关闭状态按固定窗口（ARGV[4] 毫秒）统计请求、失败和超时次数，
+#   请求数达到 ARGV[5] 且失败率达到 ARGV[6]，或超时次数达到 ARGV[7] 时打开。
+# 返回 {当前状态, 状态是否改变}
+_RECORD_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local outcome = ARGV[2]
+local state = redis.call('HGET', key, 'state') or 'closed'
+redis.call('EXPIRE', key, tonumber(ARGV[9]))
+if ARGV[3] == '1' then
+    if state ~= 'half_open' then
+        return {state, 0}
+    end
+    redis.call('HINCRBY', key, 'probes', -1)
+    if outcome == 'ok' then
+        if redis.call('HINCRBY', key, 'probe_ok', 1) >= tonumber(ARGV[8]) then
+            redis.call('HSET', key, 'state', 'closed', 'changed_at', now, 'window_start', now,
+                       'requests', 0, 'failures', 0, 'timeouts', 0)
+            return {'closed', 1}
+        end
+        return {'half_open', 0}
+    end
+    redis.call('HSET', key, 'state', 'open', 'changed_at', now, 'reason', 'probe_failed')
+    redis.call('HINCRBY', key, 'trips', 1)
+    return {'open', 1}
+end
+if state ~= 'closed' then
+    return {state, 0}
+end
+if now - tonumber(redis.call('HGET', key, 'window_start') or '0') >= tonumber(ARGV[4]) then
+    redis.call('HSET', key, 'window_start', now, 'requests', 0, 'failures', 0, 'timeouts', 0)
+end
+local requests = redis.call('HINCRBY', key, 'requests', 1)
+local failures = tonumber(redis.call('HGET', key, 'failures') or '0')
+local timeouts = tonumber(redis.call('HGET', key, 'timeouts') or '0')
+if outcome ~= 'ok' then
+    failures = redis.call('HINCRBY', key, 'failures', 1)
+end
+if outcome == 'timeout' then
+    timeouts = redis.call('HINCRBY', key, 'timeouts', 1)
+end
+local reason = nil
+if timeouts >= tonumber(ARGV[7]) then
+    reason = 'timeouts'
+elseif requests >= tonumber(ARGV[5]) and failures / requests >= tonumber(ARGV[6]) then
+    reason = 'error_rate'
+end
+if reason then
+    redis.call('HSET', key, 'state', 'open', 'changed_at', now, 'reason', reason)
+    redis.call('HINCRBY', key, 'trips', 1)
+    return {'open', 1}
+end
+return {'closed', 0}
+"""
+
+# 探测请求被取消（例如对冲中落败）时归还名额，不影响状态
+_RELEASE_PROBE_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'state') == 'half_open' and tonumber(redis.call('HGET', KEYS[1], 'probes') or '0') > 0 then
+    redis.call('HINCRBY', KEYS[1], 'probes', -1)
+end
+return 1
+"""
+
+
+class CircuitOpenError(ServiceExecutionError):
+    """所有可用执行器的熔断器都处于打开状态，请求被快速拒绝。"""
+    pass
+
+
+def breaker_key(name: str) -> str:
+    return f"{BREAKER_KEY_PREFIX}:{name}"
+
+
+def _decode(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+class CircuitBreaker:
+    """
+    按执行器的熔断器（ExecutorFactory 使用），状态保存在 Redis 中，所有 worker 进程共享：
+    - closed：正常放行，按固定窗口统计失败率和超时次数，超过阈值时打开；
+    - open：在 open_seconds 内快速拒绝，ExecutorFactory 改用其他执行器，没有可用执行器时抛出 CircuitOpenError；
+    - half_open：冷却期满后最多同时放行 half_open_probes 个探测请求，全部成功则关闭，任何一个失败则重新打开。
+    客户端错误（4xx，429 除外）说明供应商仍在正常响应，按成功计。Redis 不可用时放行所有请求，只记录警告。
+    """
+
+    def __init__(self, enabled: bool, window_seconds: float, min_requests: int, error_rate: float,
+                 timeout_threshold: int, open_seconds: float, half_open_probes: int, probe_timeout: float,
+                 redis_conn: Optional[Redis] = None):
+        self.enabled = enabled
+        self.window_seconds = window_seconds
+        self.min_requests = min_requests
+        self.error_rate = error_rate
+        self.timeout_threshold = timeout_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.probe_timeout = probe_timeout
+        self._redis_conn = redis_conn
+        self._redis_retry_at = 0.0
+
+    def _get_redis(self) -> Optional[Redis]:
+        """Redis 最近访问失败时返回 None，调用方直接放行。"""
+        if time.monotonic() < self._redis_retry_at:
+            return None
+        if self._redis_conn is None:
+            self._redis_conn = get_redis()
+        return self._redis_conn
+
+    def _redis_failed(self) -> None:
+        self._redis_retry_at = time.monotonic() + _REDIS_RETRY_SECONDS
+
+    def allow(self, name: str) -> Tuple[bool, bool]:
+        """
+        请求前检查执行器是否可用。
+        Returns:
+            Tuple[bool, bool]: (是否放行, 是否为半开状态下的探测请求)。
+        """
+        if not self.enabled:
+            return True, False
+        redis_conn = self._get_redis()
+        if redis_conn is None:
+            return True, False
+        try:
+            allowed, probe, state = redis_conn.register_script(_ALLOW_SCRIPT)(
+                keys=[breaker_key(name)],
+                args=[int(time.time() * 1000), int(self.open_seconds * 1000), self.half_open_probes,
+                      int(self.probe_timeout * 1000)],
+            )
+        except Exception as e:
+            logger.warning(f"读取执行器 {name} 的熔断器状态失败，{_REDIS_RETRY_SECONDS} 秒内放行所有请求: {e}")
+            self._redis_failed()
+            return True, False
+        if probe:
+            logger.info(f"执行器 {name} 的熔断器处于半开状态，放行探测请求。")
+        return bool(allowed), bool(probe)
+
+    def record(self, name: str, outcome: str, probe: bool) -> None:
+        """记录一次请求的结果：ok / error / timeout。"""
+        redis_conn = self._get_redis() if self.enabled else None
+        if redis_conn is None:
+            return
+        try:
+            state, changed = redis_conn.register_script(_RECORD_SCRIPT)(
+                keys=[breaker_key(name)],
+                args=[int(time.time() * 1000), outcome, int(probe), int(self.window_seconds * 1000),
+                      self.min_requests, self.error_rate, self.timeout_threshold, self.half_open_probes,
+                      int(max(self.window_seconds, self.open_seconds, self.probe_timeout) * 10)],
+            )
+        except Exception as e:
+            logger.warning(f"记录执行器 {name} 的熔断器结果失败: {e}")
+            self._redis_failed()
+            return
+        if changed:
+            state = _decode(state)
+            if state == OPEN:
+                logger.error(f"执行器 {name} 的熔断器已打开，{self.open_seconds} 秒内快速拒绝请求。")
+            else:
+                logger.info(f"执行器 {name} 的熔断器已关闭，恢复正常放行。")
+
+    def release_probe(self, name: str) -> None:
+        redis_conn = self._get_redis()
+        if redis_conn is None:
+            return
+        try:
+            redis_conn.register_script(_RELEASE_PROBE_SCRIPT)(keys=[breaker_key(name)])
+        except Exception as e:
+            logger.warning(f"归还执行器 {name} 的探测名额失败: {e}")
+            self._redis_failed()
+
+    @staticmethod
+    def outcome(error: Optional[BaseException]) -> Optional[str]:
+        """请求结果分类：ok / error / timeout；本地 Key 池预算耗尽或没有拿到并发许可时请求没有发出，返回 None，不计入统计。"""
+        if isinstance(error, (ModelRateLimitError, ConcurrencyLimitExceeded)):
+            return None
+        if error is None or isinstance(error, ModelClientError):
+            return "ok"
+        if isinstance(error, ModelTimeoutError):
+            return "timeout"
+        return "error"
+
+    def finish(self, name: str, error: Optional[BaseException], probe: bool) -> None:
+        """记录一次调用的结果；不计入统计的调用（被取消、本地预算耗尽）只归还探测名额。"""
+        outcome = None if isinstance(error, asyncio.CancelledError) else self.outcome(error)
+        if outcome is not None:
+            self.record(name, outcome, probe)
+        elif probe:
+            self.release_probe(name)
+
+    @contextmanager
+    def guard(self, name: str, probe: bool) -> Iterator[None]:
+        """记录包裹的执行器调用的结果。"""
+        try:
+            yield
+        except (Exception, asyncio.CancelledError) as e:
+            self.finish(name, e, probe)
+            raise
+        self.finish(name, None, probe)
+
+    @asynccontextmanager
+    async def guard_async(self, name: str, probe: bool) -> AsyncIterator[None]:
+        """guard 的异步版本，Redis 调用放到线程中执行，避免阻塞事件循环。"""
+        try:
+            yield
+        except (Exception, asyncio.CancelledError) as e:
+            await asyncio.to_thread(self.finish, name, e, probe)
+            raise
+        await asyncio.to_thread(self.finish, name, None, probe)
+
+
+def breaker_states(redis_conn: Redis) -> Dict[str, Dict[str, Any]]:
+    """
+    读取所有执行器的熔断器状态（供 /health 和 /metrics 使用）。
+    Returns:
+        Dict[str, Dict[str, Any]]: 以执行器名称为键，包含 state、reason、窗口内的请求/失败/超时次数、打开次数和被拒绝次数。
+    """
+    prefix = f"{BREAKER_KEY_PREFIX}:"
+    now_ms = int(time.time() * 1000)
+    states = {}
+    for key in redis_conn.scan_iter(match=f"{prefix}*", count=100):
+        raw = {_decode(field): _decode(value) for field, value in redis_conn.hgetall(key).items()}
+        if not raw:
+            continue
+        state = raw.get("state", CLOSED)
+        entry: Dict[str, Any] = {"state": state}
+        for field in ("requests", "failures", "timeouts", "trips", "rejected", "probes"):
+            entry[field] = int(raw.get(field, 0))
+        if state != CLOSED:
+            entry["reason"] = raw.get("reason")
+            entry["since_seconds"] = round((now_ms - int(raw.get("changed_at", now_ms))) / 1000, 1)
+        states[_decode(key)[len(prefix):]] = entry
+    return states
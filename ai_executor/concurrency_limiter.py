@@ -0,0 +1,293 @@
+# ~/projects/deepseek_dispatcher-new/ai_executor/concurrency_limiter.py
+
+import asyncio
+import time
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+
+from redis import Redis
+
+from ai_executor.executor import ModelOverloadedError, ModelTimeoutError
+from common.logging_utils import get_logger
+from common.redis_utils import get_redis
+from services.exceptions import ServiceExecutionError
+
+logger = get_logger("concurrency_limiter")
+
+# 每个执行器的限制器状态哈希 aimd:state:<执行器名称>，已发放的许可为有序集合 aimd:permits:<执行器名称>
+# （成员为许可 ID，分数为过期时间，持有许可的 worker 退出后许可自动收回）
+AIMD_STATE_PREFIX = "aimd:state"
+AIMD_PERMITS_PREFIX = "aimd:permits"
+
+# Redis 访问失败后，这段时间 (秒) 内不做并发限制
+_REDIS_RETRY_SECONDS = 5.0
+
+# 延迟的短期 / 长期 EWMA 系数：短期 EWMA 超过长期 EWMA 的 tolerance 倍视为延迟上升
+_SHORT_ALPHA = 0.3
+_LONG_ALPHA = 0.02
+_MIN_LATENCY_SAMPLES = 20
+
+# 申请许可：暂停期内或已发放的许可数达到当前并发上限时拒绝。
+# ARGV: 当前时间 (毫秒)、许可 ID、许可有效期 (毫秒)、初始并发上限
+# 返回 {是否发放, 建议等待的毫秒数（暂停期剩余时间，0 表示未知）}
+_ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+local pause_until = tonumber(redis.call('HGET', KEYS[1], 'pause_until') or '0')
+if now < pause_until then
+    redis.call('HINCRBY', KEYS[1], 'throttled', 1)
+    return {0, pause_until - now}
+end
+local limit = tonumber(redis.call('HGET', KEYS[1], 'limit') or ARGV[4])
+if redis.call('ZCARD', KEYS[2]) >= math.max(1, math.floor(limit)) then
+    redis.call('HINCRBY', KEYS[1], 'throttled', 1)
+    return {0, 0}
+end
+redis.call('ZADD', KEYS[2], now + tonumber(ARGV[3]), ARGV[2])
+redis.call('PEXPIRE', KEYS[2], tonumber(ARGV[3]) * 2)
+return {1, 0}
+"""
+
+# 归还许可并按结果调整并发上限（AIMD）：
+# - ok：上限增加 increase / 上限（每完成约一个"上限"数量的请求增加 increase），延迟上升时按 overload 处理；
+# - overload：每 decrease_interval 毫秒最多把上限乘以 factor 一次（同一波 429 只降一次），
+#   pause 毫秒内不发放新许可（Retry-After）；
+# - neutral：只归还许可。
+# ARGV: 当前时间、许可 ID、结果、延迟 (毫秒)、暂停毫秒数、初始 / 最小 / 最大上限、increase、factor、
+#       decrease_interval (毫秒)、延迟容忍倍数 (0 表示不按延迟调整)、短期 / 长期 EWMA 系数、
+#       开始按延迟判断所需的样本数、状态键有效期 (秒)
+# 返回调整后的并发上限和本次是否降低
+_RELEASE_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[2])
+local outcome = ARGV[3]
+local latency = tonumber(ARGV[4])
+local limit = tonumber(redis.call('HGET', KEYS[1], 'limit') or ARGV[6])
+local reason = outcome
+local tolerance = tonumber(ARGV[12])
+if outcome == 'ok' and tolerance > 0 then
+    local short = tonumber(redis.call('HGET', KEYS[1], 'latency_short') or latency)
+    local long = tonumber(redis.call('HGET', KEYS[1], 'latency_long') or latency)
+    short = short + tonumber(ARGV[13]) * (latency - short)
+    long = long + tonumber(ARGV[14]) * (latency - long)
+    local samples = redis.call('HINCRBY', KEYS[1], 'samples', 1)
+    redis.call('HSET', KEYS[1], 'latency_short', short, 'latency_long', long)
+    if samples >= tonumber(ARGV[15]) and short > long * tolerance then
+        outcome = 'overload'
+        reason = 'latency'
+    end
+end
+local decreased = 0
+if outcome == 'overload' then
+    local pause = tonumber(ARGV[5])
+    if pause > 0 then
+        local pause_until = math.max(tonumber(redis.call('HGET', KEYS[1], 'pause_until') or '0'), now + pause)
+        redis.call('HSET', KEYS[1], 'pause_until', pause_until)
+    end
+    if now - tonumber(redis.call('HGET', KEYS[1], 'last_decrease') or '0') >= tonumber(ARGV[11]) then
+        limit = math.max(tonumber(ARGV[7]), limit * tonumber(ARGV[10]))
+        redis.call('HSET', KEYS[1], 'last_decrease', now, 'last_reason', reason)
+        redis.call('HINCRBY', KEYS[1], 'decreases', 1)
+        decreased = 1
+    end
+elseif outcome == 'ok' then
+    limit = math.min(tonumber(ARGV[8]), limit + tonumber(ARGV[9]) / limit)
+end
+redis.call('HSET', KEYS[1], 'limit', limit)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[16]))
+return {tostring(limit), decreased}
+"""
+
+
+class ConcurrencyLimitExceeded(ServiceExecutionError):
+    """在 AIMD_MAX_WAIT 秒内没有拿到执行器的并发许可。"""
+    pass
+
+
+def _decode(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    按执行器的自适应并发限制器（AIMD，ExecutorFactory 使用），并发上限和已发放的许可保存在 Redis 中，所有 worker 共享。
+    每次调用执行器前申请许可，结束后按结果调整上限：成功且延迟正常时加性增加，
+    429 / 5xx / 超时或延迟明显上升时乘性降低，并遵守 Retry-After 暂停发放许可。
+    只针对单个 API Key 的 429（Key 池中还有其他 Key）由 Key 池冷却该 Key，不暂停整个执行器。
+    Redis 不可用时不做限制，只记录警告。
+    """
+
+    def __init__(self, enabled: bool, initial_limit: float, min_limit: float, max_limit: float, increase: float,
+                 decrease_factor: float, decrease_interval: float, latency_tolerance: float, max_pause: float,
+                 permit_ttl: float, max_wait: float, poll_interval: float, redis_conn: Optional[Redis] = None):
+        self.enabled = enabled
+        self.initial_limit = initial_limit
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+        self.latency_tolerance = latency_tolerance
+        self.max_pause = max_pause
+        self.permit_ttl = permit_ttl
+        self.max_wait = max_wait
+        self.poll_interval = poll_interval
+        self._redis_conn = redis_conn
+        self._redis_retry_at = 0.0
+
+    def _get_redis(self) -> Optional[Redis]:
+        if not self.enabled or time.monotonic() < self._redis_retry_at:
+            return None
+        if self._redis_conn is None:
+            self._redis_conn = get_redis()
+        return self._redis_conn
+
+    def _redis_failed(self, action: str, e: Exception) -> None:
+        logger.warning(f"{action}失败，{_REDIS_RETRY_SECONDS} 秒内不限制并发: {e}")
+        self._redis_retry_at = time.monotonic() + _REDIS_RETRY_SECONDS
+
+    @staticmethod
+    def _keys(name: str) -> list:
+        return [f"{AIMD_STATE_PREFIX}:{name}", f"{AIMD_PERMITS_PREFIX}:{name}"]
+
+    def try_acquire(self, name: str) -> Tuple[Optional[str], float]:
+        """
+        尝试申请一个许可（不等待）。
+        Returns:
+            Tuple[Optional[str], float]: (许可 ID，未拿到时为 None；建议等待的秒数)。
+            不限制并发时许可 ID 为空字符串。
+        """
+        redis_conn = self._get_redis()
+        if redis_conn is None:
+            return "", 0.0
+        permit_id = uuid.uuid4().hex
+        try:
+            granted, wait_ms = redis_conn.register_script(_ACQUIRE_SCRIPT)(
+                keys=self._keys(name),
+                args=[int(time.time() * 1000), permit_id, int(self.permit_ttl * 1000), self.initial_limit],
+            )
+        except Exception as e:
+            self._redis_failed(f"申请执行器 {name} 的并发许可", e)
+            return "", 0.0
+        if granted:
+            return permit_id, 0.0
+        return None, int(wait_ms) / 1000
+
+    def _wait_time(self, hint: float, deadline: float) -> float:
+        return max(0.0, min(max(hint, self.poll_interval), deadline - time.monotonic()))
+
+    def acquire(self, name: str) -> str:
+        """
+        申请许可，没有空余时等待。
+        Raises:
+            ConcurrencyLimitExceeded: 等待 max_wait 秒后仍没有拿到许可。
+        """
+        deadline = time.monotonic() + self.max_wait
+        permit_id, hint = self.try_acquire(name)
+        while permit_id is None:
+            if time.monotonic() >= deadline:
+                raise ConcurrencyLimitExceeded(f"执行器 {name} 的并发已达上限，{self.max_wait} 秒内没有拿到许可")
+            time.sleep(self._wait_time(hint, deadline))
+            permit_id, hint = self.try_acquire(name)
+        return permit_id
+
+    async def acquire_async(self, name: str) -> str:
+        """acquire 的异步版本，Redis 调用放到线程中执行，等待期间不阻塞事件循环。"""
+        if not self.enabled:
+            return ""
+        deadline = time.monotonic() + self.max_wait
+        permit_id, hint = await asyncio.to_thread(self.try_acquire, name)
+        while permit_id is None:
+            if time.monotonic() >= deadline:
+                raise ConcurrencyLimitExceeded(f"执行器 {name} 的并发已达上限，{self.max_wait} 秒内没有拿到许可")
+            await asyncio.sleep(self._wait_time(hint, deadline))
+            permit_id, hint = await asyncio.to_thread(self.try_acquire, name)
+        return permit_id
+
+    def _feedback(self, error: Optional[BaseException]) -> Tuple[str, float]:
+        """(结果分类 ok / overload / neutral, 暂停发放许可的秒数)。"""
+        if error is None:
+            return "ok", 0.0
+        if isinstance(error, ModelOverloadedError):
+            if error.key_scoped:
+                return "neutral", 0.0
+            return "overload", min(error.retry_after or 0.0, self.max_pause)
+        if isinstance(error, ModelTimeoutError):
+            return "overload", 0.0
+        # 其他错误（客户端错误、响应格式错误、被取消等）与供应商容量无关
+        return "neutral", 0.0
+
+    def release(self, name: str, permit_id: str, elapsed: float, error: Optional[BaseException]) -> None:
+        """归还许可，并按这次调用的结果和耗时调整并发上限。"""
+        redis_conn = self._get_redis() if permit_id else None
+        if redis_conn is None:
+            return
+        outcome, pause = self._feedback(error)
+        try:
+            limit, decreased = redis_conn.register_script(_RELEASE_SCRIPT)(
+                keys=self._keys(name),
+                args=[int(time.time() * 1000), permit_id, outcome, int(elapsed * 1000), int(pause * 1000),
+                      self.initial_limit, self.min_limit, self.max_limit, self.increase, self.decrease_factor,
+                      int(self.decrease_interval * 1000), self.latency_tolerance, _SHORT_ALPHA, _LONG_ALPHA,
+                      _MIN_LATENCY_SAMPLES, int(max(self.permit_ttl, 3600))],
+            )
+        except Exception as e:
+            self._redis_failed(f"归还执行器 {name} 的并发许可", e)
+            return
+        if decreased:
+            logger.warning(f"执行器 {name} 过载，并发上限降为 {float(_decode(limit)):.1f}"
+                           f"{f'，暂停 {pause} 秒' if pause else ''}。")
+
+    @contextmanager
+    def permit(self, name: str) -> Iterator[None]:
+        """在许可内执行包裹的调用，结束后归还许可并反馈结果。"""
+        permit_id = self.acquire(name)
+        started = time.monotonic()
+        try:
+            yield
+        except (Exception, asyncio.CancelledError) as e:
+            self.release(name, permit_id, time.monotonic() - started, e)
+            raise
+        self.release(name, permit_id, time.monotonic() - started, None)
+
+    @asynccontextmanager
+    async def permit_async(self, name: str) -> AsyncIterator[None]:
+        """permit 的异步版本。"""
+        permit_id = await self.acquire_async(name)
+        started = time.monotonic()
+        try:
+            yield
+        except (Exception, asyncio.CancelledError) as e:
+            await asyncio.to_thread(self.release, name, permit_id, time.monotonic() - started, e)
+            raise
+        await asyncio.to_thread(self.release, name, permit_id, time.monotonic() - started, None)
+
+
+def limiter_states(redis_conn: Redis) -> Dict[str, Dict[str, Any]]:
+    """
+    读取所有执行器的并发限制器状态（供 /metrics/concurrency 使用）。
+    Returns:
+        Dict[str, Dict[str, Any]]: 以执行器名称为键，包含当前并发上限、已发放的许可数、暂停剩余时间、
+        延迟 EWMA、降低次数和最近一次降低的原因、被限制的申请次数。
+    """
+    prefix = f"{AIMD_STATE_PREFIX}:"
+    now_ms = int(time.time() * 1000)
+    states = {}
+    for key in redis_conn.scan_iter(match=f"{prefix}*", count=100):
+        name = _decode(key)[len(prefix):]
+        raw = {_decode(field): _decode(value) for field, value in redis_conn.hgetall(key).items()}
+        if not raw:
+            continue
+        redis_conn.zremrangebyscore(f"{AIMD_PERMITS_PREFIX}:{name}", "-inf", now_ms)
+        states[name] = {
+            "limit": round(float(raw.get("limit", 0)), 2),
+            "in_flight": redis_conn.zcard(f"{AIMD_PERMITS_PREFIX}:{name}"),
+            "paused_seconds": round(max(0, int(float(raw.get("pause_until", 0))) - now_ms) / 1000, 1),
+            "latency_short_ms": round(float(raw.get("latency_short", 0))),
+            "latency_long_ms": round(float(raw.get("latency_long", 0))),
+            "decreases": int(raw.get("decreases", 0)),
+            "last_reason": raw.get("last_reason"),
+            "throttled": int(raw.get("throttled", 0)),
+        }
+    return states
@@ -1,9 +1,16 @@
 # ~/projects/deepseek_dispatcher-new/ai_executor/executor.py
 
-import requests
-from typing import Optional, Any, Dict
+import asyncio
+import json
+import random
+import time
+import httpx
+from typing import Optional, Any, Awaitable, Callable, Dict, List, Tuple
 from abc import ABC, abstractmethod # 导入抽象基类
 from common.logging_utils import get_logger
+from ai_executor.http_client import get_http_pool # 进程级共享的 HTTP 连接池
+from ai_executor.key_pool import KeyLease, KeyPoolExhaustedError, build_key_pool
+from ai_executor.tokenizer import count_tokens, estimate_prompt_tokens
 
 # 引入配置
 from config.settings import settings
@@ -14,6 +21,45 @@ class ModelExecutionError(Exception):
     """自定义模型执行错误异常"""
     pass
 
+class ModelTimeoutError(ModelExecutionError):
+    """模型 API 请求超时"""
+    pass
+
+class ModelClientError(ModelExecutionError):
+    """模型 API 返回 4xx（429 除外）：请求本身有问题，供应商仍在正常响应"""
+    pass
+
+class ModelOverloadedError(ModelExecutionError):
+    """
+    模型 API 返回 429 或 5xx：供应商过载。retry_after 为响应中的 Retry-After（秒），
+    key_scoped 表示 429 只针对当前 API Key（Key 池中还有其他 Key），不代表整个供应商过载。
+    """
+    def __init__(self, message: str, retry_after: Optional[float] = None, key_scoped: bool = False,
+                 status_code: Optional[int] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.key_scoped = key_scoped
+        self.status_code = status_code
+
+class ModelRateLimitError(ModelExecutionError):
+    """本地 API Key 池的请求数或 token 预算耗尽，请求没有发出"""
+    pass
+
+class ModelConnectionError(ModelExecutionError):
+    """连接失败、连接被重置等网络错误，没有拿到 HTTP 响应"""
+    pass
+
+class ModelResponseError(ModelExecutionError):
+    """模型 API 返回成功状态码，但响应格式不符合预期"""
+    pass
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    """响应头 Retry-After 的秒数；没有或不是秒数格式（HTTP 日期）时返回 None。"""
+    try:
+        return max(0.0, float(resp.headers.get("Retry-After", "")))
+    except ValueError:
+        return None
+
 class BaseExecutor(ABC):
     """
     所有AI模型执行器的抽象基类。
@@ -26,104 +72,333 @@ class BaseExecutor(ABC):
         self.max_tokens = max_tokens
         logger.debug(f"初始化 BaseExecutor，模型: {model_name}, 温度: {temperature}, Top P: {top_p}, Max Tokens: {max_tokens}")
 
+    def request_params(self, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        本次请求的模型和采样参数：params 可以包含 model / max_tokens / temperature / top_p，
+        缺省或为 None 的项使用执行器初始化时的默认值。
+        """
+        params = params or {}
+
+        def pick(name: str, default: Any) -> Any:
+            value = params.get(name)
+            return default if value is None else value
+
+        return {
+            "model": pick("model", self.model_name),
+            "max_tokens": pick("max_tokens", self.max_tokens),
+            "temperature": pick("temperature", self.temperature),
+            "top_p": pick("top_p", self.top_p),
+        }
+
     @abstractmethod
-    def execute(self, prompt: str) -> str:
+    def execute(self, prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
         """
-        抽象方法：执行AI推理并返回结果。
+        抽象方法：执行AI推理并返回结果，params 见 request_params。
         所有子类必须实现此方法。
         """
         pass
 
+    async def execute_async(self, prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
+        """
+        异步执行AI推理。
+        默认实现把同步的 execute 放到线程池中运行；基于 HTTP 的执行器会覆盖此方法，
+        直接使用 httpx.AsyncClient，使一个事件循环可以同时挂起多个推理请求。
+        """
+        return await asyncio.to_thread(self.execute, prompt, params)
 
-class DeepSeekExecutor(BaseExecutor):
-    """DeepSeek 模型执行器（通过 API 调用）"""
-    def __init__(self, api_key: str, model_name: str, temperature: float, top_p: float, max_tokens: int):
+    def execute_stream(self, prompt: str, on_delta: Callable[[str], None], params: Optional[Dict[str, Any]] = None) -> str:
+        """
+        流式执行AI推理：每收到一段增量文本就调用 on_delta，最后返回完整结果。
+        默认实现不支持流式，整段结果作为一个增量回调。
+        """
+        result = self.execute(prompt, params)
+        on_delta(result)
+        return result
+
+    async def execute_stream_async(self, prompt: str, on_delta: Callable[[str], Awaitable[None]],
+                                   params: Optional[Dict[str, Any]] = None) -> str:
+        """execute_stream 的异步版本，on_delta 为协程函数。"""
+        result = await self.execute_async(prompt, params)
+        await on_delta(result)
+        return result
+
+
+class ChatCompletionExecutor(BaseExecutor):
+    """
+    基于 HTTP Chat Completion 接口的执行器公共实现（DeepSeek、DashScope）。
+    子类声明 provider / display_name，并实现 _extract_content 解析各自的响应结构。
+    每次请求从 API Key 池中选择剩余额度最多的 Key（见 ai_executor/key_pool.py）。
+    """
+    provider = "" # 连接池中的供应商名称，同时决定使用哪组超时配置
+    display_name = "" # 日志和错误信息中使用的名称
+    format_errors: Tuple[type, ...] = (KeyError, IndexError) # 解析响应时视为"格式错误"的异常
+
+    def __init__(self, api_key: str, base_url: str, model_name: str, temperature: float, top_p: float, max_tokens: int,
+                 extra_api_keys: Optional[List[str]] = None):
         super().__init__(model_name, temperature, top_p, max_tokens)
         self.api_key = api_key
-        # DeepSeek API 的基础 URL 保持硬编码，因为它通常是固定的
-        self.base_url = "https://api.deepseek.com/v1/chat/completions" 
-        
+        self.base_url = base_url
+
         if not self.api_key:
-            logger.error("DeepSeek API Key 未设置，模型调用将失败。")
-            raise ValueError("DeepSeek API Key 必须设置。")
-        logger.info(f"DeepSeekExecutor 初始化，模型: {self.model_name}, Base URL: {self.base_url}")
+            logger.error(f"{self.display_name} API Key 未设置，模型调用将失败。")
+            raise ValueError(f"{self.display_name} API Key 必须设置。")
+        self.key_pool = build_key_pool(self.provider, [api_key] + list(extra_api_keys or []))
+        logger.info(f"{self.__class__.__name__} 初始化，模型: {self.model_name}, Base URL: {self.base_url}, "
+                    f"API Key 数: {len(self.key_pool.api_keys)}")
 
-    def execute(self, prompt: str) -> str:
+    def _build_request(self, prompt: str, stream: bool = False, api_key: Optional[str] = None,
+                       params: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, str], Dict[str, Any]]:
+        """构造请求头和请求体，api_key 为本次请求从 Key 池中选出的 Key，params 见 request_params。"""
         headers = {
-            "Authorization": f"Bearer {self.api_key}",
+            "Authorization": f"Bearer {api_key or self.api_key}",
             "Content-Type": "application/json"
         }
+        params = self.request_params(params)
         payload = {
-            "model": self.model_name,
+            "model": params["model"],
             "messages": [{"role": "user", "content": prompt}],
-            "temperature": self.temperature,
-            "top_p": self.top_p,
-            "max_tokens": self.max_tokens # 传入 max_tokens
+            "temperature": params["temperature"],
+            "top_p": params["top_p"],
+            "max_tokens": params["max_tokens"] # 传入 max_tokens
         }
-        logger.debug(f"向 DeepSeek API 发送请求，prompt 长度: {len(prompt)}")
+        if stream:
+            payload["stream"] = True
+        return headers, payload
+
+    @abstractmethod
+    def _extract_content(self, data: Dict[str, Any]) -> str:
+        """从响应 JSON 中取出生成的文本。"""
+        pass
+
+    def _extract_delta(self, chunk: Dict[str, Any]) -> Optional[str]:
+        """从流式响应的一个 chunk 中取出增量文本（OpenAI 兼容格式）。"""
+        choices = chunk.get("choices") or []
+        if not choices:
+            return None
+        return (choices[0].get("delta") or {}).get("content")
+
+    def _parse_stream_line(self, line: str) -> Optional[str]:
+        """
+        解析一行 SSE 响应。
+        Returns:
+            Optional[str]: 增量文本；非数据行或空增量返回 None。遇到 [DONE] 抛出 StopIteration。
+        """
+        if not line.startswith("data:"):
+            return None
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            raise StopIteration
+        return self._extract_delta(json.loads(data))
+
+    def _parse_response(self, resp: httpx.Response) -> Tuple[str, Optional[int]]:
+        """返回 (生成的文本, 响应中的 total_tokens)，响应没有 usage 时 token 数为 None。"""
+        resp.raise_for_status()  # 如果请求失败 (状态码 4xx 或 5xx)，会抛出 HTTPStatusError
+        data = resp.json()
+        response_content = self._extract_content(data)
+        logger.info("%s API 请求成功，返回内容长度: %d", self.display_name, len(response_content))
+        return response_content, (data.get("usage") or {}).get("total_tokens")
+
+    def _reserve(self, prompt: str, params: Optional[Dict[str, Any]] = None) -> Tuple[int, int]:
+        """
+        (prompt 的估计 token 数, 需要预占的 token 数)：输出最多 max_tokens 个 token。
+        Key 池不限额（单个 Key 且未配置 RPM/TPM）时不需要预占，跳过分词。
+        """
+        if not self.key_pool.metered:
+            return 0, 0
+        params = self.request_params(params)
+        prompt_tokens = estimate_prompt_tokens(prompt, params["model"])
+        return prompt_tokens, prompt_tokens + (params["max_tokens"] or 0)
+
+    async def _reserve_async(self, prompt: str, params: Optional[Dict[str, Any]] = None) -> Tuple[int, int]:
+        """_reserve 的异步版本：长 prompt 的分词耗时明显，放到线程中执行，不阻塞事件循环。"""
+        if not self.key_pool.metered:
+            return 0, 0
+        return await asyncio.to_thread(self._reserve, prompt, params)
+
+    def _settle(self, lease: KeyLease, content: Optional[str], used_tokens: Optional[int] = None,
+                resp: Optional[httpx.Response] = None) -> None:
+        """
+        请求结束后修正 Key 的 token 用量：优先使用响应中的 usage，流式请求按输出文本估计；
+        请求失败（content 为 None）时只计 prompt。收到 429 时按 Retry-After 冷却该 Key。
+        Key 池不限额时只记录响应中的 usage，不再估计输出的 token 数。
+        """
+        if used_tokens is None and not self.key_pool.metered:
+            used_tokens = 0
+        elif used_tokens is None:
+            used_tokens = lease.prompt_tokens + (count_tokens(content, self.model_name) if content else 0)
+        retry_after = None
+        if resp is not None and resp.status_code == 429:
+            retry_after = _retry_after(resp)
+            if retry_after is None:
+                retry_after = settings.KEY_POOL_429_COOLDOWN
+        self.key_pool.settle(lease, used_tokens, retry_after)
+
+    def _to_execution_error(self, e: Exception, resp: Optional[httpx.Response]) -> ModelExecutionError:
+        """把底层异常记录日志并转换为 ModelExecutionError。"""
+        name = self.display_name
+        if isinstance(e, KeyPoolExhaustedError):
+            logger.warning(f"{name} API Key 池预算耗尽: {e}")
+            return ModelRateLimitError(f"{name} API Key 池预算耗尽: {str(e)}")
+        if isinstance(e, httpx.TimeoutException):
+            logger.error(f"{name} API 请求超时: {e}", exc_info=True)
+            return ModelTimeoutError(f"{name} API 请求超时: {str(e)}")
+        if isinstance(e, httpx.HTTPStatusError) and 400 <= e.response.status_code < 500 and e.response.status_code != 429:
+            logger.error(f"{name} API 请求被拒绝: {e}", exc_info=True)
+            return ModelClientError(f"{name} API 请求被拒绝: {str(e)}")
+        if isinstance(e, httpx.HTTPStatusError) and (e.response.status_code == 429 or e.response.status_code >= 500):
+            # 429 / 5xx：供应商过载，并发限制器据此降低并发（见 ai_executor/concurrency_limiter.py）
+            logger.error(f"{name} API 过载: {e}", exc_info=True)
+            key_scoped = e.response.status_code == 429 and len(self.key_pool.api_keys) > 1
+            return ModelOverloadedError(f"{name} API 过载: {str(e)}", retry_after=_retry_after(e.response),
+                                        key_scoped=key_scoped, status_code=e.response.status_code)
+        if isinstance(e, httpx.HTTPError):
+            logger.error(f"{name} API 请求失败: {e}", exc_info=True)
+            return ModelConnectionError(f"{name} API 请求失败: {str(e)}")
+        if isinstance(e, self.format_errors):
+            logger.error(f"{name} API 响应格式错误: {e}. 原始响应: {resp.text if resp is not None else 'N/A'}", exc_info=True)
+            return ModelResponseError(f"{name} API 响应格式错误: {str(e)}")
+        logger.critical(f"{name} 执行器发生未知错误: {e}", exc_info=True)
+        return ModelExecutionError(f"{name} 执行器发生未知错误: {str(e)}")
+
+    def execute(self, prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
+        logger.debug(f"向 {self.display_name} API 发送请求，prompt 长度: {len(prompt)}")
+        resp = None
+        lease = None
         try:
-            resp = requests.post(self.base_url, json=payload, headers=headers, timeout=settings.TASK_JOB_TIMEOUT) # 使用配置的超时时间
-            resp.raise_for_status()  # 如果请求失败 (状态码 4xx 或 5xx)，会抛出 HTTPError
-            response_content = resp.json()["choices"][0]["message"]["content"]
-            logger.info("DeepSeek API 请求成功，返回内容长度: %d", len(response_content))
-            return response_content
-        except requests.exceptions.Timeout as e:
-            logger.error(f"DeepSeek API 请求超时: {e}", exc_info=True)
-            raise ModelExecutionError(f"DeepSeek API 请求超时: {str(e)}")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"DeepSeek API 请求失败: {e}", exc_info=True)
-            raise ModelExecutionError(f"DeepSeek API 请求失败: {str(e)}")
-        except (KeyError, IndexError) as e:
-            logger.error(f"DeepSeek API 响应格式错误: {e}. 原始响应: {resp.text if 'resp' in locals() else 'N/A'}", exc_info=True)
-            raise ModelExecutionError(f"DeepSeek API 响应格式错误: {str(e)}")
+            lease = self.key_pool.acquire(*self._reserve(prompt, params))
+            headers, payload = self._build_request(prompt, api_key=lease.api_key, params=params)
+            # 复用连接池中的长连接，超时按供应商配置（见 ai_executor/http_client.py）
+            resp = get_http_pool().get_client(self.provider).post(self.base_url, json=payload, headers=headers)
+            content, used_tokens = self._parse_response(resp)
+            self._settle(lease, content, used_tokens)
+            return content
         except Exception as e:
-            logger.critical(f"DeepSeek 执行器发生未知错误: {e}", exc_info=True)
-            raise ModelExecutionError(f"DeepSeek 执行器发生未知错误: {str(e)}")
+            if lease is not None:
+                self._settle(lease, None, resp=resp)
+            raise self._to_execution_error(e, resp)
 
+    async def execute_async(self, prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
+        logger.debug(f"向 {self.display_name} API 发送异步请求，prompt 长度: {len(prompt)}")
+        resp = None
+        lease = None
+        try:
+            lease = await self.key_pool.acquire_async(*await self._reserve_async(prompt, params))
+            headers, payload = self._build_request(prompt, api_key=lease.api_key, params=params)
+            client = get_http_pool().get_async_client(self.provider)
+            resp = await client.post(self.base_url, json=payload, headers=headers)
+            content, used_tokens = self._parse_response(resp)
+            await asyncio.to_thread(self._settle, lease, content, used_tokens)
+            return content
+        except asyncio.CancelledError:
+            # 被取消的请求（例如对冲中落败的一方）归还预占的输出 token
+            if lease is not None:
+                await asyncio.to_thread(self._settle, lease, None)
+            raise
+        except Exception as e:
+            if lease is not None:
+                await asyncio.to_thread(self._settle, lease, None, None, resp)
+            raise self._to_execution_error(e, resp)
 
-class DashScopeExecutor(BaseExecutor):
-    """DashScope (阿里云) 模型执行器（通过 API 调用）"""
-    def __init__(self, api_key: str, base_url: str, model_name: str, temperature: float, top_p: float, max_tokens: int):
-        super().__init__(model_name, temperature, top_p, max_tokens)
-        self.api_key = api_key
-        self.base_url = base_url # DashScope 的 Base URL 可以从配置中读取
-        
-        if not self.api_key:
-            logger.error("DashScope API Key 未设置，模型调用将失败。")
-            raise ValueError("DashScope API Key 必须设置。")
-        logger.info(f"DashScopeExecutor 初始化，模型: {self.model_name}, Base URL: {self.base_url}")
+    def execute_stream(self, prompt: str, on_delta: Callable[[str], None], params: Optional[Dict[str, Any]] = None) -> str:
+        logger.debug(f"向 {self.display_name} API 发送流式请求，prompt 长度: {len(prompt)}")
+        parts = []
+        resp = None
+        lease = None
+        try:
+            lease = self.key_pool.acquire(*self._reserve(prompt, params))
+            headers, payload = self._build_request(prompt, stream=True, api_key=lease.api_key, params=params)
+            client = get_http_pool().get_client(self.provider)
+            with client.stream("POST", self.base_url, json=payload, headers=headers) as resp:
+                if resp.is_error:
+                    resp.read() # 读取错误响应体，便于日志中输出原始响应
+                resp.raise_for_status()
+                for line in resp.iter_lines():
+                    try:
+                        delta = self._parse_stream_line(line)
+                    except StopIteration:
+                        break
+                    if delta:
+                        parts.append(delta)
+                        on_delta(delta)
+        except Exception as e:
+            if lease is not None:
+                self._settle(lease, None, resp=resp)
+            raise self._to_execution_error(e, resp)
+        response_content = "".join(parts)
+        self._settle(lease, response_content)
+        logger.info("%s API 流式请求成功，返回内容长度: %d", self.display_name, len(response_content))
+        return response_content
 
-    def execute(self, prompt: str) -> str:
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "model": self.model_name,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": self.temperature,
-            "top_p": self.top_p,
-            "max_tokens": self.max_tokens # 传入 max_tokens
-        }
-        logger.debug(f"向 DashScope API 发送请求，prompt 长度: {len(prompt)}")
+    async def execute_stream_async(self, prompt: str, on_delta: Callable[[str], Awaitable[None]],
+                                   params: Optional[Dict[str, Any]] = None) -> str:
+        logger.debug(f"向 {self.display_name} API 发送异步流式请求，prompt 长度: {len(prompt)}")
+        parts = []
+        resp = None
+        lease = None
         try:
-            resp = requests.post(self.base_url, json=payload, headers=headers, timeout=settings.TASK_JOB_TIMEOUT) # 使用配置的超时时间
-            resp.raise_for_status()
-            response_content = resp.json()["output"]["choices"][0]["message"]["content"]
-            logger.info("DashScope API 请求成功，返回内容长度: %d", len(response_content))
-            return response_content
-        except requests.exceptions.Timeout as e:
-            logger.error(f"DashScope API 请求超时: {e}", exc_info=True)
-            raise ModelExecutionError(f"DashScope API 请求超时: {str(e)}")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"DashScope API 请求失败: {e}", exc_info=True)
-            raise ModelExecutionError(f"DashScope API 请求失败: {str(e)}")
-        except (KeyError, IndexError, TypeError) as e: # 捕获解析响应时可能发生的错误
-            logger.error(f"DashScope API 响应格式错误: {e}. 原始响应: {resp.text if 'resp' in locals() else 'N/A'}", exc_info=True)
-            raise ModelExecutionError(f"DashScope API 响应格式错误: {str(e)}")
+            lease = await self.key_pool.acquire_async(*await self._reserve_async(prompt, params))
+            headers, payload = self._build_request(prompt, stream=True, api_key=lease.api_key, params=params)
+            client = get_http_pool().get_async_client(self.provider)
+            async with client.stream("POST", self.base_url, json=payload, headers=headers) as resp:
+                if resp.is_error:
+                    await resp.aread()
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    try:
+                        delta = self._parse_stream_line(line)
+                    except StopIteration:
+                        break
+                    if delta:
+                        parts.append(delta)
+                        await on_delta(delta)
+        except asyncio.CancelledError:
+            if lease is not None:
+                await asyncio.to_thread(self._settle, lease, "".join(parts))
+            raise
         except Exception as e:
-            logger.critical(f"DashScope 执行器发生未知错误: {e}", exc_info=True)
-            raise ModelExecutionError(f"DashScope 执行器发生未知错误: {str(e)}")
+            if lease is not None:
+                await asyncio.to_thread(self._settle, lease, None, None, resp)
+            raise self._to_execution_error(e, resp)
+        response_content = "".join(parts)
+        await asyncio.to_thread(self._settle, lease, response_content)
+        logger.info("%s API 异步流式请求成功，返回内容长度: %d", self.display_name, len(response_content))
+        return response_content
+
+
+class DeepSeekExecutor(ChatCompletionExecutor):
+    """DeepSeek 模型执行器（通过 API 调用）"""
+    provider = "deepseek"
+    display_name = "DeepSeek"
+
+    def __init__(self, api_key: str, model_name: str, temperature: float, top_p: float, max_tokens: int,
+                 extra_api_keys: Optional[List[str]] = None):
+        # DeepSeek API 的基础 URL 保持硬编码，因为它通常是固定的
+        super().__init__(api_key, "https://api.deepseek.com/v1/chat/completions", model_name, temperature, top_p, max_tokens,
+                         extra_api_keys)
+
+    def _extract_content(self, data: Dict[str, Any]) -> str:
+        return data["choices"][0]["message"]["content"]
+
+
+class DashScopeExecutor(ChatCompletionExecutor):
+    """DashScope (阿里云) 模型执行器（通过 API 调用）"""
+    provider = "dashscope"
+    display_name = "DashScope"
+    format_errors = (KeyError, IndexError, TypeError) # 捕获解析响应时可能发生的错误
+
+    def __init__(self, api_key: str, base_url: str, model_name: str, temperature: float, top_p: float, max_tokens: int,
+                 extra_api_keys: Optional[List[str]] = None):
+        # DashScope 的 Base URL 可以从配置中读取
+        super().__init__(api_key, base_url, model_name, temperature, top_p, max_tokens, extra_api_keys)
+
+    def _extract_content(self, data: Dict[str, Any]) -> str:
+        return data["output"]["choices"][0]["message"]["content"]
+
+    def _extract_delta(self, chunk: Dict[str, Any]) -> Optional[str]:
+        # 原生接口（需开启 incremental_output）在 output 下返回增量；兼容模式与 OpenAI 格式一致
+        if "output" in chunk:
+            return chunk["output"]["choices"][0]["message"].get("content")
+        return super()._extract_delta(chunk)
 
 
 class MockExecutor(BaseExecutor):
@@ -132,11 +407,46 @@ class MockExecutor(BaseExecutor):
         super().__init__(model_name, temperature, top_p, max_tokens)
         logger.info("MockExecutor 已初始化。")
 
-    def execute(self, prompt: str) -> str:
+    @staticmethod
+    def _latency() -> float:
+        # 对数正态分布的模拟延迟：中位数 MOCK_LATENCY_MEDIAN，sigma 越大长尾越重
+        sigma = settings.MOCK_LATENCY_SIGMA
+        return settings.MOCK_LATENCY_MEDIAN * (random.lognormvariate(0, sigma) if sigma > 0 else 1.0)
+
+    def _mock_response(self, prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
+        max_tokens = self.request_params(params)["max_tokens"]
+        return f"这是 MockExecutor 对您的 prompt: '{prompt[:50]}...' 的模拟响应。您请求的 max_tokens: {max_tokens}。"
+
+    def execute(self, prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
         logger.info(f"MockExecutor 正在模拟执行推理，prompt 长度: {len(prompt)}")
         # 模拟一些处理时间
-        import time
-        time.sleep(1)
+        time.sleep(self._latency())
         # 返回一个模拟的响应
-        return f"这是 MockExecutor 对您的 prompt: '{prompt[:50]}...' 的模拟响应。您请求的 max_tokens: {self.max_tokens}。"
+        return self._mock_response(prompt, params)
+
+    async def execute_async(self, prompt: str, params: Optional[Dict[str, Any]] = None) -> str:
+        logger.info(f"MockExecutor 正在模拟异步执行推理，prompt 长度: {len(prompt)}")
+        await asyncio.sleep(self._latency())
+        return self._mock_response(prompt, params)
+
+    def execute_stream(self, prompt: str, on_delta: Callable[[str], None], params: Optional[Dict[str, Any]] = None) -> str:
+        logger.info(f"MockExecutor 正在模拟流式推理，prompt 长度: {len(prompt)}")
+        response = self._mock_response(prompt, params)
+        # 按字符分成若干段逐段回调，总耗时与 execute 相同
+        chunks = [response[i:i + 8] for i in range(0, len(response), 8)]
+        latency = self._latency()
+        for chunk in chunks:
+            time.sleep(latency / len(chunks))
+            on_delta(chunk)
+        return response
 
+    async def execute_stream_async(self, prompt: str, on_delta: Callable[[str], Awaitable[None]],
+                                   params: Optional[Dict[str, Any]] = None) -> str:
+        logger.info(f"MockExecutor 正在模拟异步流式推理，prompt 长度: {len(prompt)}")
+        response = self._mock_response(prompt, params)
+        chunks = [response[i:i + 8] for i in range(0, len(response), 8)]
+        latency = self._latency()
+        for chunk in chunks:
+            await asyncio.sleep(latency / len(chunks))
+            await on_delta(chunk)
+        return response
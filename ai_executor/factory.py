@@ -1,38 +1,68 @@
 # ~/projects/deepseek_dispatcher-new/ai_executor/factory.py
 
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
 # 导入 settings 实例，而不是整个 config.settings 模块
 from config.settings import settings
 # 从 ai_executor.executor 导入具体的执行器类和 ModelExecutionError
 from ai_executor.executor import BaseExecutor, DeepSeekExecutor, DashScopeExecutor, MockExecutor, ModelExecutionError
+from ai_executor.circuit_breaker import CircuitBreaker, CircuitOpenError
+from ai_executor.concurrency_limiter import AdaptiveConcurrencyLimiter
+from ai_executor.hedging import HedgePolicy
+from ai_executor.key_pool import provider_keys
+from ai_executor.router import AdaptiveRouter
 from services.exceptions import ServiceExecutionError # ServiceExecutionError 也可能用到
 from common.logging_utils import get_logger
 
 logger = get_logger("ai_executor")
 
+
+def default_model(provider: str) -> str:
+    """
+    供应商的默认模型：MODEL_NAME 由该供应商服务时（见 ROUTER_PROVIDER_MODELS）使用 MODEL_NAME，
+    否则使用该供应商列表中的第一个模型，避免把 DeepSeek 的模型名发给 DashScope。
+    """
+    models = settings.ROUTER_PROVIDER_MODELS.get(provider)
+    if not models or settings.MODEL_NAME in models:
+        return settings.MODEL_NAME
+    return models[0]
+
+
 class ExecutorFactory:
     """
     负责创建和管理不同AI模型的执行器。
     通过配置自动选择合适的执行器，并提供API密钥等参数。
+    配置了多个执行器时，由 AdaptiveRouter 按各执行器的实际延迟、错误率和进行中请求数选择。
+    非流式请求可以启用对冲（HEDGE_ENABLED，见 ai_executor/hedging.py）。
+    每个执行器有一个熔断器（见 ai_executor/circuit_breaker.py），熔断器打开的执行器不会被选中；
+    调用执行器前需要拿到该执行器的并发许可（见 ai_executor/concurrency_limiter.py）。
     """
 
     def __init__(self):
         self.executors: Dict[str, BaseExecutor] = {} # 明确类型提示
         # 根据配置文件初始化各种执行器
-        if settings.DASHSCOPE_API_KEY:
+        # 每个供应商可以配置多个 API Key（<供应商>_API_KEYS），组成 Key 池
+        dashscope_keys = provider_keys("dashscope")
+        if dashscope_keys:
             self.executors['dashscope'] = DashScopeExecutor(
-                api_key=settings.DASHSCOPE_API_KEY,
+                api_key=dashscope_keys[0],
+                extra_api_keys=dashscope_keys[1:],
                 base_url=settings.DASHSCOPE_BASE_URL,
-                model_name=settings.MODEL_NAME, # 使用统一的 MODEL_NAME
+                model_name=default_model('dashscope'),
                 temperature=settings.MODEL_TEMPERATURE,
                 top_p=settings.MODEL_TOP_P,
                 max_tokens=settings.MODEL_MAX_TOKENS # 使用统一的 MODEL_MAX_TOKENS
             )
             logger.info("DashScope Executor 已初始化。")
 
-        if settings.DEEPSEEK_API_KEY:
+        deepseek_keys = provider_keys("deepseek")
+        if deepseek_keys:
             self.executors['deepseek'] = DeepSeekExecutor(
-                api_key=settings.DEEPSEEK_API_KEY,
-                model_name=settings.MODEL_NAME, # 使用统一的 MODEL_NAME
+                api_key=deepseek_keys[0],
+                extra_api_keys=deepseek_keys[1:],
+                model_name=default_model('deepseek'),
                 temperature=settings.MODEL_TEMPERATURE,
                 top_p=settings.MODEL_TOP_P,
                 max_tokens=settings.MODEL_MAX_TOKENS # 使用统一的 MODEL_MAX_TOKENS
@@ -49,41 +79,312 @@ class ExecutorFactory:
             )
             logger.warning("未配置任何大模型API密钥，使用 Mock Executor。请在 .env 文件中设置 DASHSCOPE_API_KEY 或 DEEPSEEK_API_KEY。")
 
-    def get_executor(self, model_name: str = None) -> BaseExecutor:
+        self.router = AdaptiveRouter(
+            list(self.executors),
+            alpha=settings.ROUTER_EWMA_ALPHA,
+            in_flight_weight=settings.ROUTER_IN_FLIGHT_WEIGHT,
+            error_penalty=settings.ROUTER_ERROR_PENALTY,
+            error_half_life=settings.ROUTER_ERROR_HALF_LIFE,
+            initial_latency=settings.ROUTER_INITIAL_LATENCY,
+            stickiness=settings.ROUTER_STICKINESS_SECONDS,
+            switch_margin=settings.ROUTER_SWITCH_MARGIN,
+            probe_interval=settings.ROUTER_PROBE_INTERVAL,
+            window=settings.HEDGE_LATENCY_WINDOW,
+        )
+        self.hedging = HedgePolicy(
+            enabled=settings.HEDGE_ENABLED,
+            percentile=settings.HEDGE_PERCENTILE,
+            min_samples=settings.HEDGE_MIN_SAMPLES,
+            min_delay=settings.HEDGE_MIN_DELAY,
+            budget_ratio=settings.HEDGE_BUDGET_RATIO,
+            budget_burst=settings.HEDGE_BUDGET_BURST,
+        )
+        self.breaker = CircuitBreaker(
+            enabled=settings.BREAKER_ENABLED,
+            window_seconds=settings.BREAKER_WINDOW_SECONDS,
+            min_requests=settings.BREAKER_MIN_REQUESTS,
+            error_rate=settings.BREAKER_ERROR_RATE,
+            timeout_threshold=settings.BREAKER_TIMEOUT_THRESHOLD,
+            open_seconds=settings.BREAKER_OPEN_SECONDS,
+            half_open_probes=settings.BREAKER_HALF_OPEN_PROBES,
+            probe_timeout=settings.BREAKER_PROBE_TIMEOUT,
+        )
+        self.limiter = AdaptiveConcurrencyLimiter(
+            enabled=settings.AIMD_ENABLED,
+            initial_limit=settings.AIMD_INITIAL_LIMIT,
+            min_limit=settings.AIMD_MIN_LIMIT,
+            max_limit=settings.AIMD_MAX_LIMIT,
+            increase=settings.AIMD_INCREASE,
+            decrease_factor=settings.AIMD_DECREASE_FACTOR,
+            decrease_interval=settings.AIMD_DECREASE_INTERVAL,
+            latency_tolerance=settings.AIMD_LATENCY_TOLERANCE,
+            max_pause=settings.AIMD_MAX_PAUSE,
+            permit_ttl=settings.AIMD_PERMIT_TTL,
+            max_wait=settings.AIMD_MAX_WAIT,
+            poll_interval=settings.AIMD_POLL_INTERVAL,
+        )
+        # 同步 worker 的对冲请求在线程中执行，懒加载
+        self._hedge_pool: Optional[ThreadPoolExecutor] = None
+        self._hedge_pool_lock = threading.Lock()
+
+    def _candidates(self, model_name: str = None) -> List[str]:
         """
-        根据模型名称获取对应的执行器。
-        如果未指定模型或指定模型不可用，则尝试按顺序返回可用的执行器。
+        可以服务 model_name 的执行器（见 ROUTER_PROVIDER_MODELS）；
+        未指定模型或模型不在任何供应商的列表中时，所有执行器都是候选。
         """
+        names = list(self.executors)
+        if not model_name:
+            return names
+        serving = [name for name in names
+                   if name not in settings.ROUTER_PROVIDER_MODELS or model_name in settings.ROUTER_PROVIDER_MODELS[name]]
+        listed = any(model_name in models for models in settings.ROUTER_PROVIDER_MODELS.values())
+        return serving if listed and serving else names
+
+    def _route_candidates(self, model_name: str = None) -> List[str]:
+        """model_name 为执行器名称时只使用该执行器，否则为能服务该模型的所有执行器。"""
         if model_name and model_name in self.executors:
             logger.debug(f"使用指定的模型执行器: {model_name}")
-            return self.executors[model_name]
-
-        # 尝试返回默认（优先 DeepSeek，其次 DashScope，最后 Mock）
-        if 'deepseek' in self.executors:
-            logger.debug("使用 DeepSeek Executor (默认)。")
-            return self.executors['deepseek']
-        elif 'dashscope' in self.executors:
-            logger.debug("使用 DashScope Executor (默认)。")
-            return self.executors['dashscope']
-        elif 'mock' in self.executors:
+            return [model_name]
+        candidates = self._candidates(model_name)
+        if not candidates:
+            logger.error("没有可用的模型执行器。")
+            raise ServiceExecutionError("没有可用的模型执行器。请检查 API 密钥配置。")
+        return candidates
+
+    def _request_params(self, name: str, model_name: Optional[str],
+                        model_kwargs: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        执行器 name 处理这次请求时的参数（见 BaseExecutor.request_params）：
+        model_kwargs 中的 max_tokens / temperature / top_p 原样发送，未指定的使用执行器的默认值；
+        请求的模型由该执行器服务时原样发送；未指定模型、指定的是执行器名称，
+        或该供应商不服务这个模型（未列出的模型、对冲到其他供应商）时使用执行器的默认模型。
+        """
+        params = {key: value for key, value in (model_kwargs or {}).items()
+                  if key in ("max_tokens", "temperature", "top_p") and value is not None}
+        if not model_name or model_name in self.executors:
+            return params
+        models = settings.ROUTER_PROVIDER_MODELS.get(name)
+        if models is None or model_name in models:
+            params["model"] = model_name
+        else:
+            logger.warning(f"执行器 {name} 不服务模型 {model_name}，使用默认模型 {self.executors[name].model_name}。")
+        return params
+
+    def select(self, model_name: str = None) -> Tuple[str, BaseExecutor]:
+        """返回 (执行器名称, 执行器)，名称用于 router.track 记录这次请求。"""
+        name = self.router.choose(self._route_candidates(model_name))
+        if name == 'mock':
             logger.warning("使用 Mock Executor (无可用真实模型)。")
-            return self.executors['mock']
-        
-        logger.error("没有可用的模型执行器。")
-        raise ServiceExecutionError("没有可用的模型执行器。请检查 API 密钥配置。")
+        return name, self.executors[name]
+
+    def _acquire(self, candidates: List[str]) -> Tuple[str, BaseExecutor, bool]:
+        """
+        在候选执行器中选择熔断器放行的一个：路由器选出的执行器被熔断时，从剩余的候选中重新选择。
+        Returns:
+            Tuple[str, BaseExecutor, bool]: (执行器名称, 执行器, 是否为半开状态下的探测请求)。
+        Raises:
+            CircuitOpenError: 所有候选执行器的熔断器都处于打开状态。
+        """
+        remaining = list(candidates)
+        while remaining:
+            name = self.router.choose(remaining)
+            allowed, probe = self.breaker.allow(name)
+            if allowed:
+                if name == 'mock':
+                    logger.warning("使用 Mock Executor (无可用真实模型)。")
+                return name, self.executors[name], probe
+            logger.warning(f"执行器 {name} 的熔断器已打开，尝试其他执行器。")
+            remaining.remove(name)
+        raise CircuitOpenError(f"执行器 {', '.join(candidates)} 的熔断器均已打开，请求被快速拒绝。")
+
+    def get_executor(self, model_name: str = None) -> BaseExecutor:
+        """
+        根据模型名称获取对应的执行器。
+        model_name 为执行器名称（deepseek / dashscope / mock）时直接使用该执行器；
+        否则在能服务该模型的执行器中由路由器选择预期完成时间最短的一个。
+        """
+        return self.select(model_name)[1]
 
-    def run(self, prompt: str, model_name: str = None) -> str:
+    def _hedge_target(self, model_name: Optional[str], primary: str) -> Optional[Tuple[str, BaseExecutor, bool]]:
         """
-        使用选择的执行器运行推理。
+        对冲请求的执行器：能服务该模型的其他执行器中分数最好的一个，没有时使用主执行器本身。
+        熔断器都不放行时返回 None，不发出对冲请求。
         """
-        executor = self.get_executor(model_name)
+        others = [name for name in self._route_candidates(model_name) if name != primary]
+        try:
+            return self._acquire(others or [primary])
+        except CircuitOpenError:
+            return None
+
+    def _get_hedge_pool(self) -> ThreadPoolExecutor:
+        if self._hedge_pool is None:
+            with self._hedge_pool_lock:
+                if self._hedge_pool is None:
+                    self._hedge_pool = ThreadPoolExecutor(max_workers=settings.HEDGE_MAX_THREADS, thread_name_prefix="hedge")
+        return self._hedge_pool
+
+    def _execute_tracked(self, name: str, executor: BaseExecutor, prompt: str, probe: bool, model_name: Optional[str],
+                         model_kwargs: Optional[Dict[str, Any]]) -> str:
+        with self.breaker.guard(name, probe), self.limiter.permit(name), self.router.track(name):
+            return executor.execute(prompt, self._request_params(name, model_name, model_kwargs))
+
+    async def _execute_tracked_async(self, name: str, executor: BaseExecutor, prompt: str, probe: bool,
+                                     model_name: Optional[str], model_kwargs: Optional[Dict[str, Any]]) -> str:
+        async with self.breaker.guard_async(name, probe), self.limiter.permit_async(name):
+            with self.router.track(name):
+                return await executor.execute_async(prompt, self._request_params(name, model_name, model_kwargs))
+
+    def _execute_hedged(self, prompt: str, model_name: Optional[str], model_kwargs: Optional[Dict[str, Any]], name: str,
+                        executor: BaseExecutor, probe: bool, delay: float) -> str:
+        """
+        同步版本的对冲：主请求在线程中执行，delay 秒内未返回且预算允许时发出对冲请求，先成功的结果生效。
+        同步的 HTTP 请求无法从其他线程中断，落败的请求在后台线程中自然结束，结果被丢弃。
+        """
+        pool = self._get_hedge_pool()
+        primary = pool.submit(self._execute_tracked, name, executor, prompt, probe, model_name, model_kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        if not self.hedging.budget.try_acquire():
+            self.hedging.stats.record(budget_denied=1)
+            return primary.result()
+        target = self._hedge_target(model_name, name)
+        if target is None:
+            return primary.result()
+        hedge_name, hedge_executor, hedge_probe = target
+        logger.info(f"{name} 超过 {delay:.2f} 秒未返回，向 {hedge_name} 发出对冲请求。")
+        hedge = pool.submit(self._execute_tracked, hedge_name, hedge_executor, prompt, hedge_probe, model_name,
+                            model_kwargs)
+        self.hedging.stats.record(hedged=1)
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for loser in pending:
+                        loser.cancel()
+                    if future is hedge:
+                        self.hedging.stats.record(hedge_wins=1)
+                    return future.result()
+                first_error = first_error or future.exception()
+        raise first_error
+
+    async def _execute_hedged_async(self, prompt: str, model_name: Optional[str], model_kwargs: Optional[Dict[str, Any]],
+                                    name: str, executor: BaseExecutor, probe: bool, delay: float) -> str:
+        """异步版本的对冲：落败的请求被取消（连接随之关闭），不计入路由统计。"""
+        primary = asyncio.create_task(self._execute_tracked_async(name, executor, prompt, probe, model_name, model_kwargs))
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if done:
+                return primary.result()
+            if not self.hedging.budget.try_acquire():
+                self.hedging.stats.record(budget_denied=1)
+                return await primary
+            target = await asyncio.to_thread(self._hedge_target, model_name, name)
+            if target is None:
+                return await primary
+            hedge_name, hedge_executor, hedge_probe = target
+            logger.info(f"{name} 超过 {delay:.2f} 秒未返回，向 {hedge_name} 发出对冲请求。")
+            hedge = asyncio.create_task(
+                self._execute_tracked_async(hedge_name, hedge_executor, prompt, hedge_probe, model_name, model_kwargs))
+            tasks.add(hedge)
+            self.hedging.stats.record(hedged=1)
+            pending = set(tasks)
+            first_error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedging.stats.record(hedge_wins=1)
+                        return task.result()
+                    first_error = first_error or task.exception()
+            raise first_error
+        finally:
+            # 返回、异常或外层取消时都取消仍在进行的请求
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    def run(self, prompt: str, model_name: str = None, model_kwargs: Optional[Dict[str, Any]] = None) -> str:
+        """
+        使用选择的执行器运行推理，model_kwargs 为请求的 max_tokens / temperature / top_p。
+        """
+        name, executor, probe = self._acquire(self._route_candidates(model_name))
         logger.info(f"正在使用模型执行器: {executor.__class__.__name__} (模型: {executor.model_name}) 进行推理，prompt 长度: {len(prompt)}")
         try:
-            return executor.execute(prompt)
+            delay = self.hedging.hedge_delay(self.router, name)
+            if delay is not None:
+                return self._execute_hedged(prompt, model_name, model_kwargs, name, executor, probe, delay)
+            return self._execute_tracked(name, executor, prompt, probe, model_name, model_kwargs)
         except ModelExecutionError as e:
             logger.error(f"模型执行错误: {e}", exc_info=True)
             raise ServiceExecutionError(f"模型执行错误: {str(e)}") # 转换为服务层面的错误
+        except ServiceExecutionError:
+            raise # 没有拿到并发许可等服务层错误直接抛出
         except Exception as e:
             logger.critical(f"执行器意外错误: {e}", exc_info=True)
             raise ServiceExecutionError(f"执行器发生意外错误: {str(e)}")
 
+    async def run_async(self, prompt: str, model_name: str = None, model_kwargs: Optional[Dict[str, Any]] = None) -> str:
+        """
+        使用选择的执行器异步运行推理（供异步 worker 使用）。
+        """
+        # 熔断器状态在 Redis 中，同步调用放到线程中执行
+        name, executor, probe = await asyncio.to_thread(self._acquire, self._route_candidates(model_name))
+        logger.info(f"正在使用模型执行器: {executor.__class__.__name__} (模型: {executor.model_name}) 进行异步推理，prompt 长度: {len(prompt)}")
+        try:
+            delay = self.hedging.hedge_delay(self.router, name)
+            if delay is not None:
+                return await self._execute_hedged_async(prompt, model_name, model_kwargs, name, executor, probe, delay)
+            return await self._execute_tracked_async(name, executor, prompt, probe, model_name, model_kwargs)
+        except ModelExecutionError as e:
+            logger.error(f"模型执行错误: {e}", exc_info=True)
+            raise ServiceExecutionError(f"模型执行错误: {str(e)}")
+        except ServiceExecutionError:
+            raise # 没有拿到并发许可等服务层错误直接抛出
+        except Exception as e:
+            logger.critical(f"执行器意外错误: {e}", exc_info=True)
+            raise ServiceExecutionError(f"执行器发生意外错误: {str(e)}")
+
+    def run_stream(self, prompt: str, on_delta: Callable[[str], None], model_name: str = None,
+                   model_kwargs: Optional[Dict[str, Any]] = None) -> str:
+        """
+        使用选择的执行器流式运行推理，每段增量文本回调 on_delta，返回完整结果。
+        """
+        name, executor, probe = self._acquire(self._route_candidates(model_name))
+        logger.info(f"正在使用模型执行器: {executor.__class__.__name__} (模型: {executor.model_name}) 进行流式推理，prompt 长度: {len(prompt)}")
+        try:
+            with self.breaker.guard(name, probe), self.limiter.permit(name), self.router.track(name):
+                return executor.execute_stream(prompt, on_delta, self._request_params(name, model_name, model_kwargs))
+        except ModelExecutionError as e:
+            logger.error(f"模型执行错误: {e}", exc_info=True)
+            raise ServiceExecutionError(f"模型执行错误: {str(e)}")
+        except ServiceExecutionError:
+            raise # 没有拿到并发许可等服务层错误直接抛出
+        except Exception as e:
+            logger.critical(f"执行器意外错误: {e}", exc_info=True)
+            raise ServiceExecutionError(f"执行器发生意外错误: {str(e)}")
+
+    async def run_stream_async(self, prompt: str, on_delta: Callable[[str], Awaitable[None]], model_name: str = None,
+                               model_kwargs: Optional[Dict[str, Any]] = None) -> str:
+        """
+        run_stream 的异步版本，on_delta 为协程函数。
+        """
+        name, executor, probe = await asyncio.to_thread(self._acquire, self._route_candidates(model_name))
+        logger.info(f"正在使用模型执行器: {executor.__class__.__name__} (模型: {executor.model_name}) 进行异步流式推理，prompt 长度: {len(prompt)}")
+        try:
+            async with self.breaker.guard_async(name, probe), self.limiter.permit_async(name):
+                with self.router.track(name):
+                    return await executor.execute_stream_async(
+                        prompt, on_delta, self._request_params(name, model_name, model_kwargs))
+        except ModelExecutionError as e:
+            logger.error(f"模型执行错误: {e}", exc_info=True)
+            raise ServiceExecutionError(f"模型执行错误: {str(e)}")
+        except ServiceExecutionError:
+            raise # 没有拿到并发许可等服务层错误直接抛出
+        except Exception as e:
+            logger.critical(f"执行器意外错误: {e}", exc_info=True)
+            raise ServiceExecutionError(f"执行器发生意外错误: {str(e)}")
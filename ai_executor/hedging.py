@@ -0,0 +1,93 @@
+# ~/projects/deepseek_dispatcher-new/ai_executor/hedging.py
+
+import threading
+from typing import Any, Dict, Optional
+
+from common.stats_reporter import StatsReporter
+from config.settings import settings
+
+
+class HedgeBudget:
+    """
+    对冲请求的预算（令牌桶）：每个请求存入 ratio 个令牌，每次对冲消耗一个，
+    长期来看对冲请求不超过总请求数的 ratio；桶容量 burst 允许短时间内集中对冲。
+    """
+
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self._tokens = burst
+        self._lock = threading.Lock()
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def tokens(self) -> float:
+        return self._tokens
+
+
+class HedgeStats:
+    """进程内的对冲统计（stats:hedging:<host>:<pid>），由 /metrics/router 汇总。"""
+
+    def __init__(self, budget: HedgeBudget):
+        self._lock = threading.Lock()
+        self._budget = budget
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.budget_denied = 0
+        self._reporter = StatsReporter("hedging", interval=settings.ROUTER_STATS_INTERVAL)
+
+    def record(self, **counts: int) -> None:
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+        self._reporter.maybe_publish(self.snapshot)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "budget_denied": self.budget_denied,
+                "hedge_ratio": round(self.hedged / self.requests, 4) if self.requests else None,
+                "budget_tokens": round(self._budget.tokens, 2),
+            }
+
+
+class HedgePolicy:
+    """
+    对冲策略（ExecutorFactory.run / run_async 使用）：主执行器超过其近期成功延迟的 percentile 分位数仍未返回时，
+    把同一个请求再发给另一个执行器（没有其他可用执行器时发给同一个执行器），先返回的结果生效，另一个请求被取消。
+    近期样本少于 min_samples 时不对冲；对冲等待时间不低于 min_delay 秒；对冲次数受 HedgeBudget 限制。
+    """
+
+    def __init__(self, enabled: bool, percentile: float, min_samples: int, min_delay: float,
+                 budget_ratio: float, budget_burst: float):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.budget = HedgeBudget(budget_ratio, budget_burst)
+        self.stats = HedgeStats(self.budget)
+
+    def hedge_delay(self, router, name: str) -> Optional[float]:
+        """主执行器的对冲等待时间（秒），不对冲时返回 None。每次调用记为一个请求并向预算存入令牌。"""
+        if not self.enabled:
+            return None
+        self.budget.deposit()
+        self.stats.record(requests=1)
+        latency = router.latency_percentile(name, self.percentile, self.min_samples)
+        if latency is None:
+            return None
+        return max(self.min_delay, latency)
@@ -0,0 +1,190 @@
+# ~/projects/deepseek_dispatcher-new/ai_executor/http_client.py
+
+import asyncio
+import importlib.util
+import threading
+import weakref
+from typing import Any, Dict, Optional
+
+import httpx
+
+from common.logging_utils import get_logger
+from common.stats_reporter import StatsReporter
+from config.settings import settings
+
+logger = get_logger("http_client")
+
+
+def provider_timeout(provider: str) -> httpx.Timeout:
+    """
+    按供应商读取连接/读取超时。
+    读取超时未配置时沿用 TASK_JOB_TIMEOUT，与之前 requests.post(timeout=...) 的行为一致。
+    """
+    prefix = provider.upper()
+    connect_timeout = getattr(settings, f"{prefix}_CONNECT_TIMEOUT", None) or settings.HTTP_CONNECT_TIMEOUT
+    read_timeout = getattr(settings, f"{prefix}_READ_TIMEOUT", None) or settings.TASK_JOB_TIMEOUT
+    return httpx.Timeout(
+        connect=connect_timeout,
+        read=read_timeout,
+        write=connect_timeout,
+        pool=settings.HTTP_POOL_TIMEOUT,
+    )
+
+
+class _ProviderStats:
+    """单个供应商的连接复用统计。"""
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        # 用弱引用记录见过的底层连接，连接被池回收后自动从集合中消失
+        self._seen_streams = weakref.WeakSet()
+
+    def record(self, network_stream: Any) -> None:
+        self.requests += 1
+        if network_stream is None:
+            return
+        if network_stream not in self._seen_streams:
+            self._seen_streams.add(network_stream)
+            self.new_connections += 1
+
+
+class HTTPClientPool:
+    """
+    进程级共享的 HTTP 连接池。
+    每个供应商一个长连接 httpx.Client，所有执行器复用，避免每次推理都重新做 TCP + TLS 握手。
+    异步模式下另有一组 httpx.AsyncClient，绑定在创建它们的事件循环上。
+    """
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.Client] = {}
+        self._async_clients: Dict[str, httpx.AsyncClient] = {}
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stats: Dict[str, _ProviderStats] = {}
+        self._lock = threading.Lock()
+        self.http2 = settings.HTTP_ENABLE_HTTP2
+        if self.http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("HTTP_ENABLE_HTTP2 已开启，但未安装 h2 (pip install 'httpx[http2]')，回退为 HTTP/1.1。")
+            self.http2 = False
+        self.limits = httpx.Limits(
+            max_connections=settings.HTTP_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=settings.HTTP_POOL_KEEPALIVE_EXPIRY,
+        )
+        self._reporter = StatsReporter("http_pool", interval=settings.HTTP_POOL_STATS_INTERVAL)
+        logger.info(f"HTTPClientPool 初始化，limits: {self.limits}, HTTP/2: {self.http2}")
+
+    def get_client(self, provider: str) -> httpx.Client:
+        """获取（必要时创建）指定供应商的共享客户端。"""
+        client = self._clients.get(provider)
+        if client is not None:
+            return client
+        with self._lock:
+            if provider not in self._clients:
+                self._stats.setdefault(provider, _ProviderStats())
+                self._clients[provider] = httpx.Client(
+                    http2=self.http2,
+                    limits=self.limits,
+                    timeout=provider_timeout(provider),
+                    event_hooks={"response": [lambda response: self._on_response(provider, response)]},
+                )
+                logger.debug(f"已为供应商 '{provider}' 创建 HTTP 客户端。")
+            return self._clients[provider]
+
+    def get_async_client(self, provider: str) -> httpx.AsyncClient:
+        """
+        获取（必要时创建）指定供应商的共享异步客户端，必须在事件循环内调用。
+        AsyncClient 的连接属于创建它的事件循环，事件循环变化时（例如 RQ 为协程任务新建循环）需重新创建。
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            # 旧循环上的连接无法在新循环中使用，直接丢弃
+            self._async_clients = {}
+            self._async_loop = loop
+        client = self._async_clients.get(provider)
+        if client is None:
+            self._stats.setdefault(provider, _ProviderStats())
+            client = httpx.AsyncClient(
+                http2=self.http2,
+                limits=self.limits,
+                timeout=provider_timeout(provider),
+                event_hooks={"response": [lambda response: self._on_async_response(provider, response)]},
+            )
+            self._async_clients[provider] = client
+            logger.debug(f"已为供应商 '{provider}' 创建异步 HTTP 客户端。")
+        return client
+
+    def _on_response(self, provider: str, response: httpx.Response) -> None:
+        self._stats[provider].record(response.extensions.get("network_stream"))
+        self._reporter.maybe_publish(self.stats)
+
+    async def _on_async_response(self, provider: str, response: httpx.Response) -> None:
+        self._on_response(provider, response)
+
+    @staticmethod
+    def _connection_counts(client: Optional[httpx.Client]) -> Dict[str, int]:
+        """从 httpcore 连接池中统计活跃/空闲连接数。"""
+        counts = {"active_connections": 0, "idle_connections": 0}
+        try:
+            connections = client._transport._pool.connections
+        except AttributeError:
+            return counts
+        for conn in connections:
+            if conn.is_idle():
+                counts["idle_connections"] += 1
+            else:
+                counts["active_connections"] += 1
+        return counts
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        返回每个供应商的连接池统计，用于调整池大小。
+        reuse_ratio = 复用已有连接的请求数 / 总请求数。
+        """
+        snapshot = {}
+        for provider, provider_stats in self._stats.items():
+            reused = provider_stats.requests - provider_stats.new_connections
+            counts = self._connection_counts(self._clients.get(provider))
+            async_counts = self._connection_counts(self._async_clients.get(provider))
+            snapshot[provider] = {
+                "requests": provider_stats.requests,
+                "new_connections": provider_stats.new_connections,
+                "reuse_ratio": round(reused / provider_stats.requests, 4) if provider_stats.requests else 0.0,
+                "active_connections": counts["active_connections"] + async_counts["active_connections"],
+                "idle_connections": counts["idle_connections"] + async_counts["idle_connections"],
+            }
+        return snapshot
+
+    def close(self) -> None:
+        """关闭所有客户端，释放连接。"""
+        with self._lock:
+            for provider, client in self._clients.items():
+                client.close()
+                logger.debug(f"已关闭供应商 '{provider}' 的 HTTP 客户端。")
+            self._clients.clear()
+
+    async def aclose(self) -> None:
+        """关闭当前事件循环上的所有异步客户端。"""
+        for provider, client in list(self._async_clients.items()):
+            await client.aclose()
+            logger.debug(f"已关闭供应商 '{provider}' 的异步 HTTP 客户端。")
+        self._async_clients = {}
+        self._async_loop = None
+
+
+_http_pool: Optional[HTTPClientPool] = None
+_http_pool_lock = threading.Lock()
+
+
+def get_http_pool() -> HTTPClientPool:
+    """
+    获取当前进程的共享连接池（懒加载）。
+    注意：RQ 默认 Worker 每个任务 fork 一个子进程，连接会随子进程销毁，
+    因此 worker 需以 SimpleWorker 运行，连接才能跨任务复用。
+    """
+    global _http_pool
+    if _http_pool is None:
+        with _http_pool_lock:
+            if _http_pool is None:
+                _http_pool = HTTPClientPool()
+    return _http_pool
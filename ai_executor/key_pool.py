@@ -0,0 +1,257 @@
+# ~/projects/deepseek_dispatcher-new/ai_executor/key_pool.py
+
+import asyncio
+import hashlib
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from redis import Redis
+
+from common.logging_utils import get_logger
+from common.redis_utils import get_redis
+from common.stats_reporter import StatsReporter
+from config.settings import settings
+
+logger = get_logger("key_pool")
+
+# 每个 Key 每分钟一个用量哈希 keypool:<供应商>:<Key 指纹>:<分钟序号>（字段 req / tok），
+# 收到 429 后的冷却标记为 keypool:<供应商>:<Key 指纹>:cooldown
+KEY_POOL_PREFIX = "keypool"
+
+# Redis 访问失败后，这段时间 (秒) 内不做预算检查，随机使用一个 Key
+_REDIS_RETRY_SECONDS = 5.0
+
+# 在所有未冷却、预算足够的 Key 中选择剩余额度比例最大的一个，并预占 1 个请求和 ARGV[3] 个 token。
+# 用量按滑动窗口估计：当前分钟的用量 + 上一分钟的用量 × 当前分钟尚未经过的比例（ARGV[2] 为已经过的比例）。
+# KEYS 每 3 个一组（当前分钟、上一分钟、冷却标记），ARGV[4..] 每 2 个一组（RPM、TPM，0 表示不限制）。
+# 返回选中 Key 的下标（从 0 开始），没有可用的 Key 时返回 -1。
+_ACQUIRE_SCRIPT = """
+local count = tonumber(ARGV[1])
+local elapsed = tonumber(ARGV[2])
+local estimate = tonumber(ARGV[3])
+local best, best_room, best_requests = -1, -1, 0
+for i = 1, count do
+    local current, previous, cooldown = KEYS[3 * i - 2], KEYS[3 * i - 1], KEYS[3 * i]
+    if redis.call('EXISTS', cooldown) == 0 then
+        local rpm = tonumber(ARGV[2 + 2 * i])
+        local tpm = tonumber(ARGV[3 + 2 * i])
+        local requests = tonumber(redis.call('HGET', current, 'req') or '0')
+            + tonumber(redis.call('HGET', previous, 'req') or '0') * (1 - elapsed)
+        local tokens = tonumber(redis.call('HGET', current, 'tok') or '0')
+            + tonumber(redis.call('HGET', previous, 'tok') or '0') * (1 - elapsed)
+        local fits = true
+        local room = 1
+        if rpm > 0 then
+            fits = requests + 1 <= rpm
+            room = math.min(room, (rpm - requests - 1) / rpm)
+        end
+        if tpm > 0 then
+            -- 单个请求的预估超过整个 TPM 时，只要求该 Key 当前没有 token 用量，避免永远等待
+            local needed = math.min(estimate, tpm)
+            fits = fits and tokens + needed <= tpm
+            room = math.min(room, (tpm - tokens - needed) / tpm)
+        end
+        if fits and (room > best_room or (room == best_room and requests < best_requests)) then
+            best, best_room, best_requests = i, room, requests
+        end
+    end
+end
+if best < 0 then
+    return -1
+end
+local current = KEYS[3 * best - 2]
+redis.call('HINCRBY', current, 'req', 1)
+redis.call('HINCRBY', current, 'tok', estimate)
+redis.call('EXPIRE', current, 180)
+return best - 1
+"""
+
+
+class KeyPoolExhaustedError(Exception):
+    """在 KEY_POOL_MAX_WAIT 秒内所有 Key 的请求数或 token 预算都没有空余。"""
+    pass
+
+
+def key_fingerprint(api_key: str) -> str:
+    """Key 的指纹，用于 Redis 键名、日志和统计，避免出现 Key 原文。"""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+class KeyLease:
+    """一次请求使用的 Key 和预占的 token 数，请求结束后通过 KeyPool.settle 按实际用量修正。"""
+
+    def __init__(self, api_key: str, fingerprint: str, bucket: Optional[str], prompt_tokens: int, reserved_tokens: int):
+        self.api_key = api_key
+        self.fingerprint = fingerprint
+        self.bucket = bucket # 预占用量所在的分钟哈希，None 表示没有经过 Redis 记账
+        self.prompt_tokens = prompt_tokens
+        self.reserved_tokens = reserved_tokens
+
+
+class KeyPool:
+    """
+    单个供应商的 API Key 池（ChatCompletionExecutor 使用）。
+    每个 Key 的每分钟请求数 (RPM) 和 token 数 (TPM) 预算在 Redis 中记账，所有 worker 进程共享；
+    每次请求选择剩余额度比例最大的 Key，预占 prompt 估计 token 数 + max_tokens，请求结束后按响应中的实际用量修正。
+    所有 Key 都没有额度时等待，最多 KEY_POOL_MAX_WAIT 秒；收到 429 的 Key 冷却一段时间后再使用。
+    只有一个 Key 且不限制 RPM/TPM 时不访问 Redis。
+    """
+
+    def __init__(self, provider: str, api_keys: List[str], rpm: int, tpm: int, redis_conn: Optional[Redis] = None):
+        self.provider = provider
+        self.api_keys = list(dict.fromkeys(api_keys)) # 去重并保持顺序
+        self.fingerprints = [key_fingerprint(key) for key in self.api_keys]
+        self.rpm = rpm
+        self.tpm = tpm
+        self.metered = len(self.api_keys) > 1 or rpm > 0 or tpm > 0
+        self._redis_conn = redis_conn
+        self._redis_retry_at = 0.0
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {
+            fingerprint: {"requests": 0, "reserved_tokens": 0, "used_tokens": 0, "rate_limited": 0}
+            for fingerprint in self.fingerprints
+        }
+        self.waits = 0
+        self.wait_ms = 0.0
+        self.exhausted = 0
+        self._reporter = StatsReporter(f"key_pool:{provider}", interval=settings.KEY_POOL_STATS_INTERVAL)
+
+    def _get_redis(self) -> Optional[Redis]:
+        if time.monotonic() < self._redis_retry_at:
+            return None
+        if self._redis_conn is None:
+            self._redis_conn = get_redis()
+        return self._redis_conn
+
+    def _key_prefix(self, fingerprint: str) -> str:
+        return f"{KEY_POOL_PREFIX}:{self.provider}:{fingerprint}"
+
+    def try_acquire(self, prompt_tokens: int, reserved_tokens: int) -> Optional[KeyLease]:
+        """尝试选择一个 Key 并预占额度，没有可用的 Key 时返回 None（不等待）。"""
+        redis_conn = self._get_redis() if self.metered else None
+        if redis_conn is None:
+            index = random.randrange(len(self.api_keys))
+            return self._lease(index, None, prompt_tokens, reserved_tokens)
+        now = time.time()
+        minute = int(now // 60)
+        keys, args = [], [len(self.api_keys), round(now / 60 - minute, 4), reserved_tokens]
+        for fingerprint in self.fingerprints:
+            prefix = self._key_prefix(fingerprint)
+            keys += [f"{prefix}:{minute}", f"{prefix}:{minute - 1}", f"{prefix}:cooldown"]
+            args += [self.rpm, self.tpm]
+        try:
+            index = redis_conn.register_script(_ACQUIRE_SCRIPT)(keys=keys, args=args)
+        except Exception as e:
+            logger.warning(f"{self.provider} Key 池记账失败，{_REDIS_RETRY_SECONDS} 秒内不检查预算: {e}")
+            self._redis_retry_at = time.monotonic() + _REDIS_RETRY_SECONDS
+            return self._lease(random.randrange(len(self.api_keys)), None, prompt_tokens, reserved_tokens)
+        if index < 0:
+            return None
+        return self._lease(index, keys[3 * index], prompt_tokens, reserved_tokens)
+
+    def _lease(self, index: int, bucket: Optional[str], prompt_tokens: int, reserved_tokens: int) -> KeyLease:
+        lease = KeyLease(self.api_keys[index], self.fingerprints[index], bucket, prompt_tokens, reserved_tokens)
+        with self._lock:
+            stats = self._stats[lease.fingerprint]
+            stats["requests"] += 1
+            stats["reserved_tokens"] += reserved_tokens
+        return lease
+
+    def _record_wait(self, started: float, exhausted: bool) -> None:
+        with self._lock:
+            self.waits += 1
+            self.wait_ms += (time.monotonic() - started) * 1000
+            if exhausted:
+                self.exhausted += 1
+
+    def acquire(self, prompt_tokens: int, reserved_tokens: int) -> KeyLease:
+        """
+        选择一个 Key 并预占额度，没有额度时等待。
+        Raises:
+            KeyPoolExhaustedError: 等待 KEY_POOL_MAX_WAIT 秒后仍没有可用的 Key。
+        """
+        lease = self.try_acquire(prompt_tokens, reserved_tokens)
+        if lease is not None:
+            return lease
+        started = time.monotonic()
+        deadline = started + settings.KEY_POOL_MAX_WAIT
+        logger.info(f"{self.provider} 所有 Key 的预算已用完，等待额度释放。")
+        while time.monotonic() < deadline:
+            time.sleep(settings.KEY_POOL_POLL_INTERVAL)
+            lease = self.try_acquire(prompt_tokens, reserved_tokens)
+            if lease is not None:
+                self._record_wait(started, exhausted=False)
+                return lease
+        self._record_wait(started, exhausted=True)
+        raise KeyPoolExhaustedError(f"{self.provider} 所有 API Key 在 {settings.KEY_POOL_MAX_WAIT} 秒内都没有可用额度")
+
+    async def acquire_async(self, prompt_tokens: int, reserved_tokens: int) -> KeyLease:
+        """acquire 的异步版本，Redis 调用放到线程中执行，等待期间不阻塞事件循环。"""
+        if not self.metered:
+            return self.try_acquire(prompt_tokens, reserved_tokens)
+        lease = await asyncio.to_thread(self.try_acquire, prompt_tokens, reserved_tokens)
+        if lease is not None:
+            return lease
+        started = time.monotonic()
+        deadline = started + settings.KEY_POOL_MAX_WAIT
+        logger.info(f"{self.provider} 所有 Key 的预算已用完，等待额度释放。")
+        while time.monotonic() < deadline:
+            await asyncio.sleep(settings.KEY_POOL_POLL_INTERVAL)
+            lease = await asyncio.to_thread(self.try_acquire, prompt_tokens, reserved_tokens)
+            if lease is not None:
+                self._record_wait(started, exhausted=False)
+                return lease
+        self._record_wait(started, exhausted=True)
+        raise KeyPoolExhaustedError(f"{self.provider} 所有 API Key 在 {settings.KEY_POOL_MAX_WAIT} 秒内都没有可用额度")
+
+    def settle(self, lease: KeyLease, used_tokens: int, retry_after: Optional[float] = None) -> None:
+        """
+        请求结束后把预占的 token 数修正为实际用量；retry_after 不为 None 表示收到 429，该 Key 冷却 retry_after 秒。
+        记账失败只记录警告，预占的额度会随分钟窗口过期。
+        """
+        with self._lock:
+            stats = self._stats[lease.fingerprint]
+            stats["used_tokens"] += used_tokens
+            if retry_after is not None:
+                stats["rate_limited"] += 1
+        self._reporter.maybe_publish(self.snapshot)
+        redis_conn = self._get_redis() if self.metered else None
+        if redis_conn is None:
+            return
+        try:
+            with redis_conn.pipeline(transaction=False) as pipeline:
+                if lease.bucket is not None and used_tokens != lease.reserved_tokens:
+                    pipeline.hincrby(lease.bucket, "tok", used_tokens - lease.reserved_tokens)
+                if retry_after is not None:
+                    logger.warning(f"{self.provider} Key {lease.fingerprint} 被限流，冷却 {retry_after} 秒。")
+                    pipeline.set(f"{self._key_prefix(lease.fingerprint)}:cooldown", 1, px=max(1, int(retry_after * 1000)))
+                pipeline.execute()
+        except Exception as e:
+            logger.warning(f"{self.provider} Key 池修正用量失败: {e}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "keys": {fingerprint: dict(stats) for fingerprint, stats in self._stats.items()},
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "waits": self.waits,
+                "wait_ms_avg": round(self.wait_ms / self.waits, 1) if self.waits else 0.0,
+                "exhausted": self.exhausted,
+            }
+
+
+def provider_keys(provider: str) -> List[str]:
+    """供应商配置的全部 API Key：<供应商>_API_KEY 加上 <供应商>_API_KEYS，去重并保持顺序。"""
+    prefix = provider.upper()
+    keys = [getattr(settings, f"{prefix}_API_KEY", None)] + list(getattr(settings, f"{prefix}_API_KEYS", []))
+    return list(dict.fromkeys(key for key in keys if key))
+
+
+def build_key_pool(provider: str, api_keys: List[str]) -> KeyPool:
+    """按 <供应商>_KEY_RPM / <供应商>_KEY_TPM 创建 Key 池。"""
+    prefix = provider.upper()
+    return KeyPool(provider, api_keys, rpm=getattr(settings, f"{prefix}_KEY_RPM", 0),
+                   tpm=getattr(settings, f"{prefix}_KEY_TPM", 0))
@@ -0,0 +1,172 @@
+# ~/projects/deepseek_dispatcher-new/ai_executor/router.py
+
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from common.logging_utils import get_logger
+from common.stats_reporter import StatsReporter
+from config.settings import settings
+
+logger = get_logger("executor_router")
+
+
+class ExecutorHealth:
+    """单个执行器在本进程内的表现：EWMA 延迟、随时间衰减的 EWMA 错误率和进行中的请求数。"""
+
+    def __init__(self, initial_latency: float, window: int):
+        self.latency = initial_latency
+        # 最近 window 个成功请求的耗时，用于计算对冲等待时间（见 ai_executor/hedging.py）
+        self.recent = deque(maxlen=window)
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.last_finished = 0.0 # time.monotonic()，0 表示还没有完成过请求
+        self.last_started = 0.0 # 最近一次被选中的时间，0 表示从未被选中
+
+    def decayed_error_rate(self, now: float, half_life: float) -> float:
+        # 一段时间没有请求的执行器错误率逐渐回落，之后会被重新尝试
+        if not self.last_finished or half_life <= 0:
+            return self.error_rate
+        return self.error_rate * math.pow(0.5, (now - self.last_finished) / half_life)
+
+
+class AdaptiveRouter:
+    """
+    按预期完成时间在多个执行器之间选择（ExecutorFactory.get_executor 使用）。
+
+    score = EWMA 延迟 × (1 + in_flight_weight × 进行中请求数) + error_penalty × 错误率，单位为秒，越小越好。
+    - 延迟只统计成功的请求（快速失败不会让执行器看起来更快），还没有样本的执行器使用 initial_latency；
+    - 错误率按 EWMA 更新，并以 error_half_life 为半衰期随时间回落；
+    - 粘滞：切换后 stickiness 秒内继续使用当前执行器，除非它的分数比最优者差 switch_margin 以上，避免流量来回抖动；
+    - 探测：超过 probe_interval 秒没有被选中的执行器（包括从未使用过的）会收到一个请求，刷新它的分数，
+      否则一次变慢或出错之后就再也没有机会证明自己已经恢复。
+    统计只在本进程内有效，定期上报到 Redis（stats:router:<host>:<pid>），由 /metrics/router 汇总。
+    """
+
+    def __init__(self, names: List[str], alpha: float, in_flight_weight: float, error_penalty: float,
+                 error_half_life: float, initial_latency: float, stickiness: float, switch_margin: float,
+                 probe_interval: float, window: int = 200):
+        self.alpha = alpha
+        self.in_flight_weight = in_flight_weight
+        self.error_penalty = error_penalty
+        self.error_half_life = error_half_life
+        self.stickiness = stickiness
+        self.switch_margin = switch_margin
+        self.probe_interval = probe_interval
+        self._health: Dict[str, ExecutorHealth] = {name: ExecutorHealth(initial_latency, window) for name in names}
+        self._lock = threading.Lock()
+        # 各候选集合当前粘滞的执行器: 候选集合 -> (执行器, 选中时间)
+        self._sticky: Dict[tuple, tuple] = {}
+        self.switches = 0
+        self.probes = 0
+        self._reporter = StatsReporter("router", interval=settings.ROUTER_STATS_INTERVAL)
+
+    def _score(self, health: ExecutorHealth, now: float) -> float:
+        error_rate = health.decayed_error_rate(now, self.error_half_life)
+        return health.latency * (1 + self.in_flight_weight * health.in_flight) + self.error_penalty * error_rate
+
+    def choose(self, candidates: List[str]) -> str:
+        """从候选执行器中选出预期完成时间最短的一个（考虑粘滞窗口）。"""
+        if len(candidates) == 1:
+            return candidates[0]
+        key = tuple(candidates)
+        now = time.monotonic()
+        with self._lock:
+            scores = {name: self._score(self._health[name], now) for name in candidates}
+            best = min(candidates, key=scores.__getitem__)
+            if self.probe_interval > 0:
+                stale = [name for name in candidates
+                         if name != best and now - self._health[name].last_started >= self.probe_interval]
+                if stale:
+                    probe = min(stale, key=lambda name: self._health[name].last_started)
+                    self._health[probe].last_started = now
+                    self.probes += 1
+                    logger.info(f"探测执行器 {probe}（超过 {self.probe_interval} 秒未被选中）")
+                    return probe
+            current, since = self._sticky.get(key, (None, 0.0))
+            if current is not None and current != best:
+                within_window = now - since < self.stickiness
+                if within_window and scores[current] <= scores[best] * (1 + self.switch_margin):
+                    return current
+                self.switches += 1
+                logger.info(f"执行器路由从 {current} 切换到 {best}，分数: "
+                            f"{ {name: round(score, 3) for name, score in scores.items()} }")
+            if current != best:
+                self._sticky[key] = (best, now)
+            return best
+
+    @contextmanager
+    def track(self, name: str) -> Iterator[None]:
+        """
+        记录一次请求：进行中计数、耗时和成败（同步和异步调用都可以使用）。
+        被取消的请求（例如对冲中落败的一方）只减少进行中计数，不计入延迟和错误率。
+        """
+        started = time.monotonic()
+        with self._lock:
+            self._health[name].in_flight += 1
+            self._health[name].last_started = started
+        ok = cancelled = False
+        try:
+            yield
+            ok = True
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            with self._lock:
+                self._health[name].in_flight -= 1
+            if not cancelled:
+                self.record(name, time.monotonic() - started, ok)
+
+    def record(self, name: str, elapsed: float, ok: bool) -> None:
+        """记录一个已完成请求的耗时和成败（不涉及进行中计数）。"""
+        with self._lock:
+            health = self._health[name]
+            now = time.monotonic()
+            health.error_rate = health.decayed_error_rate(now, self.error_half_life)
+            health.error_rate += self.alpha * ((0.0 if ok else 1.0) - health.error_rate)
+            if ok:
+                # 第一个成功样本直接替换初始值
+                successes = health.requests - health.errors
+                health.latency = elapsed if successes == 0 else health.latency + self.alpha * (elapsed - health.latency)
+                health.recent.append(elapsed)
+            else:
+                health.errors += 1
+            health.requests += 1
+            health.last_finished = now
+        self._reporter.maybe_publish(self.snapshot)
+
+    def latency_percentile(self, name: str, percentile: float, min_samples: int) -> Optional[float]:
+        """执行器最近成功请求耗时的分位数（秒），样本少于 min_samples 时返回 None。"""
+        with self._lock:
+            samples = sorted(self._health[name].recent)
+        if not samples or len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile / 100))]
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            executors = {
+                name: {
+                    "score": round(self._score(health, now), 4),
+                    "latency_ewma": round(health.latency, 4),
+                    "error_rate": round(health.decayed_error_rate(now, self.error_half_life), 4),
+                    "in_flight": health.in_flight,
+                    "requests": health.requests,
+                    "errors": health.errors,
+                }
+                for name, health in self._health.items()
+            }
+            return {
+                "executors": executors,
+                "sticky": {",".join(key): name for key, (name, _) in self._sticky.items()},
+                "switches": self.switches,
+                "probes": self.probes,
+            }
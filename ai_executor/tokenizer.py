@@ -0,0 +1,55 @@
+# ~/projects/deepseek_dispatcher-new/ai_executor/tokenizer.py
+
+import threading
+from typing import Dict, Optional
+
+import tiktoken
+
+from common.logging_utils import get_logger
+from config.settings import settings
+
+logger = get_logger("tokenizer")
+
+# 每条消息的格式开销（角色、分隔符）和回复的起始标记，按 OpenAI 的计算方式估计
+_MESSAGE_OVERHEAD_TOKENS = 7
+
+# 模型名称 -> 编码器；加载失败（例如离线环境无法下载 BPE 文件）时为 None，之后按字符数估计，不再重试
+_encoders: Dict[str, Optional[tiktoken.Encoding]] = {}
+_encoders_lock = threading.Lock()
+
+
+def get_encoder(model_name: str) -> Optional[tiktoken.Encoding]:
+    """
+    获取模型对应的 tiktoken 编码器（进程内缓存）。
+    tiktoken 不认识的模型（DeepSeek、通义千问等）使用 TOKENIZER_ENCODING，
+    估计值与供应商实际计数有偏差，但足以用于每分钟 token 预算。
+    """
+    if model_name in _encoders:
+        return _encoders[model_name]
+    with _encoders_lock:
+        if model_name not in _encoders:
+            try:
+                try:
+                    encoder = tiktoken.encoding_for_model(model_name)
+                except KeyError:
+                    encoder = tiktoken.get_encoding(settings.TOKENIZER_ENCODING)
+            except Exception as e:
+                logger.warning(f"加载模型 {model_name} 的 tiktoken 编码器失败，按字符数估计 token 数: {e}")
+                encoder = None
+            _encoders[model_name] = encoder
+    return _encoders[model_name]
+
+
+def count_tokens(text: str, model_name: str) -> int:
+    """估计文本的 token 数。没有可用的编码器时按字符数估计（对中文接近，对英文偏高，用于预算时偏保守）。"""
+    if not text:
+        return 0
+    encoder = get_encoder(model_name)
+    if encoder is None:
+        return len(text)
+    return len(encoder.encode(text, disallowed_special=()))
+
+
+def estimate_prompt_tokens(prompt: str, model_name: str) -> int:
+    """估计单条用户消息的请求消耗的输入 token 数。"""
+    return count_tokens(prompt, model_name) + _MESSAGE_OVERHEAD_TOKENS
@@ -0,0 +1,117 @@
+# ~/projects/deepseek_dispatcher-new/common/compression.py
+
+import base64
+import threading
+import zlib
+from typing import Any, Dict, Optional
+
+from common.logging_utils import get_logger
+from common.segment_store import load_text, offload_text
+from common.stats_reporter import StatsReporter
+from config.settings import settings
+
+logger = get_logger("compression")
+
+# 压缩后的值以带标记的字典保存，orjson / msgpack / pickle 和 json 都能原样存取：
+# {"__compressed__": "zlib", "data": <base64>, "size": <原始字节数>}
+COMPRESSED_MARKER = "__compressed__"
+
+
+class CompressionStats:
+    """
+    进程内的压缩统计，周期性上报到 Redis（stats:compression:<host>:<pid>），
+    由 web 进程的 /metrics/compression 汇总。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.compressed = 0
+        self.skipped = 0
+        self.raw_bytes = 0
+        self.stored_bytes = 0
+        self._reporter = StatsReporter("compression", interval=settings.COMPRESSION_STATS_INTERVAL)
+
+    def record(self, raw_bytes: int, stored_bytes: Optional[int]) -> None:
+        """stored_bytes 为 None 表示压缩后没有变小，按原文保存。"""
+        with self._lock:
+            if stored_bytes is None:
+                self.skipped += 1
+            else:
+                self.compressed += 1
+                self.raw_bytes += raw_bytes
+                self.stored_bytes += stored_bytes
+        self._reporter.maybe_publish(self.snapshot)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "compressed": self.compressed,
+                "skipped": self.skipped,
+                "raw_bytes": self.raw_bytes,
+                "stored_bytes": self.stored_bytes,
+                # 压缩后体积 / 原始体积，越小越好
+                "ratio": round(self.stored_bytes / self.raw_bytes, 4) if self.raw_bytes else None,
+            }
+
+
+compression_stats = CompressionStats()
+
+
+def compression_threshold(queue_name: Optional[str]) -> int:
+    """按队列返回压缩阈值（字节），0 表示该队列不压缩。"""
+    if not settings.RESULT_COMPRESSION_ENABLED:
+        return 0
+    return settings.RESULT_COMPRESSION_THRESHOLDS.get(queue_name, settings.RESULT_COMPRESSION_DEFAULT_THRESHOLD)
+
+
+def compress_text(value: Any, threshold: int) -> Any:
+    """
+    字符串的 UTF-8 编码达到 threshold 字节时压缩为带标记的字典，其他值原样返回。
+    压缩后（含 base64 开销）没有变小时也原样返回。
+    """
+    if threshold <= 0 or not isinstance(value, str):
+        return value
+    raw = value.encode("utf-8")
+    if len(raw) < threshold:
+        return value
+    data = base64.b64encode(zlib.compress(raw, settings.RESULT_COMPRESSION_LEVEL)).decode("ascii")
+    if len(data) >= len(raw):
+        compression_stats.record(len(raw), None)
+        return value
+    compression_stats.record(len(raw), len(data))
+    return {COMPRESSED_MARKER: "zlib", "data": data, "size": len(raw)}
+
+
+def is_compressed(value: Any) -> bool:
+    return isinstance(value, dict) and COMPRESSED_MARKER in value
+
+
+def decompress_text(value: Any) -> Any:
+    """compress_text 的逆操作：带标记的字典还原为字符串，其他值原样返回。"""
+    if not is_compressed(value):
+        return value
+    codec = value[COMPRESSED_MARKER]
+    if codec != "zlib":
+        raise ValueError(f"不支持的压缩格式: {codec}")
+    return zlib.decompress(base64.b64decode(value["data"])).decode("utf-8")
+
+
+def offload_threshold() -> int:
+    """大负载卸载阈值（字节），0 表示不卸载。"""
+    return settings.PAYLOAD_OFFLOAD_THRESHOLD if settings.PAYLOAD_OFFLOAD_ENABLED else 0
+
+
+def encode_payload(value: Any, queue_name: Optional[str]) -> Any:
+    """
+    编码准备写入 Redis 的文本负载：达到卸载阈值时写入段文件、只保留指针（见 common/segment_store.py），
+    否则按所在队列的阈值压缩。
+    """
+    stored = offload_text(value, offload_threshold())
+    if stored is not value:
+        return stored
+    return compress_text(value, compression_threshold(queue_name))
+
+
+def decode_payload(value: Any) -> Any:
+    """encode_payload 的逆操作，读取任务结果的地方统一通过它还原。"""
+    return load_text(decompress_text(value))
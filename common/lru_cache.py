@@ -0,0 +1,52 @@
+# ~/projects/deepseek_dispatcher-new/common/lru_cache.py
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """
+    线程安全的定长 LRU 缓存。
+    web 进程中同步的 Redis 调用会放到线程池执行，因此读写需要加锁。
+    max_bytes 大于 0 时同时按体积淘汰：put 时传入每个值的字节数，总字节数超过上限时淘汰最久未使用的条目。
+    """
+
+    def __init__(self, maxsize: int, max_bytes: int = 0):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes = 0
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            if key not in self._data:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any, size: int = 0) -> None:
+        if self.maxsize <= 0 or (self.max_bytes and size > self.max_bytes):
+            return
+        with self._lock:
+            self.bytes += size - self._sizes.get(key, 0)
+            self._sizes[key] = size
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize or (self.max_bytes and self.bytes > self.max_bytes):
+                evicted, _ = self._data.popitem(last=False)
+                self.bytes -= self._sizes.pop(evicted, 0)
+
+    def pop(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self._lock:
+            self.bytes -= self._sizes.pop(key, 0)
+            return self._data.pop(key, default)
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -0,0 +1,162 @@
+# ~/projects/deepseek_dispatcher-new/common/minhash.py
+
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Set, Tuple
+
+import numpy as np
+
+# 多项式滚动哈希的基数（奇数），在 uint64 上自然溢出
+_SHINGLE_BASE = np.uint64(1000003)
+_MAX_HASH = np.iinfo(np.uint64).max
+# 签名中桶内的值只取哈希的低 48 位，高位留给空桶填充时的距离偏移
+_VALUE_MASK = np.uint64((1 << 48) - 1)
+_ROTATION_OFFSET = np.uint64(1 << 48)
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    归一化 prompt：NFKC（全角转半角）、小写，去掉所有空白（中英文混排时空格的有无不影响结果）。
+    标点、运算符和 emoji 保持原样："Is 10 < 5?" 与 "Is 10 > 5?"、"???" 与 "!!!" 是不同的问题。
+    数字同样保持原样，由相似度阈值决定改动了一个日期的 prompt 是否算作重复。
+    """
+    return _WHITESPACE.sub("", unicodedata.normalize("NFKC", text).lower())
+
+
+def shingle_hashes(text: str, k: int) -> np.ndarray:
+    """
+    把归一化后的文本切成长度为 k 的字符片段（shingle），返回每个片段的 32 位哈希（未去重，重复不影响 MinHash）。
+    按字符而不是按词切分，中文等不以空格分词的文本同样适用；整个计算在码点数组上向量化完成。
+    """
+    codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.uint64)
+    k = max(1, min(k, len(codepoints)))
+    count = len(codepoints) - k + 1
+    hashes = codepoints[:count].copy()
+    for offset in range(1, k):
+        hashes *= _SHINGLE_BASE
+        hashes += codepoints[offset:offset + count]
+    return hashes >> np.uint64(32)
+
+
+class MinHasher:
+    """
+    MinHash 签名，使用单次置换哈希（one permutation hashing）加旋转填充（rotation densification）：
+    - 每个 shingle 只做一次 64 位 multiply-shift 哈希，高 log2(num_perm) 位决定所属的桶，其余位是桶内的值；
+    - 每个桶取最小值，空桶借用右侧（循环）最近的非空桶的值，并加上距离偏移。
+    两个签名相同位置相等的比例仍是 Jaccard 相似度的估计，但计算量从 O(num_perm * n) 降到一次排序，
+    几千字的 prompt 也能在几十微秒内完成。
+    """
+
+    def __init__(self, num_perm: int, shingle_size: int, seed: int = 1):
+        if num_perm <= 1 or num_perm & (num_perm - 1):
+            raise ValueError(f"num_perm 必须是大于 1 的 2 的幂: {num_perm}")
+        rng = np.random.default_rng(seed)
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self._bin_shift = np.uint64(64 - (num_perm.bit_length() - 1))
+        self._a = np.uint64(rng.integers(1, 2 ** 63, dtype=np.uint64) << np.uint64(1) | np.uint64(1))
+        self._b = np.uint64(rng.integers(0, 2 ** 63, dtype=np.uint64))
+        self._positions = np.arange(num_perm)
+
+    def signature(self, text: str) -> np.ndarray:
+        """返回 uint64 签名；归一化后为空的文本得到全 _MAX_HASH 的签名。"""
+        shingles = shingle_hashes(normalize_text(text), self.shingle_size)
+        signature = np.full(self.num_perm, _MAX_HASH, dtype=np.uint64)
+        if not len(shingles):
+            return signature
+        hashed = shingles * self._a
+        hashed += self._b
+        hashed.sort()
+        # 排序后桶号单调不减，每个桶的第一个元素就是桶内的最小值（不用 np.unique，它比排序本身慢得多）
+        all_bins = hashed >> self._bin_shift
+        first = np.flatnonzero(np.concatenate(([True], all_bins[1:] != all_bins[:-1])))
+        bins = all_bins[first]
+        signature[bins] = hashed[first] & _VALUE_MASK
+        if len(bins) < self.num_perm:
+            # 旋转填充：空桶取右侧最近的非空桶，值加上 距离 * _ROTATION_OFFSET，保证与真实的桶值不冲突
+            following = np.searchsorted(bins, self._positions) % len(bins)
+            distance = (bins[following] - self._positions) % self.num_perm
+            empty = distance > 0
+            signature[empty] = signature[bins[following[empty]]] + distance[empty].astype(np.uint64) * _ROTATION_OFFSET
+        return signature
+
+
+def jaccard_estimate(first: np.ndarray, second: np.ndarray) -> float:
+    return float(np.count_nonzero(first == second)) / len(first)
+
+
+class LSHIndex:
+    """
+    MinHash 签名的 LSH 索引（bands 个分段，每段 num_perm / bands 行），容量有上限，按 LRU 淘汰。
+
+    签名只要有一个分段完全相同就成为候选，再用签名估计的 Jaccard 相似度确认。
+    每个条目属于一个命名空间（例如模型 + 采样参数），不同命名空间之间不会互相匹配。
+    max_bytes 按条目的值大小（调用方传入）限制总内存，与条目数上限同时生效。
+    """
+
+    def __init__(self, num_perm: int, bands: int, max_entries: int, max_bytes: int = 0):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) 必须是 bands ({bands}) 的整数倍")
+        self.rows = num_perm // bands
+        self.bands = bands
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.evictions = 0
+        # 条目 id -> (命名空间, 签名, 值, 字节数)
+        self._entries: "OrderedDict[Hashable, Tuple[str, np.ndarray, Any, int]]" = OrderedDict()
+        self._buckets: Dict[Tuple[str, int, bytes], Set[Hashable]] = {}
+        self._lock = threading.Lock()
+
+    def _band_keys(self, namespace: str, signature: np.ndarray) -> List[Tuple[str, int, bytes]]:
+        bands = signature.reshape(self.bands, self.rows)
+        return [(namespace, band, bands[band].tobytes()) for band in range(self.bands)]
+
+    def _remove(self, entry_id: Hashable) -> None:
+        namespace, signature, _, size = self._entries.pop(entry_id)
+        self.bytes -= size
+        for key in self._band_keys(namespace, signature):
+            bucket = self._buckets.get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[key]
+
+    def insert(self, entry_id: Hashable, namespace: str, signature: np.ndarray, value: Any, size: int = 0) -> None:
+        if self.max_entries <= 0 or (self.max_bytes and size > self.max_bytes):
+            return
+        with self._lock:
+            if entry_id in self._entries:
+                self._remove(entry_id)
+            self._entries[entry_id] = (namespace, signature, value, size)
+            self.bytes += size
+            for key in self._band_keys(namespace, signature):
+                self._buckets.setdefault(key, set()).add(entry_id)
+            while len(self._entries) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def query(self, namespace: str, signature: np.ndarray, threshold: float) -> Optional[Tuple[Any, float]]:
+        """返回估计相似度不低于 threshold 的最相似条目的 (值, 相似度)，没有时返回 None。"""
+        with self._lock:
+            candidates = set()
+            for key in self._band_keys(namespace, signature):
+                candidates.update(self._buckets.get(key, ()))
+            best_id, best_similarity = None, threshold
+            for entry_id in candidates:
+                similarity = jaccard_estimate(signature, self._entries[entry_id][1])
+                if similarity >= best_similarity:
+                    best_id, best_similarity = entry_id, similarity
+            if best_id is None:
+                return None
+            self._entries.move_to_end(best_id)
+            return self._entries[best_id][2], best_similarity
+
+    def __contains__(self, entry_id: Hashable) -> bool:
+        return entry_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
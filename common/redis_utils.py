@@ -0,0 +1,56 @@
+# ~/projects/deepseek_dispatcher-new/common/redis_utils.py
+
+import asyncio
+import threading
+from typing import Optional
+
+import redis.asyncio as aioredis
+from redis import Redis
+
+from common.logging_utils import get_logger
+from config.settings import settings
+
+logger = get_logger("redis_utils")
+
+_redis_conn: Optional[Redis] = None
+_redis_lock = threading.Lock()
+
+_async_redis_conn: Optional[aioredis.Redis] = None
+_async_redis_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_redis() -> Redis:
+    """
+    获取当前进程共享的同步 Redis 连接（懒加载）。
+    任务实例会被 RQ 序列化，不能持有连接，任务执行时通过此函数获取。
+    """
+    global _redis_conn
+    if _redis_conn is None:
+        with _redis_lock:
+            if _redis_conn is None:
+                _redis_conn = Redis.from_url(settings.REDIS_URL)
+                logger.debug(f"已创建共享 Redis 连接: {settings.REDIS_URL}")
+    return _redis_conn
+
+
+def get_async_redis() -> aioredis.Redis:
+    """
+    获取当前事件循环共享的异步 Redis 连接，必须在事件循环内调用。
+    与 HTTPClientPool.get_async_client 相同，连接属于创建它的事件循环，循环变化时重新创建。
+    """
+    global _async_redis_conn, _async_redis_loop
+    loop = asyncio.get_running_loop()
+    if _async_redis_conn is None or _async_redis_loop is not loop:
+        _async_redis_conn = aioredis.Redis.from_url(settings.REDIS_URL)
+        _async_redis_loop = loop
+        logger.debug(f"已创建异步 Redis 连接: {settings.REDIS_URL}")
+    return _async_redis_conn
+
+
+async def close_async_redis() -> None:
+    """关闭当前事件循环上的异步 Redis 连接。"""
+    global _async_redis_conn, _async_redis_loop
+    if _async_redis_conn is not None:
+        await _async_redis_conn.aclose()
+    _async_redis_conn = None
+    _async_redis_loop = None
@@ -0,0 +1,190 @@
+# ~/projects/deepseek_dispatcher-new/common/segment_store.py
+
+import mmap
+import os
+import socket
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from common.logging_utils import get_logger
+from config.settings import settings
+
+logger = get_logger("segment_store")
+
+# Redis 中保存的指针：{"__offloaded__": <段文件名>, "offset": <起始偏移>, "length": <字节数>}
+OFFLOAD_MARKER = "__offloaded__"
+SEGMENT_SUFFIX = ".seg"
+
+
+class SegmentStore:
+    """
+    只追加写入的段文件存储，用于保存超过阈值的 prompt 和结果，Redis 中只保留指针。
+
+    - 每个进程写自己的段文件（<主机名>-<pid>-<序号>.seg），多个进程之间不需要加锁；
+      段文件超过 max_segment_bytes 或写入超过 rollover_seconds 后切换到新文件。
+    - 读取时把段文件映射到内存（mmap），返回 memoryview 切片，不额外复制数据。
+    - 段文件最后一次写入超过 ttl 秒后删除：此时引用它的任务、索引和结果都已在 Redis 中过期。
+    """
+
+    def __init__(self, root: str, max_segment_bytes: int, rollover_seconds: int, ttl: int,
+                 max_open_maps: int = 64):
+        self.root = root
+        self.max_segment_bytes = max_segment_bytes
+        self.rollover_seconds = rollover_seconds
+        self.ttl = ttl
+        self.max_open_maps = max_open_maps
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._sequence = 0
+        self._fd: Optional[int] = None
+        self._segment: Optional[str] = None
+        self._segment_size = 0
+        self._segment_opened_at = 0.0
+        self._maps: "OrderedDict[str, mmap.mmap]" = OrderedDict()
+        os.makedirs(self.root, exist_ok=True)
+
+    # --- 写入 ---
+
+    def _open_segment(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+        self._sequence += 1
+        self._segment = f"{socket.gethostname()}-{os.getpid()}-{int(time.time())}-{self._sequence}{SEGMENT_SUFFIX}"
+        self._fd = os.open(os.path.join(self.root, self._segment), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._segment_size = 0
+        self._segment_opened_at = time.monotonic()
+        logger.info(f"打开新的段文件: {self._segment}")
+
+    def _needs_rollover(self, length: int) -> bool:
+        if self._pid != os.getpid():
+            # fork 出的子进程不能继续写父进程的段文件
+            self._pid, self._fd = os.getpid(), None
+            return True
+        if self._fd is None:
+            return True
+        if self._segment_size and self._segment_size + length > self.max_segment_bytes:
+            return True
+        return time.monotonic() - self._segment_opened_at > self.rollover_seconds
+
+    def append(self, data: bytes) -> Dict[str, Any]:
+        """追加一段数据，返回可以存入 Redis 的指针。"""
+        with self._lock:
+            rolled = self._needs_rollover(len(data))
+            if rolled:
+                self._open_segment()
+            offset = self._segment_size
+            view = memoryview(data)
+            while view:
+                written = os.write(self._fd, view)
+                view = view[written:]
+            self._segment_size += len(data)
+            segment = self._segment
+        if rolled:
+            self.collect_garbage()
+        return {OFFLOAD_MARKER: segment, "offset": offset, "length": len(data)}
+
+    # --- 读取 ---
+
+    def _map(self, segment: str, end: int) -> mmap.mmap:
+        mapped = self._maps.get(segment)
+        if mapped is not None and len(mapped) >= end:
+            self._maps.move_to_end(segment)
+            return mapped
+        # 文件仍在追加时，旧映射可能不包含新写入的部分，需要重新映射
+        with open(os.path.join(self.root, segment), "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[segment] = mapped
+        self._maps.move_to_end(segment)
+        while len(self._maps) > self.max_open_maps:
+            _, evicted = self._maps.popitem(last=False)
+            try:
+                evicted.close()
+            except BufferError:
+                # 仍有调用方持有切片，映射在切片释放后由垃圾回收关闭
+                pass
+        return mapped
+
+    def read(self, pointer: Dict[str, Any]) -> memoryview:
+        """
+        按指针读取数据，返回段文件映射上的 memoryview 切片（零拷贝）。
+
+        Raises:
+            FileNotFoundError: 段文件已被删除（超过 TTL）。
+        """
+        segment, offset, length = pointer[OFFLOAD_MARKER], int(pointer["offset"]), int(pointer["length"])
+        if os.path.basename(segment) != segment:
+            raise ValueError(f"无效的段文件名: {segment}")
+        with self._lock:
+            mapped = self._map(segment, offset + length)
+        return memoryview(mapped)[offset:offset + length]
+
+    # --- 清理 ---
+
+    def collect_garbage(self) -> int:
+        """删除最后一次写入超过 ttl 秒的段文件，返回删除的文件数。"""
+        deadline = time.time() - self.ttl
+        removed = 0
+        try:
+            entries = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            if not entry.name.endswith(SEGMENT_SUFFIX) or entry.name == self._segment:
+                continue
+            try:
+                if entry.stat().st_mtime < deadline:
+                    os.remove(entry.path)
+                    removed += 1
+                    with self._lock:
+                        self._maps.pop(entry.name, None)
+            except FileNotFoundError:
+                # 其他进程已经删除
+                continue
+        if removed:
+            logger.info(f"删除过期段文件 {removed} 个。")
+        return removed
+
+
+_segment_store: Optional[SegmentStore] = None
+_segment_store_lock = threading.Lock()
+
+
+def get_segment_store() -> SegmentStore:
+    """
+    获取当前进程共享的 SegmentStore（web 进程写入大 prompt，worker 写入大结果）。
+    web 和 worker 必须能访问同一个 RESULTS_DIR。
+    """
+    global _segment_store
+    if _segment_store is None:
+        with _segment_store_lock:
+            if _segment_store is None:
+                _segment_store = SegmentStore(
+                    root=os.path.join(settings.RESULTS_DIR, settings.PAYLOAD_SEGMENT_DIR),
+                    max_segment_bytes=settings.PAYLOAD_SEGMENT_MAX_BYTES,
+                    rollover_seconds=settings.PAYLOAD_SEGMENT_ROLLOVER_SECONDS,
+                    ttl=settings.PAYLOAD_SEGMENT_TTL,
+                )
+    return _segment_store
+
+
+def is_offloaded(value: Any) -> bool:
+    return isinstance(value, dict) and OFFLOAD_MARKER in value
+
+
+def offload_text(value: Any, threshold: int) -> Any:
+    """字符串的 UTF-8 编码达到 threshold 字节时写入段文件并返回指针，其他值原样返回。"""
+    if threshold <= 0 or not isinstance(value, str):
+        return value
+    raw = value.encode("utf-8")
+    if len(raw) < threshold:
+        return value
+    return get_segment_store().append(raw)
+
+
+def load_text(value: Any) -> Any:
+    """offload_text 的逆操作：指针还原为字符串，其他值原样返回。"""
+    if not is_offloaded(value):
+        return value
+    return str(get_segment_store().read(value), "utf-8")
@@ -0,0 +1,70 @@
+# ~/projects/deepseek_dispatcher-new/common/stats_reporter.py
+
+import json
+import os
+import socket
+import time
+from typing import Any, Callable, Dict, Optional
+
+from redis import Redis
+
+from common.logging_utils import get_logger
+from config.settings import settings
+
+logger = get_logger("stats_reporter")
+
+# 所有进程统计快照的 Redis 键前缀，完整键为 stats:<namespace>:<hostname>:<pid>
+STATS_KEY_PREFIX = "stats"
+
+
+class StatsReporter:
+    """
+    把进程内的统计快照周期性写入 Redis，供 web 进程汇总展示。
+    worker 进程里的连接池、缓存等状态只存在于本进程内存中，
+    每个进程写一个带过期时间的键，进程退出后键会自动过期。
+    """
+
+    def __init__(self, namespace: str, interval: int, redis_conn: Optional[Redis] = None):
+        self.namespace = namespace
+        self.interval = interval
+        self._redis_conn = redis_conn
+        self._last_published = 0.0
+        self.key = f"{STATS_KEY_PREFIX}:{namespace}:{socket.gethostname()}:{os.getpid()}"
+
+    def _get_redis(self) -> Redis:
+        if self._redis_conn is None:
+            self._redis_conn = Redis.from_url(settings.REDIS_URL)
+        return self._redis_conn
+
+    def maybe_publish(self, snapshot: Callable[[], Dict[str, Any]]) -> None:
+        """
+        距离上次上报超过 interval 秒时写入一次快照。
+        统计上报失败只记录警告，绝不影响业务调用。
+        """
+        now = time.monotonic()
+        if now - self._last_published < self.interval:
+            return
+        self._last_published = now
+        try:
+            self._get_redis().set(self.key, json.dumps(snapshot()), ex=self.interval * 3)
+        except Exception as e:
+            logger.warning(f"上报 {self.namespace} 统计失败: {e}")
+
+
+def collect_stats(redis_conn: Redis, namespace: str) -> Dict[str, Any]:
+    """
+    读取所有进程上报的某类统计快照。
+    Returns:
+        Dict[str, Any]: 以 "<hostname>:<pid>" 为键的快照字典。
+    """
+    prefix = f"{STATS_KEY_PREFIX}:{namespace}:"
+    keys = list(redis_conn.scan_iter(match=f"{prefix}*", count=100))
+    if not keys:
+        return {}
+    snapshots = {}
+    for key, raw in zip(keys, redis_conn.mget(keys)):
+        if raw is None:
+            continue
+        key_str = key.decode() if isinstance(key, bytes) else key
+        snapshots[key_str[len(prefix):]] = json.loads(raw)
+    return snapshots
@@ -21,6 +21,9 @@ class Settings(BaseSettings):
     DASHSCOPE_API_KEY: Optional[str] = None # DashScope API Key
     DASHSCOPE_BASE_URL: str = "https://dashscope.aliyuncs.com/compatible-mode/v1" # DashScope API Base URL
     DEEPSEEK_API_KEY: Optional[str] = None  # DeepSeek API Key
+    # 额外的 API Key，与上面的 Key 一起组成 Key 池（见 ai_executor/key_pool.py），环境变量使用 JSON 数组，例如 '["sk-a", "sk-b"]'
+    DASHSCOPE_API_KEYS: List[str] = []
+    DEEPSEEK_API_KEYS: List[str] = []
 
     # --- 模型相关配置 ---
     MODEL_NAME: str = "deepseek-chat" # 默认模型名称 (您原始文件是 qwen-turbo，这里我根据 deepseek 项目名改为 deepseek-chat)
@@ -68,9 +71,166 @@ class Settings(BaseSettings):
     # --- RQ 任务参数配置（用于 dispatcher/core/dispatcher.py）---
     TASK_RESULT_TTL: int = 86400 # 任务结果在 Redis 中保留的时长（秒），默认 1 天
     TASK_FAILURE_TTL: int = 604800 # 失败任务结果在 Redis 中保留的时长（秒），默认 7 天
+    IDEMPOTENCY_KEY_TTL: int = 86400 # 客户端幂等键（Idempotency-Key）的有效期（秒），期间重复提交返回首次请求的任务，不宜超过 TASK_RESULT_TTL
     TASK_JOB_TIMEOUT: int = 300 # 任务执行超时时间（秒），默认 5 分钟
+    JOB_STATUS_CACHE_SIZE: int = 10000 # web 进程内缓存的已结束任务状态数（LRU），0 表示不缓存
+    QUEUE_METRICS_CACHE_TTL: float = 2.0 # /metrics 队列指标快照的缓存时间（秒），并发请求共享同一份快照
+
+    # --- 任务序列化配置（对应 dispatcher/core/serializers.py）---
+    JOB_SERIALIZER: str = "orjson" # RQ 任务数据和结果的编码格式：orjson / msgpack / pickle，web 和 worker 必须一致
+
+    # --- 结果压缩配置（对应 common/compression.py）---
+    # 任务数据（含 prompt）由 RQ 整体 zlib 压缩后写入，这里只处理 RQ 原样保存的任务结果
+    RESULT_COMPRESSION_ENABLED: bool = True # 是否在 worker 中压缩大结果
+    RESULT_COMPRESSION_THRESHOLDS: Dict[str, int] = {"high": 4096, "default": 1024, "low": 512} # 各队列的压缩阈值（字节），0 表示不压缩
+    RESULT_COMPRESSION_DEFAULT_THRESHOLD: int = 1024 # 未单独配置的队列使用的阈值（字节）
+    RESULT_COMPRESSION_LEVEL: int = 6 # zlib 压缩级别 (1-9)
+    COMPRESSION_STATS_INTERVAL: int = 30 # 压缩统计上报到 Redis 的间隔 (秒)
+
+    # --- 大负载卸载配置（对应 common/segment_store.py）---
+    # 超过阈值的 prompt / 结果写入 RESULTS_DIR 下的段文件，Redis 中只保存指针；web 和 worker 必须共享该目录
+    PAYLOAD_OFFLOAD_ENABLED: bool = True # 是否启用大负载卸载
+    PAYLOAD_OFFLOAD_THRESHOLD: int = 262144 # 卸载阈值（字节），默认 256 KiB
+    PAYLOAD_SEGMENT_DIR: str = "segments" # 段文件目录（相对 RESULTS_DIR）
+    PAYLOAD_SEGMENT_MAX_BYTES: int = 67108864 # 单个段文件的最大字节数，超过后切换新文件，默认 64 MiB
+    PAYLOAD_SEGMENT_ROLLOVER_SECONDS: int = 3600 # 单个段文件的最长写入时间（秒），也是过期删除的粒度
+    PAYLOAD_SEGMENT_TTL: int = 691200 # 段文件最后一次写入后保留的时长（秒），需大于 TASK_FAILURE_TTL，默认 8 天
+
+    # --- 结果归档配置（对应 dispatcher/core/result_archive.py 和 worker/archiver.py）---
+    ARCHIVE_ENABLED: bool = True # get_task_status 在 Redis 中找不到任务时是否查询归档
+    ARCHIVE_DIR: str = "archive" # 归档目录（相对 RESULTS_DIR）
+    ARCHIVE_LEAD_SECONDS: int = 3600 # 在任务从 Redis 过期前多久归档（秒），需大于 ARCHIVE_SWEEP_INTERVAL
+    ARCHIVE_SWEEP_INTERVAL: int = 300 # 归档进程扫描注册表的间隔（秒）
+    ARCHIVE_SWEEP_CHUNK_SIZE: int = 500 # 每次从注册表读取的任务数
+    ARCHIVE_RETENTION_DAYS: int = 30 # 归档保留天数
+    ANALYTICS_DIR: str = "analytics" # 归档统计汇总表的输出目录（相对 RESULTS_DIR，见 scripts/archive_analytics.py）
+
+    # --- 推理结果缓存配置（对应 dispatcher/core/response_cache.py）---
+    # 模型、prompt 和采样参数完全相同的请求直接返回缓存的结果，不再调用供应商
+    RESPONSE_CACHE_ENABLED: bool = True # 是否启用推理结果缓存
+    RESPONSE_CACHE_TTL: int = 86400 # Redis 层缓存的有效期 (秒)
+    RESPONSE_CACHE_LOCAL_MAX_ENTRIES: int = 10000 # web 进程内 LRU 缓存的最大条目数，0 表示不使用进程内缓存
+    RESPONSE_CACHE_LOCAL_MAX_BYTES: int = 67108864 # web 进程内 LRU 缓存的最大字节数，默认 64 MiB
+    RESPONSE_CACHE_MAX_RESULT_BYTES: int = 1048576 # 超过该字节数的结果不缓存，默认 1 MiB
+    RESPONSE_CACHE_MAX_TEMPERATURE: float = 2.0 # temperature 超过该值的请求不读写缓存（设为 0 则只缓存确定性请求）
+    RESPONSE_CACHE_STATS_INTERVAL: int = 30 # 缓存统计上报到 Redis 的间隔 (秒)
+
+    # --- 近似重复 prompt 缓存配置（对应 dispatcher/core/near_duplicate_cache.py）---
+    # worker 在调用模型前查找 MinHash 相似度不低于阈值的已有结果（同一模型和采样参数），只在进程内存中查找；
+    # 参与条件与精确匹配缓存相同（RESPONSE_CACHE_ENABLED、cache_bypass、RESPONSE_CACHE_MAX_TEMPERATURE）
+    NEAR_CACHE_ENABLED: bool = False # 是否启用近似重复缓存
+    NEAR_CACHE_THRESHOLD: float = 0.85 # 命中所需的估计 Jaccard 相似度 (0-1)
+    NEAR_CACHE_NUM_PERM: int = 128 # MinHash 签名长度，必须是 2 的幂
+    NEAR_CACHE_BANDS: int = 16 # LSH 分段数，需整除 NEAR_CACHE_NUM_PERM；分段越多召回越高、候选越多
+    NEAR_CACHE_SHINGLE_SIZE: int = 5 # 字符 shingle 长度
+    NEAR_CACHE_MAX_ENTRIES: int = 20000 # 每个 worker 进程内索引的最大条目数
+    NEAR_CACHE_MAX_BYTES: int = 67108864 # 每个 worker 进程内索引的最大字节数（结果 + 签名），默认 64 MiB
+    NEAR_CACHE_MAX_PROMPT_CHARS: int = 8000 # 超过该长度的 prompt 不参与近似缓存（签名计算时间随长度增长）
+    NEAR_CACHE_TTL: int = 86400 # Redis 中条目的有效期 (秒)
+    NEAR_CACHE_STATS_INTERVAL: int = 30 # 统计上报到 Redis 的间隔 (秒)
+
+    # --- 相同请求合并配置（对应 dispatcher/core/single_flight.py）---
+    # 相同的进行中请求只有一个任务（领导者）调用供应商，其余任务等待并复用它的结果，跨 worker 进程生效
+    SINGLE_FLIGHT_ENABLED: bool = True # 是否合并相同的进行中请求
+    SINGLE_FLIGHT_LEASE_MS: int = 15000 # 领导者租约时长 (毫秒)，执行期间每 1/3 时长续期一次；领导者进程退出后最多这么久由跟随者接管
+    SINGLE_FLIGHT_MAX_WAIT: int = 240 # 跟随者最长等待时间 (秒)，超过后自行调用供应商，需小于 TASK_JOB_TIMEOUT
+    SINGLE_FLIGHT_RESULT_TTL: int = 30 # 领导者结果保留时间 (秒)，期间开始执行的相同请求直接复用
+    SINGLE_FLIGHT_STATS_INTERVAL: int = 30 # 统计上报到 Redis 的间隔 (秒)
+
+    # --- 执行器路由配置（对应 ai_executor/router.py）---
+    # 配置了多个供应商时，每个请求发给预期完成时间最短的执行器：延迟 × (1 + 进行中权重 × 进行中请求数) + 错误惩罚 × 错误率
+    ROUTER_PROVIDER_MODELS: Dict[str, List[str]] = {
+        "deepseek": ["deepseek-chat", "deepseek-reasoner"],
+        "dashscope": ["qwen-turbo", "qwen-plus", "qwen-max"],
+    } # 各供应商可以服务的模型；请求的模型不在任何列表中时所有执行器都是候选，未列出的供应商可以服务任何模型
+    ROUTER_EWMA_ALPHA: float = 0.2 # 延迟和错误率的 EWMA 平滑系数 (0-1)，越大越偏向最近的请求
+    ROUTER_IN_FLIGHT_WEIGHT: float = 0.5 # 每个进行中的请求使预期延迟增加的比例
+    ROUTER_ERROR_PENALTY: float = 30.0 # 错误率为 1 时增加的预期时间 (秒)
+    ROUTER_ERROR_HALF_LIFE: float = 60.0 # 没有新请求时错误率衰减一半的时间 (秒)，之后被降级的执行器会被重新尝试
+    ROUTER_INITIAL_LATENCY: float = 2.0 # 还没有成功样本的执行器的预期延迟 (秒)
+    ROUTER_STICKINESS_SECONDS: float = 30.0 # 切换执行器后的粘滞窗口 (秒)，窗口内只有分数差距超过 ROUTER_SWITCH_MARGIN 才再次切换
+    ROUTER_SWITCH_MARGIN: float = 0.2 # 粘滞窗口内切换所需的分数差距（比例）
+    ROUTER_PROBE_INTERVAL: float = 30.0 # 超过该时间 (秒) 未被选中的执行器会收到一个探测请求以刷新分数，0 表示不探测
+    ROUTER_STATS_INTERVAL: int = 10 # 路由分数上报到 Redis 的间隔 (秒)
+
+    # --- 对冲请求配置（对应 ai_executor/hedging.py）---
+    # 主执行器超过其近期延迟的分位数仍未返回时，把同一个请求发给另一个执行器，先返回的结果生效（仅非流式请求）
+    HEDGE_ENABLED: bool = False # 是否启用对冲请求
+    HEDGE_PERCENTILE: float = 95.0 # 对冲等待时间取主执行器最近成功请求耗时的该分位数
+    HEDGE_MIN_SAMPLES: int = 20 # 主执行器近期成功样本少于该数量时不对冲
+    HEDGE_MIN_DELAY: float = 0.5 # 对冲等待时间下限 (秒)
+    HEDGE_LATENCY_WINDOW: int = 200 # 每个执行器保留的最近成功请求耗时样本数
+    HEDGE_BUDGET_RATIO: float = 0.05 # 对冲请求占总请求数的上限比例
+    HEDGE_BUDGET_BURST: float = 10.0 # 对冲预算的桶容量（允许短时间内集中对冲的次数）
+    HEDGE_MAX_THREADS: int = 8 # 同步 worker 执行对冲请求的线程数
+    MOCK_LATENCY_MEDIAN: float = 1.0 # MockExecutor 的延迟中位数 (秒)
+    MOCK_LATENCY_SIGMA: float = 0.0 # MockExecutor 延迟的对数正态分布 sigma，0 表示固定延迟；1.0 时 p99 约为中位数的 10 倍，用于评估对冲效果
+
+    # --- 熔断器配置（对应 ai_executor/circuit_breaker.py）---
+    # 状态保存在 Redis 中（breaker:<执行器名称>），所有 worker 进程共享
+    BREAKER_ENABLED: bool = True # 是否启用按执行器的熔断器
+    BREAKER_WINDOW_SECONDS: float = 60.0 # 统计失败率和超时次数的固定窗口长度 (秒)
+    BREAKER_MIN_REQUESTS: int = 10 # 窗口内请求数达到该值后才按失败率判断
+    BREAKER_ERROR_RATE: float = 0.5 # 窗口内失败率达到该值时打开熔断器
+    BREAKER_TIMEOUT_THRESHOLD: int = 5 # 窗口内超时次数达到该值时打开熔断器（不要求最少请求数）
+    BREAKER_OPEN_SECONDS: float = 30.0 # 打开后快速拒绝的时长 (秒)，之后进入半开状态
+    BREAKER_HALF_OPEN_PROBES: int = 2 # 半开状态同时放行的探测请求数，全部成功后关闭
+    BREAKER_PROBE_TIMEOUT: float = 180.0 # 探测请求超过该时长 (秒) 没有结果时收回名额（例如 worker 进程退出）
+
+    # --- API Key 池配置（对应 ai_executor/key_pool.py）---
+    # 每个 Key 的每分钟请求数 / token 数预算在 Redis 中记账（keypool:<供应商>:<Key 指纹>:<分钟>），所有 worker 共享；0 表示不限制
+    DEEPSEEK_KEY_RPM: int = 0 # 每个 DeepSeek Key 每分钟的请求数上限
+    DEEPSEEK_KEY_TPM: int = 0 # 每个 DeepSeek Key 每分钟的 token 数上限（输入 + 输出）
+    DASHSCOPE_KEY_RPM: int = 0 # 每个 DashScope Key 每分钟的请求数上限
+    DASHSCOPE_KEY_TPM: int = 0 # 每个 DashScope Key 每分钟的 token 数上限（输入 + 输出）
+    KEY_POOL_MAX_WAIT: float = 30.0 # 所有 Key 都没有额度时最多等待 (秒)，超时后任务失败并按重试策略重试
+    KEY_POOL_POLL_INTERVAL: float = 0.5 # 等待额度时重新检查的间隔 (秒)
+    KEY_POOL_429_COOLDOWN: float = 60.0 # Key 收到 429 且响应没有 Retry-After 时的冷却时间 (秒)
+    KEY_POOL_STATS_INTERVAL: int = 10 # 各进程 Key 池统计上报到 Redis 的最小间隔 (秒)
+    TOKENIZER_ENCODING: str = "cl100k_base" # 估计 token 数使用的 tiktoken 编码（模型没有对应编码时）
+
+    # --- 自适应并发限制配置（对应 ai_executor/concurrency_limiter.py）---
+    # 每个执行器的并发上限按 AIMD 调整，上限和已发放的许可保存在 Redis 中（aimd:state:<执行器> / aimd:permits:<执行器>），所有 worker 共享
+    AIMD_ENABLED: bool = True # 是否启用自适应并发限制
+    AIMD_INITIAL_LIMIT: float = 8.0 # 初始并发上限
+    AIMD_MIN_LIMIT: float = 1.0 # 并发上限的下限
+    AIMD_MAX_LIMIT: float = 256.0 # 并发上限的上限
+    AIMD_INCREASE: float = 1.0 # 加性增加：每完成约"当前上限"个成功请求，上限增加该值
+    AIMD_DECREASE_FACTOR: float = 0.5 # 乘性降低：收到 429 / 5xx / 超时或延迟上升时上限乘以该系数
+    AIMD_DECREASE_INTERVAL: float = 2.0 # 两次降低之间的最小间隔 (秒)，同一波错误只降低一次
+    AIMD_LATENCY_TOLERANCE: float = 3.0 # 短期延迟 EWMA 超过长期 EWMA 的倍数时视为过载，0 表示不按延迟调整
+    AIMD_MAX_PAUSE: float = 120.0 # 按 Retry-After 暂停发放许可的最长时间 (秒)
+    AIMD_PERMIT_TTL: float = 600.0 # 许可的有效期 (秒)，持有许可的 worker 异常退出后到期收回，需大于 TASK_JOB_TIMEOUT
+    AIMD_MAX_WAIT: float = 60.0 # 等待许可的最长时间 (秒)，超时后任务失败并按重试策略重试
+    AIMD_POLL_INTERVAL: float = 0.2 # 等待许可时重新申请的间隔 (秒)
+
+    # --- 任务重试引擎配置（对应 dispatcher/core/retry_policy.py）---
+    # 任务失败时按异常分类决定是否重试：每类有自己的最大重试次数和指数退避参数（full jitter：在 [0, min(上限, 基数 * 2^n)] 内随机等待），
+    # 客户端错误（4xx）和参数 / 代码错误不重试；总重试次数同时受下方按队列的 TASK_MAX_RETRIES_* 限制
+    RETRY_NETWORK_MAX_RETRIES: int = 3 # 网络错误（连接失败、超时）的最大重试次数
+    RETRY_NETWORK_BASE_DELAY: float = 2.0 # 网络错误的退避基数 (秒)
+    RETRY_NETWORK_MAX_DELAY: float = 30.0 # 网络错误的退避上限 (秒)
+    RETRY_RATE_LIMIT_MAX_RETRIES: int = 5 # 限流（429、Key 池或并发许可耗尽）的最大重试次数
+    RETRY_RATE_LIMIT_BASE_DELAY: float = 5.0 # 限流的退避基数 (秒)，响应带 Retry-After 时至少等待该时间
+    RETRY_RATE_LIMIT_MAX_DELAY: float = 120.0 # 限流的退避上限 (秒)
+    RETRY_SERVER_ERROR_MAX_RETRIES: int = 4 # 供应商 5xx 或熔断器打开的最大重试次数
+    RETRY_SERVER_ERROR_BASE_DELAY: float = 10.0 # 供应商 5xx 的退避基数 (秒)
+    RETRY_SERVER_ERROR_MAX_DELAY: float = 300.0 # 供应商 5xx 的退避上限 (秒)
+    RETRY_BAD_RESPONSE_MAX_RETRIES: int = 1 # 响应格式错误的最大重试次数
+    RETRY_BAD_RESPONSE_BASE_DELAY: float = 5.0 # 响应格式错误的退避基数 (秒)
+    RETRY_BAD_RESPONSE_MAX_DELAY: float = 30.0 # 响应格式错误的退避上限 (秒)
+    RETRY_UNKNOWN_MAX_RETRIES: int = 2 # 无法分类的错误的最大重试次数
+    RETRY_UNKNOWN_BASE_DELAY: float = 10.0 # 无法分类的错误的退避基数 (秒)
+    RETRY_UNKNOWN_MAX_DELAY: float = 120.0 # 无法分类的错误的退避上限 (秒)
+    # 全局重试预算（令牌桶，Redis 键 retry:budget，所有 worker 共享）：每个新任务存入 RATIO 个令牌，每次重试消耗一个，
+    # 供应商故障时重试不超过新任务数的 RATIO，不会成倍放大负载；预算耗尽的任务直接失败
+    RETRY_BUDGET_ENABLED: bool = True # 是否启用重试预算
+    RETRY_BUDGET_RATIO: float = 0.2 # 重试数占新任务数的比例上限
+    RETRY_BUDGET_BURST: float = 100.0 # 令牌桶容量（允许短时间内集中重试的次数）
+    RETRY_BUDGET_MIN_PER_SECOND: float = 0.5 # 与流量无关的令牌补充速度 (个/秒)，保证低流量时也能重试
 
     # --- 新增：任务重试策略配置 ---
+    # 按队列的总重试次数上限；重试间隔由重试引擎按异常分类计算，下面的固定间隔只对升级前入队、没有失败回调的任务生效
     TASK_MAX_RETRIES_DEFAULT: int = 3 # 默认队列最大重试次数
     TASK_RETRY_INTERVAL_DEFAULT: int = 60 # 默认队列重试间隔 (秒)
 
@@ -80,6 +240,37 @@ class Settings(BaseSettings):
     TASK_MAX_RETRIES_LOW: int = 5 # 低优先级队列最大重试次数
     TASK_RETRY_INTERVAL_LOW: int = 120 # 低优先级队列重试间隔 (秒)
 
+    # --- HTTP 连接池配置（对应 ai_executor/http_client.py）---
+    HTTP_POOL_MAX_CONNECTIONS: int = 20 # 每个供应商的最大连接数
+    HTTP_POOL_MAX_KEEPALIVE: int = 10 # 每个供应商保持的最大空闲长连接数
+    HTTP_POOL_KEEPALIVE_EXPIRY: float = 30.0 # 空闲长连接的保活时间 (秒)
+    HTTP_POOL_TIMEOUT: float = 5.0 # 等待连接池空闲连接的超时时间 (秒)
+    HTTP_ENABLE_HTTP2: bool = False # 是否启用 HTTP/2 (需安装 h2)
+    HTTP_CONNECT_TIMEOUT: float = 5.0 # 默认建连超时时间 (秒)
+    HTTP_POOL_STATS_INTERVAL: int = 30 # 连接池统计上报到 Redis 的间隔 (秒)
+    DEEPSEEK_CONNECT_TIMEOUT: Optional[float] = None # DeepSeek 建连超时，为空时使用 HTTP_CONNECT_TIMEOUT
+    DEEPSEEK_READ_TIMEOUT: Optional[float] = None # DeepSeek 读取超时，为空时使用 TASK_JOB_TIMEOUT
+    DASHSCOPE_CONNECT_TIMEOUT: Optional[float] = None # DashScope 建连超时，为空时使用 HTTP_CONNECT_TIMEOUT
+    DASHSCOPE_READ_TIMEOUT: Optional[float] = None # DashScope 读取超时，为空时使用 TASK_JOB_TIMEOUT
+
+    # --- 异步 Worker 配置（对应 worker/async_worker.py）---
+    ASYNC_WORKER_MAX_IN_FLIGHT: int = 20 # 单个异步 worker 进程同时执行的最大任务数
+
+    # --- Token 流式输出配置（对应 dispatcher/core/token_stream.py）---
+    TOKEN_STREAM_ENABLED: bool = True # 请求未指定 stream 时是否默认以流式方式调用模型
+    TOKEN_STREAM_MAXLEN: int = 10000 # 单个任务 token 流保留的最大事件数（近似裁剪）
+    TOKEN_STREAM_TTL: int = 3600 # 任务结束后 token 流在 Redis 中保留的时长（秒）
+    TOKEN_STREAM_BLOCK_MS: int = 15000 # SSE 端 XREAD 的阻塞时间（毫秒），也是心跳注释的发送间隔
+
+    # --- 任务完成通知 / 长轮询配置（对应 dispatcher/core/completion.py）---
+    TASK_WAIT_NOTIFY_TTL: int = 600 # 完成通知在 Redis 中保留的时长（秒），过期后等待接口回退到查询任务状态
+    TASK_WAIT_DEFAULT_TIMEOUT: int = 30 # /tasks/{job_id}/wait 默认最长等待时间（秒）
+    TASK_WAIT_MAX_TIMEOUT: int = 60 # /tasks/{job_id}/wait 允许的最长等待时间（秒），需小于反向代理的读超时
+
+    # --- 批量接口配置（对应 web/app.py 的 /generate/batch）---
+    BATCH_MAX_ITEMS: int = 1000 # 单次批量提交允许的最大条目数
+    EXPORT_CHUNK_SIZE: int = 500 # 导出注册表时每次从 Redis 读取的任务数（对应 /registries/{type}/export）
+
 
 # 创建 Settings 类的实例，这将自动从环境变量和 .env 文件加载配置
 settings = Settings()
@@ -0,0 +1,407 @@
+# ~/projects/deepseek_dispatcher-new/dispatcher/core/archive_analytics.py
+
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from common.logging_utils import get_logger
+from config.settings import settings
+
+logger = get_logger("archive_analytics")
+
+# 分类列：每列保存为 codes（整数编码）+ labels（去重后的字符串）
+CATEGORICAL_COLUMNS = ("status", "queue", "model", "error_type")
+# 数值列：时间为 UTC 秒级时间戳，缺失为 NaN
+NUMERIC_COLUMNS = ("enqueued_at", "started_at", "ended_at", "max_tokens", "result_chars")
+# 段文件旁的列式缓存：<段文件>.cols.npz，段文件大小变化（仍在追加）时重新解析
+COLUMNS_SUFFIX = ".cols.npz"
+PERCENTILES = (50, 95, 99)
+_DAY_FORMAT = "%Y-%m-%d"
+# datetime.isoformat() 精确到微秒时为 26 个字符，截断可去掉可能存在的时区后缀
+_ISO_LENGTH = 26
+
+
+def _loads(line: bytes) -> Dict[str, Any]:
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+
+def _error_type(error: Optional[str]) -> str:
+    """从异常堆栈的最后一行取出异常类名，例如 services.ai_service.ServiceExecutionError: ... -> ServiceExecutionError。"""
+    if not error:
+        return ""
+    lines = error.strip().splitlines()
+    if not lines:
+        return ""
+    name = lines[-1].split(":", 1)[0].strip()
+    return name.rsplit(".", 1)[-1][:64] or "unknown"
+
+
+def _timestamps(values: List[str]) -> np.ndarray:
+    """把 ISO 时间字符串（RQ 写入的 UTC 无时区时间）批量转换为秒级时间戳，缺失值为 NaN。"""
+    parsed = np.array(values, dtype="datetime64[us]")
+    seconds = parsed.astype("int64") / 1e6
+    seconds[np.isnat(parsed)] = np.nan
+    return seconds
+
+
+class ArchiveColumns:
+    """
+    归档记录的列式表示：数值列是 float64 数组，分类列是 int32 编码 + 字符串标签，
+    所有统计都在这些数组上以向量化方式计算，不再逐条遍历记录。
+    """
+
+    def __init__(self, numeric: Dict[str, np.ndarray], codes: Dict[str, np.ndarray], labels: Dict[str, np.ndarray]):
+        self.numeric = numeric
+        self.codes = codes
+        self.labels = labels
+
+    def __len__(self) -> int:
+        return len(self.numeric["ended_at"])
+
+    @classmethod
+    def empty(cls) -> "ArchiveColumns":
+        return cls(
+            {name: np.empty(0, dtype=np.float64) for name in NUMERIC_COLUMNS},
+            {name: np.empty(0, dtype=np.int32) for name in CATEGORICAL_COLUMNS},
+            {name: np.empty(0, dtype=str) for name in CATEGORICAL_COLUMNS},
+        )
+
+    @classmethod
+    def from_records(cls, records: List[Dict[str, Any]]) -> "ArchiveColumns":
+        raw_times: Dict[str, List[str]] = {"enqueued_at": [], "started_at": [], "ended_at": []}
+        raw_labels: Dict[str, List[str]] = {name: [] for name in CATEGORICAL_COLUMNS}
+        max_tokens = np.full(len(records), np.nan)
+        result_chars = np.zeros(len(records))
+        for i, record in enumerate(records):
+            for name, values in raw_times.items():
+                value = record.get(name)
+                values.append(value[:_ISO_LENGTH] if value else "NaT")
+            params = record.get("params") or {}
+            raw_labels["status"].append(record.get("status") or "unknown")
+            raw_labels["queue"].append(record.get("queue") or "unknown")
+            raw_labels["model"].append(params.get("model_name") or "default")
+            raw_labels["error_type"].append(_error_type(record.get("error")))
+            if params.get("max_tokens") is not None:
+                max_tokens[i] = params["max_tokens"]
+            result = record.get("result")
+            if isinstance(result, str):
+                result_chars[i] = len(result)
+
+        numeric = {name: _timestamps(values) for name, values in raw_times.items()}
+        numeric["max_tokens"] = max_tokens
+        numeric["result_chars"] = result_chars
+        codes, labels = {}, {}
+        for name, values in raw_labels.items():
+            labels[name], inverse = np.unique(np.array(values, dtype=str), return_inverse=True)
+            codes[name] = inverse.astype(np.int32).reshape(-1)
+        return cls(numeric, codes, labels)
+
+    @classmethod
+    def concat(cls, parts: List["ArchiveColumns"]) -> "ArchiveColumns":
+        """合并多个段文件的列：分类列的标签取并集，各段的编码按并集重新映射。"""
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            return cls.empty()
+        numeric = {name: np.concatenate([part.numeric[name] for part in parts]) for name in NUMERIC_COLUMNS}
+        codes, labels = {}, {}
+        for name in CATEGORICAL_COLUMNS:
+            labels[name] = np.unique(np.concatenate([part.labels[name] for part in parts]))
+            codes[name] = np.concatenate([
+                np.searchsorted(labels[name], part.labels[name]).astype(np.int32)[part.codes[name]] for part in parts
+            ])
+        return cls(numeric, codes, labels)
+
+    def select(self, mask: np.ndarray) -> "ArchiveColumns":
+        return ArchiveColumns(
+            {name: values[mask] for name, values in self.numeric.items()},
+            {name: values[mask] for name, values in self.codes.items()},
+            self.labels,
+        )
+
+    # --- 列式缓存 ---
+
+    def save(self, path: str, source_size: int) -> None:
+        arrays = {f"n_{name}": values for name, values in self.numeric.items()}
+        arrays.update((f"c_{name}", values) for name, values in self.codes.items())
+        arrays.update((f"l_{name}", values) for name, values in self.labels.items())
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, source_size=np.int64(source_size), **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, source_size: int) -> Optional["ArchiveColumns"]:
+        """读取列式缓存；缓存不存在或段文件之后又有追加时返回 None。"""
+        try:
+            with np.load(path) as data:
+                if int(data["source_size"]) != source_size:
+                    return None
+                return cls(
+                    {name: data[f"n_{name}"] for name in NUMERIC_COLUMNS},
+                    {name: data[f"c_{name}"] for name in CATEGORICAL_COLUMNS},
+                    {name: data[f"l_{name}"] for name in CATEGORICAL_COLUMNS},
+                )
+        except (FileNotFoundError, KeyError, ValueError, OSError):
+            return None
+
+
+def load_segment(path: str, use_cache: bool = True) -> ArchiveColumns:
+    """把一个归档段文件（JSONL）读成列；use_cache 为 True 时优先读取、并写入旁边的 .cols.npz 缓存。"""
+    source_size = os.path.getsize(path)
+    cache_path = path + COLUMNS_SUFFIX
+    if use_cache:
+        cached = ArchiveColumns.load(cache_path, source_size)
+        if cached is not None:
+            return cached
+    with open(path, "rb") as f:
+        # 只读取缓存所对应的大小，写入进程此后追加的行留到下次
+        data = f.read(source_size)
+    records = []
+    for line in data.splitlines():
+        if not line:
+            continue
+        try:
+            records.append(_loads(line))
+        except ValueError:
+            # 写入进程崩溃时可能留下不完整的最后一行
+            logger.warning(f"跳过无法解析的归档行: {path}")
+    columns = ArchiveColumns.from_records(records)
+    if use_cache:
+        try:
+            columns.save(cache_path, source_size)
+        except OSError as e:
+            logger.warning(f"写入列式缓存 {cache_path} 失败: {e}")
+    return columns
+
+
+def _archive_root() -> str:
+    return os.path.join(settings.RESULTS_DIR, settings.ARCHIVE_DIR)
+
+
+def list_segments(root: str, since: Optional[str] = None, until: Optional[str] = None) -> List[str]:
+    """列出 [since, until] 日期范围（YYYY-MM-DD，含两端）内的归档段文件。"""
+    segments = []
+    try:
+        days = sorted(name for name in os.listdir(root) if len(name) == 10)
+    except FileNotFoundError:
+        return []
+    for day in days:
+        if (since and day < since) or (until and day > until):
+            continue
+        day_dir = os.path.join(root, day)
+        segments.extend(os.path.join(day_dir, name) for name in sorted(os.listdir(day_dir)) if name.endswith(".jsonl"))
+    return segments
+
+
+def load_archive(root: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                 use_cache: bool = True, workers: int = 1) -> ArchiveColumns:
+    """
+    读取日期范围内的全部归档段文件并合并为列。
+    workers > 1 时用多进程并行解析尚未缓存的段文件（解析 JSON 是唯一的逐行开销）。
+    """
+    segments = list_segments(root or _archive_root(), since, until)
+    if workers > 1 and len(segments) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            parts = list(executor.map(load_segment, segments, [use_cache] * len(segments)))
+    else:
+        parts = [load_segment(path, use_cache) for path in segments]
+    columns = ArchiveColumns.concat(parts)
+    logger.info(f"读取归档段文件 {len(segments)} 个，共 {len(columns)} 条记录。")
+    return columns
+
+
+# --- 向量化统计 ---
+
+def grouped_percentiles(codes: np.ndarray, values: np.ndarray, groups: int,
+                        percentiles: Tuple[int, ...] = PERCENTILES) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    计算每个分组的分位数（np.percentile 默认的线性插值），忽略 NaN。
+    先按分组编码做一次稳定排序（整数基数排序）使每个分组连续，再在各分组的切片上用 np.percentile（基于 partition，O(n)）。
+
+    Returns:
+        (counts, table)：counts[g] 为分组 g 的有效值个数，table[g, i] 为第 i 个分位数，空分组为 NaN。
+    """
+    valid = ~np.isnan(values)
+    codes, values = codes[valid], values[valid]
+    ordered = values[np.argsort(codes, kind="stable")]
+    counts = np.bincount(codes, minlength=groups)
+    ends = np.cumsum(counts)
+    table = np.full((groups, len(percentiles)), np.nan)
+    for g in np.flatnonzero(counts):
+        table[g] = np.percentile(ordered[ends[g] - counts[g]:ends[g]], percentiles)
+    return counts, table
+
+
+def _group_codes(columns: ArchiveColumns, by: Optional[str]) -> Tuple[np.ndarray, np.ndarray]:
+    if by is None:
+        return np.zeros(len(columns), dtype=np.int32), np.array(["all"])
+    return columns.codes[by], columns.labels[by]
+
+
+def _round(value: float, digits: int = 3) -> Optional[float]:
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+def latency_table(columns: ArchiveColumns, by: Optional[str] = None) -> List[Dict[str, Any]]:
+    """按分组统计执行耗时（started -> ended）和端到端耗时（enqueued -> ended）的分位数（秒）。"""
+    codes, labels = _group_codes(columns, by)
+    ended = columns.numeric["ended_at"]
+    run_counts, run = grouped_percentiles(codes, ended - columns.numeric["started_at"], len(labels))
+    _, total = grouped_percentiles(codes, ended - columns.numeric["enqueued_at"], len(labels))
+    wait = columns.numeric["started_at"] - columns.numeric["enqueued_at"]
+    valid_wait = ~np.isnan(wait)
+    wait_sum = np.bincount(codes[valid_wait], weights=wait[valid_wait], minlength=len(labels))
+    wait_count = np.bincount(codes[valid_wait], minlength=len(labels))
+    rows = []
+    for g, label in enumerate(labels):
+        if not run_counts[g]:
+            continue
+        row = {by or "group": str(label), "jobs": int(run_counts[g])}
+        row.update((f"run_p{q}", _round(run[g, i])) for i, q in enumerate(PERCENTILES))
+        row.update((f"total_p{q}", _round(total[g, i])) for i, q in enumerate(PERCENTILES))
+        row["queue_wait_mean"] = _round(wait_sum[g] / wait_count[g]) if wait_count[g] else None
+        rows.append(row)
+    return rows
+
+
+def throughput_table(columns: ArchiveColumns) -> List[Dict[str, Any]]:
+    """按结束时间统计每分钟完成和失败的任务数（只列出有任务的分钟）。"""
+    ended = columns.numeric["ended_at"]
+    valid = ~np.isnan(ended)
+    if not valid.any():
+        return []
+    minutes = (ended[valid] // 60).astype(np.int64)
+    first = minutes.min()
+    failed = columns.codes["status"][valid] == _label_code(columns, "status", "failed")
+    counts = np.bincount(minutes - first)
+    failed_counts = np.bincount(minutes - first, weights=failed, minlength=len(counts))
+    active = np.flatnonzero(counts)
+    labels = np.datetime_as_string((active + first).astype("datetime64[m]"), unit="m")
+    return [
+        {"minute": str(label).replace("T", " "), "jobs": int(count), "failed": int(failed_count)}
+        for label, count, failed_count in zip(labels, counts[active].tolist(), failed_counts[active].tolist())
+    ]
+
+
+def _label_code(columns: ArchiveColumns, column: str, label: str) -> int:
+    """标签对应的编码，不存在时返回 -1（不会与任何编码相等）。"""
+    labels = columns.labels[column]
+    position = int(np.searchsorted(labels, label))
+    return position if position < len(labels) and labels[position] == label else -1
+
+
+def error_table(columns: ArchiveColumns, by: str) -> List[Dict[str, Any]]:
+    """按分组统计任务数、失败数和失败率。"""
+    codes, labels = _group_codes(columns, by)
+    failed = columns.codes["status"] == _label_code(columns, "status", "failed")
+    totals = np.bincount(codes, minlength=len(labels))
+    failures = np.bincount(codes, weights=failed, minlength=len(labels))
+    return [
+        {by: str(label), "jobs": int(totals[g]), "failed": int(failures[g]),
+         "error_rate": round(float(failures[g] / totals[g]), 4)}
+        for g, label in enumerate(labels) if totals[g]
+    ]
+
+
+def error_type_table(columns: ArchiveColumns) -> List[Dict[str, Any]]:
+    """失败任务按模型和异常类型的分布。"""
+    failed = columns.select(columns.codes["status"] == _label_code(columns, "status", "failed"))
+    if not len(failed):
+        return []
+    error_types = len(failed.labels["error_type"])
+    pairs = failed.codes["model"].astype(np.int64) * error_types + failed.codes["error_type"]
+    keys, counts = np.unique(pairs, return_counts=True)
+    rows = [
+        {"model": str(failed.labels["model"][key // error_types]),
+         "error_type": str(failed.labels["error_type"][key % error_types]) or "unknown",
+         "failed": int(count)}
+        for key, count in zip(keys, counts)
+    ]
+    return sorted(rows, key=lambda row: row["failed"], reverse=True)
+
+
+def token_table(columns: ArchiveColumns) -> List[Dict[str, Any]]:
+    """按模型统计请求的 max_tokens 和成功结果的长度（字符）。"""
+    codes, labels = columns.codes["model"], columns.labels["model"]
+    finished = columns.codes["status"] == _label_code(columns, "status", "finished")
+    max_tokens = columns.numeric["max_tokens"]
+    has_max_tokens = ~np.isnan(max_tokens)
+    max_tokens_sum = np.bincount(codes[has_max_tokens], weights=max_tokens[has_max_tokens], minlength=len(labels))
+    max_tokens_count = np.bincount(codes[has_max_tokens], minlength=len(labels))
+    chars = np.where(finished, columns.numeric["result_chars"], np.nan)
+    finished_counts, chars_percentiles = grouped_percentiles(codes, chars, len(labels))
+    chars_sum = np.bincount(codes[finished], weights=columns.numeric["result_chars"][finished], minlength=len(labels))
+    rows = []
+    for g, label in enumerate(labels):
+        if not finished_counts[g] and not max_tokens_count[g]:
+            continue
+        row = {
+            "model": str(label),
+            "finished": int(finished_counts[g]),
+            "max_tokens_mean": _round(max_tokens_sum[g] / max_tokens_count[g], 1) if max_tokens_count[g] else None,
+            "result_chars_total": int(chars_sum[g]),
+        }
+        row.update((f"result_chars_p{q}", _round(chars_percentiles[g, i], 1)) for i, q in enumerate(PERCENTILES))
+        rows.append(row)
+    return rows
+
+
+def summarize(columns: ArchiveColumns) -> Dict[str, List[Dict[str, Any]]]:
+    """计算全部汇总表，表名 -> 行列表。"""
+    throughput = throughput_table(columns)
+    per_minute = np.array([row["jobs"] for row in throughput], dtype=np.float64)
+    overview = {
+        "jobs": len(columns),
+        "failed": int(np.count_nonzero(columns.codes["status"] == _label_code(columns, "status", "failed"))),
+        "active_minutes": len(throughput),
+        "jobs_per_minute_mean": _round(per_minute.mean(), 2) if len(per_minute) else None,
+        "jobs_per_minute_p95": _round(np.percentile(per_minute, 95), 2) if len(per_minute) else None,
+        "jobs_per_minute_peak": int(per_minute.max()) if len(per_minute) else None,
+    }
+    return {
+        "overview": [overview],
+        "latency": latency_table(columns),
+        "latency_by_model": latency_table(columns, "model"),
+        "latency_by_queue": latency_table(columns, "queue"),
+        "throughput_per_minute": throughput,
+        "errors_by_model": error_table(columns, "model"),
+        "errors_by_queue": error_table(columns, "queue"),
+        "jobs_by_status": [{"status": row["status"], "jobs": row["jobs"]} for row in error_table(columns, "status")],
+        "error_types": error_type_table(columns),
+        "tokens_by_model": token_table(columns),
+    }
+
+
+def write_tables(tables: Dict[str, List[Dict[str, Any]]], output_dir: str) -> List[str]:
+    """每张表写成一个 CSV 文件，另写一份包含全部表的 summary.json，返回写入的文件路径。"""
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    for name, rows in tables.items():
+        path = os.path.join(output_dir, f"{name}.csv")
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            if rows:
+                writer = csv.DictWriter(f, fieldnames=list(rows[0]))
+                writer.writeheader()
+                writer.writerows(rows)
+        written.append(path)
+    path = os.path.join(output_dir, "summary.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(tables, f, ensure_ascii=False, indent=2)
+    written.append(path)
+    return written
+
+
+def default_date_range(days: int) -> Tuple[str, str]:
+    """最近 days 天（含今天，UTC）的日期范围。"""
+    today = datetime.now(timezone.utc)
+    return (today - timedelta(days=days - 1)).strftime(_DAY_FORMAT), today.strftime(_DAY_FORMAT)
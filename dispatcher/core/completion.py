@@ -0,0 +1,117 @@
+# ~/projects/deepseek_dispatcher-new/dispatcher/core/completion.py
+
+import json
+from typing import Any, Dict, Optional
+
+from redis import Redis
+import redis.asyncio as aioredis
+from rq.job import Callback, Job
+
+from common.compression import decode_payload
+from common.logging_utils import get_logger
+from config.settings import settings
+from dispatcher.core.job_index import index_completion
+
+logger = get_logger("completion")
+
+# 每个任务一个完成通知列表，完整键为 notify:done:<job_id>
+COMPLETION_KEY_PREFIX = "notify:done"
+
+
+def completion_key(job_id: str) -> str:
+    return f"{COMPLETION_KEY_PREFIX}:{job_id}"
+
+
+def build_completion(status: str, result: Any = None, error: Optional[str] = None) -> Dict[str, Any]:
+    """
+    构造完成通知的内容，字段与 TaskDispatcher.get_task_status 保持一致。
+    任务返回 {"status": "success", "result": ...} 时只保留 result 部分。
+    """
+    if isinstance(result, dict):
+        result = result.get("result", "无结果")
+    return {"status": status, "result": result, "error": error}
+
+
+def _decode_completion(raw: Optional[bytes]) -> Optional[Dict[str, Any]]:
+    if raw is None:
+        return None
+    completion = json.loads(raw)
+    # 通知中保存的是 worker 压缩或卸载后的结果（见 common/compression.py），返回给等待者前还原
+    completion["result"] = decode_payload(completion.get("result"))
+    return completion
+
+
+def _will_retry(retries_left: Optional[bytes]) -> bool:
+    # 与 rq.Worker.handle_job_failure 的判断一致：还有剩余重试次数时任务会被重新调度
+    return bool(retries_left) and int(retries_left) > 0
+
+
+def queue_notification(pipeline, job_id: str, completion: Dict[str, Any]) -> None:
+    """在调用方的 pipeline 中写入完成通知并更新任务索引（不执行 pipeline）。"""
+    index_completion(pipeline, job_id, completion)
+    if completion["status"] == "scheduled":
+        return
+    pipeline.delete(completion_key(job_id))
+    pipeline.lpush(completion_key(job_id), json.dumps(completion, ensure_ascii=False, default=str))
+    pipeline.expire(completion_key(job_id), settings.TASK_WAIT_NOTIFY_TTL)
+
+
+def notify_completion(redis_conn: Redis, job_id: str, completion: Dict[str, Any],
+                      will_retry: Optional[bool] = None) -> None:
+    """
+    写入任务的完成通知，唤醒所有等待者（见 wait_for_completion），并在同一个 pipeline 中更新任务索引。
+    失败且还会重试的任务不发通知（只把索引标记为 scheduled），等待者继续等待重试结果。
+    will_retry 为 None 时按任务当前的 retries_left 判断；重试引擎已做出决定时直接传入（见 dispatcher/core/retry_policy.py）。
+    通知只是优化手段，写入失败只记录警告，等待者超时后会回退到查询任务状态。
+    """
+    try:
+        if completion["status"] == "failed":
+            if will_retry is None:
+                will_retry = _will_retry(redis_conn.hget(Job.key_for(job_id), "retries_left"))
+            if will_retry:
+                completion = dict(completion, status="scheduled")
+        with redis_conn.pipeline(transaction=False) as pipeline:
+            queue_notification(pipeline, job_id, completion)
+            pipeline.execute()
+    except Exception as e:
+        logger.warning(f"写入任务 {job_id} 的完成通知失败: {e}")
+
+
+async def notify_completion_async(redis_conn: aioredis.Redis, job_id: str, completion: Dict[str, Any]) -> None:
+    """notify_completion 的异步版本，供异步 worker 使用。"""
+    try:
+        if completion["status"] == "failed" and _will_retry(await redis_conn.hget(Job.key_for(job_id), "retries_left")):
+            completion = dict(completion, status="scheduled")
+        async with redis_conn.pipeline(transaction=False) as pipeline:
+            queue_notification(pipeline, job_id, completion)
+            await pipeline.execute()
+    except Exception as e:
+        logger.warning(f"写入任务 {job_id} 的完成通知失败: {e}")
+
+
+def on_job_success(job: Job, connection: Redis, result: Any) -> None:
+    """
+    RQ 成功回调：写入完成通知，并把任务索引标记为 finished（入队时挂上该回调的任务不再由 task_wrapper 通知）。
+    worker 在任务函数返回之后、保存结果（handle_job_success）之前调用；两者之间 worker 异常退出时索引中的 finished
+    没有对应的结果，因此读取状态时只有 RQ 的结果流存在才认为 finished 有效（见 TaskDispatcher.get_task_status）。
+    """
+    notify_completion(connection, job.id, build_completion("finished", result))
+
+
+# 入队时通过 on_success 挂到每个任务上（RQ 只序列化函数的导入路径）
+COMPLETION_CALLBACK = Callback(on_job_success)
+
+
+async def get_completion(redis_conn: aioredis.Redis, job_id: str) -> Optional[Dict[str, Any]]:
+    """不阻塞地读取任务的完成通知，任务未完成或通知已过期时返回 None。"""
+    return _decode_completion(await redis_conn.lindex(completion_key(job_id), 0))
+
+
+async def wait_for_completion(redis_conn: aioredis.Redis, job_id: str, timeout: int) -> Optional[Dict[str, Any]]:
+    """
+    阻塞等待任务的完成通知，最多 timeout 秒，超时返回 None。
+    使用 BRPOPLPUSH 把元素弹出后放回同一个列表：通知不会被消费，多个等待者都能被唤醒，
+    通知写入后才开始等待的请求也会立即返回。
+    """
+    key = completion_key(job_id)
+    return _decode_completion(await redis_conn.brpoplpush(key, key, timeout=timeout))
@@ -2,14 +2,29 @@
 
 from rq import Queue, Connection
 from redis import Redis
+import threading
+import time
 import uuid
-from typing import Dict, Any, Union, Optional, Callable # 导入 Optional 和 Callable
-from dispatcher.queues.queue_config import QUEUE_MAP, default_retry, high_priority_retry, low_priority_retry # 导入重试策略
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Set, Tuple, Union, Optional, Callable # 导入 Optional 和 Callable
+from ai_executor.circuit_breaker import breaker_states
+from dispatcher.queues.queue_config import QUEUE_MAP
 from dispatcher.tasks.factory import TaskFactory # 确保导入 TaskFactory
 from common.logging_utils import get_logger
+from common.compression import decode_payload, encode_payload
+from common.lru_cache import LRUCache
+from dispatcher.core.result_archive import get_result_archive, to_status_info
+from dispatcher.core.completion import COMPLETION_CALLBACK, build_completion, queue_notification
+from dispatcher.core.idempotency import IdempotencyKeyConflict, claim_keys, payload_fingerprint, release_keys
+from dispatcher.core.job_index import IMMUTABLE_STATUSES, index_enqueued, job_index_key, parse_index
+from dispatcher.core.serializers import job_serializer
+from dispatcher.core.retry_policy import RETRY_CALLBACK, get_retry_policy, retry_for
+from dispatcher.core.registry_pager import REGISTRY_ATTRS, REGISTRY_TYPES, describe_jobs, iter_registry_jobs, page_queue_lists, page_sorted_registries
 from config.settings import settings # 从 config.settings 导入 settings 对象
-from rq.job import Job # 导入 Job 类，用于 get_task_status
-from dispatcher.tasks.base_task import task_wrapper # 导入 task_wrapper 装饰器
+from rq.job import Job, JobStatus # 导入 Job 类，用于 get_task_status
+from rq.exceptions import NoSuchJobError
+from rq.results import Result
+from rq.utils import str_to_date, utcnow
 
 # 获取一个名为 "dispatcher.core" 的 logger
 logger = get_logger("dispatcher.core")
@@ -18,6 +33,22 @@ class TaskDispatchError(Exception):
     """自定义任务调度错误异常"""
     pass
 
+
+# 批量查询状态时从任务哈希中读取的字段
+_STATUS_FIELDS = ("status", "enqueued_at", "started_at", "ended_at")
+
+
+def _extract_result(raw_result: Any) -> Any:
+    # InferenceTask.execute 返回的是 {"status": "success", "result": "..."}，大结果已在 worker 中压缩或卸载到段文件
+    if raw_result and isinstance(raw_result, dict):
+        return decode_payload(raw_result.get("result", "无结果"))
+    return raw_result
+
+
+def _isoformat(raw_date: Optional[bytes]) -> Optional[str]:
+    # 与 get_task_status 中 datetime.isoformat() 的输出格式保持一致
+    return str_to_date(raw_date).isoformat() if raw_date else None
+
 class TaskDispatcher:
     """
     负责任务的调度和状态查询。
@@ -36,17 +67,73 @@ class TaskDispatcher:
             raise ConnectionError(f"无法连接到 Redis: {e}")
 
         self.task_factory = TaskFactory() # 初始化 TaskFactory
+        # finished / failed 状态不会再变化，在进程内缓存，轮询已结束的任务时不再访问 Redis
+        self._terminal_status_cache = LRUCache(settings.JOB_STATUS_CACHE_SIZE)
+        # 指标快照 (采集时间, 队列指标, 熔断器状态)，见 get_metrics_snapshot
+        self._metrics_snapshot: Optional[Tuple[float, Dict[str, Dict[str, int]], Dict[str, Dict[str, Any]]]] = None
+        self._metrics_lock = threading.Lock()
         self.default_queue_name = queue_name # 存储默认队列名称
         
         # 确保 QUEUE_MAP 中的 Queue 实例使用相同的 Redis 连接
         for q_name, q_obj in QUEUE_MAP.items():
             if not q_obj.connection or q_obj.connection.connection_pool != self.redis_conn.connection_pool:
-                QUEUE_MAP[q_name] = Queue(name=q_name, connection=self.redis_conn)
+                QUEUE_MAP[q_name] = Queue(name=q_name, connection=self.redis_conn, serializer=job_serializer)
                 logger.debug(f"队列 '{q_name}' 已更新为使用 TaskDispatcher 的 Redis 连接。")
 
 
+    @staticmethod
+    def _resolve_priority(priority: str) -> str:
+        # 确保传入的 priority 是有效的
+        if priority not in QUEUE_MAP:
+            logger.warning(f"无效的优先级: '{priority}'。使用默认优先级。")
+            return 'default'
+        return priority
+
+    @staticmethod
+    def _build_task_kwargs(task_callable: Callable[..., Any], job_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        准备传递给任务函数的 kwargs。
+        任务函数提供 build_job_kwargs 时使用它生成的扁平负载（例如 inference_task.run_inference）；
+        否则（旧的绑定方法）task_details 将包含原始的 payload 和 job_id，以及任务类型等元数据。
+        """
+        build_job_kwargs = getattr(task_callable, "build_job_kwargs", None)
+        if build_job_kwargs is not None:
+            return build_job_kwargs(payload)
+        task_details = {
+            "task_type": task_callable.__name__, # 假设任务名称是 callable 的名称
+            "job_id": job_id,
+            "payload": { # 这里的 payload 是 web/app.py 中的 task_data_for_inference_task
+                "task_data": payload # 包含 prompt, model_kwargs, should_fail_for_test 等
+            }
+        }
+        return {'job_id': job_id, 'task_details': task_details}
+
+    def _claim_idempotency_keys(self, claims: List[Tuple[int, str, str, Dict[str, Any], str]]) -> Tuple[Dict[int, str], Set[int]]:
+        """
+        占用客户端幂等键（见 dispatcher/core/idempotency.py），claims 为 (位置, 幂等键, job_id, payload, priority) 列表。
+        返回 (位置 -> 首次请求的任务 ID，只包含幂等键已被占用的条目；幂等键已用于内容不同的请求的位置)。
+        """
+        if not claims:
+            return {}, set()
+        try:
+            originals, conflicts = claim_keys(self.redis_conn, [
+                (key, job_id, payload_fingerprint(payload, priority)) for _, key, job_id, payload, priority in claims
+            ])
+        except Exception as e:
+            logger.error(f"占用幂等键失败: {e}", exc_info=True)
+            raise TaskDispatchError(f"占用幂等键失败: {str(e)}")
+        duplicates = {claims[i][0]: original for i, original in enumerate(originals) if original is not None}
+        if duplicates:
+            logger.info(f"{len(duplicates)} 个请求的幂等键已存在，返回首次请求的任务: {list(duplicates.values())}")
+        return duplicates, {claims[i][0] for i in conflicts}
+
+    def _existing_job(self, job_id: str) -> Job:
+        # 重复请求只需要返回首次请求的任务 ID，不读取任务数据
+        return Job(job_id, connection=self.redis_conn, serializer=job_serializer)
+
     # 修正：enqueue_task 方法，更名为 dispatch，并调整参数以匹配 web/app.py 中的调用
-    def dispatch(self, task_callable: Callable[..., Any], payload: Dict[str, Any], priority: str = 'default', job_id: Optional[str] = None) -> Job:
+    def dispatch(self, task_callable: Callable[..., Any], payload: Dict[str, Any], priority: str = 'default', job_id: Optional[str] = None,
+                 idempotency_key: Optional[str] = None) -> Job:
         """
         将任务添加到 RQ 队列中。
 
@@ -55,195 +142,466 @@ class TaskDispatcher:
             payload (Dict[str, Any]): 传递给任务函数的实际数据 (例如：prompt, model_kwargs)。
             priority (str): 任务的优先级（'high', 'default', 'low'）。
             job_id (str, optional): 任务的唯一 ID。如果未提供，将自动生成。
+            idempotency_key (str, optional): 客户端幂等键。入队前用 SET NX 原子地占用，
+                IDEMPOTENCY_KEY_TTL 内的重复请求不再入队，返回首次请求的任务（job.id 与 job_id 不同）。
 
         Returns:
             Job: RQ Job 对象。
 
         Raises:
             TaskDispatchError: 如果任务调度失败。
+            IdempotencyKeyConflict: 幂等键已用于内容不同的请求。
         """
         # 如果 job_id 未提供，则生成一个 UUID
         job_id = str(uuid.uuid4()) if job_id is None else job_id
-        
-        # 确保传入的 priority 是有效的
-        if priority not in QUEUE_MAP:
-            logger.warning(f"无效的优先级: '{priority}'。使用默认优先级。")
-            priority = 'default'
-
+        priority = self._resolve_priority(priority)
         queue = QUEUE_MAP.get(priority) # 根据优先级获取队列对象
+
+        if idempotency_key is not None:
+            duplicates, conflicts = self._claim_idempotency_keys([(0, idempotency_key, job_id, payload, priority)])
+            if conflicts:
+                raise IdempotencyKeyConflict(f"幂等键 {idempotency_key} 已用于内容不同的请求")
+            if duplicates:
+                return self._existing_job(duplicates[0])
         
         logger.info(f"准备派发任务: 类型={task_callable.__name__}, ID={job_id}, 优先级={priority}")
 
         try:
-            # 准备传递给任务函数的 kwargs。
-            # task_details 将包含原始的 payload 和 job_id，以及任务类型等元数据
-            task_details = {
-                "task_type": task_callable.__name__, # 假设任务名称是 callable 的名称
-                "job_id": job_id,
-                "payload": { # 这里的 payload 是 web/app.py 中的 task_data_for_inference_task
-                    "task_data": payload # 包含 prompt, model_kwargs, should_fail_for_test 等
-                }
-            }
-
-            # 选择重试策略
-            retry_strategy = default_retry
-            if priority == "high":
-                retry_strategy = high_priority_retry
-            elif priority == "low":
-                retry_strategy = low_priority_retry
-            # 默认是 default_retry，无需额外设置
-
-            # 使用 task_wrapper 包装任务函数，确保其能够处理异常和告警
-            wrapped_task_callable = task_wrapper(task_callable)
-
-            job = queue.enqueue(
-                wrapped_task_callable, # 传递包装后的任务函数
-                job_id=job_id,        # RQ 自身的 job_id 参数
-                kwargs={'job_id': job_id, 'task_details': task_details}, # 将所有数据打包到 kwargs 传递给任务函数
-                result_ttl=settings.TASK_RESULT_TTL, 
-                failure_ttl=settings.TASK_FAILURE_TTL, 
-                timeout=settings.TASK_JOB_TIMEOUT,
-                retry=retry_strategy # 应用重试策略
-            )
+            # 任务函数已应用 task_wrapper（日志、异常和告警），这里直接入队。
+            # 模块级函数只序列化导入路径；绑定方法会连同任务实例一起序列化（仅 pickle 格式支持）。
+            # 任务和任务索引（见 dispatcher/core/job_index.py）在同一个 pipeline 中写入
+            with self.redis_conn.pipeline() as pipeline:
+                job = queue.enqueue(
+                    task_callable,
+                    job_id=job_id,        # RQ 自身的 job_id 参数
+                    kwargs=self._build_task_kwargs(task_callable, job_id, payload), # 将所有数据打包到 kwargs 传递给任务函数
+                    description=task_callable.__qualname__, # RQ 默认的描述会带上参数 repr，每个任务多占两百多字节
+                    result_ttl=settings.TASK_RESULT_TTL, 
+                    failure_ttl=settings.TASK_FAILURE_TTL, 
+                    job_timeout=settings.TASK_JOB_TIMEOUT, # 注意：RQ 1.x 只识别 job_timeout，timeout 参数会被静默忽略
+                    retry=retry_for(priority), # 按队列的总重试次数上限
+                    on_success=COMPLETION_CALLBACK, # 成功时写入完成通知和 finished 索引（见 dispatcher/core/completion.py）
+                    on_failure=RETRY_CALLBACK, # 失败时由重试引擎按错误分类决定是否重试（见 dispatcher/core/retry_policy.py）
+                    pipeline=pipeline
+                )
+                index_enqueued(pipeline, job_id, queue.name, job.enqueued_at)
+                get_retry_policy().budget.deposit(pipeline) # 新任务为全局重试预算存入令牌
+                pipeline.execute()
             logger.info(f"任务已成功入队，Job ID: {job.id}, 队列: {queue.name}")
             return job
         except Exception as e:
             logger.error(f"任务入队失败，任务类型: {task_callable.__name__}, Job ID: {job_id}: {e}", exc_info=True)
+            if idempotency_key is not None:
+                release_keys(self.redis_conn, [idempotency_key])
             raise TaskDispatchError(f"任务入队失败: {str(e)}")
 
+    def _claim_items(self, items: List[Tuple[Dict[str, Any], str, str]],
+                     idempotency_keys: Optional[List[Optional[str]]]) -> Tuple[Dict[int, str], Set[int], List[str]]:
+        """批量接口的幂等键处理：返回 (位置 -> 首次请求的任务 ID, 幂等键冲突的位置, 本次新占用的幂等键)。"""
+        if not idempotency_keys:
+            return {}, set(), []
+        claims = [(index, key, job_id, payload, self._resolve_priority(priority))
+                  for index, ((payload, priority, job_id), key) in enumerate(zip(items, idempotency_keys)) if key is not None]
+        duplicates, conflicts = self._claim_idempotency_keys(claims)
+        return duplicates, conflicts, [key for index, key, _, _, _ in claims if index not in duplicates and index not in conflicts]
+
+    def dispatch_many(self, task_callable: Callable[..., Any], items: List[Tuple[Dict[str, Any], str, Optional[str]]],
+                      idempotency_keys: Optional[List[Optional[str]]] = None) -> List[Job]:
+        """
+        批量入队：所有任务通过同一个 Redis pipeline 提交，N 个任务只需约一次网络往返。
+
+        Args:
+            task_callable (Callable): 从 TaskFactory 获取到的任务执行方法。
+            items (List[Tuple]): (payload, priority, job_id) 列表，job_id 为 None 时自动生成。
+            idempotency_keys (List, optional): 与 items 顺序一致的客户端幂等键（可为 None），
+                幂等键已存在的条目不入队，返回首次请求的任务，见 dispatch。
+
+        Returns:
+            List[Optional[Job]]: 与 items 顺序一致的 RQ Job 对象列表；幂等键已用于内容不同的请求的条目不入队，对应位置为 None。
+
+        Raises:
+            TaskDispatchError: 如果批量入队失败（pipeline 整体失败，不会出现部分入队）。
+        """
+        items = [(payload, priority, str(uuid.uuid4()) if job_id is None else job_id) for payload, priority, job_id in items]
+        duplicates, conflicts, claimed_keys = self._claim_items(items, idempotency_keys)
+        jobs: List[Optional[Job]] = [None] * len(items)
+        # 按队列分组，保留每个任务在原列表中的位置
+        grouped: Dict[str, List[Tuple[int, Any]]] = {}
+        for index, (payload, priority, job_id) in enumerate(items):
+            if index in duplicates:
+                jobs[index] = self._existing_job(duplicates[index])
+                continue
+            if index in conflicts:
+                continue
+            priority = self._resolve_priority(priority)
+            job_data = Queue.prepare_data(
+                task_callable,
+                kwargs=self._build_task_kwargs(task_callable, job_id, payload),
+                job_id=job_id,
+                description=task_callable.__qualname__,
+                result_ttl=settings.TASK_RESULT_TTL,
+                failure_ttl=settings.TASK_FAILURE_TTL,
+                timeout=settings.TASK_JOB_TIMEOUT,
+                retry=retry_for(priority),
+                on_success=COMPLETION_CALLBACK,
+                on_failure=RETRY_CALLBACK,
+            )
+            grouped.setdefault(priority, []).append((index, job_data))
+
+        logger.info(f"准备批量派发任务: 类型={task_callable.__name__}, 数量={len(items)}, 队列分布={ {p: len(g) for p, g in grouped.items()} }")
+        try:
+            with self.redis_conn.pipeline() as pipeline:
+                for priority, group in grouped.items():
+                    queue_jobs = QUEUE_MAP[priority].enqueue_many([job_data for _, job_data in group], pipeline=pipeline)
+                    for (index, _), job in zip(group, queue_jobs):
+                        jobs[index] = job
+                        index_enqueued(pipeline, job.id, QUEUE_MAP[priority].name, job.enqueued_at)
+                get_retry_policy().budget.deposit(pipeline, sum(len(group) for group in grouped.values()))
+                pipeline.execute()
+            logger.info(f"批量入队成功，共 {len(jobs)} 个任务。")
+            return jobs
+        except Exception as e:
+            logger.error(f"批量入队失败，任务类型: {task_callable.__name__}, 数量: {len(items)}: {e}", exc_info=True)
+            release_keys(self.redis_conn, claimed_keys)
+            raise TaskDispatchError(f"批量入队失败: {str(e)}")
+
+    def complete_many(self, task_callable: Callable[..., Any], items: List[Tuple[Dict[str, Any], str, Optional[str], str]],
+                      idempotency_keys: Optional[List[Optional[str]]] = None) -> List[Job]:
+        """
+        把已有结果的任务（例如推理结果缓存命中，见 dispatcher/core/response_cache.py）直接写成已完成，不进入 RQ 队列。
+        写入的内容与 worker 完成任务时一致：任务哈希、结果流、finished 注册表、任务索引和完成通知，
+        状态查询、批量查询、/wait、注册表导出和归档都与正常执行的任务没有区别；任务的 meta 中标记 cache=hit。
+
+        Args:
+            task_callable (Callable): 从 TaskFactory 获取到的任务执行方法。
+            items (List[Tuple]): (payload, priority, job_id, result) 列表，job_id 为 None 时自动生成。
+            idempotency_keys (List, optional): 与 items 顺序一致的客户端幂等键，见 dispatch_many。
+
+        Returns:
+            List[Optional[Job]]: 与 items 顺序一致的 RQ Job 对象列表；幂等键冲突的条目对应位置为 None，见 dispatch_many。
+
+        Raises:
+            TaskDispatchError: 如果写入失败。
+        """
+        now = utcnow()
+        items = [(payload, priority, str(uuid.uuid4()) if job_id is None else job_id, result)
+                 for payload, priority, job_id, result in items]
+        duplicates, conflicts, claimed_keys = self._claim_items([item[:3] for item in items], idempotency_keys)
+        try:
+            jobs: List[Optional[Job]] = []
+            with self.redis_conn.pipeline() as pipeline:
+                for index, (payload, priority, job_id, result) in enumerate(items):
+                    if index in duplicates:
+                        jobs.append(self._existing_job(duplicates[index]))
+                        continue
+                    if index in conflicts:
+                        jobs.append(None)
+                        continue
+                    queue = QUEUE_MAP[self._resolve_priority(priority)]
+                    job = Job.create(
+                        task_callable,
+                        kwargs=self._build_task_kwargs(task_callable, job_id, payload),
+                        id=job_id,
+                        connection=self.redis_conn,
+                        serializer=job_serializer,
+                        description=task_callable.__qualname__,
+                        result_ttl=settings.TASK_RESULT_TTL,
+                        failure_ttl=settings.TASK_FAILURE_TTL,
+                        timeout=settings.TASK_JOB_TIMEOUT,
+                        origin=queue.name,
+                        status=JobStatus.FINISHED,
+                        meta={"cache": "hit"},
+                    )
+                    job.enqueued_at = job.started_at = job.ended_at = now
+                    # 与 InferenceTask._build_result 的返回结构一致，大结果同样按队列阈值压缩或卸载
+                    return_value = {"status": "success", "result": encode_payload(result, queue.name)}
+                    job.save(pipeline=pipeline)
+                    Result.create(job, Result.Type.SUCCESSFUL, ttl=settings.TASK_RESULT_TTL,
+                                  return_value=return_value, pipeline=pipeline)
+                    queue.finished_job_registry.add(job, settings.TASK_RESULT_TTL, pipeline=pipeline)
+                    job.cleanup(settings.TASK_RESULT_TTL, pipeline=pipeline, remove_from_queue=False)
+                    index_enqueued(pipeline, job_id, queue.name, now)
+                    queue_notification(pipeline, job_id, build_completion("finished", return_value))
+                    jobs.append(job)
+                pipeline.execute()
+            logger.info(f"{len(jobs) - len(duplicates) - len(conflicts)} 个任务已直接完成（未入队），类型: {task_callable.__name__}")
+            return jobs
+        except Exception as e:
+            logger.error(f"写入已完成任务失败，任务类型: {task_callable.__name__}, 数量: {len(items)}: {e}", exc_info=True)
+            release_keys(self.redis_conn, claimed_keys)
+            raise TaskDispatchError(f"写入已完成任务失败: {str(e)}")
+
     def get_task_status(self, job_id: str) -> Dict[str, Union[str, Any]]:
         """
         获取指定 Job ID 的任务状态和结果。
+        依次读取：进程内的终态缓存 -> 任务索引和 RQ 最新结果（一个 pipeline）-> 完整任务（索引缺失或过期时）。
+        索引中只有状态和时间戳，终态只有在 RQ 已保存结果后才采用并缓存，
+        避免成功回调写入 finished 之后、worker 保存结果之前的查询把不完整的状态缓存下来。
         """
+        cached = self._terminal_status_cache.get(job_id)
+        if cached is not None:
+            return cached
         try:
-            job = None
-            # 遍历所有队列查找任务
-            with Connection(self.redis_conn):
-                for queue_name in QUEUE_MAP.keys():
-                    try:
-                        # 尝试从每个队列的默认注册表、已开始、已完成、已失败注册表中查找任务
-                        job = Job.fetch(job_id, connection=self.redis_conn)
-                        if job:
-                            break
-                    except Exception:
-                        continue # 如果在一个队列中没找到，尝试下一个队列
-            
-            if not job:
-                logger.warning(f"任务 {job_id} 未找到。")
-                return {"job_id": job_id, "status": "not_found", "error": "Task not found."}
-
-            status = job.get_status()
+            with self.redis_conn.pipeline(transaction=False) as pipeline:
+                pipeline.hgetall(job_index_key(job_id))
+                pipeline.xrevrange(Result.get_key(job_id), '+', '-', count=1)
+                raw_index, latest_result = pipeline.execute()
+            status_info = parse_index(job_id, raw_index)
+            if status_info is not None and status_info["status"] in IMMUTABLE_STATUSES:
+                stored = self._restore_result(job_id, latest_result)
+                if stored is None:
+                    status_info = None
+                elif status_info["status"] == 'finished':
+                    status_info["result"] = _extract_result(stored.return_value)
+                else:
+                    status_info["error"] = status_info["error"] or stored.exc_string or "Task failed with no specific error info."
+            if status_info is None:
+                status_info = self._get_task_status_from_job(job_id)
+            if status_info["status"] in IMMUTABLE_STATUSES:
+                self._terminal_status_cache.put(job_id, status_info)
+            logger.info(f"查询任务状态成功，Job ID: {job_id}, 状态: {status_info['status']}")
+            return status_info
+        except Exception as e:
+            logger.error(f"获取任务状态失败，Job ID: {job_id}: {e}", exc_info=True)
+            raise TaskDispatchError(f"获取任务状态失败: {str(e)}")
+
+    def _restore_result(self, job_id: str, latest_result: List[Tuple[bytes, Dict[bytes, bytes]]]) -> Optional[Result]:
+        """把 XREVRANGE rq:results:<job_id> 读到的最新一条还原为 RQ 的 Result，结果流不存在时返回 None。"""
+        if not latest_result:
+            return None
+        result_id, payload = latest_result[0]
+        return Result.restore(job_id, result_id.decode(), payload, connection=self.redis_conn, serializer=job_serializer)
+
+    def _get_task_status_from_job(self, job_id: str) -> Dict[str, Union[str, Any]]:
+        """
+        读取完整任务获取状态（任务索引不存在时的回退路径）。
+        """
+        try:
+            job = Job.fetch(job_id, connection=self.redis_conn, serializer=job_serializer)
+        except NoSuchJobError:
+            return self._get_task_status_from_archive(job_id)
+
+        status = job.get_status()
+        result = None
+        error = None
+
+        if status == 'finished':
+            # RQ 任务的 result 是任务函数返回的原始结果
+            result = _extract_result(job.result)
+        elif status == 'failed':
+            error = str(job.exc_info) if job.exc_info else "Task failed with no specific error info."
+
+        return {
+            "job_id": job_id,
+            "status": status,
+            "result": result,
+            "error": error,
+            "enqueued_at": job.enqueued_at.isoformat() if job.enqueued_at else None,
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "finished_at": job.ended_at.isoformat() if job.ended_at else None,
+        }
+
+    def _get_task_status_from_archive(self, job_id: str) -> Dict[str, Union[str, Any]]:
+        """
+        任务已从 Redis 过期时查询结果归档（见 dispatcher/core/result_archive.py）。
+        """
+        record = get_result_archive().lookup(job_id) if settings.ARCHIVE_ENABLED else None
+        if record is None:
+            logger.warning(f"任务 {job_id} 未找到。")
+            return {"job_id": job_id, "status": "not_found", "error": "Task not found."}
+        logger.info(f"任务 {job_id} 已从 Redis 过期，从归档中读取。")
+        return to_status_info(record)
+
+    def get_task_statuses(self, job_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        批量获取任务状态：所有任务的状态字段和最新结果在一个 pipeline 中读取，一次网络往返。
+        只读取需要的字段（状态、时间戳、最新结果），不反序列化整个任务。
+
+        Returns:
+            Dict[str, Dict[str, Any]]: 以 job_id 为键，值与 get_task_status 的返回结构相同。
+        """
+        statuses = {}
+        unique_ids = []
+        for job_id in dict.fromkeys(job_ids):
+            cached = self._terminal_status_cache.get(job_id)
+            if cached is not None:
+                statuses[job_id] = cached
+            else:
+                unique_ids.append(job_id)
+        try:
+            with self.redis_conn.pipeline(transaction=False) as pipeline:
+                for job_id in unique_ids:
+                    pipeline.hmget(Job.key_for(job_id), _STATUS_FIELDS)
+                    # RQ 在 Redis >= 5 时把结果写入 rq:results:<job_id> 流，最新一条即当前结果
+                    pipeline.xrevrange(Result.get_key(job_id), '+', '-', count=1)
+                responses = pipeline.execute()
+        except Exception as e:
+            logger.error(f"批量获取任务状态失败，数量: {len(unique_ids)}: {e}", exc_info=True)
+            raise TaskDispatchError(f"批量获取任务状态失败: {str(e)}")
+
+        for index, job_id in enumerate(unique_ids):
+            fields, latest_result = responses[2 * index], responses[2 * index + 1]
+            raw_status, enqueued_at, started_at, ended_at = fields
+            if raw_status is None:
+                statuses[job_id] = self._get_task_status_from_archive(job_id)
+                if statuses[job_id]["status"] in IMMUTABLE_STATUSES:
+                    self._terminal_status_cache.put(job_id, statuses[job_id])
+                continue
+
+            status = raw_status.decode()
             result = None
             error = None
-
-            if status == 'finished':
-                # RQ 任务的 result 是任务函数返回的原始结果
-                # InferenceTask.execute 返回的是 {"status": "success", "result": "..."}
-                if job.result and isinstance(job.result, dict):
-                    result = job.result.get("result", "无结果")
-                    # 这里不再从 result 中获取 error，因为 finished 状态通常没有 error
+            if status in ('finished', 'failed'):
+                stored = self._restore_result(job_id, latest_result)
+                if stored is not None:
+                    if status == 'finished':
+                        result = _extract_result(stored.return_value)
+                    else:
+                        error = stored.exc_string or "Task failed with no specific error info."
                 else:
-                    result = job.result
-            elif status == 'failed':
-                error = str(job.exc_info) if job.exc_info else "Task failed with no specific error info."
-            
-            logger.info(f"查询任务状态成功，Job ID: {job_id}, 状态: {status}")
-            return {
+                    # 结果流不存在（Redis < 5 或结果已过期）时回退到单个任务查询
+                    status_info = self.get_task_status(job_id)
+                    result, error = status_info.get("result"), status_info.get("error")
+
+            statuses[job_id] = {
                 "job_id": job_id,
                 "status": status,
                 "result": result,
                 "error": error,
-                "enqueued_at": job.enqueued_at.isoformat() if job.enqueued_at else None,
-                "started_at": job.started_at.isoformat() if job.started_at else None,
-                "finished_at": job.ended_at.isoformat() if job.ended_at else None,
+                "enqueued_at": _isoformat(enqueued_at),
+                "started_at": _isoformat(started_at),
+                "finished_at": _isoformat(ended_at),
             }
-        except Exception as e:
-            logger.error(f"获取任务状态失败，Job ID: {job_id}: {e}", exc_info=True)
-            raise TaskDispatchError(f"获取任务状态失败: {str(e)}")
+            if status in IMMUTABLE_STATUSES:
+                self._terminal_status_cache.put(job_id, statuses[job_id])
+        logger.info(f"批量查询任务状态成功，数量: {len(statuses)}，其中 {len(statuses) - len(unique_ids)} 个来自缓存")
+        # 按请求顺序返回
+        return {job_id: statuses[job_id] for job_id in dict.fromkeys(job_ids)}
 
     def get_queue_metrics(self) -> Dict[str, Dict[str, int]]:
         """
-        获取所有队列的指标概览。
+        获取所有队列的指标概览（来自 get_metrics_snapshot 的缓存快照）。
+        """
+        return self.get_metrics_snapshot()[0]
+
+    def get_metrics_snapshot(self) -> Tuple[Dict[str, Dict[str, int]], Dict[str, Dict[str, Any]]]:
+        """
+        获取 (队列指标, 熔断器状态)，供 /metrics 使用。
+        快照在进程内缓存 QUEUE_METRICS_CACHE_TTL 秒；缓存过期时只有一个调用方去 Redis 采集，
+        并发的其他调用方等待并复用同一份快照（single-flight）。熔断器状态需要 SCAN 加每个执行器一次 HGETALL，同样只在刷新时读取。
+        """
+        snapshot = self._metrics_snapshot
+        if snapshot is not None and time.monotonic() - snapshot[0] < settings.QUEUE_METRICS_CACHE_TTL:
+            return snapshot[1], snapshot[2]
+        with self._metrics_lock:
+            # 等锁期间其他调用方可能已经刷新了快照
+            snapshot = self._metrics_snapshot
+            if snapshot is not None and time.monotonic() - snapshot[0] < settings.QUEUE_METRICS_CACHE_TTL:
+                return snapshot[1], snapshot[2]
+            metrics = self._collect_queue_metrics()
+            breakers = breaker_states(self.redis_conn)
+            self._metrics_snapshot = (time.monotonic(), metrics, breakers)
+            return metrics, breakers
+
+    def _collect_queue_metrics(self) -> Dict[str, Dict[str, int]]:
+        """
+        在一个 pipeline 中采集所有队列和注册表的任务数（3 个队列 x 6 项，一次网络往返）。
+        started / finished / failed 注册表的分值是过期时间，用 ZCOUNT 只统计未过期的任务，
+        与 registry.count 先 cleanup 再计数的结果一致，但不在读路径上修改注册表（清理由 worker 维护任务负责）。
         """
+        now = time.time()
+        with self.redis_conn.pipeline(transaction=False) as pipeline:
+            for queue in QUEUE_MAP.values():
+                pipeline.llen(queue.key)
+                pipeline.zcount(queue.started_job_registry.key, now, '+inf')
+                pipeline.zcount(queue.finished_job_registry.key, now, '+inf')
+                pipeline.zcount(queue.failed_job_registry.key, now, '+inf')
+                pipeline.zcard(queue.scheduled_job_registry.key)
+                pipeline.zcard(queue.deferred_job_registry.key)
+            counts = pipeline.execute()
+
         metrics = {}
-        with Connection(self.redis_conn):
-            for q_name, queue in QUEUE_MAP.items():
-                metrics[q_name] = {
-                    "queued_jobs": queue.count,
-                    "started_jobs": queue.started_job_registry.count,
-                    "finished_jobs": queue.finished_job_registry.count,
-                    "failed_jobs": queue.failed_job_registry.count,
-                    "scheduled_jobs": queue.scheduled_job_registry.count,
-                    "deferred_jobs": queue.deferred_job_registry.count,
-                    "total_jobs_in_queue": queue.count + \
-                                           queue.started_job_registry.count + \
-                                           queue.finished_job_registry.count + \
-                                           queue.failed_job_registry.count + \
-                                           queue.scheduled_job_registry.count + \
-                                           queue.deferred_job_registry.count
-                }
+        for index, q_name in enumerate(QUEUE_MAP.keys()):
+            queued, started, finished, failed, scheduled, deferred = counts[6 * index: 6 * index + 6]
+            metrics[q_name] = {
+                "queued_jobs": queued,
+                "started_jobs": started,
+                "finished_jobs": finished,
+                "failed_jobs": failed,
+                "scheduled_jobs": scheduled,
+                "deferred_jobs": deferred,
+                "total_jobs_in_queue": queued + started + finished + failed + scheduled + deferred
+            }
         logger.info("获取队列指标成功。")
         return metrics
 
-    def get_jobs_in_registry(self, registry_type: str, page: int = 1, per_page: int = 20) -> Dict[str, Any]:
+    def get_jobs_in_registry(self, registry_type: str, cursor: Optional[str] = None, per_page: int = 20,
+                             include_results: bool = True) -> Dict[str, Any]:
         """
         获取特定注册表（queued, started, finished, failed, scheduled, deferred）中的任务列表。
+        分页在 Redis 中完成（见 dispatcher/core/registry_pager.py），不会把整个注册表读入内存：
+        queued 按出队顺序排列，其他注册表按结束/计划时间倒序排列。
+
+        Args:
+            registry_type (str): 注册表类型。
+            cursor (str, optional): 上一页返回的 next_cursor，为空时从第一页开始。
+            per_page (int): 每页任务数。
+            include_results (bool): 是否读取结果和错误信息，为 False 时只返回任务元数据。
+
+        Raises:
+            ValueError: 注册表类型或游标无效。
         """
-        jobs_list = []
-        total_jobs = 0
-        offset = (page - 1) * per_page
+        queues = list(QUEUE_MAP.values())
+        if registry_type == 'queued':
+            job_ids, next_cursor, total_jobs = page_queue_lists(self.redis_conn, queues, cursor, per_page)
+        elif registry_type in REGISTRY_ATTRS:
+            keys = [getattr(queue, REGISTRY_ATTRS[registry_type]).key for queue in queues]
+            entries, next_cursor, total_jobs = page_sorted_registries(self.redis_conn, keys, cursor, per_page)
+            job_ids = [job_id for job_id, _ in entries]
+        else:
+            raise ValueError(f"无效的注册表类型: {registry_type}")
 
-        with Connection(self.redis_conn):
-            all_job_ids = []
-            for q_name, queue in QUEUE_MAP.items():
-                if registry_type == 'queued':
-                    all_job_ids.extend(queue.job_ids)
-                elif registry_type == 'started':
-                    all_job_ids.extend(queue.started_job_registry.get_job_ids())
-                elif registry_type == 'finished':
-                    all_job_ids.extend(queue.finished_job_registry.get_job_ids())
-                elif registry_type == 'failed':
-                    all_job_ids.extend(queue.failed_job_registry.get_job_ids())
-                elif registry_type == 'scheduled':
-                    all_job_ids.extend(queue.scheduled_job_registry.get_job_ids())
-                elif registry_type == 'deferred':
-                    all_job_ids.extend(queue.deferred_job_registry.get_job_ids())
-                else:
-                    raise ValueError(f"无效的注册表类型: {registry_type}")
-
-            unique_job_ids = sorted(list(set(all_job_ids)), reverse=True)
-            total_jobs = len(unique_job_ids)
-            paginated_job_ids = unique_job_ids[offset : offset + per_page]
-
-            for job_id in paginated_job_ids:
-                try:
-                    job = Job.fetch(job_id, connection=self.redis_conn)
-                    jobs_list.append({
-                        "job_id": job.id,
-                        "status": job.get_status(),
-                        "created_at": job.created_at.isoformat() if job.created_at else None,
-                        "enqueued_at": job.enqueued_at.isoformat() if job.enqueued_at else None,
-                        "description": job.description,
-                        "result": job.result if job.is_finished else None,
-                        "error": str(job.exc_info) if job.is_failed and job.exc_info else None
-                    })
-                except Exception as e:
-                    logger.warning(f"获取任务 {job_id} 详情失败: {e}")
-                    jobs_list.append({
-                        "job_id": job_id,
-                        "status": "unknown",
-                        "error": str(e)
-                    })
-
-        logger.info(f"获取 {registry_type} 注册表中的任务列表成功，共 {total_jobs} 个。")
+        jobs_list = describe_jobs(self.redis_conn, job_ids, include_results=include_results)
+        logger.info(f"获取 {registry_type} 注册表中的任务列表成功，本页 {len(jobs_list)} 个，共 {total_jobs} 个。")
         return {
             "registry_type": registry_type,
             "total_jobs": total_jobs,
-            "current_page": page,
             "per_page": per_page,
+            "next_cursor": next_cursor,
             "jobs": jobs_list
         }
 
+    def export_registry(self, registry_type: str, queue_name: Optional[str] = None,
+                        since: Optional[datetime] = None, until: Optional[datetime] = None,
+                        error_contains: Optional[str] = None, include_results: bool = True) -> Iterator[Dict[str, Any]]:
+        """
+        导出整个注册表，返回逐个产出任务详情的迭代器（见 registry_pager.iter_registry_jobs）。
+        参数在调用时立即校验，迭代过程中按 EXPORT_CHUNK_SIZE 分块从 Redis 读取。
+
+        Args:
+            registry_type (str): 注册表类型。
+            queue_name (str, optional): 只导出该队列（high / default / low），为空时导出所有队列。
+            since / until (datetime, optional): 时间范围（UTC），finished / failed 按结束时间，其他按入队时间。
+            error_contains (str, optional): 只导出错误信息包含该子串的任务。
+            include_results (bool): 是否包含结果和错误信息。
+
+        Raises:
+            ValueError: 注册表类型或队列名称无效。
+        """
+        if registry_type not in REGISTRY_TYPES:
+            raise ValueError(f"无效的注册表类型: {registry_type}")
+        if queue_name is None:
+            queues = list(QUEUE_MAP.values())
+        elif queue_name in QUEUE_MAP:
+            queues = [QUEUE_MAP[queue_name]]
+        else:
+            raise ValueError(f"无效的队列名称: {queue_name}")
+        logger.info(f"开始导出 {registry_type} 注册表，队列: {queue_name or '全部'}，时间范围: {since} ~ {until}。")
+        return iter_registry_jobs(
+            self.redis_conn, registry_type, queues, since=since, until=until,
+            error_contains=error_contains, include_results=include_results
+        )
+
     def get_workers_status(self) -> Dict[str, Any]:
         """
         获取所有 RQ Worker 的状态。
@@ -286,7 +644,6 @@ if __name__ == '__main__':
         ).id # dispatch 返回 Job 对象，需要获取 id
         print(f"任务已派发，Job ID: {job_id}")
 
-        import time
         time.sleep(5)
         status_info = dispatcher.get_task_status(job_id)
         print(f"任务 {job_id} 的状态: {status_info['status']}, 结果: {status_info['result']}, 错误: {status_info['error']}")
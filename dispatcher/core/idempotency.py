@@ -0,0 +1,84 @@
+# ~/projects/deepseek_dispatcher-new/dispatcher/core/idempotency.py
+
+import hashlib
+import json
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from redis import Redis
+
+from common.logging_utils import get_logger
+from config.settings import settings
+
+logger = get_logger("idempotency")
+
+# 客户端幂等键，完整键为 idem:<Idempotency-Key>，值为 {"job_id": 首次请求的任务 ID, "fp": 请求内容指纹}
+IDEMPOTENCY_KEY_PREFIX = "idem"
+
+
+class IdempotencyKeyConflict(ValueError):
+    """同一个幂等键被用于内容不同的请求。"""
+    pass
+
+
+def idempotency_key(key: str) -> str:
+    return f"{IDEMPOTENCY_KEY_PREFIX}:{key}"
+
+
+def payload_fingerprint(payload: Dict[str, Any], priority: str) -> str:
+    """请求内容的指纹：同一个幂等键重复提交时内容必须一致。"""
+    canonical = json.dumps({"payload": payload, "priority": priority}, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def claim_keys(redis_conn: Redis, claims: List[Tuple[str, str, str]]) -> Tuple[List[Optional[str]], Set[int]]:
+    """
+    占用一批幂等键（SET NX，有效期 IDEMPOTENCY_KEY_TTL），claims 为 (幂等键, 新任务 ID, 请求指纹) 列表。
+    每个条目单独处理，一个条目冲突不影响其他条目，也不会留下没有对应任务的占用。
+    同一批中重复的幂等键，后面的条目指向第一个条目的任务（内容不同时视为冲突）。
+
+    Returns:
+        Tuple[List[Optional[str]], Set[int]]: (与 claims 顺序一致的列表：占用成功为 None，幂等键已存在时为首次请求的任务 ID；
+        幂等键已用于内容不同的请求的条目位置，这些条目没有占用任何键)。
+    """
+    originals: List[Optional[str]] = [None] * len(claims)
+    conflicts: Set[int] = set()
+    pending = list(range(len(claims)))
+    # 键在 SET NX 失败和读取之间过期时重新占用，最多重试一次
+    for _ in range(2):
+        with redis_conn.pipeline(transaction=False) as pipeline:
+            for index in pending:
+                key, job_id, fingerprint = claims[index]
+                pipeline.set(idempotency_key(key), json.dumps({"job_id": job_id, "fp": fingerprint}),
+                             nx=True, ex=settings.IDEMPOTENCY_KEY_TTL)
+            acquired = pipeline.execute()
+        taken = [index for index, ok in zip(pending, acquired) if not ok]
+        if not taken:
+            break
+        raw_values = redis_conn.mget([idempotency_key(claims[index][0]) for index in taken])
+        pending = []
+        for index, raw in zip(taken, raw_values):
+            if raw is None:
+                pending.append(index)
+                continue
+            existing = json.loads(raw)
+            if existing["fp"] != claims[index][2]:
+                conflicts.add(index)
+            else:
+                originals[index] = existing["job_id"]
+        if not pending:
+            break
+    else:
+        logger.warning(f"{len(pending)} 个幂等键反复过期，按新请求处理。")
+    if conflicts:
+        logger.warning(f"{len(conflicts)} 个幂等键已用于内容不同的请求: {[claims[index][0] for index in sorted(conflicts)]}")
+    return originals, conflicts
+
+
+def release_keys(redis_conn: Redis, keys: List[str]) -> None:
+    """入队失败时释放本次占用的幂等键，客户端重试时可以重新入队。释放失败只记录警告，键会在 TTL 后过期。"""
+    if not keys:
+        return
+    try:
+        redis_conn.delete(*[idempotency_key(key) for key in keys])
+    except Exception as e:
+        logger.warning(f"释放幂等键失败: {e}")
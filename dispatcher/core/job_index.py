@@ -0,0 +1,99 @@
+# ~/projects/deepseek_dispatcher-new/dispatcher/core/job_index.py
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from redis import Redis
+import redis.asyncio as aioredis
+from rq.utils import utcnow
+
+from common.logging_utils import get_logger
+from config.settings import settings
+
+logger = get_logger("job_index")
+
+# 每个任务一个轻量索引哈希，完整键为 jobidx:<job_id>
+# 字段：queue, status, enqueued_at, started_at, finished_at, error
+# 结果不写入索引，只保存在 RQ 的结果流中（rq:results:<job_id>），避免每个结果在 Redis 中保存两份
+JOB_INDEX_KEY_PREFIX = "jobidx"
+
+# 进入这些状态后索引不再变化，web 进程可以放心地缓存
+IMMUTABLE_STATUSES = ("finished", "failed")
+
+
+def job_index_key(job_id: str) -> str:
+    return f"{JOB_INDEX_KEY_PREFIX}:{job_id}"
+
+
+def index_enqueued(pipeline, job_id: str, queue_name: str, enqueued_at: Optional[datetime] = None) -> None:
+    """在入队的同一个 pipeline 中写入索引（TaskDispatcher.dispatch / dispatch_many）。"""
+    key = job_index_key(job_id)
+    enqueued_at = enqueued_at or utcnow()
+    pipeline.hset(key, mapping={"queue": queue_name, "status": "queued", "enqueued_at": enqueued_at.isoformat()})
+    pipeline.expire(key, settings.TASK_FAILURE_TTL)
+
+
+def _started_mapping() -> Dict[str, str]:
+    return {"status": "started", "started_at": utcnow().isoformat()}
+
+
+def mark_started(redis_conn: Redis, job_id: str) -> None:
+    """任务开始执行时由 task_wrapper 调用。索引写入失败不影响任务执行。"""
+    try:
+        redis_conn.hset(job_index_key(job_id), mapping=_started_mapping())
+    except Exception as e:
+        logger.warning(f"更新任务 {job_id} 的索引失败: {e}")
+
+
+async def mark_started_async(redis_conn: aioredis.Redis, job_id: str) -> None:
+    """mark_started 的异步版本，供异步 worker 使用。"""
+    try:
+        await redis_conn.hset(job_index_key(job_id), mapping=_started_mapping())
+    except Exception as e:
+        logger.warning(f"更新任务 {job_id} 的索引失败: {e}")
+
+
+def index_completion(pipeline, job_id: str, completion: Dict[str, Any]) -> None:
+    """
+    在写入完成通知的同一个 pipeline 中更新索引（见 dispatcher/core/completion.py）。
+    completion 的 status 为 finished / failed，或失败后等待重试的 scheduled；completion 中的结果不写入索引。
+    """
+    key = job_index_key(job_id)
+    status = completion["status"]
+    mapping = {"status": status}
+    if status in IMMUTABLE_STATUSES:
+        mapping["finished_at"] = utcnow().isoformat()
+    if completion.get("error"):
+        mapping["error"] = completion["error"]
+    pipeline.hset(key, mapping=mapping)
+    if status == "finished":
+        pipeline.expire(key, settings.TASK_RESULT_TTL)
+
+
+def _decode(value: Any) -> Optional[str]:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def parse_index(job_id: str, raw: Dict[Any, Any]) -> Optional[Dict[str, Any]]:
+    """
+    把 HGETALL 的结果转换为与 TaskDispatcher.get_task_status 相同的结构，result 为 None，由调用方从 RQ 的结果流中读取。
+    索引不存在，或任务停留在 started 的时间超过任务超时（worker 异常退出、未能更新索引）时返回 None，
+    调用方应回退到读取完整任务。
+    """
+    if not raw:
+        return None
+    fields = {_decode(k): _decode(v) for k, v in raw.items()}
+    status = fields.get("status")
+    if status == "started" and fields.get("started_at"):
+        deadline = datetime.fromisoformat(fields["started_at"]) + timedelta(seconds=settings.TASK_JOB_TIMEOUT + 60)
+        if utcnow() > deadline:
+            return None
+    return {
+        "job_id": job_id,
+        "status": status,
+        "result": None,
+        "error": fields.get("error"),
+        "enqueued_at": fields.get("enqueued_at"),
+        "started_at": fields.get("started_at"),
+        "finished_at": fields.get("finished_at"),
+    }
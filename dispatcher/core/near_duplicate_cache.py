@@ -0,0 +1,225 @@
+# ~/projects/deepseek_dispatcher-new/dispatcher/core/near_duplicate_cache.py
+
+import base64
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from redis import Redis
+
+from common.compression import compress_text, compression_threshold, decompress_text
+from common.logging_utils import get_logger
+from common.minhash import LSHIndex, MinHasher, normalize_text
+from common.stats_reporter import StatsReporter
+from config.settings import settings
+from dispatcher.core.response_cache import canonical_request, is_cacheable
+
+logger = get_logger("near_duplicate_cache")
+
+# 条目键 nearcache:entry:<条目 id>，值为 {"ns": 命名空间, "sig": base64 签名, "result": 文本或压缩后的字典}
+NEAR_CACHE_ENTRY_PREFIX = "nearcache:entry"
+# 条目 id -> 写入时间的有序集合，worker 启动时加载最近的条目，之后按写入时间增量同步其他 worker 写入的条目
+NEAR_CACHE_INDEX_KEY = "nearcache:index"
+
+
+def cache_namespace(task_data: Dict[str, Any]) -> str:
+    """模型和采样参数相同的请求才可能互相命中：命名空间是规范化请求去掉消息后的哈希。"""
+    params = {key: value for key, value in canonical_request(task_data).items() if key != "messages"}
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+class NearDuplicateStats:
+    """进程内的统计（stats:near_cache:<host>:<pid>），由 /metrics/response-cache 汇总。"""
+
+    def __init__(self, index: LSHIndex):
+        self._lock = threading.Lock()
+        self._index = index
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.lookup_us_total = 0.0
+        self.lookup_us_max = 0.0
+        self._reporter = StatsReporter("near_cache", interval=settings.NEAR_CACHE_STATS_INTERVAL)
+
+    def record_lookup(self, hit: bool, elapsed_us: float) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self.lookup_us_total += elapsed_us
+            self.lookup_us_max = max(self.lookup_us_max, elapsed_us)
+        self._reporter.maybe_publish(self.snapshot)
+
+    def record_store(self) -> None:
+        with self._lock:
+            self.stores += 1
+        self._reporter.maybe_publish(self.snapshot)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "lookup_us_avg": round(self.lookup_us_total / lookups, 1) if lookups else None,
+                "lookup_us_max": round(self.lookup_us_max, 1),
+                "entries": len(self._index),
+                "bytes": self._index.bytes,
+                "evictions": self._index.evictions,
+            }
+
+
+class NearDuplicateCache:
+    """
+    近似重复 prompt 的结果缓存，在 worker 中位于 AIService 调用之前（见 InferenceTask.run）。
+
+    prompt 归一化后切成字符 shingle，计算 MinHash 签名，在进程内的 LSH 索引中查找同一命名空间里
+    估计 Jaccard 相似度不低于阈值的条目；查找完全在本地内存中完成，不访问 Redis，也不需要向量模型。
+    推理成功后条目写入本地索引和 Redis（带 TTL），顺带拉取其他 worker 新写入的条目，
+    进程启动后第一次使用时从 Redis 加载最近的条目。索引按条目数和字节数上限做 LRU 淘汰。
+    """
+
+    def __init__(self, threshold: float, num_perm: int, bands: int, shingle_size: int,
+                 max_entries: int, max_bytes: int, ttl: int):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._hasher = MinHasher(num_perm, shingle_size)
+        self._index = LSHIndex(num_perm, bands, max_entries, max_bytes=max_bytes)
+        self.stats = NearDuplicateStats(self._index)
+        self._sync_lock = threading.Lock()
+        self._loaded = False
+        # 已同步到的写入时间（NEAR_CACHE_INDEX_KEY 的分值）
+        self._synced_until = 0.0
+
+    def _eligible(self, task_data: Dict[str, Any]) -> bool:
+        if not settings.NEAR_CACHE_ENABLED or not is_cacheable(task_data):
+            return False
+        if len(task_data["prompt"]) > settings.NEAR_CACHE_MAX_PROMPT_CHARS:
+            return False
+        # 归一化后不足一个 shingle 的 prompt（例如 "???"、单个 emoji）只有一个截短的片段，
+        # 估计的相似度没有意义，只走精确缓存
+        return len(normalize_text(task_data["prompt"])) >= self._hasher.shingle_size
+
+    @staticmethod
+    def _entry_id(namespace: str, prompt: str) -> str:
+        return hashlib.sha1(f"{namespace}:{normalize_text(prompt)}".encode("utf-8")).hexdigest()
+
+    def _insert(self, entry_id: str, namespace: str, signature: np.ndarray, result: str) -> None:
+        self._index.insert(entry_id, namespace, signature, result, size=len(result.encode("utf-8")) + signature.nbytes)
+
+    def lookup(self, task_data: Dict[str, Any]) -> Optional[str]:
+        """
+        查找近似重复的 prompt 的结果，未命中或请求不参与缓存时返回 None。
+        task_data 带 cache_refresh 时不查找（结果仍会写入）。只访问进程内存。
+        """
+        if task_data.get("cache_refresh") or not self._eligible(task_data):
+            return None
+        started = time.perf_counter()
+        signature = self._hasher.signature(task_data["prompt"])
+        found = self._index.query(cache_namespace(task_data), signature, self.threshold)
+        self.stats.record_lookup(found is not None, (time.perf_counter() - started) * 1e6)
+        if found is None:
+            return None
+        result, similarity = found
+        logger.info(f"近似重复缓存命中，估计相似度 {similarity:.3f}")
+        return result
+
+    def put(self, redis_conn: Redis, task_data: Dict[str, Any], result: Any) -> None:
+        """推理成功后由 worker 调用：写入本地索引和 Redis，并同步其他 worker 新写入的条目。写入失败不影响任务。"""
+        if not self._eligible(task_data) or not isinstance(result, str):
+            return
+        try:
+            namespace = cache_namespace(task_data)
+            signature = self._hasher.signature(task_data["prompt"])
+            entry_id = self._entry_id(namespace, task_data["prompt"])
+            self._insert(entry_id, namespace, signature, result)
+            self.stats.record_store()
+            value = {
+                "ns": namespace,
+                "sig": base64.b64encode(signature.tobytes()).decode("ascii"),
+                "result": compress_text(result, compression_threshold(None)),
+            }
+            now = time.time()
+            with redis_conn.pipeline(transaction=False) as pipeline:
+                pipeline.set(f"{NEAR_CACHE_ENTRY_PREFIX}:{entry_id}", json.dumps(value, ensure_ascii=False), ex=self.ttl)
+                pipeline.zadd(NEAR_CACHE_INDEX_KEY, {entry_id: now})
+                pipeline.zremrangebyscore(NEAR_CACHE_INDEX_KEY, "-inf", now - self.ttl)
+                pipeline.execute()
+            self.sync(redis_conn)
+        except Exception as e:
+            logger.warning(f"写入近似重复缓存失败: {e}")
+
+    def _load_entries(self, redis_conn: Redis, entry_ids: List[str]) -> int:
+        entry_ids = [entry_id for entry_id in entry_ids if entry_id not in self._index]
+        if not entry_ids:
+            return 0
+        loaded = 0
+        raw_values = redis_conn.mget([f"{NEAR_CACHE_ENTRY_PREFIX}:{entry_id}" for entry_id in entry_ids])
+        for entry_id, raw in zip(entry_ids, raw_values):
+            if raw is None:
+                continue
+            value = json.loads(raw)
+            signature = np.frombuffer(base64.b64decode(value["sig"]), dtype=np.uint64)
+            if len(signature) != self._hasher.num_perm:
+                # 修改过 NEAR_CACHE_NUM_PERM 之前写入的条目
+                continue
+            self._insert(entry_id, value["ns"], signature, decompress_text(value["result"]))
+            loaded += 1
+        return loaded
+
+    def sync(self, redis_conn: Redis) -> None:
+        """
+        从 Redis 同步条目：第一次调用时加载最近的 max_entries 个条目，之后只拉取上次同步之后写入的条目。
+        """
+        if not settings.NEAR_CACHE_ENABLED:
+            return
+        with self._sync_lock:
+            try:
+                if not self._loaded:
+                    members = redis_conn.zrevrange(NEAR_CACHE_INDEX_KEY, 0, self.max_entries - 1, withscores=True)
+                    # 从旧到新插入，LRU 顺序与写入顺序一致
+                    members.reverse()
+                else:
+                    members = redis_conn.zrangebyscore(NEAR_CACHE_INDEX_KEY, f"({self._synced_until!r}", "+inf", withscores=True)
+                if members:
+                    entry_ids = [member.decode() if isinstance(member, bytes) else member for member, _ in members]
+                    loaded = self._load_entries(redis_conn, entry_ids)
+                    # 两种情况下 members 都按写入时间升序
+                    self._synced_until = max(self._synced_until, members[-1][1])
+                    if loaded:
+                        logger.info(f"从 Redis 同步近似重复缓存条目 {loaded} 个，当前 {len(self._index)} 个。")
+                self._loaded = True
+            except Exception as e:
+                logger.warning(f"同步近似重复缓存失败: {e}")
+
+    def ensure_loaded(self, redis_conn: Redis) -> None:
+        """进程第一次使用缓存前从 Redis 加载最近的条目。"""
+        if not self._loaded and settings.NEAR_CACHE_ENABLED:
+            self.sync(redis_conn)
+
+
+_near_duplicate_cache: Optional[NearDuplicateCache] = None
+_near_duplicate_cache_lock = threading.Lock()
+
+
+def get_near_duplicate_cache() -> NearDuplicateCache:
+    global _near_duplicate_cache
+    if _near_duplicate_cache is None:
+        with _near_duplicate_cache_lock:
+            if _near_duplicate_cache is None:
+                _near_duplicate_cache = NearDuplicateCache(
+                    threshold=settings.NEAR_CACHE_THRESHOLD,
+                    num_perm=settings.NEAR_CACHE_NUM_PERM,
+                    bands=settings.NEAR_CACHE_BANDS,
+                    shingle_size=settings.NEAR_CACHE_SHINGLE_SIZE,
+                    max_entries=settings.NEAR_CACHE_MAX_ENTRIES,
+                    max_bytes=settings.NEAR_CACHE_MAX_BYTES,
+                    ttl=settings.NEAR_CACHE_TTL,
+                )
+    return _near_duplicate_cache
@@ -0,0 +1,284 @@
+# ~/projects/deepseek_dispatcher-new/dispatcher/core/registry_pager.py
+
+import base64
+import calendar
+import json
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from redis import Redis
+from rq import Queue
+from rq.job import Job
+from rq.results import Result
+
+from common.compression import decode_payload
+from common.logging_utils import get_logger
+from config.settings import settings
+from dispatcher.core.serializers import job_serializer
+
+logger = get_logger("registry_pager")
+
+# 注册表类型 -> Queue 上对应的注册表属性（queued 是队列本身的列表，单独处理）
+REGISTRY_ATTRS = {
+    'started': 'started_job_registry',
+    'finished': 'finished_job_registry',
+    'failed': 'failed_job_registry',
+    'scheduled': 'scheduled_job_registry',
+    'deferred': 'deferred_job_registry',
+}
+REGISTRY_TYPES = ('queued',) + tuple(REGISTRY_ATTRS)
+
+
+def encode_cursor(data: Dict[str, Any]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError(f"无效的分页游标: {cursor}")
+
+
+def _decode(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def page_queue_lists(redis_conn: Redis, queues: List[Queue], cursor: Optional[str],
+                     per_page: int) -> Tuple[List[str], Optional[str], int]:
+    """
+    分页读取排队中的任务：按队列顺序（即出队优先级）依次读取各队列的列表。
+    游标记录 (队列序号, 列表偏移)。
+    """
+    position = decode_cursor(cursor) if cursor else {"q": 0, "o": 0}
+    start_queue, offset = int(position["q"]), int(position["o"])
+    with redis_conn.pipeline(transaction=False) as pipeline:
+        for queue in queues:
+            pipeline.llen(queue.key)
+        for index in range(start_queue, len(queues)):
+            start = offset if index == start_queue else 0
+            pipeline.lrange(queues[index].key, start, start + per_page - 1)
+        responses = pipeline.execute()
+    lengths, pages = responses[:len(queues)], responses[len(queues):]
+
+    job_ids: List[str] = []
+    next_position = None
+    for index, ids in zip(range(start_queue, len(queues)), pages):
+        start = offset if index == start_queue else 0
+        room = per_page - len(job_ids)
+        job_ids.extend(_decode(job_id) for job_id in ids[:room])
+        if len(job_ids) == per_page:
+            consumed = start + min(room, len(ids))
+            if consumed < lengths[index]:
+                next_position = {"q": index, "o": consumed}
+            elif index + 1 < len(queues):
+                # 当前页恰好在某个队列末尾结束，下一页从后续队列开始（可能为空页）
+                next_position = {"q": index + 1, "o": 0}
+            break
+    return job_ids, encode_cursor(next_position) if next_position else None, sum(lengths)
+
+
+def page_sorted_registries(redis_conn: Redis, keys: List[str], cursor: Optional[str], per_page: int,
+                           min_score: str = "-inf", max_score: str = "+inf") -> Tuple[List[Tuple[str, float]], Optional[str], int]:
+    """
+    在 Redis 中分页读取多个有序集合注册表，按 (分值, 任务ID) 倒序合并。
+    started / finished / failed 注册表的分值是过期时间（结束时间 + TTL），因此即为按结束时间倒序；
+    scheduled 的分值是计划执行时间。游标记录上一页最后一项的 (分值, 任务ID)，新任务写入不会打乱后续页。
+
+    Returns:
+        Tuple: ([(job_id, score)], 下一页游标（没有更多时为 None）, 所有注册表的任务总数)
+    """
+    last = decode_cursor(cursor) if cursor else None
+    with redis_conn.pipeline(transaction=False) as pipeline:
+        for key in keys:
+            if last is None:
+                pipeline.zrevrangebyscore(key, max_score, min_score, start=0, num=per_page, withscores=True)
+            else:
+                # 严格小于游标分值的部分 + 与游标分值相同、任务ID更小的部分（同分值按成员字典序排列）
+                pipeline.zrevrangebyscore(key, f"({last['s']}", min_score, start=0, num=per_page, withscores=True)
+                pipeline.zrevrangebyscore(key, last['s'], last['s'], withscores=True)
+            pipeline.zcard(key)
+        responses = pipeline.execute()
+
+    candidates: List[Tuple[str, float]] = []
+    total = 0
+    step = 2 if last is None else 3
+    for index in range(len(keys)):
+        chunk = responses[index * step: index * step + step]
+        if last is not None:
+            ties = [(_decode(member), score) for member, score in chunk[1] if _decode(member) < last['m']]
+            candidates.extend(ties)
+        candidates.extend((_decode(member), score) for member, score in chunk[0])
+        total += chunk[-1]
+
+    candidates.sort(key=lambda item: (item[1], item[0]), reverse=True)
+    page = candidates[:per_page]
+    next_cursor = None
+    if len(page) == per_page:
+        job_id, score = page[-1]
+        next_cursor = encode_cursor({"s": repr(score), "m": job_id})
+    return page, next_cursor, total
+
+
+def fetch_latest_results(redis_conn: Redis, job_ids: List[str]) -> Dict[str, Result]:
+    """在一个 pipeline 中读取多个任务的最新结果（Redis >= 5 时 RQ 把结果写入 rq:results:<job_id> 流）。"""
+    if not job_ids:
+        return {}
+    with redis_conn.pipeline(transaction=False) as pipeline:
+        for job_id in job_ids:
+            pipeline.xrevrange(Result.get_key(job_id), '+', '-', count=1)
+        responses = pipeline.execute()
+    results = {}
+    for job_id, response in zip(job_ids, responses):
+        if response:
+            result_id, payload = response[0]
+            results[job_id] = Result.restore(job_id, _decode(result_id), payload, connection=redis_conn,
+                                             serializer=job_serializer)
+    return results
+
+
+# 任务参数中不属于模型参数的字段（prompt 体积大，v 是负载版本号）
+_NON_PARAM_KWARGS = ("v", "prompt")
+
+
+def _job_params(job: Job) -> Dict[str, Any]:
+    """读取任务的模型参数（模型名、max_tokens 等），不包含 prompt；参数无法解码时返回空字典。"""
+    try:
+        kwargs = job.kwargs
+    except Exception as e:
+        logger.warning(f"读取任务 {job.id} 的参数失败: {e}")
+        return {}
+    if "v" in kwargs:
+        return {key: value for key, value in kwargs.items() if key not in _NON_PARAM_KWARGS}
+    # 升级前入队的任务：参数嵌套在 task_details.payload.task_data 中
+    task_data = ((kwargs.get("task_details") or {}).get("payload") or {}).get("task_data") or {}
+    params = dict(task_data.get("model_kwargs") or {})
+    if task_data.get("model_name"):
+        params["model_name"] = task_data["model_name"]
+    return params
+
+
+def describe_jobs(redis_conn: Redis, job_ids: List[str], include_results: bool = True,
+                  include_params: bool = False) -> List[Dict[str, Any]]:
+    """
+    批量读取任务详情：Job.fetch_many 一次往返读取所有任务，
+    include_results 为 True 时再用一次往返读取已结束任务的最新结果；为 False 时完全不读取结果负载。
+    include_params 为 True 时附带任务的模型参数（params），供归档和统计分析使用。
+    """
+    jobs = Job.fetch_many(job_ids, connection=redis_conn, serializer=job_serializer)
+    results: Dict[str, Result] = {}
+    if include_results:
+        ended_ids = [job.id for job in jobs if job is not None and job.get_status(refresh=False) in ('finished', 'failed')]
+        results = fetch_latest_results(redis_conn, ended_ids)
+
+    described = []
+    for job_id, job in zip(job_ids, jobs):
+        if job is None:
+            # 任务哈希已过期但仍留在注册表中（注册表清理前的短暂窗口）
+            described.append({"job_id": job_id, "status": "unknown", "error": "Task not found."})
+            continue
+        status = job.get_status(refresh=False) # 使用 fetch_many 已读到的状态，不再单独访问 Redis
+        entry = {
+            "job_id": job.id,
+            "status": status,
+            "queue": job.origin,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "enqueued_at": job.enqueued_at.isoformat() if job.enqueued_at else None,
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "ended_at": job.ended_at.isoformat() if job.ended_at else None,
+            "description": job.description,
+        }
+        if include_params:
+            entry["params"] = _job_params(job)
+        if include_results:
+            stored = results.get(job.id)
+            return_value = stored.return_value if stored is not None else None
+            if isinstance(return_value, dict):
+                return_value = decode_payload(return_value.get("result", "无结果"))
+            entry["result"] = return_value if status == 'finished' else None
+            entry["error"] = stored.exc_string if status == 'failed' and stored is not None else None
+        described.append(entry)
+    return described
+
+
+def _utc_timestamp(moment: datetime) -> float:
+    return calendar.timegm(moment.utctimetuple()) + moment.microsecond / 1e6
+
+
+def _registry_score_window(registry_type: str, since: Optional[datetime],
+                           until: Optional[datetime]) -> Tuple[str, str]:
+    """
+    把时间范围换算成注册表分值范围，让 Redis 只返回可能命中的任务。
+    finished / failed 的分值是结束时间 + TTL（TaskDispatcher 统一使用配置中的 TTL），scheduled 的分值是计划时间；
+    started 的分值是心跳过期时间，无法换算，不做预过滤。精确的时间过滤在读取任务后进行。
+    """
+    offset = {'finished': settings.TASK_RESULT_TTL, 'failed': settings.TASK_FAILURE_TTL, 'scheduled': 0}.get(registry_type)
+    if offset is None:
+        return "-inf", "+inf"
+    # since / until 是无时区的 UTC 时间，datetime.timestamp() 会把它当作本地时间，这里按 UTC 换算
+    min_score = repr(_utc_timestamp(since) + offset) if since else "-inf"
+    max_score = repr(_utc_timestamp(until) + offset) if until else "+inf"
+    return min_score, max_score
+
+
+def _matches(entry: Dict[str, Any], time_field: str, since: Optional[datetime], until: Optional[datetime],
+             error_contains: Optional[str]) -> bool:
+    if since or until:
+        value = entry.get(time_field)
+        if value is None:
+            return False
+        moment = datetime.fromisoformat(value)
+        if (since and moment < since) or (until and moment > until):
+            return False
+    if error_contains and error_contains not in (entry.get("error") or ""):
+        return False
+    return True
+
+
+def iter_registry_jobs(redis_conn: Redis, registry_type: str, queues: List[Queue],
+                       since: Optional[datetime] = None, until: Optional[datetime] = None,
+                       error_contains: Optional[str] = None, include_results: bool = True,
+                       chunk_size: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """
+    按注册表顺序逐个产出任务详情，用于导出整个注册表。
+    每次只在 Redis 中读取 chunk_size 个任务（游标分页 + Job.fetch_many + 结果流 pipeline），
+    内存占用与注册表大小无关。since / until 为 UTC 时间（无时区），
+    对 finished / failed 按结束时间过滤，对其他注册表按入队时间过滤。
+
+    Raises:
+        ValueError: 注册表类型无效。
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    time_field = "ended_at" if registry_type in ('finished', 'failed') else "enqueued_at"
+    # 按错误内容过滤需要读取失败原因
+    load_results = include_results or bool(error_contains)
+
+    if registry_type == 'queued':
+        keys, min_score, max_score = [], None, None
+    elif registry_type in REGISTRY_ATTRS:
+        keys = [getattr(queue, REGISTRY_ATTRS[registry_type]).key for queue in queues]
+        min_score, max_score = _registry_score_window(registry_type, since, until)
+    else:
+        raise ValueError(f"无效的注册表类型: {registry_type}")
+
+    cursor = None
+    exported = 0
+    while True:
+        if registry_type == 'queued':
+            job_ids, cursor, _ = page_queue_lists(redis_conn, queues, cursor, chunk_size)
+        else:
+            entries, cursor, _ = page_sorted_registries(redis_conn, keys, cursor, chunk_size, min_score, max_score)
+            job_ids = [job_id for job_id, _ in entries]
+
+        for entry in describe_jobs(redis_conn, job_ids, include_results=load_results):
+            if not _matches(entry, time_field, since, until, error_contains):
+                continue
+            if not include_results:
+                entry.pop("result", None)
+                entry.pop("error", None)
+            exported += 1
+            yield entry
+
+        if cursor is None:
+            break
+    logger.info(f"导出 {registry_type} 注册表完成，共 {exported} 个任务。")
@@ -0,0 +1,207 @@
+# ~/projects/deepseek_dispatcher-new/dispatcher/core/response_cache.py
+
+import hashlib
+import json
+import threading
+from typing import Any, Dict, List, Optional
+
+from redis import Redis
+import redis.asyncio as aioredis
+
+from common.compression import compress_text, compression_threshold, decompress_text
+from common.logging_utils import get_logger
+from common.lru_cache import LRUCache
+from common.stats_reporter import StatsReporter
+from config.settings import settings
+
+logger = get_logger("response_cache")
+
+# 推理结果缓存，完整键为 respcache:<sha256>，值为 {"result": <文本或压缩后的字典>, "model": <模型名>}
+RESPONSE_CACHE_KEY_PREFIX = "respcache"
+
+
+def canonical_request(task_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    缓存键对应的规范化请求：模型、消息和采样参数，未指定的参数取配置的默认值，
+    同一个请求在 web 进程（入队前）和 worker（parse_job_kwargs 之后）得到相同的结果。
+    消息结构与执行器发送给供应商的一致（见 ai_executor/executor.py）。
+    """
+    model_kwargs = task_data.get("model_kwargs") or {}
+
+    def param(name: str, default: Any) -> Any:
+        value = model_kwargs.get(name)
+        return default if value is None else value
+
+    return {
+        "model": task_data.get("model_name") or settings.MODEL_NAME,
+        "messages": [{"role": "user", "content": task_data.get("prompt")}],
+        "max_tokens": int(param("max_tokens", settings.MODEL_MAX_TOKENS)),
+        "temperature": float(param("temperature", settings.MODEL_TEMPERATURE)),
+        "top_p": float(param("top_p", settings.MODEL_TOP_P)),
+    }
+
+
+def cache_key(task_data: Dict[str, Any]) -> str:
+    canonical = json.dumps(canonical_request(task_data), ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return f"{RESPONSE_CACHE_KEY_PREFIX}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+
+
+def is_cacheable(task_data: Dict[str, Any]) -> bool:
+    """请求是否参与缓存：缓存已启用、未指定 cache_bypass、不是测试失败任务，且 temperature 不超过上限。"""
+    if not settings.RESPONSE_CACHE_ENABLED or task_data.get("cache_bypass") or task_data.get("should_fail_for_test"):
+        return False
+    if not isinstance(task_data.get("prompt"), str):
+        return False
+    return canonical_request(task_data)["temperature"] <= settings.RESPONSE_CACHE_MAX_TEMPERATURE
+
+
+class ResponseCacheStats:
+    """
+    进程内的缓存统计，周期性上报到 Redis（stats:response_cache:<host>:<pid>），
+    由 web 进程的 /metrics/response-cache 汇总。web 进程记录命中 / 未命中，worker 记录写入。
+    """
+
+    def __init__(self, local: LRUCache):
+        self._lock = threading.Lock()
+        self._local = local
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.stores = 0
+        self.hit_bytes = 0
+        self.stored_bytes = 0
+        self._reporter = StatsReporter("response_cache", interval=settings.RESPONSE_CACHE_STATS_INTERVAL)
+
+    def record(self, **counts: int) -> None:
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+        self._reporter.maybe_publish(self.snapshot)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.local_hits + self.redis_hits + self.misses
+            return {
+                "local_hits": self.local_hits,
+                "redis_hits": self.redis_hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_ratio": round((self.local_hits + self.redis_hits) / lookups, 4) if lookups else None,
+                "hit_bytes": self.hit_bytes,
+                "stores": self.stores,
+                "stored_bytes": self.stored_bytes,
+                "local_entries": len(self._local),
+                "local_bytes": self._local.bytes,
+            }
+
+
+class ResponseCache:
+    """
+    精确匹配的推理结果缓存，两级：
+    - 进程内 LRU（按条目数和字节数淘汰），只缓存从 Redis 读到的结果，重复请求不再访问 Redis；
+    - Redis 共享层（带 TTL），由 worker 在推理成功后写入，所有 web 进程共享。
+
+    命中时 web 进程直接把任务写成已完成（TaskDispatcher.complete_many），不进入 RQ 队列。
+    """
+
+    def __init__(self, local_max_entries: int, local_max_bytes: int, ttl: int):
+        self.ttl = ttl
+        self._local = LRUCache(local_max_entries, max_bytes=local_max_bytes)
+        self.stats = ResponseCacheStats(self._local)
+
+    @staticmethod
+    def _decode(raw: bytes) -> str:
+        return decompress_text(json.loads(raw)["result"])
+
+    def get_many(self, redis_conn: Redis, task_datas: List[Dict[str, Any]]) -> List[Optional[str]]:
+        """
+        批量查找缓存，返回与 task_datas 顺序一致的结果（未命中或不参与缓存为 None）。
+        进程内未命中的键用一次 MGET 读取；task_data 带 cache_refresh 时不读缓存（结果仍会由 worker 重新写入）。
+        Redis 读取失败时按未命中处理，不影响入队。
+        """
+        results: List[Optional[str]] = [None] * len(task_datas)
+        pending: Dict[str, List[int]] = {}
+        local_hits = hit_bytes = bypassed = 0
+        for index, task_data in enumerate(task_datas):
+            if task_data.get("cache_refresh") or not is_cacheable(task_data):
+                bypassed += 1
+                continue
+            key = cache_key(task_data)
+            cached = self._local.get(key)
+            if cached is not None:
+                results[index] = cached
+                local_hits += 1
+                hit_bytes += len(cached.encode("utf-8"))
+            else:
+                pending.setdefault(key, []).append(index)
+
+        redis_hits = 0
+        if pending:
+            keys = list(pending)
+            try:
+                raw_values = redis_conn.mget(keys)
+            except Exception as e:
+                logger.warning(f"读取推理结果缓存失败，按未命中处理: {e}")
+                raw_values = [None] * len(keys)
+            for key, raw in zip(keys, raw_values):
+                if raw is None:
+                    continue
+                result = self._decode(raw)
+                size = len(result.encode("utf-8"))
+                self._local.put(key, result, size=size)
+                for index in pending[key]:
+                    results[index] = result
+                    redis_hits += 1
+                    hit_bytes += size
+        misses = sum(len(indexes) for indexes in pending.values()) - redis_hits
+        self.stats.record(local_hits=local_hits, redis_hits=redis_hits, misses=misses, bypassed=bypassed, hit_bytes=hit_bytes)
+        return results
+
+    def get(self, redis_conn: Redis, task_data: Dict[str, Any]) -> Optional[str]:
+        return self.get_many(redis_conn, [task_data])[0]
+
+    def _encode(self, task_data: Dict[str, Any], result: Any) -> Optional[bytes]:
+        if not is_cacheable(task_data) or not isinstance(result, str):
+            return None
+        size = len(result.encode("utf-8"))
+        if size > settings.RESPONSE_CACHE_MAX_RESULT_BYTES:
+            return None
+        self.stats.record(stores=1, stored_bytes=size)
+        value = {"result": compress_text(result, compression_threshold(None)), "model": canonical_request(task_data)["model"]}
+        return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+    def put(self, redis_conn: Redis, task_data: Dict[str, Any], result: Any) -> None:
+        """推理成功后由 worker 写入 Redis 层；写入失败只记录警告，不影响任务结果。"""
+        try:
+            value = self._encode(task_data, result)
+            if value is not None:
+                redis_conn.set(cache_key(task_data), value, ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"写入推理结果缓存失败: {e}")
+
+    async def put_async(self, redis_conn: aioredis.Redis, task_data: Dict[str, Any], result: Any) -> None:
+        """put 的异步版本，供异步 worker 使用。"""
+        try:
+            value = self._encode(task_data, result)
+            if value is not None:
+                await redis_conn.set(cache_key(task_data), value, ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"写入推理结果缓存失败: {e}")
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache(
+                    local_max_entries=settings.RESPONSE_CACHE_LOCAL_MAX_ENTRIES,
+                    local_max_bytes=settings.RESPONSE_CACHE_LOCAL_MAX_BYTES,
+                    ttl=settings.RESPONSE_CACHE_TTL,
+                )
+    return _response_cache
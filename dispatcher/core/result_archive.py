@@ -0,0 +1,225 @@
+# ~/projects/deepseek_dispatcher-new/dispatcher/core/result_archive.py
+
+import json
+import mmap
+import os
+import shutil
+import socket
+import struct
+import threading
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from redis import Redis
+from redis.exceptions import LockError
+from rq import Queue
+
+from common.logging_utils import get_logger
+from config.settings import settings
+from dispatcher.core.registry_pager import describe_jobs
+
+logger = get_logger("result_archive")
+
+# 索引记录：job_id (36 字节 UUID) + 段文件名 + 偏移 + 长度，定长便于在索引文件中直接定位
+_INDEX_RECORD = struct.Struct("<36s64sQI")
+_INDEX_BUCKETS = 256
+_DAY_FORMAT = "%Y-%m-%d"
+
+# 每个注册表已归档到的分值（过期时间），完整键为 archive:watermark:<注册表键>
+ARCHIVE_WATERMARK_PREFIX = "archive:watermark"
+# 同一时间只允许一个归档进程扫描
+ARCHIVE_LOCK_KEY = "archive:lock"
+
+
+def _bucket(job_id: str) -> str:
+    return f"{zlib.crc32(job_id.encode()) % _INDEX_BUCKETS:02x}"
+
+
+class ResultArchive:
+    """
+    按天分段的结果归档：RESULTS_DIR/archive/<YYYY-MM-DD>/
+
+    - <主机名>-<pid>.jsonl：每个进程只追加写自己的段文件，一行一个任务；
+    - index/<桶>.idx：job_id -> (段文件, 偏移, 长度) 的定长记录，按 job_id 的 CRC32 分成 256 个桶，
+      多个进程以 O_APPEND 追加写入（单条记录远小于 PIPE_BUF，写入是原子的）。
+
+    查找一个任务只需在每天对应的一个桶文件中定位记录，再对段文件做一次 seek 读取。
+    """
+
+    def __init__(self, root: str, retention_days: int):
+        self.root = root
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._writer = f"{socket.gethostname()}-{os.getpid()}"
+
+    def _day_dir(self, day: str) -> str:
+        return os.path.join(self.root, day)
+
+    def append(self, records: List[Dict[str, Any]]) -> int:
+        """把一批任务记录追加到今天的段文件，并写入索引，返回写入的条数。"""
+        if not records:
+            return 0
+        day = datetime.now(timezone.utc).strftime(_DAY_FORMAT)
+        index_dir = os.path.join(self._day_dir(day), "index")
+        segment = f"{self._writer}.jsonl"
+        entries: Dict[str, List[bytes]] = {}
+        with self._lock:
+            os.makedirs(index_dir, exist_ok=True)
+            with open(os.path.join(self._day_dir(day), segment), "ab") as f:
+                offset = f.tell()
+                lines = []
+                for record in records:
+                    line = json.dumps(record, ensure_ascii=False, default=str).encode("utf-8") + b"\n"
+                    lines.append(line)
+                    entries.setdefault(_bucket(record["job_id"]), []).append(
+                        _INDEX_RECORD.pack(record["job_id"].encode(), segment.encode(), offset, len(line) - 1)
+                    )
+                    offset += len(line)
+                f.write(b"".join(lines))
+                # 先落盘数据再写索引，索引中的记录总能读到完整的行
+                f.flush()
+                os.fsync(f.fileno())
+            for bucket, packed in entries.items():
+                fd = os.open(os.path.join(index_dir, f"{bucket}.idx"), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+                try:
+                    for record in packed:
+                        os.write(fd, record)
+                finally:
+                    os.close(fd)
+        return len(records)
+
+    def _days(self) -> List[str]:
+        try:
+            return sorted((name for name in os.listdir(self.root) if len(name) == 10), reverse=True)
+        except FileNotFoundError:
+            return []
+
+    def _find_in_index(self, path: str, key: bytes) -> Optional[tuple]:
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size < _INDEX_RECORD.size:
+                    return None
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    usable = len(mapped) - len(mapped) % _INDEX_RECORD.size
+                    position = mapped.rfind(key, 0, usable)
+                    while position != -1:
+                        # 只接受位于记录边界上的匹配
+                        if position % _INDEX_RECORD.size == 0:
+                            return _INDEX_RECORD.unpack_from(mapped, position)
+                        position = mapped.rfind(key, 0, position)
+        except FileNotFoundError:
+            return None
+        return None
+
+    def lookup(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """从新到旧按天查找任务的归档记录，找不到时返回 None。"""
+        key = job_id.encode()
+        if len(key) > 36:
+            return None
+        key = key.ljust(36, b"\0")
+        bucket = f"{_bucket(job_id)}.idx"
+        for day in self._days():
+            found = self._find_in_index(os.path.join(self._day_dir(day), "index", bucket), key)
+            if found is None:
+                continue
+            _, segment, offset, length = found
+            with open(os.path.join(self._day_dir(day), segment.rstrip(b"\0").decode()), "rb") as f:
+                f.seek(offset)
+                return json.loads(f.read(length))
+        return None
+
+    def remove_expired(self) -> int:
+        """删除超过保留天数的归档目录，返回删除的天数。"""
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=self.retention_days)).strftime(_DAY_FORMAT)
+        removed = 0
+        for day in self._days():
+            if day < cutoff:
+                shutil.rmtree(self._day_dir(day), ignore_errors=True)
+                removed += 1
+        if removed:
+            logger.info(f"删除过期归档 {removed} 天。")
+        return removed
+
+
+_result_archive: Optional[ResultArchive] = None
+_result_archive_lock = threading.Lock()
+
+
+def get_result_archive() -> ResultArchive:
+    global _result_archive
+    if _result_archive is None:
+        with _result_archive_lock:
+            if _result_archive is None:
+                _result_archive = ResultArchive(
+                    root=os.path.join(settings.RESULTS_DIR, settings.ARCHIVE_DIR),
+                    retention_days=settings.ARCHIVE_RETENTION_DAYS,
+                )
+    return _result_archive
+
+
+def to_status_info(record: Dict[str, Any]) -> Dict[str, Any]:
+    """把归档记录转换为与 TaskDispatcher.get_task_status 相同的结构。"""
+    return {
+        "job_id": record["job_id"],
+        "status": record["status"],
+        "result": record.get("result"),
+        "error": record.get("error"),
+        "enqueued_at": record.get("enqueued_at"),
+        "started_at": record.get("started_at"),
+        "finished_at": record.get("ended_at"),
+    }
+
+
+def _archive_registry(redis_conn: Redis, archive: ResultArchive, key: str, upper: float, chunk_size: int) -> int:
+    watermark_key = f"{ARCHIVE_WATERMARK_PREFIX}:{key}"
+    watermark = redis_conn.get(watermark_key)
+    lower = f"({watermark.decode()}" if watermark else "-inf"
+    archived = 0
+    while True:
+        entries = redis_conn.zrangebyscore(key, lower, upper, start=0, num=chunk_size, withscores=True)
+        if not entries:
+            break
+        last_score = entries[-1][1]
+        if len(entries) == chunk_size:
+            # 分值相同的任务必须在同一批归档，否则以分值为水位时会漏掉
+            seen = {member for member, _ in entries}
+            entries += [(member, score) for member, score in
+                        redis_conn.zrangebyscore(key, last_score, last_score, withscores=True) if member not in seen]
+        job_ids = [member.decode() if isinstance(member, bytes) else member for member, _ in entries]
+        records = [entry for entry in describe_jobs(redis_conn, job_ids, include_params=True) if entry["status"] in ("finished", "failed")]
+        archived += archive.append(records)
+        redis_conn.set(watermark_key, repr(last_score))
+        lower = f"({last_score!r}"
+        if len(entries) < chunk_size:
+            break
+    return archived
+
+
+def archive_expiring_jobs(redis_conn: Redis, queues: List[Queue], archive: Optional[ResultArchive] = None) -> int:
+    """
+    把 finished / failed 注册表中即将过期（ARCHIVE_LEAD_SECONDS 内）的任务写入归档。
+    注册表分值即过期时间，每个注册表记录已归档到的分值，下一次从该分值之后继续。
+
+    Returns:
+        int: 本次归档的任务数。
+    """
+    archive = archive or get_result_archive()
+    lock = redis_conn.lock(ARCHIVE_LOCK_KEY, timeout=settings.ARCHIVE_SWEEP_INTERVAL * 2, blocking=False)
+    if not lock.acquire():
+        logger.info("其他归档进程正在运行，跳过本次归档。")
+        return 0
+    try:
+        upper = datetime.now(timezone.utc).timestamp() + settings.ARCHIVE_LEAD_SECONDS
+        archived = 0
+        for queue in queues:
+            for registry in (queue.finished_job_registry, queue.failed_job_registry):
+                archived += _archive_registry(redis_conn, archive, registry.key, upper, settings.ARCHIVE_SWEEP_CHUNK_SIZE)
+        archive.remove_expired()
+        logger.info(f"归档完成，本次归档 {archived} 个任务。")
+        return archived
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            logger.warning("归档耗时超过锁的有效期，锁已被释放。")
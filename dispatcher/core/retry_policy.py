@@ -0,0 +1,304 @@
+# ~/projects/deepseek_dispatcher-new/dispatcher/core/retry_policy.py
+
+import random
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+import httpx
+from redis import Redis
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from rq import Callback
+from rq.job import Job, Retry
+from rq.timeouts import JobTimeoutException
+
+from ai_executor.circuit_breaker import CircuitOpenError
+from ai_executor.concurrency_limiter import ConcurrencyLimitExceeded
+from ai_executor.executor import (
+    ModelClientError, ModelConnectionError, ModelExecutionError, ModelOverloadedError, ModelRateLimitError,
+    ModelResponseError, ModelTimeoutError,
+)
+from common.logging_utils import get_logger
+from config.settings import settings
+from dispatcher.core.completion import build_completion, notify_completion
+from dispatcher.queues.queue_config import default_retry, high_priority_retry, low_priority_retry
+
+logger = get_logger("retry_policy")
+
+# 全局重试预算的令牌桶（哈希：tokens、updated）
+RETRY_BUDGET_KEY = "retry:budget"
+# 重试决策计数（哈希，字段为 <错误分类>:<决策>），供 /metrics/retry 使用
+RETRY_STATS_KEY = "retry:stats"
+_RETRY_STATS_TTL = 7 * 86400
+
+# 任务 meta 中记录的已重试次数和最近一次失败的错误分类
+RETRY_ATTEMPTS_META = "retry_attempts"
+RETRY_CLASS_META = "retry_error_class"
+
+# 错误分类
+NETWORK = "network"             # 连接失败、超时：重试
+RATE_LIMIT = "rate_limit"       # 429、Key 池或并发许可耗尽：重试，遵守 Retry-After
+SERVER_ERROR = "server_error"   # 供应商 5xx、熔断器打开：较长的退避后重试
+BAD_RESPONSE = "bad_response"   # 响应格式错误：少量重试
+CLIENT_ERROR = "client_error"   # 4xx（429 除外）：请求本身有问题，不重试
+PERMANENT = "permanent"         # 参数 / 代码错误（ValueError、TypeError 等，包括 should_fail_for_test）：不重试
+UNKNOWN = "unknown"             # 无法分类：少量重试
+
+NON_RETRYABLE = (CLIENT_ERROR, PERMANENT)
+
+# 决策
+RETRIED = "retried"
+NOT_RETRYABLE = "not_retryable"
+EXHAUSTED = "exhausted"
+BUDGET_DENIED = "budget_denied"
+
+# 按异常链从外到内逐个匹配，第一个命中的规则决定分类。
+# 顺序：子类在父类之前；ServiceExecutionError 等没有规则的包装异常继续检查它包装的异常（__cause__ / __context__）
+_RULES: Tuple[Tuple[Tuple[type, ...], str], ...] = (
+    ((ModelClientError,), CLIENT_ERROR),
+    ((ModelRateLimitError, ConcurrencyLimitExceeded), RATE_LIMIT),
+    ((CircuitOpenError,), SERVER_ERROR),
+    ((ModelTimeoutError, ModelConnectionError), NETWORK),
+    ((ModelResponseError,), BAD_RESPONSE),
+    ((ModelExecutionError,), UNKNOWN),
+    ((httpx.TransportError, RedisConnectionError, RedisTimeoutError, ConnectionError, TimeoutError,
+      JobTimeoutException), NETWORK),
+    ((ValueError, TypeError, KeyError, IndexError, AttributeError, NotImplementedError), PERMANENT),
+)
+
+# 令牌桶：先按流逝时间补充 min_per_second 个 / 秒，再存入 deposit 个令牌（不超过容量），withdraw 为 1 时尝试取出一个。
+# ARGV: 当前时间 (毫秒)、存入的令牌数、是否取出、容量、每秒补充的令牌数、键有效期 (秒)
+# 返回 {是否取出, 剩余令牌数}
+_BUDGET_SCRIPT = """
+local now = tonumber(ARGV[1])
+local burst = tonumber(ARGV[4])
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens') or ARGV[4])
+local updated = tonumber(redis.call('HGET', KEYS[1], 'updated') or ARGV[1])
+tokens = math.min(burst, tokens + math.max(0, now - updated) / 1000 * tonumber(ARGV[5]) + tonumber(ARGV[2]))
+local granted = 0
+if ARGV[3] == '1' and tokens >= 1 then
+    tokens = tokens - 1
+    granted = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', now)
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[6]))
+return {granted, tostring(tokens)}
+"""
+_BUDGET_TTL = 86400
+
+
+def _decode(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else str(value)
+
+
+def _exception_chain(error: BaseException) -> Iterator[BaseException]:
+    # AIService / ExecutorFactory 在 except 块中重新抛出 ServiceExecutionError，原始异常保存在 __context__ 中
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        yield error
+        error = error.__cause__ or error.__context__
+
+
+def classify_error(error: BaseException) -> str:
+    """按异常链判断任务失败的错误分类，见 _RULES。"""
+    for exc in _exception_chain(error):
+        if isinstance(exc, ModelOverloadedError):
+            return RATE_LIMIT if exc.status_code == 429 else SERVER_ERROR
+        for types, error_class in _RULES:
+            if isinstance(exc, types):
+                return error_class
+    return UNKNOWN
+
+
+def _retry_after(error: BaseException) -> Optional[float]:
+    """异常链中供应商返回的 Retry-After（秒）。"""
+    for exc in _exception_chain(error):
+        if isinstance(exc, ModelOverloadedError) and exc.retry_after is not None:
+            return exc.retry_after
+    return None
+
+
+class Backoff:
+    """指数退避（full jitter）：第 n 次重试（从 0 开始）在 [0, min(max_delay, base_delay * 2^n)] 内随机等待。"""
+
+    def __init__(self, max_retries: int, base_delay: float, max_delay: float):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** min(attempt, 32)))
+
+
+class RetryBudget:
+    """
+    全局重试预算（Redis 中的令牌桶，所有 web / worker 进程共享）：每个新任务入队时存入 ratio 个令牌，
+    每次重试消耗一个，长期来看重试数不超过新任务数的 ratio；另外每秒补充 min_per_second 个，保证低流量时也能重试。
+    """
+
+    def __init__(self, enabled: bool, ratio: float, burst: float, min_per_second: float):
+        self.enabled = enabled
+        self.ratio = ratio
+        self.burst = burst
+        self.min_per_second = min_per_second
+
+    def _call(self, client: Any, deposit: float, withdraw: bool) -> Any:
+        return client.register_script(_BUDGET_SCRIPT)(
+            keys=[RETRY_BUDGET_KEY],
+            args=[int(time.time() * 1000), deposit, 1 if withdraw else 0, self.burst, self.min_per_second, _BUDGET_TTL],
+        )
+
+    def deposit(self, client: Any, count: int = 1) -> None:
+        """为 count 个新任务存入令牌。client 可以是 pipeline（与入队在同一次往返中提交），Redis 错误由调用方处理。"""
+        if self.enabled and count > 0:
+            self._call(client, count * self.ratio, False)
+
+    def try_withdraw(self, redis_conn: Redis) -> bool:
+        """取出一个令牌；Redis 访问失败时放行（与没有预算时的行为一致）。"""
+        if not self.enabled:
+            return True
+        try:
+            granted, _ = self._call(redis_conn, 0, True)
+        except Exception as e:
+            logger.warning(f"读取重试预算失败，放行本次重试: {e}")
+            return True
+        return bool(granted)
+
+    def tokens(self, redis_conn: Redis) -> float:
+        _, tokens = self._call(redis_conn, 0, False)
+        return float(_decode(tokens))
+
+
+class RetryPolicy:
+    """
+    任务重试引擎：RQ 任务失败时（失败回调 on_job_failure）按错误分类决定是否重试以及等待多久。
+    每类错误有自己的最大重试次数和退避参数，重试还需要从全局重试预算中取得令牌；
+    按队列的总重试次数上限仍由入队时的 Retry（TASK_MAX_RETRIES_*）决定。
+    """
+
+    def __init__(self, backoffs: Dict[str, Backoff], budget: RetryBudget):
+        self.backoffs = backoffs
+        self.budget = budget
+
+    def decide(self, redis_conn: Redis, job: Job, error: BaseException) -> Tuple[str, str, Optional[float]]:
+        """
+        Returns:
+            Tuple[str, str, Optional[float]]: (错误分类, 决策, 重试前等待的秒数，不重试时为 None)。
+        """
+        error_class = classify_error(error)
+        if error_class in NON_RETRYABLE:
+            return error_class, NOT_RETRYABLE, None
+        backoff = self.backoffs[error_class]
+        attempt = int(job.meta.get(RETRY_ATTEMPTS_META, 0))
+        if attempt >= backoff.max_retries or not job.retries_left:
+            return error_class, EXHAUSTED, None
+        if not self.budget.try_withdraw(redis_conn):
+            return error_class, BUDGET_DENIED, None
+        delay = backoff.delay(attempt)
+        retry_after = _retry_after(error)
+        if error_class == RATE_LIMIT and retry_after is not None:
+            delay = max(delay, retry_after)
+        return error_class, RETRIED, round(delay, 3)
+
+    def apply(self, redis_conn: Redis, job: Job, error: BaseException) -> None:
+        """
+        按决策修改任务的重试参数，随后由 RQ 的 handle_job_failure 保存：
+        不重试时把 retries_left 置 0；重试时把 retry_intervals 设为本次的等待时间（大于 0 时由 RQ 调度器按时入队）。
+        同时按决策写入完成通知和任务索引：重试时标记为 scheduled，否则为 failed 并唤醒等待者
+        （task_wrapper 执行时还不知道这次决策，挂有本回调的任务由这里发送失败通知）。
+        """
+        error_class, decision, delay = self.decide(redis_conn, job, error)
+        job.meta[RETRY_CLASS_META] = error_class
+        if delay is None:
+            job.retries_left = 0
+        else:
+            job.meta[RETRY_ATTEMPTS_META] = int(job.meta.get(RETRY_ATTEMPTS_META, 0)) + 1
+            job.retry_intervals = [delay]
+        if decision == RETRIED:
+            logger.info(f"任务 {job.id} 失败（{error_class}），{delay} 秒后第 {job.meta[RETRY_ATTEMPTS_META]} 次重试。")
+        else:
+            logger.warning(f"任务 {job.id} 失败（{error_class}），不再重试: {decision}")
+        try:
+            with redis_conn.pipeline() as pipeline:
+                # RQ 把任务移入失败注册表时不保存 meta，这里先写入，便于排查任务为什么没有重试
+                pipeline.hset(job.key, "meta", job.serializer.dumps(job.meta))
+                pipeline.hincrby(RETRY_STATS_KEY, f"{error_class}:{decision}", 1)
+                pipeline.expire(RETRY_STATS_KEY, _RETRY_STATS_TTL)
+                pipeline.execute()
+        except Exception as e:
+            logger.warning(f"记录重试统计失败: {e}")
+        notify_completion(redis_conn, job.id, build_completion("failed", error=str(error)),
+                          will_retry=decision == RETRIED)
+
+
+def _backoff(prefix: str) -> Backoff:
+    return Backoff(
+        max_retries=getattr(settings, f"RETRY_{prefix}_MAX_RETRIES"),
+        base_delay=getattr(settings, f"RETRY_{prefix}_BASE_DELAY"),
+        max_delay=getattr(settings, f"RETRY_{prefix}_MAX_DELAY"),
+    )
+
+
+_retry_policy: Optional[RetryPolicy] = None
+_retry_policy_lock = threading.Lock()
+
+
+def get_retry_policy() -> RetryPolicy:
+    global _retry_policy
+    if _retry_policy is None:
+        with _retry_policy_lock:
+            if _retry_policy is None:
+                _retry_policy = RetryPolicy(
+                    backoffs={error_class: _backoff(error_class.upper())
+                              for error_class in (NETWORK, RATE_LIMIT, SERVER_ERROR, BAD_RESPONSE, UNKNOWN)},
+                    budget=RetryBudget(
+                        enabled=settings.RETRY_BUDGET_ENABLED,
+                        ratio=settings.RETRY_BUDGET_RATIO,
+                        burst=settings.RETRY_BUDGET_BURST,
+                        min_per_second=settings.RETRY_BUDGET_MIN_PER_SECOND,
+                    ),
+                )
+    return _retry_policy
+
+
+def on_job_failure(job: Job, connection: Redis, exc_type: type, exc_value: BaseException, traceback: Any) -> None:
+    """RQ 失败回调：在 worker 处理失败（重试或移入失败注册表）之前决定这次失败是否重试。"""
+    get_retry_policy().apply(connection, job, exc_value)
+
+
+# 入队时通过 on_failure 挂到每个任务上（RQ 只序列化函数的导入路径）
+RETRY_CALLBACK = Callback(on_job_failure)
+
+
+def retry_for(priority: str) -> Retry:
+    """选择按队列的总重试次数上限，默认是 default_retry。"""
+    if priority == "high":
+        return high_priority_retry
+    if priority == "low":
+        return low_priority_retry
+    return default_retry
+
+
+def retry_stats(redis_conn: Redis) -> Dict[str, Any]:
+    """
+    读取重试预算和各错误分类的重试决策计数（供 /metrics/retry 使用）。
+    Returns:
+        Dict[str, Any]: {"budget": 令牌桶状态, "classes": {错误分类: {决策: 次数}}}。
+    """
+    policy = get_retry_policy()
+    classes: Dict[str, Dict[str, int]] = {}
+    for field, value in redis_conn.hgetall(RETRY_STATS_KEY).items():
+        error_class, _, decision = _decode(field).partition(":")
+        classes.setdefault(error_class, {})[decision] = int(value)
+    budget = policy.budget
+    return {
+        "budget": {
+            "enabled": budget.enabled,
+            "tokens": round(budget.tokens(redis_conn), 2) if budget.enabled else None,
+            "ratio": budget.ratio,
+            "burst": budget.burst,
+            "min_per_second": budget.min_per_second,
+        },
+        "classes": classes,
+    }
@@ -0,0 +1,74 @@
+# ~/projects/deepseek_dispatcher-new/dispatcher/core/serializers.py
+
+import pickle
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from common.logging_utils import get_logger
+from config.settings import settings
+
+logger = get_logger("serializers")
+
+SERIALIZER_FORMATS = ("orjson", "msgpack", "pickle")
+
+# RQ 默认使用 pickle.HIGHEST_PROTOCOL，协议 >= 2 的 pickle 以 PROTO 操作码开头
+_PICKLE_PROTO = 0x80
+
+
+def _is_pickle(data: bytes) -> bool:
+    # 单字节 0x80 是 msgpack 的空 map，pickle 至少还带一个协议版本字节
+    return len(data) > 1 and data[0] == _PICKLE_PROTO and 2 <= data[1] <= pickle.HIGHEST_PROTOCOL
+
+
+class JobSerializer:
+    """
+    RQ 任务序列化器（任务数据、meta 和返回值都通过它编码）。
+    写入时使用配置的格式；读取时先识别 pickle，升级前入队的任务和结果仍然可以读取。
+
+    orjson / msgpack 只能编码基础类型：任务函数必须是模块级函数（RQ 只记录导入路径），
+    不能是绑定方法，参数也不能包含自定义对象。
+    """
+
+    def __init__(self, fmt: str):
+        if fmt not in SERIALIZER_FORMATS:
+            raise ValueError(f"无效的任务序列化格式: {fmt}，可选: {', '.join(SERIALIZER_FORMATS)}")
+        if fmt == "orjson" and orjson is None:
+            raise ImportError("JOB_SERIALIZER=orjson 需要安装 orjson")
+        if fmt == "msgpack" and msgpack is None:
+            raise ImportError("JOB_SERIALIZER=msgpack 需要安装 msgpack")
+        self.format = fmt
+
+    def dumps(self, obj: Any) -> bytes:
+        if self.format == "orjson":
+            return orjson.dumps(obj)
+        if self.format == "msgpack":
+            return msgpack.packb(obj, use_bin_type=True)
+        return pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, data: bytes) -> Any:
+        if _is_pickle(data):
+            return pickle.loads(data)
+        if msgpack is not None and (self.format == "msgpack" or orjson is None):
+            try:
+                return msgpack.unpackb(data, raw=False, strict_map_key=False)
+            except Exception:
+                if orjson is None:
+                    raise
+                # 切换到 msgpack 之前以 orjson 写入的数据
+        return orjson.loads(data)
+
+    def __repr__(self) -> str:
+        return f"JobSerializer({self.format!r})"
+
+
+# web 进程、TaskDispatcher 和 worker 共用的序列化器。
+# worker 启动时通过 `--serializer dispatcher.core.serializers.job_serializer` 指定（见 supervisor/conf.d）。
+job_serializer = JobSerializer(settings.JOB_SERIALIZER)
@@ -0,0 +1,359 @@
+# ~/projects/deepseek_dispatcher-new/dispatcher/core/single_flight.py
+
+import asyncio
+import json
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from redis import Redis
+import redis.asyncio as aioredis
+
+from common.compression import compress_text, compression_threshold, decompress_text
+from common.logging_utils import get_logger
+from common.stats_reporter import StatsReporter
+from config.settings import settings
+from dispatcher.core.response_cache import cache_key, canonical_request
+
+logger = get_logger("single_flight")
+
+# 领导者租约，完整键为 singleflight:lease:<请求哈希>，值为领导者任务的 job_id
+SINGLE_FLIGHT_LEASE_PREFIX = "singleflight:lease"
+# 领导者的完成通知列表 singleflight:done:<领导者 job_id>，值为 {"status": "success" | "failed", "result": ...}
+SINGLE_FLIGHT_DONE_PREFIX = "singleflight:done"
+# 最近一次成功的领导者 singleflight:recent:<请求哈希> -> 领导者 job_id，
+# 领导者完成后才开始执行的同一请求（例如同一秒入队、排在后面的任务）直接复用它的结果
+SINGLE_FLIGHT_RECENT_PREFIX = "singleflight:recent"
+
+# 跟随者每次阻塞等待完成通知的秒数，超时后检查领导者的租约是否还在
+_FOLLOW_POLL_SECONDS = 1
+
+# 只有租约仍属于自己时才续期 / 释放，避免租约过期后误删新领导者的租约
+_RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def is_coalescable(task_data: Dict[str, Any]) -> bool:
+    """请求是否参与合并：已启用、未指定 cache_bypass、不是测试失败任务，且 temperature 不超过结果缓存的上限。"""
+    if not settings.SINGLE_FLIGHT_ENABLED or task_data.get("cache_bypass") or task_data.get("should_fail_for_test"):
+        return False
+    if not isinstance(task_data.get("prompt"), str):
+        return False
+    return canonical_request(task_data)["temperature"] <= settings.RESPONSE_CACHE_MAX_TEMPERATURE
+
+
+def _request_hash(task_data: Dict[str, Any]) -> str:
+    # 与结果缓存使用同一个规范化请求的哈希
+    return cache_key(task_data).rsplit(":", 1)[-1]
+
+
+def _decode_outcome(raw: Optional[bytes]) -> Optional[Dict[str, Any]]:
+    if raw is None:
+        return None
+    outcome = json.loads(raw)
+    if outcome.get("result") is not None:
+        outcome["result"] = decompress_text(outcome["result"])
+    return outcome
+
+
+def _decode_id(raw: Optional[bytes]) -> Optional[str]:
+    return raw.decode() if isinstance(raw, bytes) else raw
+
+
+class SingleFlightStats:
+    """进程内的合并统计（stats:single_flight:<host>:<pid>），由 /metrics/single-flight 汇总。"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self.recent_hits = 0
+        self.takeovers = 0
+        self.fallbacks = 0
+        self.follow_wait_ms_total = 0.0
+        self._reporter = StatsReporter("single_flight", interval=settings.SINGLE_FLIGHT_STATS_INTERVAL)
+
+    def record(self, follow_wait_ms: float = 0.0, **counts: int) -> None:
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+            self.follow_wait_ms_total += follow_wait_ms
+        self._reporter.maybe_publish(self.snapshot)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "recent_hits": self.recent_hits,
+                "takeovers": self.takeovers,
+                "fallbacks": self.fallbacks,
+                "follow_wait_ms_avg": round(self.follow_wait_ms_total / self.followers, 1) if self.followers else None,
+            }
+
+
+class SingleFlight:
+    """
+    跨 worker 进程合并相同的进行中推理请求（single-flight）。
+
+    同一个规范化请求（模型、prompt、采样参数，见 response_cache.canonical_request）同时只有一个任务调用供应商：
+    - 第一个任务用 SET NX 取得领导者租约，执行期间由后台线程 / 协程定期续期，完成后写入完成通知再释放租约；
+    - 之后到达的任务成为跟随者，阻塞等待领导者的完成通知（BRPOPLPUSH，多个跟随者都能被唤醒），
+      直接使用领导者的结果，不再调用供应商；
+    - 领导者失败时跟随者重新竞争租约，由新的领导者重试一次；领导者进程退出时租约在 SINGLE_FLIGHT_LEASE_MS 后过期，
+      跟随者检测到租约消失后接管；等待超过 SINGLE_FLIGHT_MAX_WAIT 秒的跟随者放弃等待，自己调用供应商。
+    Redis 不可用时直接调用供应商，合并只是优化手段。
+    """
+
+    def __init__(self, lease_ms: int, max_wait: int, result_ttl: int):
+        self.lease_ms = lease_ms
+        self.max_wait = max_wait
+        self.result_ttl = result_ttl
+        self.stats = SingleFlightStats()
+
+    # --- 同步版本（同步 worker） ---
+
+    def run(self, redis_conn: Redis, job_id: str, task_data: Dict[str, Any],
+            compute: Callable[[], str]) -> Tuple[str, bool]:
+        """
+        执行 compute 或复用相同请求的结果，返回 (结果, 是否由本任务调用了供应商)。
+        compute 抛出的异常原样抛出；作为跟随者时领导者的异常不会传给本任务。
+        """
+        if not is_coalescable(task_data):
+            return compute(), True
+        request_hash = _request_hash(task_data)
+        lease_key = f"{SINGLE_FLIGHT_LEASE_PREFIX}:{request_hash}"
+        try:
+            leader, result = self._coordinate(redis_conn, job_id, task_data, request_hash, lease_key)
+        except Exception as e:
+            logger.warning(f"请求合并失败，直接调用模型: {e}")
+            return compute(), True
+        if result is not None:
+            return result, False
+        if leader:
+            return self._lead(redis_conn, job_id, request_hash, lease_key, compute), True
+        return compute(), True
+
+    def _coordinate(self, redis_conn: Redis, job_id: str, task_data: Dict[str, Any], request_hash: str,
+                    lease_key: str) -> Tuple[bool, Optional[str]]:
+        """
+        返回 (是否取得了租约, 复用的结果)；两者都为空表示等待超时，由调用方自行调用供应商。
+        """
+        started = time.monotonic()
+        followed = False
+        while True:
+            if not task_data.get("cache_refresh"):
+                recent = self._recent_result(redis_conn, request_hash)
+                if recent is not None:
+                    self.stats.record(recent_hits=1)
+                    return False, recent
+            if redis_conn.set(lease_key, job_id, nx=True, px=self.lease_ms):
+                self.stats.record(leaders=1, takeovers=int(followed))
+                return True, None
+            leader_id = _decode_id(redis_conn.get(lease_key))
+            if leader_id is None:
+                continue
+            followed = True
+            outcome = self._follow(redis_conn, lease_key, leader_id, started)
+            if outcome is None:
+                self.stats.record(fallbacks=1)
+                logger.warning(f"等待任务 {leader_id} 超过 {self.max_wait} 秒，任务 {job_id} 自行调用模型。")
+                return False, None
+            if outcome.get("status") == "success":
+                self.stats.record(followers=1, follow_wait_ms=(time.monotonic() - started) * 1000)
+                logger.info(f"任务 {job_id} 复用进行中的相同请求 {leader_id} 的结果。")
+                return False, outcome["result"]
+            # 领导者失败或租约过期：重新竞争租约
+
+    def _recent_result(self, redis_conn: Redis, request_hash: str) -> Optional[str]:
+        leader_id = _decode_id(redis_conn.get(f"{SINGLE_FLIGHT_RECENT_PREFIX}:{request_hash}"))
+        if leader_id is None:
+            return None
+        outcome = _decode_outcome(redis_conn.lindex(f"{SINGLE_FLIGHT_DONE_PREFIX}:{leader_id}", 0))
+        return outcome["result"] if outcome and outcome.get("status") == "success" else None
+
+    def _follow(self, redis_conn: Redis, lease_key: str, leader_id: str, started: float) -> Optional[Dict[str, Any]]:
+        """等待领导者完成；返回完成通知，租约过期时返回 {"status": "expired"}，超过最长等待时间返回 None。"""
+        done_key = f"{SINGLE_FLIGHT_DONE_PREFIX}:{leader_id}"
+        while time.monotonic() - started < self.max_wait:
+            outcome = _decode_outcome(redis_conn.brpoplpush(done_key, done_key, timeout=_FOLLOW_POLL_SECONDS))
+            if outcome is not None:
+                return outcome
+            if _decode_id(redis_conn.get(lease_key)) != leader_id:
+                # 领导者在上次检查之后完成时通知已经写入，再读一次
+                return _decode_outcome(redis_conn.lindex(done_key, 0)) or {"status": "expired"}
+        return None
+
+    def _lead(self, redis_conn: Redis, job_id: str, request_hash: str, lease_key: str,
+              compute: Callable[[], str]) -> str:
+        # RQ 重试同一个任务时 job_id 不变，清掉上一次失败留下的完成通知
+        redis_conn.delete(f"{SINGLE_FLIGHT_DONE_PREFIX}:{job_id}")
+        stop = threading.Event()
+        renew = redis_conn.register_script(_RENEW_SCRIPT)
+
+        def keep_lease():
+            while not stop.wait(self.lease_ms / 3000):
+                try:
+                    renew(keys=[lease_key], args=[job_id, self.lease_ms])
+                except Exception as e:
+                    logger.warning(f"续期任务 {job_id} 的领导者租约失败: {e}")
+
+        keeper = threading.Thread(target=keep_lease, name=f"single-flight-{job_id}", daemon=True)
+        keeper.start()
+        try:
+            result = compute()
+        except Exception:
+            self._finish(redis_conn, job_id, request_hash, lease_key, None)
+            raise
+        finally:
+            stop.set()
+        self._finish(redis_conn, job_id, request_hash, lease_key, result)
+        return result
+
+    def _finish(self, redis_conn: Redis, job_id: str, request_hash: str, lease_key: str, result: Optional[str]) -> None:
+        # 先写完成通知再释放租约：跟随者看到租约消失时通知一定已经存在
+        try:
+            with redis_conn.pipeline(transaction=False) as pipeline:
+                self._queue_outcome(pipeline, job_id, request_hash, result)
+                pipeline.execute()
+            redis_conn.register_script(_RELEASE_SCRIPT)(keys=[lease_key], args=[job_id])
+        except Exception as e:
+            logger.warning(f"写入任务 {job_id} 的合并结果失败: {e}")
+
+    def _queue_outcome(self, pipeline, job_id: str, request_hash: str, result: Optional[str]) -> None:
+        done_key = f"{SINGLE_FLIGHT_DONE_PREFIX}:{job_id}"
+        if result is None:
+            outcome = {"status": "failed", "result": None}
+        else:
+            outcome = {"status": "success", "result": compress_text(result, compression_threshold(None))}
+            pipeline.set(f"{SINGLE_FLIGHT_RECENT_PREFIX}:{request_hash}", job_id, ex=self.result_ttl)
+        pipeline.delete(done_key)
+        pipeline.lpush(done_key, json.dumps(outcome, ensure_ascii=False))
+        pipeline.expire(done_key, self.result_ttl)
+
+    # --- 异步版本（异步 worker），逻辑与同步版本相同 ---
+
+    async def run_async(self, redis_conn: aioredis.Redis, job_id: str, task_data: Dict[str, Any],
+                        compute: Callable[[], Awaitable[str]]) -> Tuple[str, bool]:
+        """run 的异步版本。"""
+        if not is_coalescable(task_data):
+            return await compute(), True
+        request_hash = _request_hash(task_data)
+        lease_key = f"{SINGLE_FLIGHT_LEASE_PREFIX}:{request_hash}"
+        try:
+            leader, result = await self._coordinate_async(redis_conn, job_id, task_data, request_hash, lease_key)
+        except Exception as e:
+            logger.warning(f"请求合并失败，直接调用模型: {e}")
+            return await compute(), True
+        if result is not None:
+            return result, False
+        if leader:
+            return await self._lead_async(redis_conn, job_id, request_hash, lease_key, compute), True
+        return await compute(), True
+
+    async def _coordinate_async(self, redis_conn: aioredis.Redis, job_id: str, task_data: Dict[str, Any],
+                                request_hash: str, lease_key: str) -> Tuple[bool, Optional[str]]:
+        started = time.monotonic()
+        followed = False
+        while True:
+            if not task_data.get("cache_refresh"):
+                recent = await self._recent_result_async(redis_conn, request_hash)
+                if recent is not None:
+                    self.stats.record(recent_hits=1)
+                    return False, recent
+            if await redis_conn.set(lease_key, job_id, nx=True, px=self.lease_ms):
+                self.stats.record(leaders=1, takeovers=int(followed))
+                return True, None
+            leader_id = _decode_id(await redis_conn.get(lease_key))
+            if leader_id is None:
+                continue
+            followed = True
+            outcome = await self._follow_async(redis_conn, lease_key, leader_id, started)
+            if outcome is None:
+                self.stats.record(fallbacks=1)
+                logger.warning(f"等待任务 {leader_id} 超过 {self.max_wait} 秒，任务 {job_id} 自行调用模型。")
+                return False, None
+            if outcome.get("status") == "success":
+                self.stats.record(followers=1, follow_wait_ms=(time.monotonic() - started) * 1000)
+                logger.info(f"任务 {job_id} 复用进行中的相同请求 {leader_id} 的结果。")
+                return False, outcome["result"]
+
+    async def _recent_result_async(self, redis_conn: aioredis.Redis, request_hash: str) -> Optional[str]:
+        leader_id = _decode_id(await redis_conn.get(f"{SINGLE_FLIGHT_RECENT_PREFIX}:{request_hash}"))
+        if leader_id is None:
+            return None
+        outcome = _decode_outcome(await redis_conn.lindex(f"{SINGLE_FLIGHT_DONE_PREFIX}:{leader_id}", 0))
+        return outcome["result"] if outcome and outcome.get("status") == "success" else None
+
+    async def _follow_async(self, redis_conn: aioredis.Redis, lease_key: str, leader_id: str,
+                            started: float) -> Optional[Dict[str, Any]]:
+        done_key = f"{SINGLE_FLIGHT_DONE_PREFIX}:{leader_id}"
+        while time.monotonic() - started < self.max_wait:
+            outcome = _decode_outcome(await redis_conn.brpoplpush(done_key, done_key, timeout=_FOLLOW_POLL_SECONDS))
+            if outcome is not None:
+                return outcome
+            if _decode_id(await redis_conn.get(lease_key)) != leader_id:
+                return _decode_outcome(await redis_conn.lindex(done_key, 0)) or {"status": "expired"}
+        return None
+
+    async def _lead_async(self, redis_conn: aioredis.Redis, job_id: str, request_hash: str, lease_key: str,
+                          compute: Callable[[], Awaitable[str]]) -> str:
+        await redis_conn.delete(f"{SINGLE_FLIGHT_DONE_PREFIX}:{job_id}")
+        renew = redis_conn.register_script(_RENEW_SCRIPT)
+
+        async def keep_lease():
+            while True:
+                await asyncio.sleep(self.lease_ms / 3000)
+                try:
+                    await renew(keys=[lease_key], args=[job_id, self.lease_ms])
+                except Exception as e:
+                    logger.warning(f"续期任务 {job_id} 的领导者租约失败: {e}")
+
+        keeper = asyncio.create_task(keep_lease())
+        try:
+            result = await compute()
+        except (Exception, asyncio.CancelledError):
+            # 任务超时或 worker 取消任务时同样写入失败通知并释放租约，跟随者立即重新竞争，不必等到最长等待时间
+            await self._finish_async(redis_conn, job_id, request_hash, lease_key, None)
+            raise
+        finally:
+            keeper.cancel()
+        await self._finish_async(redis_conn, job_id, request_hash, lease_key, result)
+        return result
+
+    async def _finish_async(self, redis_conn: aioredis.Redis, job_id: str, request_hash: str, lease_key: str,
+                            result: Optional[str]) -> None:
+        try:
+            async with redis_conn.pipeline(transaction=False) as pipeline:
+                self._queue_outcome(pipeline, job_id, request_hash, result)
+                await pipeline.execute()
+            await redis_conn.register_script(_RELEASE_SCRIPT)(keys=[lease_key], args=[job_id])
+        except Exception as e:
+            logger.warning(f"写入任务 {job_id} 的合并结果失败: {e}")
+
+
+_single_flight: Optional[SingleFlight] = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight(
+                    lease_ms=settings.SINGLE_FLIGHT_LEASE_MS,
+                    max_wait=settings.SINGLE_FLIGHT_MAX_WAIT,
+                    result_ttl=settings.SINGLE_FLIGHT_RESULT_TTL,
+                )
+    return _single_flight
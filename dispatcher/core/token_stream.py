@@ -0,0 +1,129 @@
+# ~/projects/deepseek_dispatcher-new/dispatcher/core/token_stream.py
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from redis import Redis
+import redis.asyncio as aioredis
+
+from common.logging_utils import get_logger
+from config.settings import settings
+
+logger = get_logger("token_stream")
+
+# 每个任务一个 Redis Stream，完整键为 stream:tokens:<job_id>
+TOKEN_STREAM_KEY_PREFIX = "stream:tokens"
+
+# 流中的事件类型：
+#   start - 一次执行（含重试）开始，客户端应丢弃之前收到的内容
+#   token - 一段增量文本，字段 delta
+#   end   - 执行结束，字段 status (finished / failed)，失败时带 error
+EVENT_START = "start"
+EVENT_TOKEN = "token"
+EVENT_END = "end"
+
+
+def token_stream_key(job_id: str) -> str:
+    return f"{TOKEN_STREAM_KEY_PREFIX}:{job_id}"
+
+
+def _end_fields(status: str, error: Optional[str]) -> Dict[str, str]:
+    fields = {"type": EVENT_END, "status": status}
+    if error:
+        fields["error"] = error
+    return fields
+
+
+class TokenStreamWriter:
+    """
+    在同步 worker 中把模型输出的增量文本追加到任务的 Redis Stream。
+    写入失败只记录警告：流式输出只是体验优化，最终结果仍以任务结果为准。
+    """
+
+    def __init__(self, redis_conn: Redis, job_id: str):
+        self.redis_conn = redis_conn
+        self.job_id = job_id
+        self.key = token_stream_key(job_id)
+
+    def _add(self, fields: Dict[str, str], expire: int) -> None:
+        try:
+            with self.redis_conn.pipeline(transaction=False) as pipeline:
+                pipeline.xadd(self.key, fields, maxlen=settings.TOKEN_STREAM_MAXLEN, approximate=True)
+                pipeline.expire(self.key, expire)
+                pipeline.execute()
+        except Exception as e:
+            logger.warning(f"写入任务 {self.job_id} 的 token 流失败: {e}")
+
+    def start(self) -> None:
+        # worker 异常退出时不会写 end 事件，先按任务超时设置过期时间，避免流永久残留
+        self._add({"type": EVENT_START}, settings.TASK_JOB_TIMEOUT + settings.TOKEN_STREAM_TTL)
+
+    def append(self, delta: str) -> None:
+        try:
+            self.redis_conn.xadd(self.key, {"type": EVENT_TOKEN, "delta": delta},
+                                 maxlen=settings.TOKEN_STREAM_MAXLEN, approximate=True)
+        except Exception as e:
+            logger.warning(f"写入任务 {self.job_id} 的 token 流失败: {e}")
+
+    def finish(self, status: str, error: Optional[str] = None) -> None:
+        self._add(_end_fields(status, error), settings.TOKEN_STREAM_TTL)
+
+
+class AsyncTokenStreamWriter:
+    """TokenStreamWriter 的异步版本，供异步 worker 使用，避免每个 token 都阻塞事件循环。"""
+
+    def __init__(self, redis_conn: aioredis.Redis, job_id: str):
+        self.redis_conn = redis_conn
+        self.job_id = job_id
+        self.key = token_stream_key(job_id)
+
+    async def _add(self, fields: Dict[str, str], expire: int) -> None:
+        try:
+            async with self.redis_conn.pipeline(transaction=False) as pipeline:
+                pipeline.xadd(self.key, fields, maxlen=settings.TOKEN_STREAM_MAXLEN, approximate=True)
+                pipeline.expire(self.key, expire)
+                await pipeline.execute()
+        except Exception as e:
+            logger.warning(f"写入任务 {self.job_id} 的 token 流失败: {e}")
+
+    async def start(self) -> None:
+        await self._add({"type": EVENT_START}, settings.TASK_JOB_TIMEOUT + settings.TOKEN_STREAM_TTL)
+
+    async def append(self, delta: str) -> None:
+        try:
+            await self.redis_conn.xadd(self.key, {"type": EVENT_TOKEN, "delta": delta},
+                                       maxlen=settings.TOKEN_STREAM_MAXLEN, approximate=True)
+        except Exception as e:
+            logger.warning(f"写入任务 {self.job_id} 的 token 流失败: {e}")
+
+    async def finish(self, status: str, error: Optional[str] = None) -> None:
+        await self._add(_end_fields(status, error), settings.TOKEN_STREAM_TTL)
+
+
+def _decode(value: Any) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+async def read_token_events(redis_conn: aioredis.Redis, job_id: str, last_id: str,
+                            block_ms: int) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    从 last_id 之后读取任务的 token 事件，没有新事件时最多阻塞 block_ms 毫秒。
+    Returns:
+        List[Tuple[str, Dict[str, str]]]: (事件 ID, 字段) 列表，超时返回空列表。
+    """
+    response = await redis_conn.xread({token_stream_key(job_id): last_id}, block=block_ms, count=100)
+    events = []
+    for _, entries in response or []:
+        for entry_id, fields in entries:
+            events.append((_decode(entry_id), {_decode(k): _decode(v) for k, v in fields.items()}))
+    return events
+
+
+def format_sse(event: str, data: Dict[str, Any], event_id: Optional[str] = None) -> str:
+    """按 Server-Sent Events 格式编码一条消息。"""
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
@@ -6,6 +6,8 @@ from rq.job import Retry # 修正：从 rq.job 导入 Retry 类，兼容 rq 1.x
 
 # 引入配置
 from config.settings import settings
+# 任务数据和结果的序列化器，worker 启动时需指定同一个（见 supervisor/conf.d）
+from dispatcher.core.serializers import job_serializer
 
 # 初始化 Redis 连接
 # 从 settings.REDIS_URL 获取 Redis 连接字符串
@@ -14,9 +16,9 @@ redis_conn = Redis.from_url(settings.REDIS_URL)
 # 定义不同优先级的 RQ 队列
 # 这些队列将共享同一个 Redis 连接
 QUEUE_MAP = {
-    'high': Queue('high', connection=redis_conn),
-    'default': Queue('default', connection=redis_conn),
-    'low': Queue('low', connection=redis_conn),
+    'high': Queue('high', connection=redis_conn, serializer=job_serializer),
+    'default': Queue('default', connection=redis_conn, serializer=job_serializer),
+    'low': Queue('low', connection=redis_conn, serializer=job_serializer),
 }
 
 # 定义任务的重试策略
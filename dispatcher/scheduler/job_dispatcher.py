@@ -1,8 +1,9 @@
 # ~/projects/deepseek_dispatcher-new/dispatcher/scheduler/job_dispatcher.py
 
 from dispatcher.queues.queue_config import QUEUE_MAP
-# 导入我们定义的重试策略
-from dispatcher.queues.retry_config import high_priority_retry, default_retry, low_priority_retry
+# 重试由重试引擎统一处理（见 dispatcher/core/retry_policy.py）
+from dispatcher.core.completion import COMPLETION_CALLBACK
+from dispatcher.core.retry_policy import RETRY_CALLBACK, get_retry_policy, retry_for
 from dispatcher.tasks.example_task import unreliable_task # 确保这个任务函数存在且可被导入
 from typing import Any
 from rq import Queue
@@ -15,13 +16,6 @@ from common.logging_utils import get_logger
 # 获取一个名为 "dispatcher" 的 logger
 logger = get_logger("dispatcher")
 
-# 将重试配置映射到优先级
-RETRY_STRATEGIES = {
-    'high': high_priority_retry,
-    'default': default_retry,
-    'low': low_priority_retry,
-}
-
 def dispatch_job(task_name: str, priority: str = 'default', **kwargs: Any) -> Job:
     """
     根据优先级派发任务到对应的 RQ 队列。
@@ -40,20 +34,23 @@ def dispatch_job(task_name: str, priority: str = 'default', **kwargs: Any) -> Jo
     job_id = str(uuid.uuid4())
     kwargs['job_id'] = job_id
 
-    # 获取对应优先级的重试策略
-    retry_config = RETRY_STRATEGIES.get(priority, default_retry)
+    # 获取对应优先级的总重试次数上限
+    retry = retry_for(priority)
 
     logger.info(f"正在派发任务: {task_name}, 优先级={priority}, job_id={job_id}, "
-                f"重试策略={retry_config.to_dict()}, 参数={kwargs}")
+                f"最大重试次数={retry.max}, 参数={kwargs}")
 
     job = queue.enqueue(
         task_name, # 注意这里是 task_name 字符串，RQ 会去加载它
         kwargs=kwargs, # 传递所有 kwargs，包括 job_id
-        retry_intervals=retry_config.interval, # 使用从策略中获取的重试间隔
+        retry=retry, # 每次失败是否重试、等待多久由失败回调中的重试引擎决定
+        on_success=COMPLETION_CALLBACK,
+        on_failure=RETRY_CALLBACK,
         result_ttl=86400, # 任务结果在 Redis 中保留 1 天 (秒)
         failure_ttl=604800, # 失败任务结果在 Redis 中保留 7 天 (秒)
         job_timeout=300 # 任务超时时间 300 秒 (秒)
     )
+    get_retry_policy().budget.deposit(queue.connection)
     logger.info(f"任务 {job.id} 已派发到 {priority} 队列")
     return job
 
@@ -2,15 +2,70 @@
 
 # 引入我们新的日志工具
 from common.logging_utils import get_logger
+import asyncio
 import functools
+import inspect
+from contextvars import ContextVar
+from typing import Optional
+
+from rq import get_current_job
+from rq.job import Job
 # 引入告警工具
 from common.alert_utils import send_email_alert, send_dingtalk_alert
 # 引入配置，现在导入 settings 对象本身
 from config.settings import settings
+from common.redis_utils import get_redis, get_async_redis
+# 任务结束时写入完成通知，唤醒 /tasks/{job_id}/wait 的等待者
+from dispatcher.core.completion import build_completion, notify_completion, notify_completion_async, on_job_success
+# 任务状态变化时更新轻量索引，供 TaskDispatcher.get_task_status 读取
+from dispatcher.core.job_index import mark_started, mark_started_async
+from dispatcher.core.retry_policy import on_job_failure
 
 # 获取一个名为 "worker" 的 logger，日志将写入 logs/worker.log 并按天切分
 logger = get_logger("worker")
 
+# 异步 worker 在同一个线程中并发执行多个任务，rq.get_current_job() 无法区分，
+# 由 AsyncWorker 在每个任务自己的协程上下文中设置（见 worker/async_worker.py）
+_current_job: ContextVar[Optional[Job]] = ContextVar("current_job", default=None)
+
+
+def set_current_job(job: Job) -> None:
+    _current_job.set(job)
+
+
+def _get_current_job() -> Optional[Job]:
+    return _current_job.get() or get_current_job()
+
+
+def current_job_id() -> str:
+    """
+    当前正在执行的任务 ID。新格式的任务参数不再包含 job_id，任务函数通过它获取。
+    """
+    job = _get_current_job()
+    return job.id if job is not None else 'unknown_job'
+
+
+def _failure_notified_by_retry_policy() -> bool:
+    """
+    当前任务挂有重试引擎的失败回调时，失败通知由回调在决定是否重试之后发送（见 dispatcher/core/retry_policy.py）；
+    此时任务的 retries_left 还没有被更新，在这里判断会把最终失败的任务误标记为 scheduled。
+    """
+    job = _get_current_job()
+    return job is not None and job.failure_callback is on_job_failure
+
+
+def _success_notified_by_callback() -> bool:
+    """当前任务挂有完成回调时，finished 通知和索引由 worker 调用回调时写入（见 dispatcher/core/completion.py）。"""
+    job = _get_current_job()
+    return job is not None and job.success_callback is on_job_success
+
+
+def current_queue_name() -> Optional[str]:
+    """当前正在执行的任务所在的队列，不在任务中时返回 None。"""
+    job = _get_current_job()
+    return job.origin if job is not None else None
+
+
 # 定义 BaseTask 类，作为所有具体任务的基类
 class BaseTask:
     """
@@ -26,44 +81,85 @@ class BaseTask:
         """
         raise NotImplementedError("Subclasses must implement 'execute' method.")
 
+def _handle_task_failure(task_name: str, job_id: str, e: Exception):
+    """
+    记录任务失败日志，并在启用告警时发送告警。
+    """
+    logger.error(f"[TASK FAIL] {task_name} (ID: {job_id}) - {e}", exc_info=True)
+
+    # 检查任务是否已经达到最大重试次数并最终失败
+    # 注意：RQ 在任务重试用尽后才会将 job.is_failed 设置为 True
+    # 这个逻辑通常由 RQ worker 内部处理，我们在这里只负责在异常发生时记录日志
+    # 并在任务最终失败时触发告警。
+    # RQ 自身会管理重试次数，当重试次数用尽且任务仍失败时，它会进入 'failed' 注册表。
+    # 告警应该在任务确定失败时触发，而不是每次异常都触发。
+
+    # 为了简化，我们假设这里的异常捕获意味着任务尝试失败，
+    # 并且如果 settings.ENABLE_ALERT 为 True，就发送告警。
+    if settings.ENABLE_ALERT: # 访问 settings 对象的属性
+        alert_subject = f"DeepSeek Dispatcher 任务失败告警: {task_name} (ID: {job_id})"
+        alert_message = (
+            f"任务 '{task_name}' (ID: {job_id}) 最终执行失败。\n"
+            f"错误信息: {e}\n"
+            f"请检查 Worker 日志以获取更多详情。"
+        )
+        send_email_alert(alert_subject, alert_message)
+        send_dingtalk_alert(alert_subject, alert_message)
+        logger.info(f"已发送任务失败告警: {task_name} (ID: {job_id})")
+
+
 def task_wrapper(func):
     """
     一个通用的任务包装器，用于日志记录和异常处理。
+    同时支持普通函数和协程函数（异步 worker 直接 await 后者）。
     """
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapped(*args, **kwargs):
+            job_id = kwargs.get('job_id') or current_job_id()
+            task_name = func.__name__
+
+            logger.info(f"[TASK START] {task_name} (ID: {job_id})")
+            await mark_started_async(get_async_redis(), job_id)
+
+            try:
+                result = await func(*args, **kwargs)
+                logger.info(f"[TASK SUCCESS] {task_name} (ID: {job_id})")
+                if not _success_notified_by_callback():
+                    await notify_completion_async(get_async_redis(), job_id, build_completion("finished", result))
+                return result
+            except Exception as e:
+                _handle_task_failure(task_name, job_id, e)
+                if not _failure_notified_by_retry_policy():
+                    await notify_completion_async(get_async_redis(), job_id, build_completion("failed", error=str(e)))
+                raise e
+            except asyncio.CancelledError:
+                # 异步 worker 在任务超时或强制停止时取消协程，同样视为一次失败；
+                # 挂有重试引擎回调时由 worker 的失败处理决定是否重试并发送通知（见 worker/async_worker.py）
+                logger.error(f"[TASK CANCELLED] {task_name} (ID: {job_id})")
+                if not _failure_notified_by_retry_policy():
+                    await notify_completion_async(get_async_redis(), job_id, build_completion("failed", error="任务超时或被取消"))
+                raise
+        return async_wrapped
+
     @functools.wraps(func) # 保持原函数的元数据，方便调试和内省
     def wrapped(*args, **kwargs):
-        # 尝试从 kwargs 中获取 job_id，用于日志追踪
-        job_id = kwargs.get('job_id', 'unknown_job')
+        # 尝试从 kwargs 中获取 job_id（旧格式任务），否则读取当前任务，用于日志追踪
+        job_id = kwargs.get('job_id') or current_job_id()
         task_name = func.__name__
 
         logger.info(f"[TASK START] {task_name} (ID: {job_id})")
+        mark_started(get_redis(), job_id)
 
         try:
             result = func(*args, **kwargs)
             logger.info(f"[TASK SUCCESS] {task_name} (ID: {job_id})")
+            if not _success_notified_by_callback():
+                notify_completion(get_redis(), job_id, build_completion("finished", result))
             return result
         except Exception as e:
-            logger.error(f"[TASK FAIL] {task_name} (ID: {job_id}) - {e}", exc_info=True)
-
-            # 检查任务是否已经达到最大重试次数并最终失败
-            # 注意：RQ 在任务重试用尽后才会将 job.is_failed 设置为 True
-            # 这个逻辑通常由 RQ worker 内部处理，我们在这里只负责在异常发生时记录日志
-            # 并在任务最终失败时触发告警。
-            # RQ 自身会管理重试次数，当重试次数用尽且任务仍失败时，它会进入 'failed' 注册表。
-            # 告警应该在任务确定失败时触发，而不是每次异常都触发。
-
-            # 为了简化，我们假设这里的异常捕获意味着任务尝试失败，
-            # 并且如果 settings.ENABLE_ALERT 为 True，就发送告警。
-            if settings.ENABLE_ALERT: # 访问 settings 对象的属性
-                alert_subject = f"DeepSeek Dispatcher 任务失败告警: {task_name} (ID: {job_id})"
-                alert_message = (
-                    f"任务 '{task_name}' (ID: {job_id}) 最终执行失败。\n"
-                    f"错误信息: {e}\n"
-                    f"请检查 Worker 日志以获取更多详情。"
-                )
-                send_email_alert(alert_subject, alert_message)
-                send_dingtalk_alert(alert_subject, alert_message)
-                logger.info(f"已发送任务失败告警: {task_name} (ID: {job_id})")
-
+            _handle_task_failure(task_name, job_id, e)
+            if not _failure_notified_by_retry_policy():
+                notify_completion(get_redis(), job_id, build_completion("failed", error=str(e)))
             raise e # 必须重新抛出异常，以便 RQ 能够将其标记为失败并进行重试（如果配置了）
     return wrapped
@@ -1,8 +1,8 @@
 # ~/projects/deepseek_dispatcher-new/dispatcher/tasks/factory.py
 
-from typing import Dict, Type, Callable, Any
+from typing import Dict, Type, Callable, Any, Optional
 # 修正导入：现在从 dispatcher.tasks.inference_task 导入的是 InferenceTask 类
-from dispatcher.tasks.inference_task import InferenceTask
+from dispatcher.tasks.inference_task import InferenceTask, run_inference
 
 # 引入我们统一的日志工具
 from common.logging_utils import get_logger
@@ -15,6 +15,8 @@ class TaskFactory:
     # 修正：将 _registered_tasks 声明为类属性，并且直接在类中初始化
     # 现在存储的是任务类 (Type[Any])，而不是直接的 callable 函数
     _registered_tasks: Dict[str, Type[Any]] = {}
+    # 任务类型 -> 模块级入队函数（只序列化导入路径和扁平参数，见 dispatcher/core/serializers.py）
+    _job_functions: Dict[str, Callable[..., Any]] = {}
 
     def __init__(self):
         # 确保在工厂初始化时注册任务，避免重复注册
@@ -23,13 +25,16 @@ class TaskFactory:
         logger.info("TaskFactory 初始化。")
 
     @classmethod
-    def register_task(cls, task_type: str, task_class: Type[Any]): # 接受任务类 Type
+    def register_task(cls, task_type: str, task_class: Type[Any], job_function: Optional[Callable[..., Any]] = None): # 接受任务类 Type
         """
         注册一个任务类到工厂。
+        job_function 为模块级入队函数，提供时 get_task_callable 返回它而不是任务实例的 execute 方法。
         """
         if task_type in cls._registered_tasks:
             logger.warning(f"任务类型 '{task_type}' 已经被注册，将被覆盖。")
         cls._registered_tasks[task_type] = task_class # 注册任务类
+        if job_function is not None:
+            cls._job_functions[task_type] = job_function
         logger.debug(f"已注册任务类型: '{task_type}'")
 
     def _register_tasks(self):
@@ -38,7 +43,7 @@ class TaskFactory:
         """
         # 修正：注册 InferenceTask 类
         # 这里的 "inference_task" 应该是你的 API 传入的任务类型字符串
-        self.register_task("inference_task", InferenceTask)
+        self.register_task("inference_task", InferenceTask, job_function=run_inference)
         # 如果有其他任务类型，可以在这里继续注册
         logger.info("所有任务已注册到 TaskFactory。")
 
@@ -50,7 +55,7 @@ class TaskFactory:
         Args:
             task_type: 任务类型字符串 (例如: "inference_task")。
         Returns:
-            任务实例的 execute 方法 (一个可调用对象)。
+            注册的模块级入队函数；未注册时返回任务实例的 execute 方法 (一个可调用对象)。
         Raises:
             ValueError: 如果任务类型未知或任务实例化失败。
             TypeError: 如果任务类没有实现 execute 方法。
@@ -59,6 +64,8 @@ class TaskFactory:
         if not task_class:
             logger.error(f"未知的任务类型: '{task_type}'")
             raise ValueError(f"未知的任务类型: {task_type}")
+        if task_type in cls._job_functions:
+            return cls._job_functions[task_type]
 
         task_instance = None
         try:
@@ -1,47 +1,46 @@
 # dispatcher/tasks/inference_task.py
 
-from typing import Dict
-from dispatcher.tasks.base_task import BaseTask
+import asyncio
+from typing import Dict, Any, Optional
+from dispatcher.tasks.base_task import BaseTask, current_job_id, current_queue_name, task_wrapper
+from services.ai_service import get_ai_service
+from dispatcher.core.token_stream import TokenStreamWriter, AsyncTokenStreamWriter
+from dispatcher.core.response_cache import get_response_cache
+from dispatcher.core.near_duplicate_cache import get_near_duplicate_cache
+from dispatcher.core.single_flight import get_single_flight
+from common.compression import encode_payload, offload_threshold
+from common.segment_store import load_text, offload_text
 from common.logging_utils import get_logger
+from common.redis_utils import get_redis, get_async_redis
+from config.settings import settings
 
 logger = get_logger("inference_task")
 
+# 推理任务负载的版本号：字段含义变化时递增，parse_job_kwargs 按版本解析
+INFERENCE_PAYLOAD_VERSION = 1
+
+
 class InferenceTask(BaseTask):
     """
     处理大模型推理任务的类。
+    新任务通过模块级函数 run_inference 入队（扁平、带版本号的负载，见 build_job_kwargs）；
+    execute / execute_async 保留给升级前入队、序列化了任务实例的旧任务。
     """
     def __init__(self, model_name: str):
         super().__init__()
         self.model_name = model_name
-        # 这里可以初始化模型客户端，例如：
-        # self.client = YourAIClient(api_key=settings.DEEPSEEK_API_KEY)
+        # 注意：旧任务会序列化任务实例，不要在这里持有模型客户端或连接池，
+        # 执行时通过 get_ai_service() 获取当前进程共享的 AIService。
 
-    def execute(self, job_id: str, task_details: Dict): # 修正：execute 方法签名与 dispatcher.dispatch 匹配
+    def _prepare(self, job_id: str, task_data: Dict[str, Any]) -> Dict[str, Any]:
         """
-        执行推理任务。
+        记录任务信息，并处理测试用的失败开关。
         :param job_id: 任务的 Job ID。
-        :param task_details: 包含任务所有详细信息的字典。
-                           例如: {"job_id": "...", "task_type": "...", "payload": {"task_data": {"prompt": "...", "should_fail_for_test": true}}}
+        :param task_data: web/app.py 传入的 task_data，例如 {"prompt": "...", "should_fail_for_test": true}
         """
-        # 从 task_details 中提取实际的 task_data
-        # task_data_for_inference_task = task_details.get('payload', {}).get('task_data', {}) # 这是之前 web/app.py 传递过来的结构
-        
-        # 修正：直接从 task_details['payload'] 中获取 task_data_for_inference_task
-        # 因为 dispatch 方法现在直接把 payload 参数（即 web/app.py 中的 task_data_for_inference_task）
-        # 作为 kwargs={'payload': payload_from_web_app} 传给 RQ 任务的。
-        # 而 execute 方法的 signature 则是 def execute(self, job_id, task_details)
-        # 所以这里的 task_details 参数就是 dispatch 传递过来的 kwargs
-        # 也就是 {'job_id': job_id, 'task_details': task_details_from_dispatch_method}
-        # 而 task_details_from_dispatch_method 包含了 'payload' 键，对应 web/app.py 传过来的 task_data_for_inference_task
-        
-        # 修正：直接访问 task_details['payload'] 拿到 web/app.py 传入的 task_data_for_inference_task
-        task_data = task_details.get('payload', {})
-
-
         prompt = task_data.get('prompt', '无提示')
         should_fail_for_test = task_data.get('should_fail_for_test', False)
 
-
         logger.info(f"开始执行推理任务 (ID: {job_id}), 模型: {self.model_name}, Prompt: {prompt[:50]}...")
 
         # --- 故意制造一个失败点，用于测试重试和告警 (KT3 验证) ---
@@ -51,19 +50,193 @@ class InferenceTask(BaseTask):
             raise ValueError(error_message)
         # --- 故意制造失败点结束 ---
 
-        try:
-            # 模拟大模型推理耗时操作
-            import time
-            time.sleep(2) # 模拟推理时间
+        return task_data
 
-            # 假设这里是调用实际的推理服务
-            # response = self.client.generate(prompt=prompt, **task_data.get('model_kwargs', {}))
-            # result = response.text
+    @staticmethod
+    def _legacy_task_data(task_details: Dict) -> Dict[str, Any]:
+        # 旧任务把 task_data 放在 task_details['payload']['task_data'] 中
+        return task_details.get('payload', {}).get('task_data', {})
 
-            result = f"模拟推理结果：成功处理了 '{prompt}'"
-            logger.info(f"推理任务执行成功 (ID: {job_id}), 结果: {result[:50]}...") # 打印部分结果
+    @staticmethod
+    def _build_result(result: str) -> Dict[str, Any]:
+        # 大结果卸载到段文件或按所在队列的阈值压缩后再交给 RQ 保存，读取方通过 common.compression.decode_payload 还原
+        return {"status": "success", "result": encode_payload(result, current_queue_name())}
 
-            return {"status": "success", "result": result}
+    @staticmethod
+    def _should_stream(task_data: Dict[str, Any]) -> bool:
+        stream = task_data.get('stream')
+        return settings.TOKEN_STREAM_ENABLED if stream is None else bool(stream)
+
+    @staticmethod
+    def _near_duplicate_result(job_id: str, task_data: Dict[str, Any]) -> Optional[str]:
+        # 近似重复缓存只查进程内存；进程第一次使用时从 Redis 加载最近的条目
+        near_cache = get_near_duplicate_cache()
+        near_cache.ensure_loaded(get_redis())
+        result = near_cache.lookup(task_data)
+        if result is not None:
+            logger.info(f"推理任务命中近似重复缓存，跳过模型调用 (ID: {job_id})")
+        return result
+
+    def _call_model(self, prompt: str, task_data: Dict[str, Any], writer: Optional[TokenStreamWriter]) -> str:
+        # 采样参数与结果缓存键（response_cache.canonical_request）使用的一致
+        model_name, model_kwargs = task_data.get('model_name'), task_data.get('model_kwargs')
+        if writer:
+            writer.start()
+            result = get_ai_service().execute_stream(prompt, writer.append, model_name=model_name, model_kwargs=model_kwargs)
+            writer.finish("finished")
+            return result
+        return get_ai_service().execute(prompt, model_name=model_name, model_kwargs=model_kwargs)
+
+    async def _call_model_async(self, prompt: str, task_data: Dict[str, Any],
+                                writer: Optional[AsyncTokenStreamWriter]) -> str:
+        model_name, model_kwargs = task_data.get('model_name'), task_data.get('model_kwargs')
+        if writer:
+            await writer.start()
+            result = await get_ai_service().execute_stream_async(prompt, writer.append, model_name=model_name,
+                                                                 model_kwargs=model_kwargs)
+            await writer.finish("finished")
+            return result
+        return await get_ai_service().execute_async(prompt, model_name=model_name, model_kwargs=model_kwargs)
+
+    def run(self, job_id: str, task_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        执行推理任务（同步 worker）。
+        相同的进行中请求由 SingleFlight 合并：只有领导者调用模型并写入缓存，其余任务复用它的结果。
+        """
+        task_data = self._prepare(job_id, task_data)
+        prompt = task_data.get('prompt', '无提示')
+        # 流式模式下增量文本实时写入 token 流（见 web/app.py 的 /tasks/{job_id}/stream），完整结果仍作为任务结果返回
+        writer = TokenStreamWriter(get_redis(), job_id) if self._should_stream(task_data) else None
+        try:
+            result = self._near_duplicate_result(job_id, task_data)
+            called_model = False
+            if result is None:
+                result, called_model = get_single_flight().run(
+                    get_redis(), job_id, task_data, lambda: self._call_model(prompt, task_data, writer)
+                )
+            if called_model:
+                logger.info(f"推理任务执行成功 (ID: {job_id}), 结果: {result[:50]}...") # 打印部分结果
+                get_response_cache().put(get_redis(), task_data, result)
+                get_near_duplicate_cache().put(get_redis(), task_data, result)
+            elif writer:
+                # 复用的结果没有增量输出，一次性写入 token 流
+                writer.start()
+                writer.append(result)
+                writer.finish("finished")
+            return self._build_result(result)
         except Exception as e:
             logger.error(f"推理任务执行失败 (ID: {job_id}): {e}", exc_info=True)
+            if writer:
+                writer.finish("failed", str(e))
             raise # 重新抛出异常，让 RQ 捕获并触发重试/告警
+
+    async def run_async(self, job_id: str, task_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        执行推理任务（异步 worker，见 worker/async_worker.py），参数和返回值与 run 相同。
+        """
+        task_data = self._prepare(job_id, task_data)
+        prompt = task_data.get('prompt', '无提示')
+        writer = AsyncTokenStreamWriter(get_async_redis(), job_id) if self._should_stream(task_data) else None
+        try:
+            # 近似重复缓存的加载和写入使用同步连接，放到线程中执行，不阻塞事件循环
+            result = await asyncio.to_thread(self._near_duplicate_result, job_id, task_data)
+            called_model = False
+            if result is None:
+                result, called_model = await get_single_flight().run_async(
+                    get_async_redis(), job_id, task_data, lambda: self._call_model_async(prompt, task_data, writer)
+                )
+            if called_model:
+                logger.info(f"推理任务执行成功 (ID: {job_id}), 结果: {result[:50]}...")
+                await get_response_cache().put_async(get_async_redis(), task_data, result)
+                await asyncio.to_thread(get_near_duplicate_cache().put, get_redis(), task_data, result)
+            elif writer:
+                await writer.start()
+                await writer.append(result)
+                await writer.finish("finished")
+            return self._build_result(result)
+        except Exception as e:
+            logger.error(f"推理任务执行失败 (ID: {job_id}): {e}", exc_info=True)
+            if writer:
+                await writer.finish("failed", str(e))
+            raise
+
+    @task_wrapper
+    def execute(self, job_id: str, task_details: Dict):
+        """
+        执行旧格式的推理任务（task_details 嵌套负载）。
+        """
+        return self.run(job_id, self._legacy_task_data(task_details))
+
+    @task_wrapper
+    async def execute_async(self, job_id: str, task_details: Dict):
+        """
+        execute 的异步版本。
+        """
+        return await self.run_async(job_id, self._legacy_task_data(task_details))
+
+
+def build_job_kwargs(task_data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    把 web/app.py 的 task_data 编码为扁平的任务参数（第 1 版）：
+    {"v": 1, "prompt": ..., "model_name": ..., "max_tokens": ..., "temperature": ..., "top_p": ..., "stream": ..., "fail": ..., "nocache": ..., "refresh": ...}
+    job_id 不再重复写入参数（任务执行时从当前任务读取），值为空的字段省略。
+    超过卸载阈值的 prompt 写入段文件，参数中只保存指针（RQ 会整体压缩任务数据，这里不再单独压缩）。
+    """
+    model_kwargs = task_data.get('model_kwargs') or {}
+    fields = {
+        "prompt": offload_text(task_data.get('prompt'), offload_threshold()),
+        "model_name": task_data.get('model_name'),
+        "max_tokens": model_kwargs.get('max_tokens'),
+        "temperature": model_kwargs.get('temperature'),
+        "top_p": model_kwargs.get('top_p'),
+        "stream": task_data.get('stream'),
+        "fail": task_data.get('should_fail_for_test') or None,
+        # cache_bypass：worker 不写入结果缓存；cache_refresh：worker 不查找近似重复缓存（结果仍会写入）
+        "nocache": task_data.get('cache_bypass') or None,
+        "refresh": task_data.get('cache_refresh') or None,
+    }
+    job_kwargs = {"v": INFERENCE_PAYLOAD_VERSION}
+    job_kwargs.update((key, value) for key, value in fields.items() if value is not None)
+    return job_kwargs
+
+
+def parse_job_kwargs(job_kwargs: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    把扁平的任务参数还原为 InferenceTask.run 使用的 task_data。
+
+    Raises:
+        ValueError: 负载版本不受支持（例如由更新版本的 web 进程写入）。
+    """
+    version = job_kwargs.get("v")
+    if version != INFERENCE_PAYLOAD_VERSION:
+        raise ValueError(f"不支持的推理任务负载版本: {version}")
+    model_kwargs = {key: job_kwargs[key] for key in ("max_tokens", "temperature", "top_p") if key in job_kwargs}
+    return {
+        "prompt": load_text(job_kwargs.get("prompt", '无提示')),
+        "model_name": job_kwargs.get("model_name"),
+        "model_kwargs": model_kwargs,
+        "stream": job_kwargs.get("stream"),
+        "should_fail_for_test": job_kwargs.get("fail", False),
+        "cache_bypass": job_kwargs.get("nocache", False),
+        "cache_refresh": job_kwargs.get("refresh", False),
+    }
+
+
+@task_wrapper
+def run_inference(**job_kwargs):
+    """
+    推理任务的入队函数：RQ 只记录导入路径，参数为 build_job_kwargs 生成的扁平负载。
+    """
+    return InferenceTask(settings.MODEL_NAME).run(current_job_id(), parse_job_kwargs(job_kwargs))
+
+
+@task_wrapper
+async def run_inference_async(**job_kwargs):
+    """
+    run_inference 的异步版本，异步 worker 按 "<函数名>_async" 查找并直接 await。
+    """
+    return await InferenceTask(settings.MODEL_NAME).run_async(current_job_id(), parse_job_kwargs(job_kwargs))
+
+
+# TaskDispatcher 通过该属性把 task_data 编码为任务参数
+run_inference.build_job_kwargs = build_job_kwargs
@@ -0,0 +1,73 @@
+# ~/projects/deepseek_dispatcher-new/scripts/bench_hedging.py
+"""
+对比启用和不启用对冲请求时的尾延迟：通过 ExecutorFactory.run_async 向 MockExecutor 发出请求，
+MockExecutor 的延迟服从对数正态分布（中位数 --median，长尾程度 --sigma），输出 p50/p95/p99 和对冲比例。
+未配置任何 API 密钥时工厂只有 mock 执行器，对冲请求发回同一个执行器（相当于同一供应商的另一次独立请求）。
+前 --warmup 个请求只用于积累延迟样本，不计入结果。不连接 Redis（统计上报失败会被忽略）。
+
+用法：
+    PYTHONPATH=. python scripts/bench_hedging.py --requests 1000 --concurrency 50 --median 0.02 --sigma 1.0
+"""
+
+import argparse
+import asyncio
+import time
+from typing import List
+
+from ai_executor.factory import ExecutorFactory
+from config.settings import settings
+
+
+def _percentile(samples: List[float], percentile: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+async def _measure(factory: ExecutorFactory, requests: int, concurrency: int) -> List[float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+
+    async def one(index: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            await factory.run_async(f"bench {index}")
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    return latencies
+
+
+async def run(requests: int, concurrency: int, warmup: int) -> None:
+    print(f"请求数: {requests}, 并发: {concurrency}, 模拟延迟中位数: {settings.MOCK_LATENCY_MEDIAN}s, "
+          f"sigma: {settings.MOCK_LATENCY_SIGMA}, 对冲分位数: p{settings.HEDGE_PERCENTILE:g}, "
+          f"预算比例: {settings.HEDGE_BUDGET_RATIO}")
+    print(f"{'mode':<10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'hedged':>10}{'ratio':>8}")
+    for hedging in (False, True):
+        settings.HEDGE_ENABLED = hedging
+        factory = ExecutorFactory()
+        await _measure(factory, warmup, concurrency)
+        before = factory.hedging.stats.snapshot()
+        latencies = await _measure(factory, requests, concurrency)
+        after = factory.hedging.stats.snapshot()
+        hedged = after["hedged"] - before["hedged"]
+        row = [_percentile(latencies, p) * 1000 for p in (50, 95, 99, 100)]
+        print(f"{'hedged' if hedging else 'baseline':<10}" + "".join(f"{value:>10.1f}" for value in row) +
+              f"{hedged:>10}{hedged / requests:>8.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="对冲请求尾延迟基准测试")
+    parser.add_argument("--requests", type=int, default=1000, help="每种模式计入结果的请求数")
+    parser.add_argument("--concurrency", type=int, default=50, help="并发请求数")
+    parser.add_argument("--warmup", type=int, default=200, help="每种模式开始计时前的预热请求数")
+    parser.add_argument("--median", type=float, default=0.02, help="模拟延迟中位数 (秒)")
+    parser.add_argument("--sigma", type=float, default=1.0, help="模拟延迟的对数正态分布 sigma")
+    parser.add_argument("--percentile", type=float, default=settings.HEDGE_PERCENTILE, help="对冲等待时间的分位数")
+    parser.add_argument("--budget-ratio", type=float, default=settings.HEDGE_BUDGET_RATIO, help="对冲请求占比上限")
+    args = parser.parse_args()
+    settings.MOCK_LATENCY_MEDIAN = args.median
+    settings.MOCK_LATENCY_SIGMA = args.sigma
+    settings.HEDGE_PERCENTILE = args.percentile
+    settings.HEDGE_BUDGET_RATIO = args.budget_ratio
+    settings.HEDGE_MIN_DELAY = 0.0 # 模拟延迟为毫秒级，不使用面向真实供应商的下限
+    asyncio.run(run(args.requests, args.concurrency, args.warmup))
@@ -0,0 +1,93 @@
+# ~/projects/deepseek_dispatcher-new/scripts/bench_job_serializer.py
+"""
+对比推理任务在 Redis 中的体积和编解码耗时：
+- legacy-pickle：升级前的格式（绑定方法 + 任务实例 + 嵌套 task_details，pickle 编码）
+- flat-<格式>：run_inference + 扁平带版本号的参数，分别用 pickle / orjson / msgpack 编码
+
+体积为 RQ 写入任务哈希的全部字段（data 字段经 zlib 压缩），legacy 使用 RQ 默认的描述；编码耗时为 Job.create + to_dict，
+解码耗时为从哈希恢复任务并读取 kwargs。不连接 Redis。
+
+用法：
+    PYTHONPATH=. python scripts/bench_job_serializer.py --jobs 2000 --prompt-chars 500
+"""
+
+import argparse
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Tuple
+
+from redis import Redis
+from rq.job import Job
+from rq.serializers import DefaultSerializer
+
+from dispatcher.core.dispatcher import TaskDispatcher
+from dispatcher.core.serializers import SERIALIZER_FORMATS, JobSerializer
+from dispatcher.tasks.inference_task import InferenceTask, run_inference
+
+
+def _task_data(prompt_chars: int) -> Dict[str, Any]:
+    # 与 web/app.py 的 _build_inference_task_data 结构一致
+    return {
+        "prompt": ("请总结以下内容：" * prompt_chars)[:prompt_chars],
+        "should_fail_for_test": False,
+        "model_kwargs": {"max_tokens": 1024, "temperature": 0.7, "top_p": 1.0},
+        "model_name": "deepseek",
+        "stream": True,
+    }
+
+
+def _variants() -> List[Tuple[str, Callable[..., Any], Any]]:
+    variants = [("legacy-pickle", InferenceTask(model_name="deepseek").execute, DefaultSerializer)]
+    for fmt in SERIALIZER_FORMATS:
+        try:
+            variants.append((f"flat-{fmt}", run_inference, JobSerializer(fmt)))
+        except ImportError as e:
+            print(f"跳过 flat-{fmt}: {e}")
+    return variants
+
+
+def _hash_bytes(mapping: Dict[str, Any]) -> int:
+    total = 0
+    for key, value in mapping.items():
+        value = value if isinstance(value, bytes) else str(value).encode()
+        total += len(key) + len(value)
+    return total
+
+
+def run(jobs: int, prompt_chars: int) -> None:
+    connection = Redis() # 只用于构造 Job，不会发起连接
+    task_data = _task_data(prompt_chars)
+    print(f"任务数: {jobs}, prompt 长度: {prompt_chars} 字符")
+    print(f"{'variant':<16}{'data B/job':>12}{'hash B/job':>12}{'encode us':>12}{'decode us':>12}")
+    for name, func, serializer in _variants():
+        mappings = []
+        started = time.perf_counter()
+        for _ in range(jobs):
+            job_id = str(uuid.uuid4())
+            job = Job.create(
+                func, kwargs=TaskDispatcher._build_task_kwargs(func, job_id, task_data),
+                id=job_id, connection=connection, serializer=serializer,
+                description=func.__qualname__ if func is run_inference else None, # 与 TaskDispatcher.dispatch 一致
+            )
+            mappings.append(job.to_dict())
+        encode_us = (time.perf_counter() - started) / jobs * 1e6
+
+        started = time.perf_counter()
+        for mapping in mappings:
+            job = Job(str(uuid.uuid4()), connection=connection, serializer=serializer)
+            job.restore({key.encode(): value if isinstance(value, bytes) else str(value).encode()
+                         for key, value in mapping.items()})
+            job.kwargs
+        decode_us = (time.perf_counter() - started) / jobs * 1e6
+
+        data_bytes = sum(len(mapping["data"]) for mapping in mappings) / jobs
+        hash_bytes = sum(_hash_bytes(mapping) for mapping in mappings) / jobs
+        print(f"{name:<16}{data_bytes:>12.0f}{hash_bytes:>12.0f}{encode_us:>12.1f}{decode_us:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="RQ 任务序列化格式基准测试")
+    parser.add_argument("--jobs", type=int, default=2000, help="每种格式编码的任务数")
+    parser.add_argument("--prompt-chars", type=int, default=500, help="prompt 长度（字符）")
+    args = parser.parse_args()
+    run(args.jobs, args.prompt_chars)
@@ -21,7 +21,7 @@ QUEUE_LIST=("high" "default" "low")
 for QUEUE in "${QUEUE_LIST[@]}"; do
     echo "  -> 启动 worker [$QUEUE]"
     # 使用完整的虚拟环境路径来运行 rq worker
-    nohup "$PROJECT_ROOT"/.venv_dispatcher_new/bin/rq worker "$QUEUE" --with-scheduler > "logs/worker_$QUEUE.log" 2>&1 &
+    nohup "$PROJECT_ROOT"/.venv_dispatcher_new/bin/rq worker "$QUEUE" --with-scheduler --serializer dispatcher.core.serializers.job_serializer > "logs/worker_$QUEUE.log" 2>&1 &
 done
 
 sleep 2
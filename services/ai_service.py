@@ -1,5 +1,7 @@
 # ~/projects/deepseek_dispatcher-new/services/ai_service.py
 
+from typing import Any, Awaitable, Callable, Dict, Optional
+
 from ai_executor.factory import ExecutorFactory
 from services.exceptions import ServiceExecutionError
 from common.logging_utils import get_logger
@@ -18,12 +20,13 @@ class AIService:
         self.executor_factory = ExecutorFactory()
         logger.info("AIService 已初始化。")
 
-    def execute(self, query: str, model_name: str = None) -> str:
+    def execute(self, query: str, model_name: str = None, model_kwargs: Optional[Dict[str, Any]] = None) -> str:
         """
         执行AI推理。
         Args:
             query (str): 输入给AI模型的查询文本。
             model_name (str, optional): 指定要使用的模型名称。如果为None，则使用默认/可用模型。
+            model_kwargs (dict, optional): 采样参数 max_tokens / temperature / top_p，未指定的使用配置的默认值。
         Returns:
             str: AI模型的推理结果。
         Raises:
@@ -33,7 +36,7 @@ class AIService:
         try:
             # 通过 ExecutorFactory 获取并运行合适的执行器
             # model_name 参数现在传递给 factory.run
-            result = self.executor_factory.run(query, model_name=model_name) 
+            result = self.executor_factory.run(query, model_name=model_name, model_kwargs=model_kwargs)
             logger.info("AIService 推理执行成功。")
             return result
         except ServiceExecutionError as e:
@@ -43,3 +46,68 @@ class AIService:
             logger.critical(f"AIService 发生意外错误: {e}", exc_info=True)
             raise ServiceExecutionError(f"AI 服务发生意外错误: {str(e)}")
 
+    async def execute_async(self, query: str, model_name: str = None, model_kwargs: Optional[Dict[str, Any]] = None) -> str:
+        """
+        异步执行AI推理，参数和异常语义与 execute 相同。
+        """
+        logger.info(f"AIService 接收到异步查询: '{query[:50]}...' (长度: {len(query)})")
+        try:
+            result = await self.executor_factory.run_async(query, model_name=model_name, model_kwargs=model_kwargs)
+            logger.info("AIService 异步推理执行成功。")
+            return result
+        except ServiceExecutionError as e:
+            logger.error(f"AIService 异步推理失败: {e}", exc_info=True)
+            raise ServiceExecutionError(f"AI 服务执行失败: {str(e)}")
+        except Exception as e:
+            logger.critical(f"AIService 发生意外错误: {e}", exc_info=True)
+            raise ServiceExecutionError(f"AI 服务发生意外错误: {str(e)}")
+
+    def execute_stream(self, query: str, on_delta: Callable[[str], None], model_name: str = None,
+                       model_kwargs: Optional[Dict[str, Any]] = None) -> str:
+        """
+        流式执行AI推理，每段增量文本回调 on_delta，返回完整结果。异常语义与 execute 相同。
+        """
+        logger.info(f"AIService 接收到流式查询: '{query[:50]}...' (长度: {len(query)})")
+        try:
+            result = self.executor_factory.run_stream(query, on_delta, model_name=model_name, model_kwargs=model_kwargs)
+            logger.info("AIService 流式推理执行成功。")
+            return result
+        except ServiceExecutionError as e:
+            logger.error(f"AIService 流式推理失败: {e}", exc_info=True)
+            raise ServiceExecutionError(f"AI 服务执行失败: {str(e)}")
+        except Exception as e:
+            logger.critical(f"AIService 发生意外错误: {e}", exc_info=True)
+            raise ServiceExecutionError(f"AI 服务发生意外错误: {str(e)}")
+
+    async def execute_stream_async(self, query: str, on_delta: Callable[[str], Awaitable[None]], model_name: str = None,
+                                   model_kwargs: Optional[Dict[str, Any]] = None) -> str:
+        """
+        execute_stream 的异步版本，on_delta 为协程函数。
+        """
+        logger.info(f"AIService 接收到异步流式查询: '{query[:50]}...' (长度: {len(query)})")
+        try:
+            result = await self.executor_factory.run_stream_async(query, on_delta, model_name=model_name,
+                                                                 model_kwargs=model_kwargs)
+            logger.info("AIService 异步流式推理执行成功。")
+            return result
+        except ServiceExecutionError as e:
+            logger.error(f"AIService 异步流式推理失败: {e}", exc_info=True)
+            raise ServiceExecutionError(f"AI 服务执行失败: {str(e)}")
+        except Exception as e:
+            logger.critical(f"AIService 发生意外错误: {e}", exc_info=True)
+            raise ServiceExecutionError(f"AI 服务发生意外错误: {str(e)}")
+
+
+_ai_service = None
+
+
+def get_ai_service() -> AIService:
+    """
+    获取当前进程共享的 AIService 实例（懒加载）。
+    任务对象会被 RQ 序列化到 Redis，不能持有执行器和连接池，需要时通过此函数获取。
+    """
+    global _ai_service
+    if _ai_service is None:
+        _ai_service = AIService()
+    return _ai_service
+
@@ -0,0 +1,22 @@
+# tests/ai_executor_tests/conftest.py
+import pytest
+
+from ai_executor.router import AdaptiveRouter
+
+
+def _router(names=("deepseek", "dashscope"), **overrides):
+    # 不粘滞、不探测、错误率不衰减，便于断言每一步的选择
+    options = dict(alpha=0.5, in_flight_weight=0.5, error_penalty=30.0, error_half_life=0,
+                   initial_latency=2.0, stickiness=0, switch_margin=0.2, probe_interval=0)
+    options.update(overrides)
+    return AdaptiveRouter(list(names), **options)
+
+
+@pytest.fixture(scope="class")
+def make_router(request):
+    """
+    AdaptiveRouter 的构造函数，关键字参数覆盖默认配置。
+    unittest.TestCase 通过 @pytest.mark.usefixtures("make_router") 使用，设置为 self.make_router。
+    """
+    request.cls.make_router = staticmethod(_router)
+    return _router
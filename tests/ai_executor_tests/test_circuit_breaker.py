@@ -0,0 +1,101 @@
+# tests/ai_executor_tests/test_circuit_breaker.py
+import asyncio
+import time
+import unittest
+
+import fakeredis
+import httpx
+
+from ai_executor.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, breaker_states
+from ai_executor.executor import DeepSeekExecutor, ModelClientError, ModelExecutionError, ModelTimeoutError
+
+
+def _status_error(status_code):
+    request = httpx.Request("POST", "https://api.example.com")
+    response = httpx.Response(status_code, request=request)
+    return httpx.HTTPStatusError(f"{status_code}", request=request, response=response), response
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = DeepSeekExecutor(api_key="k", model_name="deepseek-chat", temperature=0.7, top_p=1.0, max_tokens=16)
+
+    def test_client_errors_do_not_count_as_provider_failures(self):
+        for status_code, expected in ((400, "ok"), (429, "error"), (503, "error")):
+            error = self.executor._to_execution_error(*_status_error(status_code))
+            self.assertIsInstance(error, ModelExecutionError)
+            self.assertEqual(CircuitBreaker.outcome(error), expected, status_code)
+        self.assertIsInstance(self.executor._to_execution_error(*_status_error(404)), ModelClientError)
+
+    def test_timeouts_are_classified_separately(self):
+        error = self.executor._to_execution_error(httpx.ReadTimeout("timeout"), None)
+        self.assertIsInstance(error, ModelTimeoutError)
+        self.assertEqual(CircuitBreaker.outcome(error), "timeout")
+
+    def test_disabled_breaker_allows_without_redis(self):
+        breaker = CircuitBreaker(enabled=False, window_seconds=60, min_requests=10, error_rate=0.5,
+                                 timeout_threshold=5, open_seconds=30, half_open_probes=2, probe_timeout=180)
+        self.assertEqual(breaker.allow("deepseek"), (True, False))
+        with self.assertRaises(ModelExecutionError):
+            with breaker.guard("deepseek", probe=False):
+                raise ModelExecutionError("down")
+
+
+class TestCircuitBreakerTransitions(unittest.TestCase):
+    """用 fakeredis 执行 Lua 脚本，检查 closed -> open -> half_open -> closed 的状态转换。"""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.breaker = CircuitBreaker(enabled=True, window_seconds=60, min_requests=2, error_rate=0.5,
+                                      timeout_threshold=3, open_seconds=0.05, half_open_probes=1, probe_timeout=180,
+                                      redis_conn=self.redis)
+
+    def _state(self):
+        return breaker_states(self.redis)["deepseek"]
+
+    def _trip(self):
+        self.breaker.record("deepseek", "ok", probe=False)
+        self.assertEqual(self._state()["state"], CLOSED)
+        self.breaker.record("deepseek", "error", probe=False)
+        self.assertEqual(self._state()["state"], OPEN)
+        self.assertEqual(self._state()["reason"], "error_rate")
+
+    def test_open_half_open_closed(self):
+        self._trip()
+        self.assertEqual(self.breaker.allow("deepseek"), (False, False))
+        time.sleep(0.06)
+        # 冷却期满后只放行 half_open_probes 个探测请求
+        self.assertEqual(self.breaker.allow("deepseek"), (True, True))
+        self.assertEqual(self._state()["state"], HALF_OPEN)
+        self.assertEqual(self.breaker.allow("deepseek"), (False, False))
+        self.breaker.record("deepseek", "ok", probe=True)
+        state = self._state()
+        self.assertEqual((state["state"], state["requests"], state["trips"], state["rejected"]), (CLOSED, 0, 1, 2))
+        self.assertEqual(self.breaker.allow("deepseek"), (True, False))
+
+    def test_failed_probe_reopens(self):
+        self._trip()
+        time.sleep(0.06)
+        self.assertEqual(self.breaker.allow("deepseek"), (True, True))
+        self.breaker.record("deepseek", "timeout", probe=True)
+        self.assertEqual((self._state()["state"], self._state()["reason"]), (OPEN, "probe_failed"))
+
+    def test_released_probe_frees_the_slot(self):
+        self._trip()
+        time.sleep(0.06)
+        self.assertEqual(self.breaker.allow("deepseek"), (True, True))
+        self.breaker.finish("deepseek", asyncio.CancelledError(), probe=True)
+        self.assertEqual(self.breaker.allow("deepseek"), (True, True))
+
+    def test_timeouts_trip_below_min_requests(self):
+        breaker = CircuitBreaker(enabled=True, window_seconds=60, min_requests=100, error_rate=0.5,
+                                 timeout_threshold=2, open_seconds=30, half_open_probes=1, probe_timeout=180,
+                                 redis_conn=self.redis)
+        breaker.record("dashscope", "timeout", probe=False)
+        breaker.record("dashscope", "timeout", probe=False)
+        self.assertEqual(breaker_states(self.redis)["dashscope"]["reason"], "timeouts")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+# tests/ai_executor_tests/test_concurrency_limiter.py
+import unittest
+
+from ai_executor.concurrency_limiter import AdaptiveConcurrencyLimiter
+from ai_executor.executor import ModelClientError, ModelOverloadedError, ModelTimeoutError
+
+
+def _limiter(**overrides):
+    options = dict(enabled=True, initial_limit=8, min_limit=1, max_limit=256, increase=1.0, decrease_factor=0.5,
+                   decrease_interval=2.0, latency_tolerance=3.0, max_pause=30.0, permit_ttl=600, max_wait=1.0,
+                   poll_interval=0.1)
+    options.update(overrides)
+    return AdaptiveConcurrencyLimiter(**options)
+
+
+class TestConcurrencyLimiter(unittest.TestCase):
+
+    def test_feedback_classification(self):
+        limiter = _limiter()
+        self.assertEqual(limiter._feedback(None), ("ok", 0.0))
+        self.assertEqual(limiter._feedback(ModelOverloadedError("503", retry_after=5)), ("overload", 5.0))
+        # Retry-After 超过上限时截断
+        self.assertEqual(limiter._feedback(ModelOverloadedError("429", retry_after=3600)), ("overload", 30.0))
+        self.assertEqual(limiter._feedback(ModelTimeoutError("timeout")), ("overload", 0.0))
+        # 只针对单个 Key 的 429 由 Key 池处理
+        self.assertEqual(limiter._feedback(ModelOverloadedError("429", key_scoped=True)), ("neutral", 0.0))
+        self.assertEqual(limiter._feedback(ModelClientError("400")), ("neutral", 0.0))
+
+    def test_disabled_limiter_grants_without_redis(self):
+        limiter = _limiter(enabled=False)
+        with limiter.permit("deepseek"):
+            pass
+        self.assertEqual(limiter.try_acquire("deepseek"), ("", 0.0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+# tests/ai_executor_tests/test_factory.py
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import httpx
+
+from ai_executor.factory import ExecutorFactory
+from config.settings import settings
+
+# 同时满足 DeepSeek（choices）和 DashScope（output.choices）两种响应结构
+_BODY = {"choices": [{"message": {"content": "ok"}}], "output": {"choices": [{"message": {"content": "ok"}}]}}
+
+
+class _FakeClient:
+    def __init__(self, provider, requests):
+        self.provider = provider
+        self.requests = requests
+
+    def post(self, url, json, headers):
+        self.requests.append((self.provider, json))
+        return httpx.Response(200, json=_BODY, request=httpx.Request("POST", url))
+
+
+class _FakeAsyncClient(_FakeClient):
+    async def post(self, url, json, headers):
+        return super().post(url, json, headers)
+
+
+class _FakeHttpPool:
+    def __init__(self):
+        self.requests = []
+
+    def get_client(self, provider):
+        return _FakeClient(provider, self.requests)
+
+    def get_async_client(self, provider):
+        return _FakeAsyncClient(provider, self.requests)
+
+
+class TestExecutorFactory(unittest.TestCase):
+    """路由选出的执行器收到的模型名（ROUTER_PROVIDER_MODELS 使用默认配置）。"""
+
+    def setUp(self):
+        patcher = patch.multiple(settings, DEEPSEEK_API_KEY="sk-deepseek", DASHSCOPE_API_KEY="sk-dashscope",
+                                 MODEL_NAME="deepseek-chat", BREAKER_ENABLED=False, AIMD_ENABLED=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.http_pool = _FakeHttpPool()
+        pool_patcher = patch("ai_executor.executor.get_http_pool", return_value=self.http_pool)
+        pool_patcher.start()
+        self.addCleanup(pool_patcher.stop)
+        self.factory = ExecutorFactory()
+
+    def _sent(self, model_name):
+        self.factory.run("你好", model_name=model_name)
+        return self.http_pool.requests[-1]
+
+    def test_requested_model_is_sent_to_the_provider_that_serves_it(self):
+        self.assertEqual(self._sent("qwen-max"), ("dashscope", self._payload_model("qwen-max")))
+        self.assertEqual(self._sent("deepseek-reasoner"), ("deepseek", self._payload_model("deepseek-reasoner")))
+
+    def test_provider_default_model_is_used_otherwise(self):
+        # MODEL_NAME 是 DeepSeek 的模型，DashScope 使用自己列表中的第一个模型
+        self.assertEqual(self.factory.executors["dashscope"].model_name, "qwen-turbo")
+        self.assertEqual(self._sent("dashscope"), ("dashscope", self._payload_model("qwen-turbo")))
+        provider, payload = self._sent("some-unlisted-model")
+        self.assertEqual(payload["model"], self.factory.executors[provider].model_name)
+        # 对冲到不服务该模型的供应商时同样使用默认模型
+        self.assertEqual(self.factory._request_params("dashscope", "deepseek-chat"), {})
+
+    def test_async_run_sends_requested_model(self):
+        asyncio.run(self.factory.run_async("你好", model_name="qwen-plus"))
+        self.assertEqual(self.http_pool.requests[-1], ("dashscope", self._payload_model("qwen-plus")))
+
+    def test_model_kwargs_are_sent_to_the_provider(self):
+        # 与结果缓存键一致：指定的采样参数原样发送，None 使用配置的默认值
+        model_kwargs = {"max_tokens": 512, "temperature": 0.0, "top_p": None}
+        self.factory.run("你好", model_name="qwen-max", model_kwargs=model_kwargs)
+        expected = dict(self._payload_model("qwen-max"), max_tokens=512, temperature=0.0)
+        self.assertEqual(self.http_pool.requests[-1], ("dashscope", expected))
+        asyncio.run(self.factory.run_async("你好", model_name="deepseek-chat", model_kwargs=model_kwargs))
+        self.assertEqual(self.http_pool.requests[-1][1]["temperature"], 0.0)
+
+    def test_unmetered_key_pool_skips_token_estimation(self):
+        # 单个 Key 且不限 RPM/TPM 时不预占额度，请求前后都不分词
+        with patch("ai_executor.executor.estimate_prompt_tokens") as estimate, \
+                patch("ai_executor.executor.count_tokens") as count:
+            self.factory.run("你好", model_name="deepseek-chat")
+            asyncio.run(self.factory.run_async("你好", model_name="qwen-max"))
+        estimate.assert_not_called()
+        count.assert_not_called()
+
+    @staticmethod
+    def _payload_model(model):
+        return {"model": model, "messages": [{"role": "user", "content": "你好"}],
+                "temperature": settings.MODEL_TEMPERATURE, "top_p": settings.MODEL_TOP_P,
+                "max_tokens": settings.MODEL_MAX_TOKENS}
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+# tests/ai_executor_tests/test_hedging.py
+import unittest
+
+import pytest
+
+from ai_executor.hedging import HedgeBudget, HedgePolicy
+
+
+@pytest.mark.usefixtures("make_router")
+class TestHedging(unittest.TestCase):
+
+    def test_budget_limits_hedge_ratio(self):
+        budget = HedgeBudget(ratio=0.25, burst=1.0)
+        granted = 0
+        for _ in range(1000):
+            budget.deposit()
+            granted += budget.try_acquire()
+        # 每 4 个请求 1 个（桶容量为 1，初始令牌不会额外累积）
+        self.assertEqual(granted, 250)
+
+    def test_delay_follows_recent_latency_percentile(self):
+        router = self.make_router(["a", "b"])
+        policy = HedgePolicy(enabled=True, percentile=90.0, min_samples=10, min_delay=0.05,
+                             budget_ratio=0.05, budget_burst=10.0)
+        for elapsed in range(1, 10):
+            router.record("a", elapsed / 100, True)
+        self.assertIsNone(policy.hedge_delay(router, "a")) # 样本不足
+        router.record("a", 0.10, True)
+        router.record("a", 5.0, False) # 失败不计入延迟样本
+        self.assertAlmostEqual(policy.hedge_delay(router, "a"), 0.10)
+        self.assertEqual(policy.hedge_delay(router, "b"), None)
+
+    def test_disabled_policy_never_hedges(self):
+        router = self.make_router(["a", "b"])
+        for _ in range(50):
+            router.record("a", 0.2, True)
+        policy = HedgePolicy(enabled=False, percentile=95.0, min_samples=1, min_delay=0.0,
+                             budget_ratio=1.0, budget_burst=1.0)
+        self.assertIsNone(policy.hedge_delay(router, "a"))
+        self.assertEqual(policy.stats.snapshot()["requests"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
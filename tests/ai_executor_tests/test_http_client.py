@@ -0,0 +1,41 @@
+# tests/ai_executor_tests/test_http_client.py
+import unittest
+from unittest.mock import patch
+
+from ai_executor.http_client import _ProviderStats, provider_timeout
+from config.settings import settings
+
+
+class _FakeStream:
+    """模拟 httpcore 的底层连接对象（需要支持弱引用）。"""
+    pass
+
+
+class TestHTTPClientPool(unittest.TestCase):
+
+    def test_reuse_is_counted_per_connection(self):
+        stats = _ProviderStats()
+        first, second = _FakeStream(), _FakeStream()
+        for stream in (first, first, first, second):
+            stats.record(stream)
+
+        self.assertEqual(stats.requests, 4)
+        self.assertEqual(stats.new_connections, 2)
+
+    def test_provider_timeout_falls_back_to_defaults(self):
+        with patch.object(settings, "DEEPSEEK_CONNECT_TIMEOUT", None), \
+                patch.object(settings, "DEEPSEEK_READ_TIMEOUT", None):
+            timeout = provider_timeout("deepseek")
+        self.assertEqual(timeout.connect, settings.HTTP_CONNECT_TIMEOUT)
+        self.assertEqual(timeout.read, settings.TASK_JOB_TIMEOUT)
+
+    def test_provider_timeout_uses_provider_settings(self):
+        with patch.object(settings, "DASHSCOPE_CONNECT_TIMEOUT", 1.5), \
+                patch.object(settings, "DASHSCOPE_READ_TIMEOUT", 42.0):
+            timeout = provider_timeout("dashscope")
+        self.assertEqual(timeout.connect, 1.5)
+        self.assertEqual(timeout.read, 42.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+# tests/ai_executor_tests/test_key_pool.py
+import unittest
+from unittest.mock import patch
+
+from ai_executor import tokenizer
+from ai_executor.key_pool import KeyPool, key_fingerprint, provider_keys
+from config.settings import settings
+
+
+class TestKeyPool(unittest.TestCase):
+
+    def test_single_unlimited_key_skips_redis(self):
+        pool = KeyPool("deepseek", ["sk-a", "sk-a"], rpm=0, tpm=0)
+        self.assertFalse(pool.metered)
+        lease = pool.acquire(prompt_tokens=10, reserved_tokens=110)
+        self.assertEqual(lease.api_key, "sk-a")
+        self.assertIsNone(lease.bucket)
+        pool.settle(lease, used_tokens=42)
+        stats = pool.snapshot()["keys"][key_fingerprint("sk-a")]
+        self.assertEqual((stats["requests"], stats["reserved_tokens"], stats["used_tokens"]), (1, 110, 42))
+
+    def test_provider_keys_merges_and_dedupes(self):
+        with patch.object(settings, "DEEPSEEK_API_KEY", "sk-a"), \
+                patch.object(settings, "DEEPSEEK_API_KEYS", ["sk-b", "sk-a", ""]):
+            self.assertEqual(provider_keys("deepseek"), ["sk-a", "sk-b"])
+        with patch.object(settings, "DEEPSEEK_API_KEY", None), patch.object(settings, "DEEPSEEK_API_KEYS", []):
+            self.assertEqual(provider_keys("deepseek"), [])
+
+    def test_fingerprint_does_not_leak_key(self):
+        fingerprint = key_fingerprint("sk-secret-value")
+        self.assertEqual(len(fingerprint), 12)
+        self.assertNotIn("secret", fingerprint)
+
+    def test_token_estimate_falls_back_to_characters(self):
+        # 编码器不可用（例如离线环境）时按字符数估计
+        with patch.dict(tokenizer._encoders, {"unknown-model": None}):
+            self.assertEqual(tokenizer.count_tokens("你好世界", "unknown-model"), 4)
+            self.assertEqual(tokenizer.estimate_prompt_tokens("", "unknown-model"), tokenizer._MESSAGE_OVERHEAD_TOKENS)
+
+
+if __name__ == '__main__':
+    unittest.main()
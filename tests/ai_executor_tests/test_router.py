@@ -0,0 +1,41 @@
+# tests/ai_executor_tests/test_router.py
+import unittest
+
+import pytest
+
+
+@pytest.mark.usefixtures("make_router")
+class TestAdaptiveRouter(unittest.TestCase):
+
+    def test_prefers_faster_and_healthier_executor(self):
+        router = self.make_router()
+        router.record("deepseek", 1.0, True)
+        router.record("dashscope", 0.5, True)
+        self.assertEqual(router.choose(["deepseek", "dashscope"]), "dashscope")
+        router.record("dashscope", 0.5, False) # 错误率 0.5，加 15 秒惩罚
+        self.assertEqual(router.choose(["deepseek", "dashscope"]), "deepseek")
+        # 只有一个候选时不参与打分
+        self.assertEqual(router.choose(["dashscope"]), "dashscope")
+
+    def test_in_flight_requests_raise_expected_latency(self):
+        router = self.make_router()
+        router.record("deepseek", 1.0, True)
+        router.record("dashscope", 1.5, True)
+        with router.track("deepseek"), router.track("deepseek"):
+            # 1.0 × (1 + 0.5 × 2) = 2.0 > 1.5
+            self.assertEqual(router.choose(["deepseek", "dashscope"]), "dashscope")
+        self.assertEqual(router.snapshot()["executors"]["deepseek"]["in_flight"], 0)
+
+    def test_stickiness_ignores_small_differences(self):
+        router = self.make_router(stickiness=60)
+        router.record("deepseek", 1.0, True)
+        router.record("dashscope", 1.1, True)
+        self.assertEqual(router.choose(["deepseek", "dashscope"]), "deepseek")
+        router.record("deepseek", 1.3, True) # EWMA 1.15，只比 dashscope 慢约 5%
+        self.assertEqual(router.choose(["deepseek", "dashscope"]), "deepseek")
+        router.record("deepseek", 3.0, True) # 明显变慢，窗口内也切换
+        self.assertEqual(router.choose(["deepseek", "dashscope"]), "dashscope")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+# tests/common_tests/test_minhash.py
+import unittest
+
+from common.minhash import LSHIndex, MinHasher, jaccard_estimate, normalize_text
+
+PROMPT = "请用三句话总结这篇文章的主要观点，并给出一个适合做标题的短语。文章讨论了城市交通拥堵的成因和治理方案。"
+
+
+class TestMinHash(unittest.TestCase):
+
+    def setUp(self):
+        self.hasher = MinHasher(128, 5)
+
+    def test_near_duplicates_score_higher_than_unrelated(self):
+        signature = self.hasher.signature(PROMPT)
+        # 空白和全角字符的差异在归一化后消失
+        self.assertEqual(normalize_text(PROMPT), normalize_text(" " + PROMPT.replace("，", ", ") + "  "))
+        self.assertEqual(jaccard_estimate(signature, self.hasher.signature(PROMPT + "\n")), 1.0)
+        self.assertGreater(jaccard_estimate(signature, self.hasher.signature(PROMPT + "！")), 0.85)
+        near = jaccard_estimate(signature, self.hasher.signature(PROMPT.replace("三句话", "两句话")))
+        unrelated = jaccard_estimate(signature, self.hasher.signature("Translate the following sentence into French."))
+        self.assertGreater(near, 0.6)
+        self.assertLess(unrelated, 0.1)
+
+    def test_symbols_and_operators_are_kept(self):
+        # 只由符号或 emoji 组成的 prompt 不会归一化成同一个空串
+        self.assertEqual(len({normalize_text(text) for text in ("???", "!!!", "😀", "？？？")}), 3)
+        self.assertEqual(normalize_text("？？？"), "???")
+        # 运算符不同的问题不是重复
+        self.assertNotEqual(normalize_text("Is 10 < 5?"), normalize_text("Is 10 > 5?"))
+        self.assertLess(jaccard_estimate(self.hasher.signature("Is 10 < 5?"), self.hasher.signature("Is 10 > 5?")), 0.5)
+
+    def test_index_respects_namespace_and_capacity(self):
+        index = LSHIndex(128, 16, max_entries=2)
+        index.insert("a", "model-a", self.hasher.signature(PROMPT), "结果 A")
+        index.insert("b", "model-a", self.hasher.signature("第二个 prompt"), "结果 B")
+        found = index.query("model-a", self.hasher.signature(PROMPT + "谢谢"), 0.8)
+        self.assertEqual(found[0], "结果 A")
+        self.assertIsNone(index.query("model-b", self.hasher.signature(PROMPT), 0.8))
+
+        index.insert("c", "model-a", self.hasher.signature("第三个 prompt"), "结果 C") # 淘汰最久未使用的 b
+        self.assertNotIn("b", index)
+        self.assertIn("a", index)
+        self.assertEqual(index.evictions, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
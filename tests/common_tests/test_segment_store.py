@@ -0,0 +1,42 @@
+# tests/common_tests/test_segment_store.py
+import os
+import tempfile
+import time
+import unittest
+
+from common.segment_store import OFFLOAD_MARKER, SegmentStore
+
+
+class TestSegmentStore(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.store = SegmentStore(self.root, max_segment_bytes=32, rollover_seconds=3600, ttl=3600)
+
+    def test_append_and_read_back(self):
+        first = self.store.append("你好".encode("utf-8"))
+        second = self.store.append(b"world")
+        self.assertEqual(first[OFFLOAD_MARKER], second[OFFLOAD_MARKER])
+        self.assertEqual(second["offset"], first["length"])
+        self.assertEqual(str(self.store.read(first), "utf-8"), "你好")
+        self.assertEqual(bytes(self.store.read(second)), b"world")
+
+    def test_rolls_over_when_segment_is_full(self):
+        first = self.store.append(b"x" * 30)
+        second = self.store.append(b"y" * 30)
+        self.assertNotEqual(first[OFFLOAD_MARKER], second[OFFLOAD_MARKER])
+        self.assertEqual(bytes(self.store.read(first)), b"x" * 30)
+
+    def test_garbage_collection_keeps_active_segment(self):
+        old = self.store.append(b"x" * 30)
+        active = self.store.append(b"y" * 30)
+        self.store.ttl = 0
+        time.sleep(0.01)
+        self.assertEqual(self.store.collect_garbage(), 1)
+        self.assertEqual(os.listdir(self.root), [active[OFFLOAD_MARKER]])
+        with self.assertRaises(FileNotFoundError):
+            self.store.read(old)
+
+
+if __name__ == '__main__':
+    unittest.main()
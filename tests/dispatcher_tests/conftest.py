@@ -0,0 +1,27 @@
+# tests/dispatcher_tests/conftest.py
+import pytest
+
+
+def _task_data(**overrides):
+    # 与 web/app.py 的 _build_inference_task_data 结构一致
+    task_data = {
+        "prompt": "你好",
+        "should_fail_for_test": False,
+        "model_kwargs": {"max_tokens": None, "temperature": 0.0, "top_p": None},
+        "model_name": None,
+        "stream": False,
+        "cache_bypass": False,
+        "cache_refresh": False,
+    }
+    task_data.update(overrides)
+    return task_data
+
+
+@pytest.fixture(scope="class")
+def make_task_data(request):
+    """
+    推理任务 task_data 的构造函数，关键字参数覆盖默认字段。
+    unittest.TestCase 不能直接接收 fixture，通过 @pytest.mark.usefixtures("make_task_data") 设置为 self.make_task_data。
+    """
+    request.cls.make_task_data = staticmethod(_task_data)
+    return _task_data
@@ -0,0 +1,67 @@
+# tests/dispatcher_tests/test_archive_analytics.py
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from dispatcher.core.archive_analytics import (
+    ArchiveColumns, grouped_percentiles, load_archive, summarize,
+)
+from dispatcher.core.result_archive import ResultArchive
+
+
+def _record(job_id, status, model, queue, run_seconds):
+    return {
+        "job_id": job_id, "status": status, "queue": queue,
+        "enqueued_at": "2024-01-01T00:00:00", "started_at": "2024-01-01T00:00:01",
+        "ended_at": f"2024-01-01T00:00:{1 + run_seconds:02d}",
+        "params": {"model_name": model, "max_tokens": 512},
+        "result": "ok" if status == "finished" else None,
+        "error": "Traceback...\nservices.ai_service.ServiceExecutionError: boom" if status == "failed" else None,
+    }
+
+
+class TestArchiveAnalytics(unittest.TestCase):
+
+    def test_grouped_percentiles_match_numpy(self):
+        rng = np.random.default_rng(0)
+        codes = rng.integers(0, 3, size=1000).astype(np.int32)
+        values = rng.exponential(2.0, size=1000)
+        values[::50] = np.nan
+        counts, table = grouped_percentiles(codes, values, 4)
+        for group in range(3):
+            expected = np.percentile(values[(codes == group) & ~np.isnan(values)], (50, 95, 99))
+            np.testing.assert_allclose(table[group], expected)
+        self.assertEqual(counts[3], 0)
+        self.assertTrue(np.isnan(table[3]).all())
+
+    def test_concat_remaps_categories(self):
+        first = ArchiveColumns.from_records([_record("a", "finished", "deepseek", "high", 1)])
+        second = ArchiveColumns.from_records([_record("b", "failed", "openai", "low", 2),
+                                              _record("c", "finished", "deepseek", "low", 3)])
+        merged = ArchiveColumns.concat([first, second])
+        models = merged.labels["model"][merged.codes["model"]]
+        self.assertEqual(list(models), ["deepseek", "openai", "deepseek"])
+        self.assertEqual(list(merged.labels["status"][merged.codes["status"]]), ["finished", "failed", "finished"])
+
+    def test_summary_from_archive_with_cache(self):
+        root = tempfile.mkdtemp()
+        archive = ResultArchive(root, retention_days=30)
+        archive.append([_record(f"job-{i}", "failed" if i % 4 == 0 else "finished",
+                                "deepseek" if i % 2 else "openai", "default", i % 5) for i in range(40)])
+        columns = load_archive(root)
+        self.assertEqual(len(columns), 40)
+        self.assertTrue(any(name.endswith(".cols.npz") for _, _, files in os.walk(root) for name in files))
+
+        tables = summarize(load_archive(root))
+        self.assertEqual(tables["overview"][0]["failed"], 10)
+        errors = {row["model"]: row for row in tables["errors_by_model"]}
+        self.assertEqual(errors["openai"]["failed"], 10)
+        self.assertEqual(errors["deepseek"]["error_rate"], 0.0)
+        self.assertEqual(tables["error_types"][0]["error_type"], "ServiceExecutionError")
+        self.assertEqual(tables["latency"][0]["run_p50"], 2.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
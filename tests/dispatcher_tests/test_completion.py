@@ -0,0 +1,25 @@
+# tests/dispatcher_tests/test_completion.py
+import unittest
+
+from dispatcher.core.completion import _will_retry, build_completion
+
+
+class TestCompletion(unittest.TestCase):
+
+    def test_build_completion_unwraps_task_result(self):
+        completion = build_completion("finished", {"status": "success", "result": "done"})
+        self.assertEqual(completion, {"status": "finished", "result": "done", "error": None})
+
+    def test_failed_completion_keeps_error(self):
+        completion = build_completion("failed", error="boom")
+        self.assertEqual(completion["status"], "failed")
+        self.assertEqual(completion["error"], "boom")
+
+    def test_will_retry_follows_retries_left(self):
+        self.assertTrue(_will_retry(b"2"))
+        self.assertFalse(_will_retry(b"0"))
+        self.assertFalse(_will_retry(None))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+# tests/dispatcher_tests/test_dispatcher.py
+import unittest
+from unittest.mock import patch
+
+import fakeredis
+from rq import SimpleWorker
+from rq.job import Job
+
+import common.redis_utils as redis_utils
+from ai_executor.circuit_breaker import breaker_key
+from config.settings import settings
+from dispatcher.core.completion import completion_key, on_job_success
+from dispatcher.core.dispatcher import TaskDispatcher
+from dispatcher.core.job_index import job_index_key
+from dispatcher.core.retry_policy import on_job_failure
+from dispatcher.core.serializers import job_serializer
+from dispatcher.queues.queue_config import QUEUE_MAP
+from dispatcher.tasks.base_task import task_wrapper
+from dispatcher.tasks.inference_task import run_inference
+
+
+@task_wrapper
+def answer(job_id, task_details):
+    prompt = task_details["payload"]["task_data"]["prompt"]
+    if prompt == "失败":
+        raise ValueError("人为的测试失败")
+    return {"status": "success", "result": f"回答: {prompt}"}
+
+
+class TestTaskDispatcher(unittest.TestCase):
+    """用 fakeredis 检查 TaskDispatcher 的批量入队、批量完成、状态查询和指标快照。"""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self._saved_conn = redis_utils._redis_conn
+        redis_utils._redis_conn = self.redis
+        for patcher in (patch.dict(QUEUE_MAP), patch("dispatcher.core.dispatcher.Redis.from_url", return_value=self.redis)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.dispatcher = TaskDispatcher("redis://fake", "default")
+
+    def tearDown(self):
+        redis_utils._redis_conn = self._saved_conn
+
+    def _fetch(self, job_id: str) -> Job:
+        return Job.fetch(job_id, connection=self.redis, serializer=job_serializer)
+
+    def test_dispatch_many_enqueues_by_priority(self):
+        items = [({"prompt": "一"}, "high", "job-1"), ({"prompt": "二"}, "low", None), ({"prompt": "三"}, "unknown", "job-3")]
+        jobs = self.dispatcher.dispatch_many(run_inference, items)
+        self.assertEqual([job.id for job in jobs][::2], ["job-1", "job-3"])
+        # 未知优先级回退到 default 队列，入队顺序与提交顺序一致
+        self.assertEqual(QUEUE_MAP["high"].job_ids, ["job-1"])
+        self.assertEqual(QUEUE_MAP["low"].job_ids, [jobs[1].id])
+        self.assertEqual(QUEUE_MAP["default"].job_ids, ["job-3"])
+        for job in jobs:
+            self.assertEqual(self.redis.hget(job_index_key(job.id), "status"), b"queued")
+            job = self._fetch(job.id)
+            self.assertIs(job.success_callback, on_job_success)
+            self.assertIs(job.failure_callback, on_job_failure)
+        self.assertEqual(self._fetch("job-1").kwargs["prompt"], "一")
+
+    def test_dispatch_many_deduplicates_idempotency_keys(self):
+        first = self.dispatcher.dispatch_many(run_inference, [({"prompt": "一"}, "default", "job-1")], ["key-1"])
+        jobs = self.dispatcher.dispatch_many(
+            run_inference,
+            [({"prompt": "一"}, "default", "job-2"), ({"prompt": "不同的内容"}, "default", "job-3"), ({"prompt": "二"}, "default", None)],
+            ["key-1", "key-1", None],
+        )
+        # 重复的幂等键返回首次请求的任务，内容不同的条目被拒绝，其余条目正常入队
+        self.assertEqual(jobs[0].id, first[0].id)
+        self.assertIsNone(jobs[1])
+        self.assertEqual(QUEUE_MAP["default"].job_ids, ["job-1", jobs[2].id])
+
+    def test_complete_many_writes_finished_jobs(self):
+        items = [({"prompt": "一"}, "high", "job-1", "缓存的回答"), ({"prompt": "二"}, "default", None, "另一个回答")]
+        jobs = self.dispatcher.complete_many(run_inference, items, ["key-1", None])
+        # 与 worker 完成的任务一致：finished 注册表、任务索引、完成通知和 RQ 结果，不进入队列
+        self.assertEqual(QUEUE_MAP["high"].finished_job_registry.get_job_ids(), ["job-1"])
+        self.assertEqual(QUEUE_MAP["high"].job_ids, [])
+        self.assertEqual(self.redis.hget(job_index_key("job-1"), "status"), b"finished")
+        self.assertIsNotNone(self.redis.lindex(completion_key("job-1"), 0))
+        job = self._fetch("job-1")
+        self.assertEqual((job.get_status(), job.meta["cache"]), ("finished", "hit"))
+        self.assertEqual(self.dispatcher.get_task_status("job-1")["result"], "缓存的回答")
+        self.assertEqual(self.dispatcher.get_task_statuses([jobs[1].id])[jobs[1].id]["result"], "另一个回答")
+        # 幂等键重复时返回首次请求的任务
+        duplicate = self.dispatcher.complete_many(run_inference, [({"prompt": "一"}, "high", "job-3", "缓存的回答")], ["key-1"])
+        self.assertEqual(duplicate[0].id, "job-1")
+        self.assertFalse(Job.exists("job-3", connection=self.redis))
+
+    def test_get_task_statuses(self):
+        jobs = self.dispatcher.dispatch_many(answer, [({"prompt": "一"}, "default", "job-1"), ({"prompt": "失败"}, "default", "job-2")])
+        SimpleWorker([QUEUE_MAP["default"]], connection=self.redis, serializer=job_serializer).work(burst=True)
+        self.dispatcher.dispatch_many(answer, [({"prompt": "二"}, "default", "job-3")])
+        statuses = self.dispatcher.get_task_statuses(["job-3", "job-1", "missing", "job-2", "job-1"])
+        # 按请求顺序返回并去重
+        self.assertEqual(list(statuses), ["job-3", "job-1", "missing", "job-2"])
+        self.assertEqual(statuses["job-1"]["status"], "finished")
+        self.assertEqual(statuses["job-1"]["result"], "回答: 一")
+        self.assertIsNotNone(statuses["job-1"]["finished_at"])
+        self.assertEqual(statuses["job-2"]["status"], "failed")
+        self.assertIn("人为的测试失败", statuses["job-2"]["error"])
+        self.assertEqual((statuses["job-3"]["status"], statuses["job-3"]["result"]), ("queued", None))
+        self.assertEqual(statuses["missing"]["status"], "not_found")
+        # 终态进入进程内缓存，与单个查询的结果一致
+        self.assertEqual(self.dispatcher._terminal_status_cache.get("job-1"), statuses["job-1"])
+        self.assertIsNone(self.dispatcher._terminal_status_cache.get("job-3"))
+        self.assertEqual(self.dispatcher.get_task_status(jobs[0].id)["result"], "回答: 一")
+
+    def test_queue_metrics_are_cached(self):
+        self.dispatcher.dispatch_many(run_inference, [({"prompt": "一"}, "high", None)])
+        with patch.object(settings, "QUEUE_METRICS_CACHE_TTL", 60):
+            metrics = self.dispatcher.get_queue_metrics()
+            self.assertEqual(metrics["high"]["queued_jobs"], 1)
+            self.assertEqual(metrics["default"]["total_jobs_in_queue"], 0)
+            # 命中：有效期内新入队的任务不会反映在快照中
+            self.dispatcher.dispatch_many(run_inference, [({"prompt": "二"}, "high", None)])
+            self.assertEqual(self.dispatcher.get_queue_metrics()["high"]["queued_jobs"], 1)
+        with patch.object(settings, "QUEUE_METRICS_CACHE_TTL", 0):
+            # 未命中：快照过期后重新采集
+            self.assertEqual(self.dispatcher.get_queue_metrics()["high"]["queued_jobs"], 2)
+
+    def test_metrics_snapshot_includes_breakers(self):
+        self.redis.hset(breaker_key("deepseek"), mapping={"state": "closed", "requests": 3})
+        with patch.object(settings, "QUEUE_METRICS_CACHE_TTL", 60):
+            metrics, breakers = self.dispatcher.get_metrics_snapshot()
+            self.assertEqual(breakers["deepseek"]["requests"], 3)
+            # 缓存有效期内不再读取熔断器状态
+            self.redis.hset(breaker_key("deepseek"), "state", "open")
+            with patch("dispatcher.core.dispatcher.breaker_states") as states:
+                self.assertEqual(self.dispatcher.get_metrics_snapshot(), (metrics, breakers))
+            states.assert_not_called()
+        self.assertEqual(self.dispatcher.get_queue_metrics(), metrics)
+
+
+if __name__ == '__main__':
+    unittest.main()
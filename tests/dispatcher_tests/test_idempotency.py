@@ -0,0 +1,57 @@
+# tests/dispatcher_tests/test_idempotency.py
+import unittest
+
+import fakeredis
+
+from dispatcher.core.idempotency import claim_keys, idempotency_key, payload_fingerprint, release_keys
+
+
+class TestIdempotency(unittest.TestCase):
+
+    def test_fingerprint_ignores_key_order(self):
+        first = payload_fingerprint({"prompt": "你好", "model_kwargs": {"temperature": 0.0, "top_p": None}}, "default")
+        second = payload_fingerprint({"model_kwargs": {"top_p": None, "temperature": 0.0}, "prompt": "你好"}, "default")
+        self.assertEqual(first, second)
+
+    def test_fingerprint_covers_payload_and_priority(self):
+        payload = {"prompt": "你好"}
+        self.assertNotEqual(payload_fingerprint(payload, "default"), payload_fingerprint(payload, "high"))
+        self.assertNotEqual(payload_fingerprint(payload, "default"), payload_fingerprint({"prompt": "你好！"}, "default"))
+        self.assertEqual(idempotency_key("order-42"), "idem:order-42")
+
+
+class TestClaimKeys(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+
+    def test_fresh_claim_and_duplicate(self):
+        self.assertEqual(claim_keys(self.redis, [("k1", "job-1", "fp-1")]), ([None], set()))
+        self.assertGreater(self.redis.ttl(idempotency_key("k1")), 0)
+        # 相同内容的重复请求返回首次请求的任务
+        self.assertEqual(claim_keys(self.redis, [("k1", "job-2", "fp-1")]), (["job-1"], set()))
+
+    def test_duplicate_key_within_one_batch(self):
+        originals, conflicts = claim_keys(self.redis, [("k1", "job-1", "fp-1"), ("k1", "job-2", "fp-1")])
+        self.assertEqual((originals, conflicts), ([None, "job-1"], set()))
+        originals, conflicts = claim_keys(self.redis, [("k2", "job-3", "fp-1"), ("k2", "job-4", "fp-2")])
+        self.assertEqual((originals, conflicts), ([None, None], {1}))
+
+    def test_conflict_only_rejects_that_item(self):
+        claim_keys(self.redis, [("k2", "job-old", "fp-2")])
+        originals, conflicts = claim_keys(self.redis, [("k1", "job-new", "fp-1"), ("k2", "job-x", "fp-other")])
+        self.assertEqual((originals, conflicts), ([None, None], {1}))
+        # 冲突条目没有改动已有的键，其他条目的占用属于本次入队的任务
+        self.assertEqual(claim_keys(self.redis, [("k2", "job-y", "fp-2")]), (["job-old"], set()))
+        self.assertEqual(claim_keys(self.redis, [("k1", "job-z", "fp-1")]), (["job-new"], set()))
+
+    def test_release_after_enqueue_failure(self):
+        claim_keys(self.redis, [("k1", "job-1", "fp-1"), ("k2", "job-2", "fp-2")])
+        release_keys(self.redis, ["k1", "k2"])
+        # 客户端重试时按新请求入队
+        self.assertEqual(claim_keys(self.redis, [("k1", "job-3", "fp-1")]), ([None], set()))
+        self.assertEqual(claim_keys(self.redis, [("k1", "job-4", "fp-1")]), (["job-3"], set()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+# tests/dispatcher_tests/test_job_index.py
+import json
+import unittest
+from datetime import timedelta
+from unittest.mock import patch
+
+import fakeredis
+from rq import SimpleWorker
+from rq.utils import utcnow
+
+import common.redis_utils as redis_utils
+from common.compression import compress_text, is_compressed
+from common.lru_cache import LRUCache
+from config.settings import settings
+from dispatcher.core.completion import completion_key
+from dispatcher.core.dispatcher import TaskDispatcher
+from dispatcher.core.job_index import job_index_key, parse_index
+from dispatcher.core.serializers import job_serializer
+from dispatcher.queues.queue_config import QUEUE_MAP
+from dispatcher.tasks.base_task import task_wrapper
+
+LONG_TEXT = "很长的结果。" * 200
+
+
+@task_wrapper
+def long_answer(job_id, task_details):
+    # 与 InferenceTask.execute 的返回结构一致，长结果在 worker 中压缩
+    return {"status": "success", "result": compress_text(LONG_TEXT, threshold=512)}
+
+
+class TestJobIndex(unittest.TestCase):
+
+    def test_parse_finished_index(self):
+        raw = {b"queue": b"default", b"status": b"finished",
+               b"enqueued_at": b"2024-01-01T00:00:00", b"finished_at": b"2024-01-01T00:00:05"}
+        status_info = parse_index("job-1", raw)
+        self.assertEqual(status_info["status"], "finished")
+        # 结果由调用方从 RQ 的结果流中读取
+        self.assertIsNone(status_info["result"])
+        self.assertIsNone(status_info["started_at"])
+
+    def test_missing_or_stale_index_falls_back(self):
+        self.assertIsNone(parse_index("job-1", {}))
+        stale = utcnow() - timedelta(seconds=settings.TASK_JOB_TIMEOUT + 120)
+        raw = {b"status": b"started", b"started_at": stale.isoformat().encode()}
+        self.assertIsNone(parse_index("job-1", raw))
+
+    def test_lru_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(len(cache), 2)
+
+
+class TestJobIndexWithWorker(unittest.TestCase):
+    """用真实的 SimpleWorker 执行任务，检查索引只保存状态、结果从 RQ 读取。"""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self._saved_conn = redis_utils._redis_conn
+        redis_utils._redis_conn = self.redis
+        for patcher in (patch.dict(QUEUE_MAP), patch("dispatcher.core.dispatcher.Redis.from_url", return_value=self.redis)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.dispatcher = TaskDispatcher("redis://fake", "default")
+
+    def tearDown(self):
+        redis_utils._redis_conn = self._saved_conn
+
+    def test_finished_result_is_read_from_rq(self):
+        job = self.dispatcher.dispatch(long_answer, {"prompt": "你好"})
+        SimpleWorker([QUEUE_MAP["default"]], connection=self.redis, serializer=job_serializer).work(burst=True)
+        index = self.redis.hgetall(job_index_key(job.id))
+        self.assertEqual(index[b"status"], b"finished")
+        self.assertNotIn(b"result", index)
+        notice = json.loads(self.redis.lindex(completion_key(job.id), 0))
+        self.assertEqual(notice["status"], "finished")
+        status_info = self.dispatcher.get_task_status(job.id)
+        self.assertEqual(status_info["status"], "finished")
+        self.assertEqual(status_info["result"], LONG_TEXT)
+        self.assertTrue(is_compressed(job.latest_result().return_value["result"]))
+
+    def test_finished_index_without_rq_result_is_not_cached(self):
+        # 成功回调已写入 finished、worker 还没保存结果时，以完整任务为准且不缓存
+        job = self.dispatcher.dispatch(long_answer, {"prompt": "你好"})
+        self.redis.hset(job_index_key(job.id), "status", "finished")
+        self.assertEqual(self.dispatcher.get_task_status(job.id)["status"], "queued")
+        self.assertIsNone(self.dispatcher._terminal_status_cache.get(job.id))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+# tests/dispatcher_tests/test_near_duplicate_cache.py
+import unittest
+from unittest.mock import patch
+
+import fakeredis
+
+from config.settings import settings
+from dispatcher.core.near_duplicate_cache import NEAR_CACHE_INDEX_KEY, NearDuplicateCache
+
+PROMPT = "请用三句话总结这篇文章的主要观点，并给出一个适合做标题的短语。"
+
+
+class TestNearDuplicateCache(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.cache = NearDuplicateCache(threshold=0.85, num_perm=128, bands=16, shingle_size=5,
+                                        max_entries=100, max_bytes=0, ttl=60)
+        patcher = patch.multiple(settings, NEAR_CACHE_ENABLED=True, RESPONSE_CACHE_ENABLED=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_near_duplicate_hits(self):
+        self.cache.put(self.redis, {"prompt": PROMPT, "temperature": 0}, "结果")
+        self.assertEqual(self.cache.lookup({"prompt": PROMPT + "谢谢", "temperature": 0}), "结果")
+
+    def test_prompts_shorter_than_a_shingle_are_skipped(self):
+        for prompt in ("???", "😀", " 1 + 1 "):
+            self.cache.put(self.redis, {"prompt": prompt, "temperature": 0}, "结果")
+            self.assertIsNone(self.cache.lookup({"prompt": prompt, "temperature": 0}))
+        self.assertEqual(self.redis.zcard(NEAR_CACHE_INDEX_KEY), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+# tests/dispatcher_tests/test_registry_pager.py
+import os
+import time
+import unittest
+from datetime import datetime
+
+from dispatcher.core.registry_pager import _registry_score_window, decode_cursor, encode_cursor
+
+
+class TestRegistryPager(unittest.TestCase):
+
+    def test_cursor_round_trip(self):
+        position = {"s": repr(float("inf")), "m": "job-1"}
+        self.assertEqual(decode_cursor(encode_cursor(position)), position)
+
+    def test_invalid_cursor_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            decode_cursor("not-a-cursor")
+
+    def test_score_window_treats_naive_datetimes_as_utc(self):
+        # 在非 UTC 时区的机器上，分值仍按 UTC 换算（与 RQ 写入注册表的分值一致）
+        saved_tz = os.environ.get("TZ")
+        os.environ["TZ"] = "Asia/Shanghai"
+        time.tzset()
+        try:
+            window = _registry_score_window('scheduled', datetime(2024, 1, 1), datetime(2024, 1, 1, 0, 0, 1, 500000))
+        finally:
+            if saved_tz is None:
+                os.environ.pop("TZ")
+            else:
+                os.environ["TZ"] = saved_tz
+            time.tzset()
+        self.assertEqual(window, (repr(1704067200.0), repr(1704067201.5)))
+        self.assertEqual(_registry_score_window('started', datetime(2024, 1, 1), None), ("-inf", "+inf"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+# tests/dispatcher_tests/test_response_cache.py
+import unittest
+
+import pytest
+
+from common.lru_cache import LRUCache
+from dispatcher.core.response_cache import cache_key, is_cacheable
+from dispatcher.tasks.inference_task import build_job_kwargs, parse_job_kwargs
+
+
+@pytest.mark.usefixtures("make_task_data")
+class TestResponseCache(unittest.TestCase):
+
+    def test_key_matches_between_web_and_worker(self):
+        task_data = self.make_task_data()
+        worker_task_data = parse_job_kwargs(build_job_kwargs(task_data))
+        self.assertEqual(cache_key(task_data), cache_key(worker_task_data))
+        self.assertNotEqual(cache_key(task_data), cache_key(self.make_task_data(model_kwargs={"temperature": 0.5})))
+        self.assertNotEqual(cache_key(task_data), cache_key(self.make_task_data(prompt="你好！")))
+
+    def test_bypass_reaches_worker(self):
+        self.assertTrue(is_cacheable(self.make_task_data()))
+        worker_task_data = parse_job_kwargs(build_job_kwargs(self.make_task_data(cache_bypass=True)))
+        self.assertFalse(is_cacheable(worker_task_data))
+        self.assertFalse(is_cacheable(self.make_task_data(should_fail_for_test=True)))
+
+    def test_lru_evicts_by_bytes(self):
+        cache = LRUCache(10, max_bytes=100)
+        cache.put("a", "a", size=60)
+        cache.put("b", "b", size=30)
+        cache.get("a")
+        cache.put("c", "c", size=30) # 超过 100 字节，淘汰最久未使用的 b
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.bytes, 90)
+        cache.put("d", "d", size=200) # 单个值超过上限，不缓存
+        self.assertIsNone(cache.get("d"))
+        self.assertEqual(len(cache), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
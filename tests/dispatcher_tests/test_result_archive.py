@@ -0,0 +1,32 @@
+# tests/dispatcher_tests/test_result_archive.py
+import tempfile
+import unittest
+import uuid
+
+from dispatcher.core.result_archive import ResultArchive, to_status_info
+
+
+class TestResultArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.archive = ResultArchive(tempfile.mkdtemp(), retention_days=30)
+
+    def test_lookup_returns_latest_record(self):
+        job_ids = [str(uuid.uuid4()) for _ in range(50)]
+        self.archive.append([{"job_id": job_id, "status": "finished", "result": f"结果 {job_id}"} for job_id in job_ids])
+        self.archive.append([{"job_id": job_ids[3], "status": "failed", "error": "boom"}])
+        self.assertEqual(self.archive.lookup(job_ids[10])["result"], f"结果 {job_ids[10]}")
+        self.assertEqual(self.archive.lookup(job_ids[3])["status"], "failed")
+        self.assertIsNone(self.archive.lookup(str(uuid.uuid4())))
+
+    def test_status_info_matches_get_task_status_shape(self):
+        record = {"job_id": "job-1", "status": "finished", "result": "ok", "error": None,
+                  "enqueued_at": "2024-01-01T00:00:00", "started_at": "2024-01-01T00:00:01",
+                  "ended_at": "2024-01-01T00:00:02", "queue": "default"}
+        status_info = to_status_info(record)
+        self.assertEqual(status_info["finished_at"], "2024-01-01T00:00:02")
+        self.assertEqual(set(status_info), {"job_id", "status", "result", "error", "enqueued_at", "started_at", "finished_at"})
+
+
+if __name__ == '__main__':
+    unittest.main()
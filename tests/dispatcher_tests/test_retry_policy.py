@@ -0,0 +1,75 @@
+# tests/dispatcher_tests/test_retry_policy.py
+import unittest
+
+from ai_executor.circuit_breaker import CircuitOpenError
+from ai_executor.executor import (
+    ModelClientError, ModelConnectionError, ModelOverloadedError, ModelResponseError, ModelTimeoutError,
+)
+from dispatcher.core.retry_policy import (
+    BAD_RESPONSE, CLIENT_ERROR, EXHAUSTED, NETWORK, NOT_RETRYABLE, PERMANENT, RATE_LIMIT,
+    RETRIED, SERVER_ERROR, UNKNOWN, Backoff, RetryBudget, RetryPolicy, classify_error,
+)
+from services.exceptions import ServiceExecutionError
+
+
+def _wrapped(error):
+    # 与 ExecutorFactory / AIService 一样在 except 块中重新抛出 ServiceExecutionError
+    try:
+        try:
+            raise error
+        except Exception as e:
+            raise ServiceExecutionError(f"模型执行错误: {e}")
+    except ServiceExecutionError as e:
+        return e
+
+
+class _FakeJob:
+    def __init__(self, retries_left=3, attempts=0):
+        self.id = "job-1"
+        self.retries_left = retries_left
+        self.retry_intervals = [60]
+        self.meta = {"retry_attempts": attempts} if attempts else {}
+
+
+def _policy(budget_enabled=False):
+    backoffs = {error_class: Backoff(max_retries=2, base_delay=1.0, max_delay=4.0)
+                for error_class in (NETWORK, RATE_LIMIT, SERVER_ERROR, BAD_RESPONSE, UNKNOWN)}
+    return RetryPolicy(backoffs, RetryBudget(enabled=budget_enabled, ratio=0.2, burst=10, min_per_second=0))
+
+
+class TestRetryPolicy(unittest.TestCase):
+
+    def test_classify_follows_exception_chain(self):
+        self.assertEqual(classify_error(_wrapped(ModelClientError("400"))), CLIENT_ERROR)
+        self.assertEqual(classify_error(_wrapped(ModelOverloadedError("429", status_code=429))), RATE_LIMIT)
+        self.assertEqual(classify_error(_wrapped(ModelOverloadedError("503", status_code=503))), SERVER_ERROR)
+        self.assertEqual(classify_error(_wrapped(ModelTimeoutError("timeout"))), NETWORK)
+        self.assertEqual(classify_error(_wrapped(ModelConnectionError("reset"))), NETWORK)
+        self.assertEqual(classify_error(_wrapped(ModelResponseError("no choices"))), BAD_RESPONSE)
+        self.assertEqual(classify_error(CircuitOpenError("open")), SERVER_ERROR)
+        # should_fail_for_test 抛出的 ValueError 不重试
+        self.assertEqual(classify_error(ValueError("测试失败")), PERMANENT)
+        self.assertEqual(classify_error(RuntimeError("?")), UNKNOWN)
+
+    def test_full_jitter_backoff_is_capped(self):
+        backoff = Backoff(max_retries=5, base_delay=1.0, max_delay=4.0)
+        for attempt in range(10):
+            for _ in range(50):
+                self.assertTrue(0 <= backoff.delay(attempt) <= min(4.0, 2 ** attempt))
+
+    def test_decide(self):
+        policy = _policy()
+        self.assertEqual(policy.decide(None, _FakeJob(), ModelClientError("400"))[1:], (NOT_RETRYABLE, None))
+        error_class, decision, delay = policy.decide(None, _FakeJob(), ModelTimeoutError("timeout"))
+        self.assertEqual((error_class, decision), (NETWORK, RETRIED))
+        self.assertLessEqual(delay, 1.0)
+        # 分类的重试次数用完，或队列的总重试次数用完
+        self.assertEqual(policy.decide(None, _FakeJob(attempts=2), ModelTimeoutError("t"))[1], EXHAUSTED)
+        self.assertEqual(policy.decide(None, _FakeJob(retries_left=0), ModelTimeoutError("t"))[1], EXHAUSTED)
+        # 限流时至少等待 Retry-After
+        _, _, delay = policy.decide(None, _FakeJob(), ModelOverloadedError("429", retry_after=30, status_code=429))
+        self.assertEqual(delay, 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+# tests/dispatcher_tests/test_retry_worker.py
+import json
+import unittest
+
+import fakeredis
+from rq import Queue, SimpleWorker
+from rq.job import Job, JobStatus, Retry
+
+import common.redis_utils as redis_utils
+import dispatcher.core.retry_policy as retry_policy
+from ai_executor.executor import ModelTimeoutError
+from dispatcher.core.completion import completion_key
+from dispatcher.core.job_index import index_enqueued, job_index_key
+from dispatcher.core.retry_policy import (
+    BAD_RESPONSE, NETWORK, RATE_LIMIT, RETRY_CALLBACK, SERVER_ERROR, UNKNOWN, Backoff, RetryBudget, RetryPolicy,
+)
+from dispatcher.core.serializers import job_serializer
+from dispatcher.tasks.base_task import task_wrapper
+from dispatcher.tasks.inference_task import build_job_kwargs, run_inference
+
+
+@task_wrapper
+def timeout_task():
+    raise ModelTimeoutError("DeepSeek API 请求超时")
+
+
+class TestRetryWorker(unittest.TestCase):
+    """用真实的 SimpleWorker 执行失败任务，检查重试引擎、RQ 的失败处理和完成通知 / 任务索引的配合。"""
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self._saved = (redis_utils._redis_conn, retry_policy._retry_policy)
+        redis_utils._redis_conn = self.redis
+        # 退避为 0：重试的任务直接重新入队，在同一次 burst 中再次执行
+        retry_policy._retry_policy = RetryPolicy(
+            backoffs={error_class: Backoff(max_retries=2, base_delay=0, max_delay=0)
+                      for error_class in (NETWORK, RATE_LIMIT, SERVER_ERROR, BAD_RESPONSE, UNKNOWN)},
+            budget=RetryBudget(enabled=True, ratio=0.2, burst=10, min_per_second=0),
+        )
+        self.queue = Queue("default", connection=self.redis, serializer=job_serializer)
+
+    def tearDown(self):
+        redis_utils._redis_conn, retry_policy._retry_policy = self._saved
+
+    def _enqueue(self, func, **kwargs) -> Job:
+        job = self.queue.enqueue(func, kwargs=kwargs, retry=Retry(max=3), on_failure=RETRY_CALLBACK)
+        with self.redis.pipeline() as pipeline:
+            index_enqueued(pipeline, job.id, self.queue.name, job.enqueued_at)
+            pipeline.execute()
+        return job
+
+    def _work(self, job: Job):
+        SimpleWorker([self.queue], connection=self.redis, serializer=job_serializer).work(burst=True)
+        job = Job.fetch(job.id, connection=self.redis, serializer=job_serializer)
+        index_status = self.redis.hget(job_index_key(job.id), "status").decode()
+        notice = self.redis.lindex(completion_key(job.id), 0)
+        return job, index_status, json.loads(notice) if notice else None
+
+    def test_non_retryable_failure_is_reported_as_failed(self):
+        job = self._enqueue(run_inference, **build_job_kwargs({"prompt": "你好", "should_fail_for_test": True}))
+        job, index_status, notice = self._work(job)
+        self.assertEqual(job.get_status(), JobStatus.FAILED)
+        self.assertEqual(job.retries_left, 0)
+        self.assertEqual(index_status, "failed")
+        self.assertEqual(notice["status"], "failed")
+        self.assertIn("人为的测试失败", notice["error"])
+
+    def test_retryable_failure_retries_then_fails(self):
+        job = self._enqueue(timeout_task)
+        job, index_status, notice = self._work(job)
+        # 第一次执行加上网络错误允许的 2 次重试，之后分类的重试次数用完
+        self.assertEqual(job.get_status(), JobStatus.FAILED)
+        self.assertEqual(job.meta[retry_policy.RETRY_ATTEMPTS_META], 2)
+        self.assertEqual(job.meta[retry_policy.RETRY_CLASS_META], NETWORK)
+        self.assertEqual(index_status, "failed")
+        self.assertEqual(notice["status"], "failed")
+        stats = self.redis.hgetall(retry_policy.RETRY_STATS_KEY)
+        self.assertEqual(stats, {b"network:retried": b"2", b"network:exhausted": b"1"})
+
+    def test_retry_marks_index_scheduled_without_notice(self):
+        # 退避大于 0 时任务进入调度注册表，等待者继续等待；固定等待时间，避免 full jitter 取到接近 0 的值
+        backoff = Backoff(max_retries=2, base_delay=60, max_delay=60)
+        backoff.delay = lambda attempt: 60
+        retry_policy._retry_policy.backoffs[NETWORK] = backoff
+        job = self._enqueue(timeout_task)
+        job, index_status, notice = self._work(job)
+        self.assertEqual(job.get_status(), JobStatus.SCHEDULED)
+        self.assertEqual(index_status, "scheduled")
+        self.assertIsNone(notice)
+
+
+if __name__ == '__main__':
+    unittest.main()
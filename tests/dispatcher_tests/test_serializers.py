@@ -0,0 +1,54 @@
+# tests/dispatcher_tests/test_serializers.py
+import pickle
+import unittest
+
+from dispatcher.core.serializers import JobSerializer
+from dispatcher.tasks.inference_task import INFERENCE_PAYLOAD_VERSION, build_job_kwargs, parse_job_kwargs
+
+
+class TestJobSerializer(unittest.TestCase):
+
+    def test_orjson_round_trip_of_job_data(self):
+        serializer = JobSerializer("orjson")
+        data = ("dispatcher.tasks.inference_task.run_inference", None, (), {"v": 1, "prompt": "你好"})
+        func_name, instance, args, kwargs = serializer.loads(serializer.dumps(data))
+        self.assertEqual(func_name, data[0])
+        self.assertIsNone(instance)
+        self.assertEqual(list(args), [])
+        self.assertEqual(kwargs, data[3])
+
+    def test_reads_legacy_pickle_payloads(self):
+        serializer = JobSerializer("orjson")
+        legacy = pickle.dumps({"status": "success", "result": "旧结果"}, protocol=pickle.HIGHEST_PROTOCOL)
+        self.assertEqual(serializer.loads(legacy), {"status": "success", "result": "旧结果"})
+
+    def test_rejects_unknown_format(self):
+        with self.assertRaises(ValueError):
+            JobSerializer("yaml")
+
+
+class TestInferencePayload(unittest.TestCase):
+
+    def test_flat_payload_round_trip(self):
+        task_data = {
+            "prompt": "你好",
+            "should_fail_for_test": False,
+            "model_kwargs": {"max_tokens": 10, "temperature": 0.5, "top_p": None},
+            "model_name": None,
+            "stream": True,
+        }
+        job_kwargs = build_job_kwargs(task_data)
+        self.assertEqual(job_kwargs, {"v": INFERENCE_PAYLOAD_VERSION, "prompt": "你好", "max_tokens": 10,
+                                      "temperature": 0.5, "stream": True})
+        parsed = parse_job_kwargs(job_kwargs)
+        self.assertEqual(parsed["prompt"], "你好")
+        self.assertEqual(parsed["model_kwargs"], {"max_tokens": 10, "temperature": 0.5})
+        self.assertFalse(parsed["should_fail_for_test"])
+
+    def test_unknown_payload_version_is_rejected(self):
+        with self.assertRaises(ValueError):
+            parse_job_kwargs({"v": INFERENCE_PAYLOAD_VERSION + 1, "prompt": "x"})
+
+
+if __name__ == '__main__':
+    unittest.main()
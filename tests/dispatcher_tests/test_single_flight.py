@@ -0,0 +1,97 @@
+# tests/dispatcher_tests/test_single_flight.py
+import asyncio
+import json
+import unittest
+
+import fakeredis
+import pytest
+from fakeredis import aioredis
+
+from dispatcher.core.single_flight import (
+    SINGLE_FLIGHT_DONE_PREFIX, SINGLE_FLIGHT_LEASE_PREFIX, SingleFlight, _request_hash, is_coalescable,
+)
+from dispatcher.tasks.inference_task import build_job_kwargs, parse_job_kwargs
+
+
+@pytest.mark.usefixtures("make_task_data")
+class TestSingleFlight(unittest.TestCase):
+
+    def test_identical_requests_share_a_key(self):
+        # 不同任务解析出的 task_data 相同（stream、cache_refresh 不影响请求本身）
+        first = parse_job_kwargs(build_job_kwargs(self.make_task_data()))
+        second = parse_job_kwargs(build_job_kwargs(self.make_task_data(stream=True, cache_refresh=True)))
+        self.assertEqual(_request_hash(first), _request_hash(second))
+        self.assertNotEqual(_request_hash(first), _request_hash(self.make_task_data(model_name="deepseek-reasoner")))
+
+    def test_bypass_and_test_failures_are_not_coalesced(self):
+        self.assertTrue(is_coalescable(self.make_task_data()))
+        self.assertFalse(is_coalescable(self.make_task_data(cache_bypass=True)))
+        self.assertFalse(is_coalescable(self.make_task_data(should_fail_for_test=True)))
+
+
+@pytest.mark.usefixtures("make_task_data")
+class TestSingleFlightCoordination(unittest.IsolatedAsyncioTestCase):
+    """领导者 / 跟随者 / 租约过期的协作，使用 fakeredis。"""
+
+    async def asyncSetUp(self):
+        self.redis = aioredis.FakeRedis()
+        self.single_flight = SingleFlight(lease_ms=300, max_wait=5, result_ttl=30)
+        self.single_flight.stats._reporter._redis_conn = fakeredis.FakeRedis()
+        self.task_data = self.make_task_data()
+        self.lease_key = f"{SINGLE_FLIGHT_LEASE_PREFIX}:{_request_hash(self.task_data)}"
+        self.calls = []
+
+    def _compute(self, job_id, delay=0.2, error=None):
+        async def compute():
+            self.calls.append(job_id)
+            await asyncio.sleep(delay)
+            if error is not None:
+                raise error
+            return f"结果-{job_id}"
+        return compute
+
+    async def _done_status(self, job_id):
+        return json.loads(await self.redis.lindex(f"{SINGLE_FLIGHT_DONE_PREFIX}:{job_id}", 0))["status"]
+
+    async def test_follower_reuses_leader_result(self):
+        leader = asyncio.create_task(
+            self.single_flight.run_async(self.redis, "job-1", self.task_data, self._compute("job-1")))
+        await asyncio.sleep(0.05)
+        follower = await self.single_flight.run_async(self.redis, "job-2", self.task_data, self._compute("job-2"))
+        self.assertEqual(await leader, ("结果-job-1", True))
+        self.assertEqual(follower, ("结果-job-1", False))
+        self.assertEqual(self.calls, ["job-1"])
+        self.assertFalse(await self.redis.exists(self.lease_key))
+
+    async def test_follower_takes_over_after_leader_failure(self):
+        leader = asyncio.create_task(self.single_flight.run_async(
+            self.redis, "job-1", self.task_data, self._compute("job-1", error=RuntimeError("供应商错误"))))
+        await asyncio.sleep(0.05)
+        follower = await self.single_flight.run_async(self.redis, "job-2", self.task_data, self._compute("job-2"))
+        with self.assertRaises(RuntimeError):
+            await leader
+        self.assertEqual(follower, ("结果-job-2", True))
+        self.assertEqual(self.calls, ["job-1", "job-2"])
+        self.assertEqual(self.single_flight.stats.takeovers, 1)
+
+    async def test_cancelled_leader_releases_lease(self):
+        # AsyncWorker 的任务超时（wait_for）和第二次停止信号都以 CancelledError 结束领导者
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self.single_flight.run_async(
+                self.redis, "job-1", self.task_data, self._compute("job-1", delay=10)), 0.1)
+        await asyncio.sleep(0.5)
+        self.assertFalse(await self.redis.exists(self.lease_key))
+        self.assertEqual(await self._done_status("job-1"), "failed")
+        self.assertEqual(asyncio.all_tasks(), {asyncio.current_task()})
+
+    async def test_expired_lease_is_taken_over(self):
+        # 领导者进程退出后不再续期，租约过期后跟随者接管
+        await self.redis.set(self.lease_key, "job-dead", px=300)
+        result = await self.single_flight.run_async(self.redis, "job-2", self.task_data, self._compute("job-2"))
+        self.assertEqual(result, ("结果-job-2", True))
+        self.assertEqual(self.single_flight.stats.takeovers, 1)
+        self.assertEqual(await self._done_status("job-2"), "success")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+# tests/dispatcher_tests/test_token_stream.py
+import json
+import unittest
+
+from ai_executor.executor import DashScopeExecutor, DeepSeekExecutor
+from dispatcher.core.token_stream import format_sse, token_stream_key
+
+
+class TestTokenStream(unittest.TestCase):
+
+    def test_format_sse(self):
+        message = format_sse("token", {"delta": "你好"}, "1-0")
+        self.assertEqual(message, 'id: 1-0\nevent: token\ndata: {"delta": "你好"}\n\n')
+        self.assertTrue(token_stream_key("abc").endswith(":abc"))
+
+    def test_parse_openai_stream_lines(self):
+        executor = DeepSeekExecutor("key", "deepseek-chat", 0.7, 0.8, 100)
+        chunk = {"choices": [{"delta": {"content": "Hi"}}]}
+        self.assertEqual(executor._parse_stream_line(f"data: {json.dumps(chunk)}"), "Hi")
+        self.assertIsNone(executor._parse_stream_line(": keep-alive"))
+        self.assertIsNone(executor._parse_stream_line('data: {"choices": [{"delta": {}}]}'))
+        with self.assertRaises(StopIteration):
+            executor._parse_stream_line("data: [DONE]")
+
+    def test_parse_dashscope_native_chunk(self):
+        executor = DashScopeExecutor("key", "https://example.com", "qwen-turbo", 0.7, 0.8, 100)
+        chunk = {"output": {"choices": [{"message": {"content": "好"}}]}}
+        self.assertEqual(executor._parse_stream_line(f"data: {json.dumps(chunk)}"), "好")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# tests/web_tests/test_app.py
+import unittest
+from unittest.mock import patch
+
+import fakeredis
+from fastapi.testclient import TestClient
+from redis import Redis
+from rq import SimpleWorker
+
+import common.redis_utils as redis_utils
+from config.settings import settings
+from dispatcher.core.response_cache import get_response_cache
+from dispatcher.core.serializers import job_serializer
+from dispatcher.queues.queue_config import QUEUE_MAP
+from tests.dispatcher_tests.test_dispatcher import answer
+
+FAKE_REDIS = fakeredis.FakeRedis()
+_patchers = []
+
+
+def setUpModule():
+    global app_module
+    # web.app 在导入时创建 TaskDispatcher 并改写 QUEUE_MAP，测试结束后恢复
+    _patchers.append(patch.dict(QUEUE_MAP))
+    _patchers.append(patch.object(redis_utils, "_redis_conn", FAKE_REDIS))
+    for patcher in _patchers:
+        patcher.start()
+    with patch.object(Redis, "from_url", return_value=FAKE_REDIS):
+        import web.app as app_module
+
+
+def tearDownModule():
+    for patcher in reversed(_patchers):
+        patcher.stop()
+
+
+class TestApp(unittest.TestCase):
+    """用 TestClient 和 fakeredis 检查 HTTP 接口。"""
+
+    def setUp(self):
+        FAKE_REDIS.flushall()
+        self.client = TestClient(app_module.app)
+
+    def test_generate_batch(self):
+        body = [
+            {"prompt": "一", "priority": "high", "idempotency_key": "key-1"},
+            {"prompt": ""},
+            {"prompt": "一", "priority": "high", "idempotency_key": "key-1"},
+            {"prompt": "不同的内容", "idempotency_key": "key-1"},
+        ]
+        resp = self.client.post("/generate/batch", json=body)
+        self.assertEqual(resp.status_code, 202)
+        data = resp.json()
+        self.assertEqual([item["status"] for item in data["items"]], ["enqueued", "invalid", "duplicate", "invalid"])
+        self.assertEqual(data["items"][2]["job_id"], data["items"][0]["job_id"])
+        self.assertEqual((data["enqueued"], data["duplicates"], data["invalid"]), (1, 1, 2))
+        self.assertEqual(QUEUE_MAP["high"].job_ids, [data["items"][0]["job_id"]])
+
+    def test_generate_cached_and_enqueued(self):
+        request = {"prompt": "缓存命中的请求", "temperature": 0.0}
+        task_data = app_module._build_inference_task_data(app_module.GenerateTextRequest(**request))
+        get_response_cache().put(FAKE_REDIS, task_data, "缓存的回答")
+        resp = self.client.post("/generate", json=request)
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.json()["status"], "cached")
+        status_info = self.client.get(f"/tasks/{resp.json()['job_id']}/status").json()
+        self.assertEqual((status_info["status"], status_info["result"]), ("finished", "缓存的回答"))
+        resp = self.client.post("/generate", json={"prompt": "没有缓存的请求"}, headers={"Idempotency-Key": "key-1"})
+        self.assertEqual(resp.json()["status"], "enqueued")
+        duplicate = self.client.post("/generate", json={"prompt": "没有缓存的请求"}, headers={"Idempotency-Key": "key-1"})
+        self.assertEqual(duplicate.json(), {"job_id": resp.json()["job_id"], "status": "duplicate"})
+        self.assertEqual(QUEUE_MAP["default"].job_ids, [resp.json()["job_id"]])
+
+    def test_batch_status(self):
+        dispatcher = app_module.task_dispatcher
+        finished, queued = dispatcher.dispatch_many(answer, [({"prompt": "一"}, "default", None), ({"prompt": "二"}, "low", None)])
+        SimpleWorker([QUEUE_MAP["default"]], connection=FAKE_REDIS, serializer=job_serializer).work(burst=True)
+        resp = self.client.post("/tasks/status:batch", json={"job_ids": [queued.id, finished.id, "missing", queued.id]})
+        self.assertEqual(resp.status_code, 200)
+        tasks = resp.json()["tasks"]
+        self.assertEqual([(task["job_id"], task["status"]) for task in tasks],
+                         [(queued.id, "queued"), (finished.id, "finished"), ("missing", "not_found")])
+        self.assertEqual(tasks[1]["result"], "回答: 一")
+        self.assertEqual(self.client.post("/tasks/status:batch", json={"job_ids": []}).status_code, 422)
+
+    def test_metrics(self):
+        app_module.task_dispatcher.dispatch_many(answer, [({"prompt": "一"}, "low", None)])
+        with patch.object(settings, "QUEUE_METRICS_CACHE_TTL", 0):
+            resp = self.client.get("/metrics")
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(data["queued_tasks"], {"high": 0, "default": 0, "low": 1})
+        self.assertEqual(data["circuit_breakers"], {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+# tests/worker_tests/test_async_worker.py
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import fakeredis
+from fakeredis import aioredis
+from rq import Callback, Queue
+from rq.job import Job, JobStatus
+from rq.suspension import suspend
+
+from dispatcher.core.completion import completion_key
+from dispatcher.core.retry_policy import RETRY_CALLBACK
+from dispatcher.core.serializers import job_serializer
+from dispatcher.tasks.base_task import task_wrapper
+from worker.async_worker import AsyncWorker
+
+succeeded = []
+
+
+def echo(text):
+    return text
+
+
+async def slow_echo(text):
+    await asyncio.sleep(10)
+    return text
+
+
+@task_wrapper
+async def wrapped_slow_echo(text):
+    await asyncio.sleep(10)
+    return text
+
+
+def record_success(job, connection, result):
+    succeeded.append((job.id, result))
+
+
+def broken_success(job, connection, result):
+    raise RuntimeError("回调出错")
+
+
+class TestAsyncWorker(unittest.TestCase):
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.queue = Queue("default", connection=self.redis, serializer=job_serializer)
+        succeeded.clear()
+
+    def _cancel_while_running(self, job: Job):
+        worker = AsyncWorker([self.queue], connection=self.redis, serializer=job_serializer)
+
+        async def cancel_while_running():
+            task = asyncio.create_task(worker._perform_job_async(job, self.queue))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_while_running())
+        return Job.fetch(job.id, connection=self.redis, serializer=job_serializer)
+
+    def _work(self, job: Job) -> Job:
+        AsyncWorker([self.queue], connection=self.redis, serializer=job_serializer).work(burst=True)
+        return Job.fetch(job.id, connection=self.redis, serializer=job_serializer)
+
+    def test_success_callback_runs_before_job_finishes(self):
+        job = self._work(self.queue.enqueue(echo, "你好", on_success=Callback(record_success)))
+        self.assertEqual(job.get_status(), JobStatus.FINISHED)
+        self.assertEqual(succeeded, [(job.id, "你好")])
+
+    def test_failing_success_callback_fails_the_job(self):
+        # 与 rq.Worker 一致：成功回调抛出异常时任务按失败处理
+        job = self._work(self.queue.enqueue(echo, "你好", on_success=Callback(broken_success)))
+        self.assertEqual(job.get_status(), JobStatus.FAILED)
+        self.assertIn("回调出错", job.latest_result().exc_string)
+
+    def test_cancelled_job_is_moved_to_failed(self):
+        # 第二次停止信号会取消进行中的任务，任务不应留在 StartedJobRegistry 中
+        job = self._cancel_while_running(self.queue.enqueue(slow_echo, "你好"))
+        self.assertEqual(job.get_status(), JobStatus.FAILED)
+        self.assertNotIn(job.id, self.queue.started_job_registry.get_job_ids())
+        self.assertIn("CancelledError", job.latest_result().exc_string)
+
+    def test_cancelled_task_leaves_failure_notice_to_retry_policy(self):
+        # task_wrapper 不再抢先发送失败通知，由重试引擎在决定是否重试之后发送
+        job = self.queue.enqueue(wrapped_slow_echo, "你好", on_failure=RETRY_CALLBACK)
+        with patch("dispatcher.tasks.base_task.get_async_redis", return_value=aioredis.FakeRedis()), \
+                patch("dispatcher.tasks.base_task.notify_completion_async") as wrapper_notify:
+            job = self._cancel_while_running(job)
+        wrapper_notify.assert_not_called()
+        self.assertEqual(job.get_status(), JobStatus.FAILED)
+        self.assertIn(b'"failed"', self.redis.lindex(completion_key(job.id), 0))
+
+    def test_suspended_worker_exits_in_burst_mode(self):
+        suspend(self.redis)
+        job = self._work(self.queue.enqueue(echo, "你好"))
+        self.assertEqual(job.get_status(), JobStatus.QUEUED)
+
+
+if __name__ == '__main__':
+    unittest.main()
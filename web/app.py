@@ -1,20 +1,34 @@
 # ~/projects/deepseek_dispatcher-new/web/app.py
 
+import asyncio
+import json
 import uuid
-from typing import Optional, Dict, Any, List
+import zlib
+from datetime import datetime, timezone
+from typing import Optional, Dict, Any, Iterator, List
 
-from fastapi import FastAPI, HTTPException, status, Query, BackgroundTasks
-from pydantic import BaseModel, Field
+from fastapi import FastAPI, HTTPException, status, Query, BackgroundTasks, Request, Body, Header
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
 from rq.job import Job
 from redis import Redis # 导入 Redis 用于健康检查
 
 # 导入我们统一的日志工具
 from common.logging_utils import get_logger
+from common.stats_reporter import collect_stats
+from common.redis_utils import get_async_redis, close_async_redis
+from ai_executor.circuit_breaker import OPEN, breaker_states
+from ai_executor.concurrency_limiter import limiter_states
 # 导入配置
 from config.settings import settings # 导入 settings 对象
 
 # TaskDispatcher 和 TaskDispatchError 现在从 dispatcher.core.dispatcher 正确导入
 from dispatcher.core.dispatcher import TaskDispatcher, TaskDispatchError
+from dispatcher.core.completion import get_completion, wait_for_completion
+from dispatcher.core.idempotency import IdempotencyKeyConflict
+from dispatcher.core.retry_policy import retry_stats
+from dispatcher.core.response_cache import get_response_cache
+from dispatcher.core.token_stream import EVENT_END, EVENT_START, EVENT_TOKEN, format_sse, read_token_events, token_stream_key
 # 导入 task_wrapper 和 TaskFactory
 from dispatcher.tasks.base_task import task_wrapper
 from dispatcher.tasks.factory import TaskFactory
@@ -57,6 +71,31 @@ class GenerateTextRequest(BaseModel):
     priority: Optional[str] = Field('default', description="Task priority (high, default, low).")
     # 新增：用于测试任务失败的标志。默认值为 False。
     should_fail_for_test: Optional[bool] = Field(False, description="Set to true to force this task to fail for testing retry and alert.")
+    stream: Optional[bool] = Field(None, description="Stream tokens to /tasks/{job_id}/stream while generating. Defaults to TOKEN_STREAM_ENABLED.")
+    cache_bypass: Optional[bool] = Field(False, description="Skip the response cache: do not return a cached result and do not cache this one.")
+    cache_refresh: Optional[bool] = Field(False, description="Ignore any cached result and run the model; the new result replaces the cached one.")
+    idempotency_key: Optional[str] = Field(None, min_length=1, max_length=255, description="Client idempotency key (same as the Idempotency-Key header). Repeats within IDEMPOTENCY_KEY_TTL return the original job_id.")
+
+
+class BatchItemResult(BaseModel):
+    """
+    批量提交中单个任务的处理结果。
+    """
+    index: int = Field(..., description="Position of the item in the submitted array.")
+    job_id: Optional[str] = Field(None, description="The job ID, if the item was enqueued.")
+    status: str = Field(..., description="'enqueued', 'cached' (finished from the response cache), 'duplicate' (idempotency key already used; job_id is the original job) or 'invalid'.")
+    error: Optional[str] = Field(None, description="Validation or idempotency-key conflict error, if the item was rejected.")
+
+
+class BatchEnqueueResponse(BaseModel):
+    """
+    响应体模型，用于批量提交任务。
+    """
+    items: List[BatchItemResult] = Field(..., description="Per-item results, in submission order.")
+    enqueued: int = Field(..., description="Number of items enqueued.")
+    cached: int = Field(0, description="Number of items finished immediately from the response cache (not enqueued).")
+    duplicates: int = Field(0, description="Number of items whose idempotency key was already used (not enqueued).")
+    invalid: int = Field(..., description="Number of items rejected by validation or an idempotency-key conflict.")
 
 
 class TaskStatusResponse(BaseModel):
@@ -69,12 +108,26 @@ class TaskStatusResponse(BaseModel):
     error: Optional[str] = Field(None, description="Error message, if the task failed.")
 
 
+class BatchStatusRequest(BaseModel):
+    """
+    请求体模型，用于批量查询任务状态。
+    """
+    job_ids: List[str] = Field(..., min_length=1, description="Job IDs to look up.")
+
+
+class BatchStatusResponse(BaseModel):
+    """
+    响应体模型，用于批量查询任务状态。
+    """
+    tasks: List[TaskStatusResponse] = Field(..., description="Task statuses, in request order (duplicates removed).")
+
+
 class EnqueueResponse(BaseModel):
     """
     响应体模型，用于任务入队成功。
     """
     job_id: str = Field(..., description="The unique ID of the enqueued task job.")
-    status: str = Field(..., description="Status of the enqueue operation (always 'enqueued' if successful).")
+    status: str = Field(..., description="'enqueued', 'cached' if the task was finished immediately from the response cache, or 'duplicate' if the idempotency key was already used (job_id is the original job).")
 
 
 class QueueMetricsResponse(BaseModel):
@@ -85,6 +138,7 @@ class QueueMetricsResponse(BaseModel):
     started_tasks: Dict[str, int] = Field(..., description="Number of started tasks for each queue.")
     failed_tasks: Dict[str, int] = Field(..., description="Number of failed tasks for each queue.")
     finished_tasks: Dict[str, int] = Field(..., description="Number of finished tasks for each queue.")
+    circuit_breakers: Dict[str, Dict[str, Any]] = Field(default_factory=dict, description="Circuit breaker state of each executor.")
 
 
 class WorkerStatus(BaseModel):
@@ -106,20 +160,12 @@ class AllWorkersStatusResponse(BaseModel):
     total_workers: int = Field(..., description="Total number of workers.")
 
 
-# --- FastAPI 路由定义 ---
-@app.post("/generate", response_model=EnqueueResponse, status_code=status.HTTP_202_ACCEPTED)
-async def generate_text(
-    request: GenerateTextRequest,
-    background_tasks: BackgroundTasks # 引入 background_tasks
-):
+def _build_inference_task_data(request: GenerateTextRequest) -> Dict[str, Any]:
     """
-    提交一个文本生成任务到队列。
+    准备传递给 TaskDispatcher 的 task_data。
+    这将作为 task_details['payload'] 传递给 execute 方法。
     """
-    api_logger.info(f"收到文本生成请求，prompt 长度: {len(request.prompt)}")
-
-    # 准备传递给 TaskDispatcher 的 task_data
-    # 这将作为 task_details['payload'] 传递给 execute 方法
-    task_data_for_inference_task = {
+    return {
         "prompt": request.prompt,
         # 修正：直接访问 request.should_fail_for_test，因为已经在 Pydantic 模型中定义
         "should_fail_for_test": request.should_fail_for_test,
@@ -128,19 +174,69 @@ async def generate_text(
             "temperature": request.temperature,
             "top_p": request.top_p,
         },
-        "model_name": request.model_name # 将 model_name 传递给任务
+        "model_name": request.model_name, # 将 model_name 传递给任务
+        "stream": request.stream,
+        "cache_bypass": request.cache_bypass,
+        "cache_refresh": request.cache_refresh,
     }
 
+
+# --- FastAPI 路由定义 ---
+@app.post("/generate", response_model=EnqueueResponse, status_code=status.HTTP_202_ACCEPTED)
+async def generate_text(
+    request: GenerateTextRequest,
+    background_tasks: BackgroundTasks, # 引入 background_tasks
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key", min_length=1, max_length=255)
+):
+    """
+    提交一个文本生成任务到队列。
+    带 Idempotency-Key 请求头（或 idempotency_key 字段，请求头优先）时，重复提交返回首次请求的 job_id，不再入队。
+    """
+    api_logger.info(f"收到文本生成请求，prompt 长度: {len(request.prompt)}")
+
+    task_data_for_inference_task = _build_inference_task_data(request)
+    inference_task = task_factory.get_task_callable("inference_task") # 任务类型，与 TaskFactory 中的注册键一致
+    idempotency_key = idempotency_key or request.idempotency_key
+    job_id = str(uuid.uuid4()) # 生成一个新的 job_id
+
     try:
+        # 相同请求已有缓存结果时直接写成已完成的任务，不进入队列。
+        # 与 /generate/batch 一致，缓存查询、写入和入队（含幂等键占用）都是同步的 Redis 调用，放到线程中执行
+        cached_result = await asyncio.to_thread(get_response_cache().get, task_dispatcher.redis_conn, task_data_for_inference_task)
+        if cached_result is not None:
+            job = (await asyncio.to_thread(
+                task_dispatcher.complete_many,
+                inference_task,
+                [(task_data_for_inference_task, request.priority, job_id, cached_result)],
+                [idempotency_key]
+            ))[0]
+            if job is None:
+                raise IdempotencyKeyConflict(f"幂等键 {idempotency_key} 已用于内容不同的请求")
+            if job.id != job_id:
+                return EnqueueResponse(job_id=job.id, status="duplicate")
+            api_logger.info(f"任务 {job.id} 命中推理结果缓存，已直接完成。")
+            return EnqueueResponse(job_id=job.id, status="cached")
+
         # 修正：将 enqueue_task 修改为 dispatch
-        job = task_dispatcher.dispatch(
-            task_callable=task_factory.get_task_callable("inference_task"),   # 任务类型，与 TaskFactory 中的注册键一致
+        job = await asyncio.to_thread(
+            task_dispatcher.dispatch,
+            task_callable=inference_task,
             payload=task_data_for_inference_task,  # 传递完整的 payload
             priority=request.priority,
-            job_id=str(uuid.uuid4()) # 生成一个新的 job_id
+            job_id=job_id,
+            idempotency_key=idempotency_key
         )
+        if job.id != job_id:
+            api_logger.info(f"幂等键重复，返回首次请求的任务 {job.id}。")
+            return EnqueueResponse(job_id=job.id, status="duplicate")
         api_logger.info(f"任务 {job.id} 已成功入队。")
         return EnqueueResponse(job_id=job.id, status="enqueued")
+    except IdempotencyKeyConflict as e:
+        api_logger.warning(f"幂等键冲突: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Idempotency key reused with a different request: {str(e)}"
+        )
     except TaskDispatchError as e:
         api_logger.error(f"任务调度失败: {e}", exc_info=True)
         raise HTTPException(
@@ -155,6 +251,103 @@ async def generate_text(
         )
 
 
+def _mark_duplicates(results: List[BatchItemResult], indexes: List[int], items: List[tuple], jobs: List[Optional[Job]]) -> None:
+    # 幂等键重复的条目没有入队，返回的是首次请求的任务；幂等键已用于内容不同的请求的条目（job 为 None）只拒绝该条目
+    for result_index, item, job in zip(indexes, items, jobs):
+        if job is None:
+            results[result_index].job_id = None
+            results[result_index].status = "invalid"
+            results[result_index].error = "Idempotency key reused with a different request."
+        elif job.id != item[2]:
+            results[result_index].job_id = job.id
+            results[result_index].status = "duplicate"
+
+
+@app.post("/generate/batch", response_model=BatchEnqueueResponse, status_code=status.HTTP_202_ACCEPTED)
+async def generate_text_batch(items: List[Dict[str, Any]] = Body(..., description="Array of GenerateTextRequest objects.")):
+    """
+    批量提交文本生成任务：所有合法条目通过一个 Redis pipeline 入队，返回顺序与提交顺序一致。
+    单个条目校验失败只影响该条目，不会导致整批失败。
+    条目可以带 idempotency_key 字段，幂等键已使用过的条目返回首次请求的 job_id（status=duplicate），不再入队；
+    幂等键已用于内容不同的请求的条目返回 status=invalid，其余条目照常处理。
+    """
+    api_logger.info(f"收到批量文本生成请求，条目数: {len(items)}")
+    if len(items) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch too large: {len(items)} items (max {settings.BATCH_MAX_ITEMS})."
+        )
+
+    results: List[BatchItemResult] = []
+    valid_indexes: List[int] = []
+    dispatch_items = []
+    idempotency_keys: List[Optional[str]] = []
+    for index, item in enumerate(items):
+        try:
+            request = GenerateTextRequest.model_validate(item)
+        except ValidationError as e:
+            results.append(BatchItemResult(index=index, status="invalid", error=str(e)))
+            continue
+        job_id = str(uuid.uuid4())
+        results.append(BatchItemResult(index=index, job_id=job_id, status="enqueued"))
+        valid_indexes.append(index)
+        dispatch_items.append((_build_inference_task_data(request), request.priority, job_id))
+        idempotency_keys.append(request.idempotency_key)
+
+    try:
+        inference_task = task_factory.get_task_callable("inference_task")
+        cached_items, cached_keys, cached_indexes = [], [], []
+        pending_indexes = valid_indexes
+        if dispatch_items:
+            # 缓存命中的条目直接写成已完成的任务，其余条目批量入队
+            cached_results = await asyncio.to_thread(
+                get_response_cache().get_many, task_dispatcher.redis_conn, [payload for payload, _, _ in dispatch_items]
+            )
+            pending_items, pending_keys, pending_indexes = [], [], []
+            for result_index, dispatch_item, key, cached_result in zip(valid_indexes, dispatch_items, idempotency_keys, cached_results):
+                if cached_result is None:
+                    pending_items.append(dispatch_item)
+                    pending_keys.append(key)
+                    pending_indexes.append(result_index)
+                else:
+                    cached_items.append(dispatch_item + (cached_result,))
+                    cached_keys.append(key)
+                    cached_indexes.append(result_index)
+                    results[result_index].status = "cached"
+            if cached_items:
+                cached_jobs = await asyncio.to_thread(task_dispatcher.complete_many, inference_task, cached_items, cached_keys)
+                _mark_duplicates(results, cached_indexes, cached_items, cached_jobs)
+            dispatch_items, idempotency_keys = pending_items, pending_keys
+        if dispatch_items:
+            # 入队是同步的 Redis 调用，批量较大时放到线程中执行，避免阻塞事件循环
+            jobs = await asyncio.to_thread(
+                task_dispatcher.dispatch_many,
+                inference_task,
+                dispatch_items,
+                idempotency_keys
+            )
+            _mark_duplicates(results, pending_indexes, dispatch_items, jobs)
+        duplicates = sum(1 for result in results if result.status == "duplicate")
+        cached = sum(1 for result in results if result.status == "cached")
+        enqueued = sum(1 for result in results if result.status == "enqueued")
+        invalid = sum(1 for result in results if result.status == "invalid")
+        api_logger.info(f"批量任务入队完成，入队: {enqueued}，缓存命中: {cached}，重复: {duplicates}，校验失败: {invalid}")
+        return BatchEnqueueResponse(items=results, enqueued=enqueued, cached=cached, duplicates=duplicates,
+                                    invalid=invalid)
+    except TaskDispatchError as e:
+        api_logger.error(f"批量任务调度失败: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to dispatch batch: {str(e)}"
+        )
+    except Exception as e:
+        api_logger.critical(f"处理 /generate/batch 请求时发生未知错误: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+
 @app.get("/tasks/{job_id}/status", response_model=TaskStatusResponse)
 async def get_task_status(job_id: str):
     """
@@ -162,7 +355,8 @@ async def get_task_status(job_id: str):
     """
     api_logger.info(f"查询任务状态请求，Job ID: {job_id}")
     try:
-        status_info = task_dispatcher.get_task_status(job_id)
+        # 未命中终态缓存时需要访问 Redis，放到线程中执行
+        status_info = await asyncio.to_thread(task_dispatcher.get_task_status, job_id)
         api_logger.info(f"任务 {job_id} 状态: {status_info['status']}")
         return TaskStatusResponse(
             job_id=job_id,
@@ -184,6 +378,177 @@ async def get_task_status(job_id: str):
         )
 
 
+@app.post("/tasks/status:batch", response_model=BatchStatusResponse)
+async def get_task_statuses(request: BatchStatusRequest):
+    """
+    批量获取任务状态，所有任务在一次 Redis 往返中读取。不存在的任务返回 status=not_found。
+    """
+    api_logger.info(f"批量查询任务状态请求，数量: {len(request.job_ids)}")
+    if len(request.job_ids) > settings.BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Too many job IDs: {len(request.job_ids)} (max {settings.BATCH_MAX_ITEMS})."
+        )
+    try:
+        statuses = await asyncio.to_thread(task_dispatcher.get_task_statuses, request.job_ids)
+        return BatchStatusResponse(tasks=[
+            TaskStatusResponse(
+                job_id=job_id,
+                status=status_info.get("status", "unknown"),
+                result=status_info.get("result"),
+                error=status_info.get("error")
+            )
+            for job_id, status_info in statuses.items()
+        ])
+    except TaskDispatchError as e:
+        api_logger.error(f"批量获取任务状态失败: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to get task statuses: {str(e)}"
+        )
+    except Exception as e:
+        api_logger.critical(f"处理 /tasks/status:batch 请求时发生未知错误: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+
+# 任务进入这些状态后不会再变化（也不会再有新的 token）
+TERMINAL_TASK_STATUSES = {"finished", "failed", "stopped", "canceled", "not_found"}
+
+
+@app.get("/tasks/{job_id}/wait", response_model=TaskStatusResponse)
+async def wait_task(
+    job_id: str,
+    timeout: int = Query(settings.TASK_WAIT_DEFAULT_TIMEOUT, ge=1, le=settings.TASK_WAIT_MAX_TIMEOUT,
+                         description="Maximum seconds to wait for the task to complete.")
+):
+    """
+    长轮询：任务完成（或最终失败）时立即返回结果，最多等待 timeout 秒。
+    超时仍未完成时返回当前状态，客户端可再次调用，取代循环查询 /tasks/{job_id}/status。
+    """
+    api_logger.info(f"等待任务完成请求，Job ID: {job_id}, timeout: {timeout}")
+    try:
+        redis_conn = get_async_redis()
+        completion = await get_completion(redis_conn, job_id)
+        if completion is None:
+            # 没有完成通知：先确认任务存在且尚未结束（通知过期或任务在通知机制之前完成的情况）
+            status_info = await asyncio.to_thread(task_dispatcher.get_task_status, job_id)
+            if status_info["status"] == "not_found":
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task {job_id} not found.")
+            if status_info["status"] in TERMINAL_TASK_STATUSES:
+                completion = status_info
+            else:
+                completion = await wait_for_completion(redis_conn, job_id, timeout)
+                if completion is None:
+                    completion = await asyncio.to_thread(task_dispatcher.get_task_status, job_id)
+        api_logger.info(f"任务 {job_id} 等待结束，状态: {completion['status']}")
+        return TaskStatusResponse(
+            job_id=job_id,
+            status=completion.get("status", "unknown"),
+            result=completion.get("result"),
+            error=completion.get("error")
+        )
+    except HTTPException:
+        raise
+    except TaskDispatchError as e:
+        api_logger.error(f"获取任务状态失败: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to get task status: {str(e)}"
+        )
+    except Exception as e:
+        api_logger.critical(f"处理 /tasks/{job_id}/wait 请求时发生未知错误: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+
+# 收到失败事件后缩短阻塞时间，尽快确认任务是进入重试还是最终失败
+TOKEN_STREAM_RETRY_CHECK_MS = 1000
+
+
+async def _token_event_source(request: Request, job_id: str, last_id: str):
+    """
+    跟随任务的 token 流，按 SSE 格式逐条输出。
+    - token 流不存在（未开启流式或已过期）且任务已结束时，直接输出完整结果；
+    - 失败事件之后任务可能被重试，此时继续跟随，直到收到新的 start 事件或任务最终结束。
+    """
+    redis_conn = get_async_redis()
+    received_tokens = last_id != "0-0"
+    block_ms = settings.TOKEN_STREAM_BLOCK_MS
+    check_status = not await redis_conn.exists(token_stream_key(job_id))
+
+    while True:
+        if check_status:
+            status_info = await asyncio.to_thread(task_dispatcher.get_task_status, job_id)
+            if status_info["status"] in TERMINAL_TASK_STATUSES:
+                if status_info.get("result") and not received_tokens:
+                    yield format_sse(EVENT_TOKEN, {"delta": status_info["result"]})
+                yield format_sse(EVENT_END, {"status": status_info["status"], "error": status_info.get("error")})
+                return
+            check_status = False
+
+        if await request.is_disconnected():
+            api_logger.info(f"任务 {job_id} 的 token 流客户端已断开。")
+            return
+
+        events = await read_token_events(redis_conn, job_id, last_id, block_ms)
+        if not events:
+            # 阻塞超时：发送心跳注释保持连接，并确认任务是否已在没有流的情况下结束
+            check_status = True
+            yield ": keep-alive\n\n"
+            continue
+
+        for event_id, fields in events:
+            last_id = event_id
+            event_type = fields.pop("type", EVENT_TOKEN)
+            if event_type == EVENT_START:
+                block_ms = settings.TOKEN_STREAM_BLOCK_MS
+            elif event_type == EVENT_TOKEN:
+                received_tokens = True
+            elif event_type == EVENT_END:
+                if fields.get("status") == "finished":
+                    yield format_sse(EVENT_END, fields, event_id)
+                    return
+                # 失败后由任务状态决定是否结束，见 check_status
+                block_ms = TOKEN_STREAM_RETRY_CHECK_MS
+                check_status = True
+                yield format_sse("error", fields, event_id)
+                continue
+            yield format_sse(event_type, fields, event_id)
+
+
+@app.get("/tasks/{job_id}/stream")
+async def stream_task_tokens(job_id: str, request: Request):
+    """
+    以 Server-Sent Events 实时推送任务生成的 token。
+    事件类型：start（一次执行开始，重试时客户端应清空已收内容）、token（data.delta 为增量文本）、
+    error（一次执行失败，可能随后重试）、end（任务结束）。
+    断线重连时浏览器会带上 Last-Event-ID，从断点继续推送。
+    """
+    api_logger.info(f"订阅任务 token 流请求，Job ID: {job_id}")
+    try:
+        status_info = await asyncio.to_thread(task_dispatcher.get_task_status, job_id)
+    except TaskDispatchError as e:
+        api_logger.error(f"获取任务状态失败: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to get task status: {str(e)}"
+        )
+    if status_info["status"] == "not_found":
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Task {job_id} not found.")
+
+    last_id = request.headers.get("last-event-id") or "0-0"
+    return StreamingResponse(
+        _token_event_source(request, job_id, last_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}, # 禁止反向代理缓冲 SSE
+    )
+
+
 @app.get("/metrics", response_model=QueueMetricsResponse)
 async def get_queue_metrics():
     """
@@ -191,7 +556,9 @@ async def get_queue_metrics():
     """
     api_logger.info("获取队列指标请求。")
     try:
-        metrics = task_dispatcher.get_queue_metrics()
+        # 采集是同步的 Redis 调用，放到线程中执行，避免阻塞事件循环
+        # 队列指标和熔断器状态来自同一份缓存快照，抓取频繁时不会每次都扫描 Redis
+        metrics, breakers = await asyncio.to_thread(task_dispatcher.get_metrics_snapshot)
         api_logger.info(f"队列指标: {metrics}")
         # 注意：这里返回的 metrics 结构应该匹配 QueueMetricsResponse 的定义
         # 如果 metrics 是平铺的，需要调整 Pydantic 模型或这里进行映射
@@ -199,7 +566,8 @@ async def get_queue_metrics():
             queued_tasks={q_name: m['queued_jobs'] for q_name, m in metrics.items()},
             started_tasks={q_name: m['started_jobs'] for q_name, m in metrics.items()},
             failed_tasks={q_name: m['failed_jobs'] for q_name, m in metrics.items()},
-            finished_tasks={q_name: m['finished_jobs'] for q_name, m in metrics.items()}
+            finished_tasks={q_name: m['finished_jobs'] for q_name, m in metrics.items()},
+            circuit_breakers=breakers,
         )
     except TaskDispatchError as e:
         api_logger.error(f"获取队列指标失败: {e}", exc_info=True)
@@ -215,6 +583,282 @@ async def get_queue_metrics():
         )
 
 
+@app.get("/metrics/http_pool")
+async def get_http_pool_metrics():
+    """
+    获取各 worker 进程上报的 HTTP 连接池统计（复用率、活跃/空闲连接数），用于调整连接池大小。
+    """
+    api_logger.info("获取 HTTP 连接池统计请求。")
+    try:
+        return {"processes": collect_stats(task_dispatcher.redis_conn, "http_pool")}
+    except Exception as e:
+        api_logger.critical(f"处理 /metrics/http_pool 请求时发生未知错误: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+
+@app.get("/metrics/compression")
+async def get_compression_metrics():
+    """
+    获取各 worker 进程上报的结果压缩统计（压缩次数、原始/压缩后字节数、压缩比），用于调整各队列的压缩阈值。
+    """
+    api_logger.info("获取结果压缩统计请求。")
+    try:
+        return {"processes": collect_stats(task_dispatcher.redis_conn, "compression")}
+    except Exception as e:
+        api_logger.critical(f"处理 /metrics/compression 请求时发生未知错误: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+
+@app.get("/metrics/response-cache")
+async def get_response_cache_metrics():
+    """
+    获取推理结果缓存统计：web 进程上报命中（进程内 / Redis）、未命中和命中字节数，worker 上报写入次数和字节数。
+    near_duplicate 为 worker 的近似重复缓存统计（命中、未命中、查找耗时和索引大小）。
+    """
+    api_logger.info("获取推理结果缓存统计请求。")
+    try:
+        processes = collect_stats(task_dispatcher.redis_conn, "response_cache")
+        totals = {name: sum(snapshot.get(name, 0) for snapshot in processes.values())
+                  for name in ("local_hits", "redis_hits", "misses", "bypassed", "hit_bytes", "stores", "stored_bytes")}
+        lookups = totals["local_hits"] + totals["redis_hits"] + totals["misses"]
+        totals["hit_ratio"] = round((totals["local_hits"] + totals["redis_hits"]) / lookups, 4) if lookups else None
+        near_processes = collect_stats(task_dispatcher.redis_conn, "near_cache")
+        near_totals = {name: sum(snapshot.get(name, 0) for snapshot in near_processes.values())
+                       for name in ("hits", "misses", "stores", "entries", "bytes", "evictions")}
+        near_lookups = near_totals["hits"] + near_totals["misses"]
+        near_totals["hit_ratio"] = round(near_totals["hits"] / near_lookups, 4) if near_lookups else None
+        near_totals["lookup_us_max"] = max((snapshot.get("lookup_us_max", 0) for snapshot in near_processes.values()), default=0)
+        return {
+            "totals": totals,
+            "processes": processes,
+            "near_duplicate": {"totals": near_totals, "processes": near_processes},
+        }
+    except Exception as e:
+        api_logger.critical(f"处理 /metrics/response-cache 请求时发生未知错误: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+
+@app.get("/metrics/single-flight")
+async def get_single_flight_metrics():
+    """
+    获取相同请求合并的统计：各 worker 进程作为领导者调用模型、作为跟随者复用结果的次数，
+    复用最近结果、接管失效领导者和等待超时的次数。
+    """
+    api_logger.info("获取相同请求合并统计请求。")
+    try:
+        processes = collect_stats(task_dispatcher.redis_conn, "single_flight")
+        totals = {name: sum(snapshot.get(name, 0) for snapshot in processes.values())
+                  for name in ("leaders", "followers", "recent_hits", "takeovers", "fallbacks")}
+        executions = totals["leaders"] + totals["followers"] + totals["recent_hits"]
+        totals["coalesced_ratio"] = round((totals["followers"] + totals["recent_hits"]) / executions, 4) if executions else None
+        return {"totals": totals, "processes": processes}
+    except Exception as e:
+        api_logger.critical(f"处理 /metrics/single-flight 请求时发生未知错误: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+
+@app.get("/metrics/circuit-breakers")
+async def get_circuit_breaker_metrics():
+    """
+    获取各执行器的熔断器状态（所有 worker 共享）：closed / open / half_open、打开原因和持续时间，
+    当前窗口内的请求、失败和超时次数，累计打开次数和被快速拒绝的请求数。
+    """
+    api_logger.info("获取熔断器状态请求。")
+    try:
+        return {"executors": await asyncio.to_thread(breaker_states, task_dispatcher.redis_conn)}
+    except Exception as e:
+        api_logger.critical(f"处理 /metrics/circuit-breakers 请求时发生未知错误: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+
+@app.get("/metrics/concurrency")
+async def get_concurrency_metrics():
+    """
+    获取各执行器的自适应并发限制状态（所有 worker 共享）：当前并发上限、已发放的许可数、按 Retry-After 暂停的剩余时间、
+    短期 / 长期延迟 EWMA、降低次数和最近一次降低的原因（overload / latency）、因达到上限被拒绝的申请次数。
+    """
+    api_logger.info("获取并发限制状态请求。")
+    try:
+        return {"executors": await asyncio.to_thread(limiter_states, task_dispatcher.redis_conn)}
+    except Exception as e:
+        api_logger.critical(f"处理 /metrics/concurrency 请求时发生未知错误: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+
+@app.get("/metrics/retry")
+async def get_retry_metrics():
+    """
+    获取任务重试引擎的状态：全局重试预算的剩余令牌，以及各错误分类（network / rate_limit / server_error / bad_response /
+    client_error / permanent / unknown）的决策次数（retried / exhausted / budget_denied / not_retryable）。
+    """
+    api_logger.info("获取重试统计请求。")
+    try:
+        return await asyncio.to_thread(retry_stats, task_dispatcher.redis_conn)
+    except Exception as e:
+        api_logger.critical(f"处理 /metrics/retry 请求时发生未知错误: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+
+@app.get("/metrics/key-pool")
+async def get_key_pool_metrics():
+    """
+    获取各 worker 进程的 API Key 池统计（以 "<供应商>:<hostname>:<pid>" 为键）：每个 Key（以指纹表示）的请求数、
+    预占和实际 token 数、被 429 限流的次数，以及等待额度的次数、平均等待时间和等待超时的次数。
+    """
+    api_logger.info("获取 API Key 池统计请求。")
+    try:
+        return {"processes": collect_stats(task_dispatcher.redis_conn, "key_pool")}
+    except Exception as e:
+        api_logger.critical(f"处理 /metrics/key-pool 请求时发生未知错误: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+
+@app.get("/metrics/router")
+async def get_router_metrics():
+    """
+    获取各 worker 进程的执行器路由分数：每个执行器的分数（预期完成时间，秒）、EWMA 延迟、错误率、进行中请求数，
+    以及当前粘滞的执行器和切换次数，用于解释流量为什么在供应商之间移动。
+    hedging 部分为各进程的对冲统计：请求数、对冲次数、对冲请求胜出次数、因预算不足放弃的次数和对冲比例。
+    """
+    api_logger.info("获取执行器路由分数请求。")
+    try:
+        return {
+            "processes": collect_stats(task_dispatcher.redis_conn, "router"),
+            "hedging": collect_stats(task_dispatcher.redis_conn, "hedging"),
+        }
+    except Exception as e:
+        api_logger.critical(f"处理 /metrics/router 请求时发生未知错误: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+
+@app.get("/registries/{registry_type}/jobs")
+async def list_registry_jobs(
+    registry_type: str,
+    cursor: Optional[str] = Query(None, description="next_cursor from the previous page; omit for the first page."),
+    per_page: int = Query(20, ge=1, le=500, description="Number of jobs per page."),
+    include_results: bool = Query(True, description="Set to false to skip loading result payloads and errors.")
+):
+    """
+    分页列出注册表（queued, started, finished, failed, scheduled, deferred）中的任务。
+    使用游标分页：把响应中的 next_cursor 传给下一次请求，next_cursor 为 null 表示没有更多数据。
+    """
+    api_logger.info(f"获取注册表任务列表请求，类型: {registry_type}, per_page: {per_page}")
+    try:
+        return await asyncio.to_thread(
+            task_dispatcher.get_jobs_in_registry, registry_type,
+            cursor=cursor, per_page=per_page, include_results=include_results
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        api_logger.critical(f"处理 /registries/{registry_type}/jobs 请求时发生未知错误: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+
+# 导出时攒够这么多字节再交给响应写出，避免每个任务一次线程池切换
+EXPORT_WRITE_BUFFER_BYTES = 64 * 1024
+
+
+def _to_naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """RQ 中的时间都是无时区的 UTC 时间，带时区的查询参数先转换为 UTC。"""
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _ndjson_chunks(jobs: Iterator[Dict[str, Any]], registry_type: str, compress: bool) -> Iterator[bytes]:
+    """把任务迭代器编码为 NDJSON 字节块，compress 为 True 时输出 gzip 流。"""
+    compressor = zlib.compressobj(wbits=31) if compress else None # wbits=31 表示带 gzip 头
+    buffer = bytearray()
+    try:
+        for job in jobs:
+            buffer += json.dumps(job, ensure_ascii=False, default=str).encode("utf-8")
+            buffer += b"\n"
+            if len(buffer) >= EXPORT_WRITE_BUFFER_BYTES:
+                data = compressor.compress(bytes(buffer)) if compressor else bytes(buffer)
+                buffer.clear()
+                if data:
+                    yield data
+        data = compressor.compress(bytes(buffer)) + compressor.flush() if compressor else bytes(buffer)
+        if data:
+            yield data
+    except Exception as e:
+        # 响应头已经发出，只能中断连接，客户端会收到不完整的流
+        api_logger.critical(f"导出 {registry_type} 注册表时发生错误，导出中断: {e}", exc_info=True)
+        raise
+
+
+@app.get("/registries/{registry_type}/export")
+async def export_registry_jobs(
+    registry_type: str,
+    queue: Optional[str] = Query(None, description="Only export jobs from this queue (high, default, low)."),
+    since: Optional[datetime] = Query(None, description="Only export jobs that ended (finished/failed) or were enqueued at or after this time."),
+    until: Optional[datetime] = Query(None, description="Only export jobs that ended (finished/failed) or were enqueued at or before this time."),
+    error_contains: Optional[str] = Query(None, min_length=1, description="Only export jobs whose error message contains this substring."),
+    include_results: bool = Query(True, description="Set to false to skip result payloads and errors."),
+    gzip: bool = Query(False, description="Compress the export with gzip.")
+):
+    """
+    以 NDJSON（每行一个 JSON 对象）流式导出整个注册表。
+    任务按 EXPORT_CHUNK_SIZE 分块从 Redis 读取并立即写出，内存占用与注册表大小无关。
+    """
+    api_logger.info(
+        f"导出注册表请求，类型: {registry_type}, 队列: {queue}, 时间范围: {since} ~ {until}, "
+        f"错误过滤: {error_contains}, gzip: {gzip}"
+    )
+    try:
+        jobs = task_dispatcher.export_registry(
+            registry_type, queue_name=queue, since=_to_naive_utc(since), until=_to_naive_utc(until),
+            error_contains=error_contains, include_results=include_results
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        api_logger.critical(f"处理 /registries/{registry_type}/export 请求时发生未知错误: {e}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"An unexpected error occurred: {str(e)}"
+        )
+
+    filename = f"{registry_type}-jobs.ndjson" + (".gz" if gzip else "")
+    # 同步生成器由 StreamingResponse 放到线程池中迭代，不会阻塞事件循环
+    return StreamingResponse(
+        _ndjson_chunks(jobs, registry_type, gzip),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
 @app.get("/workers/status", response_model=AllWorkersStatusResponse)
 async def get_workers_status():
     """
@@ -247,13 +891,16 @@ async def get_workers_status():
 async def health_check():
     """
     健康检查端点。
+    有执行器的熔断器处于打开状态时 status 为 degraded（仍返回 200，任务可以入队，会改用其他执行器或快速失败）。
     """
     api_logger.info("Health check requested.")
     try:
         # 尝试 ping Redis 连接以确保其可用
         redis_conn = Redis.from_url(settings.REDIS_URL) # 从 settings 获取 Redis URL
         redis_conn.ping()
-        return {"status": "healthy", "redis_connection": "ok"}
+        breakers = {name: breaker["state"] for name, breaker in breaker_states(redis_conn).items()}
+        degraded = any(state == OPEN for state in breakers.values())
+        return {"status": "degraded" if degraded else "healthy", "redis_connection": "ok", "circuit_breakers": breakers}
     except Exception as e:
         api_logger.error(f"Health check failed: Redis connection error: {e}", exc_info=True)
         raise HTTPException(
@@ -278,6 +925,7 @@ async def shutdown_event():
             api_logger.info("Redis connection closed.")
         except Exception as e:
             api_logger.warning(f"关闭 Redis 连接时发生错误: {e}")
+    await close_async_redis()
 
 
 # 如果直接运行此文件 (例如使用 `python app.py`)，则会启动 Uvicorn 服务器
@@ -0,0 +1,40 @@
+# ~/projects/deepseek_dispatcher-new/worker/archiver.py
+
+import signal
+import threading
+
+from common.logging_utils import get_logger
+from common.redis_utils import get_redis
+from config.settings import settings
+from dispatcher.core.result_archive import archive_expiring_jobs
+from dispatcher.queues.queue_config import QUEUE_MAP
+
+logger = get_logger("archiver")
+
+
+def run_archiver(interval: int = None) -> None:
+    """
+    每隔 interval 秒把即将从 Redis 过期的 finished / failed 任务写入结果归档，收到 SIGINT / SIGTERM 后退出。
+
+    用法（见 supervisor/conf.d/result_archiver.conf）：
+        python3 -m worker.archiver
+    """
+    interval = interval or settings.ARCHIVE_SWEEP_INTERVAL
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+
+    logger.info(f"结果归档进程启动，扫描间隔: {interval} 秒")
+    queues = list(QUEUE_MAP.values())
+    while not stop.is_set():
+        try:
+            archive_expiring_jobs(get_redis(), queues)
+        except Exception as e:
+            # 单次归档失败不退出，下一轮从水位处继续
+            logger.error(f"归档失败: {e}", exc_info=True)
+        stop.wait(interval)
+    logger.info("结果归档进程退出。")
+
+
+if __name__ == "__main__":
+    run_archiver()
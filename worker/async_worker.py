@@ -0,0 +1,254 @@
+# ~/projects/deepseek_dispatcher-new/worker/async_worker.py
+
+import asyncio
+import inspect
+import signal
+import sys
+import traceback
+from typing import Any, Optional, Set, Tuple
+
+from rq import Queue, Worker
+from rq.defaults import DEFAULT_LOGGING_DATE_FORMAT, DEFAULT_LOGGING_FORMAT
+from rq.exceptions import DequeueTimeout
+from rq.job import Job
+from rq.timeouts import JobTimeoutException
+from rq.utils import utcnow
+from rq.worker import StopRequested, WorkerStatus
+
+from ai_executor.http_client import get_http_pool
+from common.logging_utils import get_logger
+from config.settings import settings
+from dispatcher.tasks.base_task import set_current_job
+
+logger = get_logger("async_worker")
+
+# 出队时 BLPOP 的阻塞时间（秒），也是 worker 响应停止信号的最大延迟
+DEQUEUE_POLL_TIMEOUT = 5
+# worker 心跳间隔（秒），需明显小于 RQ 默认的 worker_ttl (420 秒)
+HEARTBEAT_INTERVAL = 30
+
+
+class AsyncWorker(Worker):
+    """
+    在一个事件循环中并发执行多个任务的 RQ Worker。
+    推理任务几乎全部时间都在等待供应商响应，用协程在一个进程内同时挂起多个请求，
+    取代默认 Worker "一个进程只跑一个任务" 的模式。
+
+    用法（见 supervisor/conf.d/rq_worker_async.conf）：
+        python3 -m rq.worker high default low --worker-class worker.async_worker.AsyncWorker \
+            --serializer dispatcher.core.serializers.job_serializer
+    """
+
+    def __init__(self, *args, max_in_flight: Optional[int] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_in_flight = max_in_flight or settings.ASYNC_WORKER_MAX_IN_FLIGHT
+        self._in_flight: Set[asyncio.Task] = set()
+        self._completed_jobs = 0
+
+    def _install_signal_handlers(self):
+        # 信号处理在事件循环启动后通过 loop.add_signal_handler 安装，见 _work_loop
+        pass
+
+    def work(
+        self,
+        burst: bool = False,
+        logging_level: str = "INFO",
+        date_format: str = DEFAULT_LOGGING_DATE_FORMAT,
+        log_format: str = DEFAULT_LOGGING_FORMAT,
+        max_jobs: Optional[int] = None,
+        max_idle_time: Optional[int] = None,
+        with_scheduler: bool = False,
+        **kwargs: Any,
+    ) -> bool:
+        """
+        启动工作循环，签名与 rq.Worker.work 保持一致，以便通过 `rq worker --worker-class` 启动。
+        max_idle_time 和 dequeue_strategy 在异步模式下不生效。
+
+        Returns:
+            bool: 是否处理过任务。
+        """
+        self.bootstrap(logging_level, date_format, log_format)
+        if with_scheduler:
+            self._start_scheduler(burst, logging_level, date_format, log_format)
+        try:
+            asyncio.run(self._work_loop(burst, max_jobs))
+        finally:
+            self.teardown()
+        return bool(self._completed_jobs)
+
+    async def _work_loop(self, burst: bool, max_jobs: Optional[int]):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._request_async_stop)
+
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        heartbeat_task = asyncio.create_task(self._heartbeat_loop())
+        logger.info(f"AsyncWorker {self.name} 启动，队列: {self.queue_names()}，最大并发: {self.max_in_flight}")
+
+        dispatched = 0
+        try:
+            while not self._stop_requested:
+                # 并发已满时在这里等待，直到有任务完成
+                await semaphore.acquire()
+                if self._stop_requested:
+                    semaphore.release()
+                    break
+
+                try:
+                    # `rq suspend` 暂停期间在线程中等待恢复（burst 模式直接退出），不影响进行中的任务
+                    await asyncio.to_thread(self.check_for_suspension, burst)
+                except StopRequested:
+                    semaphore.release()
+                    break
+
+                if self.should_run_maintenance_tasks:
+                    # 清理注册表会扫描所有队列，放到线程中执行
+                    await asyncio.to_thread(self.run_maintenance_tasks)
+
+                try:
+                    # BLPOP 会阻塞，放到线程中执行，避免卡住正在进行的推理请求
+                    result = await asyncio.to_thread(self._dequeue, None if burst else DEQUEUE_POLL_TIMEOUT)
+                except DequeueTimeout:
+                    semaphore.release()
+                    continue
+
+                if result is None:
+                    # 只有 burst 模式会走到这里：所有队列都已为空
+                    semaphore.release()
+                    break
+
+                job, queue = result
+                task = asyncio.create_task(self._perform_job_async(job, queue))
+                self._in_flight.add(task)
+                self.set_state(WorkerStatus.BUSY)
+                task.add_done_callback(lambda t: self._on_job_done(t, semaphore))
+
+                dispatched += 1
+                if max_jobs is not None and dispatched >= max_jobs:
+                    logger.info(f"AsyncWorker {self.name} 已派发 {dispatched} 个任务，达到 max_jobs，停止取新任务。")
+                    break
+
+            if self._in_flight:
+                logger.info(f"等待 {len(self._in_flight)} 个进行中的任务完成...")
+                await asyncio.gather(*self._in_flight, return_exceptions=True)
+        finally:
+            heartbeat_task.cancel()
+            await get_http_pool().aclose()
+
+    def _dequeue(self, timeout: Optional[int]) -> Optional[Tuple[Job, Queue]]:
+        """从监听的队列中按顺序取出一个任务（在线程中执行）。"""
+        result = self.queue_class.dequeue_any(
+            self._ordered_queues,
+            timeout,
+            connection=self.connection,
+            job_class=self.job_class,
+            serializer=self.serializer,
+            death_penalty_class=self.death_penalty_class,
+        )
+        if result is not None:
+            job, queue = result
+            job.redis_server_version = self.get_redis_server_version()
+            logger.info(f"{queue.name}: 取出任务 {job.id}，当前并发: {len(self._in_flight) + 1}")
+        return result
+
+    def _on_job_done(self, task: asyncio.Task, semaphore: asyncio.Semaphore):
+        self._in_flight.discard(task)
+        semaphore.release()
+        if not self._in_flight:
+            self.set_state(WorkerStatus.IDLE)
+
+    def _request_async_stop(self):
+        """第一次信号：不再取新任务，等待进行中的任务完成；第二次信号：取消所有进行中的任务。"""
+        if self._stop_requested:
+            logger.warning(f"Worker {self.name} 再次收到停止信号，取消 {len(self._in_flight)} 个进行中的任务。")
+            for task in self._in_flight:
+                task.cancel()
+            return
+        logger.info(f"Worker {self.name} 收到停止信号，等待 {len(self._in_flight)} 个进行中的任务完成后退出。")
+        self._stop_requested = True
+        self.set_shutdown_requested_date()
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            await asyncio.to_thread(self.heartbeat)
+
+    def _prepare_job(self, job: Job, queue: Queue, timeout: int):
+        """标记任务开始执行，并加入 StartedJobRegistry。"""
+        with self.connection.pipeline() as pipeline:
+            # 心跳 TTL 覆盖整个任务超时时间，任务执行期间不需要再单独续期
+            job.heartbeat(utcnow(), timeout + 60, pipeline=pipeline)
+            job.prepare_for_execution(self.name, pipeline=pipeline)
+            if len(self.queues) == 1:
+                # 只监听一个队列时 RQ 通过 LMOVE 出队，需要从中间队列中移除
+                pipeline.lrem(queue.intermediate_queue_key, 1, job.id)
+            pipeline.execute()
+
+    async def _run_job(self, job: Job) -> Any:
+        """
+        执行任务函数：
+        1. 存在 <函数名>_async 协程时直接 await：任务实例上的方法（例如 InferenceTask.execute_async），
+           或同一模块中的函数（例如 inference_task.run_inference_async）；
+        2. 任务函数本身是协程函数时直接 await；
+        3. 其他同步任务放到线程池中执行，不阻塞事件循环。
+           线程无法被取消：超时或强制停止时任务按失败处理，但任务函数会在线程中继续运行到返回为止，
+           期间占用默认线程池的一个线程；同步任务需要自行限制执行时间（例如 HTTP 请求的超时）。
+        """
+        if job.instance is not None:
+            async_method = getattr(job.instance, f"{job.func_name}_async", None)
+        else:
+            async_method = getattr(inspect.getmodule(job.func), f"{job.func.__name__}_async", None)
+        if async_method is not None:
+            return await async_method(*job.args, **job.kwargs)
+        if inspect.iscoroutinefunction(job.func):
+            return await job.func(*job.args, **job.kwargs)
+        return await asyncio.to_thread(job.perform)
+
+    async def _perform_job_async(self, job: Job, queue: Queue):
+        """执行单个任务，并复用 rq.Worker 的成功/失败处理（结果保存、重试、注册表维护）。"""
+        started_job_registry = queue.started_job_registry
+        timeout = job.timeout or self.queue_class.DEFAULT_TIMEOUT
+        # 每个任务运行在自己的 asyncio.Task 中，上下文变量互不影响
+        set_current_job(job)
+        try:
+            await asyncio.to_thread(self._prepare_job, job, queue, timeout)
+            job.started_at = utcnow()
+            try:
+                rv = await asyncio.wait_for(self._run_job(job), timeout)
+            except asyncio.TimeoutError:
+                raise JobTimeoutException(f"Task exceeded maximum timeout value ({timeout} seconds)")
+            job.ended_at = utcnow()
+            job._result = rv
+            # 与 rq.Worker.perform_job 一致：成功回调在 handle_job_success 之前执行，回调抛出的异常按任务失败处理。
+            # 回调和结果保存都是同步的 Redis 调用，放到线程中执行
+            if job.success_callback:
+                await asyncio.to_thread(job.success_callback, job, self.connection, rv)
+            await asyncio.to_thread(self.handle_job_success, job=job, queue=queue, started_job_registry=started_job_registry)
+            logger.info(f"{job.origin}: Job OK ({job.id})")
+        except Exception:
+            await self._handle_failure_async(job, queue, sys.exc_info())
+        except asyncio.CancelledError:
+            # 第二次停止信号取消进行中的任务：同样按失败处理，否则任务会一直留在 StartedJobRegistry 中
+            logger.warning(f"{job.origin}: 任务 {job.id} 被取消")
+            await self._handle_failure_async(job, queue, sys.exc_info())
+            raise
+        finally:
+            self._completed_jobs += 1
+
+    async def _handle_failure_async(self, job: Job, queue: Queue, exc_info: Tuple[Any, Any, Any]):
+        """
+        与 rq.Worker.perform_job 一致：先执行失败回调（重试引擎在其中决定是否重试，见 dispatcher/core/retry_policy.py），
+        再由 handle_job_failure 重试或移入失败注册表。回调在线程中执行，不使用信号实现的超时。
+        """
+        job.ended_at = utcnow()
+        exc_string = ''.join(traceback.format_exception(*exc_info))
+        if job.failure_callback:
+            try:
+                await asyncio.to_thread(job.failure_callback, job, self.connection, *exc_info)
+            except Exception:
+                logger.exception(f"任务 {job.id} 的失败回调执行出错")
+                exc_info = sys.exc_info()
+                exc_string = ''.join(traceback.format_exception(*exc_info))
+        await asyncio.to_thread(self.handle_job_failure, job=job, queue=queue,
+                                started_job_registry=queue.started_job_registry, exc_string=exc_string)
+        self.handle_exception(job, *exc_info)